@@ -0,0 +1,193 @@
+"""benchmark.py
+
+End-to-end throughput benchmark of the publishing pipeline, fully offline.
+
+Starts fake_services.py in a subprocess, points every client at it, creates
+N synthetic plans in a fresh storage.db in a temporary directory and runs
+`thenextai_publisher.publish_next_article` until the plans are used up. The
+whole pipeline runs unchanged: streamed article with validation, image, media
+upload, tags/categories, post creation, social posts generation and fan-out
+to Facebook/VK/Telegram.
+
+With --replay the fake services are not started: every WordPress, Gemini
+and social request is answered from a traffic recording (see traffic.py)
+with the recorded latencies divided by --speedup, using the credentials and
+URLs of the current .env. By default as many plans are published as there
+are runs in the recording.
+
+Reports throughput, success/failure counts, per-stage p50/p95/p99 (from the
+run ledger), peak RSS and optionally the tracemalloc peak. Use it to compare
+a change before and after on the same arguments.
+
+Usage:
+    python benchmark.py --plans 20 --latency-scale 0.1
+    python benchmark.py --plans 50 --malformed-rate 0.1 --error-rate 0.05 --article-mode sectioned
+    python benchmark.py --plans 10 --tracemalloc --keep
+    python benchmark.py --replay traffic/day.jsonl --speedup 10
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import resource
+import tempfile
+import argparse
+import subprocess
+import contextlib
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PLANS = 10
+
+
+def start_fake_services(args):
+    """Run fake_services.py in a subprocess; returns (process, base_url)"""
+    command = [sys.executable, os.path.join(HERE, 'fake_services.py'), '--port', '0',
+               '--latency-scale', str(args.latency_scale), '--malformed-rate', str(args.malformed_rate),
+               '--error-rate', str(args.error_rate), '--seed', str(args.seed)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    first_line = process.stdout.readline()
+    base_url = first_line.strip().rsplit(' ', 1)[-1]
+    if not base_url.startswith('http'):
+        process.kill()
+        raise RuntimeError(f"fake services did not start: {first_line!r}")
+    return process, base_url
+
+
+def prepare_environment(base_url, args):
+    if args.replay:
+        os.environ.update({'HTTP_REPLAY_FILE': os.path.abspath(args.replay), 'HTTP_REPLAY_SPEEDUP': str(args.speedup),
+                           'HTTP_RECORD_FILE': ''})
+    else:
+        import fake_services
+        os.environ.update(fake_services.env(base_url))
+    os.environ.update({
+        'ENABLE_SOCIAL_MEDIA': 'true' if args.social else 'false',
+        'SOCIAL_POST_PAUSE_SECONDS': '0',
+        'ENABLE_PREFETCH': 'false',
+        'ARTICLE_MODE': args.article_mode,
+        'METRICS_PORT': '0',
+        'GEMINI_DAILY_TOKEN_QUOTA': '0', 'GEMINI_DAILY_REQUEST_QUOTA': '0',
+        'GEMINI_MINUTE_TOKEN_QUOTA': '0', 'GEMINI_MINUTE_REQUEST_QUOTA': '0',
+    })
+
+
+def synthetic_plans(count, seed=0):
+    subjects = ['AI in Education', 'Machine Learning for Retail', 'LLM Agents in Support',
+                'Computer Vision in Farming', 'AI for Small Business', 'Generative Design']
+    angles = ['Tools and Workflows', 'Risks and Guardrails', 'A Practical Roadmap', 'Costs and ROI',
+              'Case Studies', 'Getting Started']
+    for index in range(count):
+        subject = subjects[(index + seed) % len(subjects)]
+        angle = angles[(index // len(subjects) + seed) % len(angles)]
+        yield json.dumps({'seed': f"{subject}: {angle} #{index + 1}", 'category': 'AI Tools'}) + "\n"
+
+
+def recorded_runs(path):
+    # traffic.py читает настройки при импорте, поэтому вызывать после prepare_environment
+    import traffic
+
+    return len({entry['run_id'] for entry in traffic.load_entries(path) if entry.get('run_id')})
+
+
+def run(args):
+    if args.replay:
+        process, base_url = None, None
+        print(f"📼 Воспроизведение {args.replay} (x{args.speedup:g})")
+    else:
+        process, base_url = start_fake_services(args)
+        print(f"🧪 Заглушки: {base_url}")
+    workdir = tempfile.mkdtemp(prefix='autoposter-bench-')
+    print(f"   Рабочий каталог: {workdir}")
+    prepare_environment(base_url, args)
+    sys.path.insert(0, HERE)
+    if not args.plans:
+        args.plans = recorded_runs(args.replay) if args.replay else DEFAULT_PLANS
+    os.chdir(workdir)
+    log = open(os.path.join(workdir, 'pipeline.log'), 'w')
+    try:
+        with contextlib.redirect_stdout(log if not args.verbose else sys.stdout):
+            import plan_ingest
+            import run_ledger
+            import thenextai_publisher
+            thenextai_publisher.init_db()
+            stats = plan_ingest.ingest_lines(synthetic_plans(args.plans, args.seed), fmt='ndjson')
+        print(f"   Планов создано: {stats['inserted']}")
+        logging.getLogger('thenextai_publisher').setLevel(logging.WARNING)
+
+        if args.tracemalloc:
+            tracemalloc.start()
+        durations = []
+        succeeded = 0
+        started = time.perf_counter()
+        for index in range(args.plans):
+            run_started = time.perf_counter()
+            with contextlib.redirect_stdout(log if not args.verbose else sys.stdout):
+                ok = thenextai_publisher.publish_next_article()
+            durations.append(time.perf_counter() - run_started)
+            succeeded += bool(ok)
+            print(f"   {'✅' if ok else '❌'} {index + 1}/{args.plans} {durations[-1]:.2f}s", flush=True)
+        elapsed = time.perf_counter() - started
+        traced_peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+        if args.tracemalloc:
+            tracemalloc.stop()
+
+        report = run_ledger.report(days=1)
+        print_results(args, elapsed, durations, succeeded, report, traced_peak)
+    finally:
+        log.close()
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=10)
+        os.chdir(HERE)
+        if args.keep:
+            print(f"\n   Данные сохранены в {workdir} (storage.db, pipeline.log, generated_images/)")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def print_results(args, elapsed, durations, succeeded, report, traced_peak):
+    from usage_ledger import percentile
+
+    ordered = sorted(durations)
+    if args.replay:
+        source = f"запись {os.path.basename(args.replay)} x{args.speedup:g}"
+    else:
+        source = (f"latency x{args.latency_scale:g}, malformed {args.malformed_rate:.0%}, "
+                  f"429 {args.error_rate:.0%}")
+    print(f"\n📊 Результат ({args.plans} планов, {source}, {args.article_mode}):")
+    print(f"   Время: {elapsed:.1f}s, успешно: {succeeded}, с ошибкой: {len(durations) - succeeded}")
+    print(f"   Пропускная способность: {succeeded / elapsed * 60:.1f} статей/мин" if elapsed else "")
+    print(f"   Прогон: p50 {percentile(ordered, 50):.2f}s, p95 {percentile(ordered, 95):.2f}s, "
+          f"max {ordered[-1]:.2f}s" if ordered else "")
+    # ru_maxrss в Linux - килобайты, в macOS - байты
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_rss_mb = peak_rss / 1024 / (1024 if sys.platform == 'darwin' else 1)
+    print(f"   Пиковая память (RSS): {peak_rss_mb:.0f} MB"
+          + (f", tracemalloc: {traced_peak / 1024 / 1024:.1f} MB" if traced_peak is not None else ""))
+
+    print(f"\n   {'Этап':<24}{'N':>6}{'p50':>9}{'p95':>9}{'p99':>9}{'Ошиб.':>7}{'Повт.':>7}")
+    for row in report['stages']:
+        name = f"{row['stage']}/{row['backend']}" if row['backend'] else row['stage']
+        print(f"   {name:<24}{row['count']:>6}{row['p50_ms'] / 1000:>8.2f}s{row['p95_ms'] / 1000:>8.2f}s"
+              f"{row['p99_ms'] / 1000:>8.2f}s{row['failures']:>7}{row['retries']:>7}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Сквозной бенчмарк публикации на локальных заглушках')
+    parser.add_argument('--plans', type=int, help=f'Сколько синтетических планов опубликовать '
+                        f'(по умолчанию {DEFAULT_PLANS}, с --replay - по числу прогонов в записи)')
+    parser.add_argument('--latency-scale', type=float, default=1.0, help='Множитель задержек заглушек (0 = без задержек)')
+    parser.add_argument('--malformed-rate', type=float, default=0.0, help='Доля невалидных ответов Gemini')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Доля ответов 429 от Gemini')
+    parser.add_argument('--article-mode', choices=['single', 'sectioned', 'auto'], default='single')
+    parser.add_argument('--no-social', dest='social', action='store_false', help='Без публикации в соцсети')
+    parser.add_argument('--tracemalloc', action='store_true', help='Измерять пик памяти Python (медленнее)')
+    parser.add_argument('--replay', metavar='FILE', help='Отвечать записанным трафиком вместо заглушек (traffic.py)')
+    parser.add_argument('--speedup', type=float, default=1.0, help='Ускорение записанных задержек при --replay (0 = без задержек)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--keep', action='store_true', help='Не удалять рабочий каталог')
+    parser.add_argument('--verbose', action='store_true', help='Показывать вывод конвейера')
+    run(parser.parse_args())
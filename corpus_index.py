@@ -0,0 +1,356 @@
+"""corpus_index.py
+
+Similarity of new topics and articles to what is already published (TF-IDF).
+
+Every published post is turned into weighted terms: the words and word pairs
+of its title (TITLE_WEIGHT), its SEO keywords (KEYWORD_WEIGHT) and the
+headings of its content (weight 1), normalized like near_duplicates.py. The
+terms are stored in the `post_terms` table when the post is recorded; posts
+recorded before, or by scripts that do not call `record_post`, are backfilled
+from their title and keywords.
+
+In memory the corpus is a sparse matrix of hashed features (CORPUS_FEATURES
+buckets) with sublinear tf and smoothed idf, kept as postings sorted by
+feature. A query only touches the postings of its own features, so scoring a
+plan or an article against tens of thousands of posts takes milliseconds.
+NumPy is used when installed; otherwise the same postings live in dicts. New
+posts are appended incrementally; the postings are re-sorted on the next
+query. The index is shared by all threads of the process (the API job
+workers), so syncing and scoring run under a module lock.
+
+Before generating, the publisher scores the plan's seed against the corpus.
+Above CORPUS_SIMILARITY_THRESHOLD (cosine) it logs a warning, or with
+CORPUS_SIMILARITY_MODE=skip sets the plan aside (status 'similar') and takes
+the next one. A generated article is scored again by its title, keywords and
+headings before it is posted.
+
+Settings (.env):
+    CORPUS_SIMILARITY_MODE=warn          # warn | skip | off
+    CORPUS_SIMILARITY_THRESHOLD=0.5
+    CORPUS_FEATURES=1048576
+
+Usage:
+    python corpus_index.py --check "AI in Education: Tools and Workflows"
+    python corpus_index.py --stats
+"""
+import os
+import re
+import json
+import math
+import time
+import zlib
+import sqlite3
+import threading
+from array import array
+from dotenv import load_dotenv
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+from near_duplicates import words
+from data_export import parse_keywords
+
+load_dotenv()
+
+DB_FILE = 'storage.db'
+
+MODE_WARN = 'warn'
+MODE_SKIP = 'skip'
+MODE_OFF = 'off'
+MODE = os.getenv('CORPUS_SIMILARITY_MODE', MODE_WARN).lower()
+THRESHOLD = float(os.getenv('CORPUS_SIMILARITY_THRESHOLD', '0.5'))
+FEATURES = int(os.getenv('CORPUS_FEATURES', str(1 << 20)))
+TITLE_WEIGHT = 3
+KEYWORD_WEIGHT = 2
+HEADING_WEIGHT = 1
+# Статус отложенного плана: тема уже раскрыта опубликованной статьей
+STATUS_SIMILAR = 'similar'
+
+_HEADING = re.compile(r'<h[1-3][^>]*>(.*?)</h[1-3]>', re.IGNORECASE | re.DOTALL)
+_TAG = re.compile(r'<[^>]+>')
+
+
+def _add_phrase(terms, text, weight):
+    tokens = words(text)
+    for token in tokens:
+        terms[token] = terms.get(token, 0) + weight
+    for first, second in zip(tokens, tokens[1:]):
+        pair = f"{first} {second}"
+        terms[pair] = terms.get(pair, 0) + weight
+
+
+def document_terms(title, keywords=None, content_html=None):
+    """Weighted terms (words and word pairs) of a post or a topic"""
+    terms = {}
+    _add_phrase(terms, title or '', TITLE_WEIGHT)
+    for keyword in keywords or []:
+        _add_phrase(terms, keyword, KEYWORD_WEIGHT)
+    for heading in _HEADING.findall(content_html or ''):
+        _add_phrase(terms, _TAG.sub(' ', heading), HEADING_WEIGHT)
+    return terms
+
+
+def _features(terms):
+    """Hashed feature -> sublinear tf"""
+    features = {}
+    for term, weight in terms.items():
+        feature = zlib.crc32(term.encode('utf-8')) % FEATURES
+        features[feature] = features.get(feature, 0) + weight
+    return {feature: 1 + math.log(weight) for feature, weight in features.items() if weight > 0}
+
+
+def ensure_schema(conn):
+    conn.execute("""CREATE TABLE IF NOT EXISTS post_terms (
+        post_id INTEGER PRIMARY KEY,
+        terms TEXT
+    )""")
+    conn.commit()
+
+
+def _connect():
+    conn = sqlite3.connect(DB_FILE, timeout=30)
+    ensure_schema(conn)
+    return conn
+
+
+class CorpusIndex:
+    """In-memory TF-IDF index of the published posts, synced from storage.db by post id"""
+
+    def __init__(self):
+        self.posts = []  # (post_id, wp_id, title, slug) по номеру строки матрицы
+        self.loaded_through = 0
+        # Ненулевые элементы матрицы в порядке добавления: признак, строка, tf
+        self._features = array('q')
+        self._rows = array('q')
+        self._tfs = array('d')
+        self._postings = {}  # без numpy: признак -> [(строка, tf)], пополняется при добавлении
+        self._dirty = True
+
+    def __len__(self):
+        return len(self.posts)
+
+    @property
+    def entries(self):
+        """Non-zero elements of the matrix"""
+        return len(self._features) if HAS_NUMPY else sum(len(entries) for entries in self._postings.values())
+
+    def sync(self, conn):
+        """Backfill terms of unindexed posts and load the posts added since the last sync"""
+        try:
+            missing = conn.execute("""SELECT posts.id, posts.title, posts.seo_keywords FROM posts
+                                      LEFT JOIN post_terms ON post_terms.post_id = posts.id
+                                      WHERE posts.id > ? AND post_terms.post_id IS NULL""",
+                                   (self.loaded_through,)).fetchall()
+        except sqlite3.OperationalError:
+            return  # Таблицы posts еще нет
+        if missing:
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO post_terms (post_id, terms) VALUES (?, ?)",
+                                 [(post_id, json.dumps(document_terms(title, parse_keywords(keywords)),
+                                                       ensure_ascii=False))
+                                  for post_id, title, keywords in missing])
+        for post_id, wp_id, title, slug, terms in conn.execute(
+                """SELECT post_terms.post_id, posts.wp_id, posts.title, posts.slug, post_terms.terms
+                   FROM post_terms JOIN posts ON posts.id = post_terms.post_id
+                   WHERE post_terms.post_id > ? ORDER BY post_terms.post_id""", (self.loaded_through,)):
+            self.add(post_id, wp_id, title, slug, json.loads(terms))
+
+    def add(self, post_id, wp_id, title, slug, terms):
+        row = len(self.posts)
+        self.posts.append((post_id, wp_id, title, slug))
+        for feature, tf in _features(terms).items():
+            if HAS_NUMPY:
+                self._features.append(feature)
+                self._rows.append(row)
+                self._tfs.append(tf)
+            else:
+                self._postings.setdefault(feature, []).append((row, tf))
+        self.loaded_through = max(self.loaded_through, post_id)
+        self._dirty = True
+
+    def _idf(self, df):
+        return math.log((1 + len(self.posts)) / (1 + df)) + 1
+
+    def _compact(self):
+        """Sort the postings by feature (numpy) and recompute the row norms, which depend on idf"""
+        if HAS_NUMPY:
+            features = np.frombuffer(self._features, dtype=np.int64)
+            order = np.argsort(features, kind='stable')
+            self._sorted_features = features[order]
+            self._sorted_rows = np.frombuffer(self._rows, dtype=np.int64)[order]
+            tfs = np.frombuffer(self._tfs, dtype=np.float64)[order]
+            self._unique, self._starts, counts = np.unique(self._sorted_features, return_index=True,
+                                                           return_counts=True)
+            idf = np.log((1 + len(self.posts)) / (1 + counts)) + 1
+            self._sorted_weights = tfs * np.repeat(idf, counts)
+            self._norms = np.sqrt(np.bincount(self._sorted_rows, weights=self._sorted_weights ** 2,
+                                              minlength=len(self.posts)))
+        else:
+            norms = [0.0] * len(self.posts)
+            for entries in self._postings.values():
+                idf = self._idf(len(entries))
+                for row, tf in entries:
+                    norms[row] += (tf * idf) ** 2
+            self._norms = [math.sqrt(value) for value in norms]
+        self._dirty = False
+
+    def score(self, terms, top=5):
+        """Most similar posts to `terms`: [{'post_id', 'wp_id', 'title', 'slug', 'similarity'}], best first"""
+        query = _features(terms)
+        if not query or not self.posts:
+            return []
+        if self._dirty:
+            self._compact()
+        if HAS_NUMPY:
+            scores = self._score_numpy(query)
+            best = np.argsort(-scores)[:top] if len(scores) <= top else np.argpartition(-scores, top)[:top]
+            ranked = sorted(((float(scores[row]), int(row)) for row in best if scores[row] > 0), reverse=True)
+        else:
+            ranked = sorted(((value, row) for row, value in self._score_python(query).items()),
+                            reverse=True)[:top]
+        return [{'post_id': self.posts[row][0], 'wp_id': self.posts[row][1], 'title': self.posts[row][2],
+                 'slug': self.posts[row][3], 'similarity': round(value, 3)} for value, row in ranked]
+
+    def _score_numpy(self, query):
+        keys = np.fromiter(query, dtype=np.int64, count=len(query))
+        positions = np.searchsorted(self._unique, keys)
+        found = positions < len(self._unique)
+        found[found] = self._unique[positions[found]] == keys[found]
+        query_norm = 0.0
+        slices, weights = [], []
+        for key, position, present in zip(keys.tolist(), positions.tolist(), found.tolist()):
+            if not present:
+                query_norm += (query[key] * self._idf(0)) ** 2
+                continue
+            start = self._starts[position]
+            end = self._starts[position + 1] if position + 1 < len(self._starts) else len(self._sorted_features)
+            idf = self._idf(end - start)
+            query_norm += (query[key] * idf) ** 2
+            slices.append(np.arange(start, end))
+            weights.append(np.full(end - start, query[key] * idf))
+        if not slices:
+            return np.zeros(len(self.posts))
+        entries = np.concatenate(slices)
+        dots = np.bincount(self._sorted_rows[entries], weights=self._sorted_weights[entries] * np.concatenate(weights),
+                           minlength=len(self.posts))
+        norms = np.where(self._norms > 0, self._norms, 1.0)
+        return dots / (norms * math.sqrt(query_norm))
+
+    def _score_python(self, query):
+        dots = {}
+        query_norm = 0.0
+        for feature, tf in query.items():
+            entries = self._postings.get(feature, ())
+            idf = self._idf(len(entries))
+            weight = tf * idf * idf
+            query_norm += (tf * idf) ** 2
+            for row, doc_tf in entries:
+                dots[row] = dots.get(row, 0.0) + doc_tf * weight
+        query_norm = math.sqrt(query_norm)
+        return {row: dot / (self._norms[row] * query_norm) for row, dot in dots.items() if self._norms[row]}
+
+
+_INDEX = None
+# Два синхронизатора с одним loaded_through добавили бы одни и те же посты дважды
+_LOCK = threading.RLock()
+
+
+def get_index(conn=None):
+    """Process-wide index, synced with storage.db on every call"""
+    global _INDEX
+    own = conn is None
+    conn = conn or _connect()
+    try:
+        with _LOCK:
+            if _INDEX is None:
+                _INDEX = CorpusIndex()
+            ensure_schema(conn)
+            started = time.time()
+            loaded = len(_INDEX)
+            _INDEX.sync(conn)
+            if len(_INDEX) - loaded > 1000:
+                print(f"[corpus_index] Indexed {len(_INDEX) - loaded} posts in {time.time() - started:.1f}s")
+    finally:
+        if own:
+            conn.close()
+    return _INDEX
+
+
+def record_post(conn, post_id, title, keywords, content_html=None):
+    """Store the terms of a just published post (in the caller's transaction)"""
+    ensure_schema(conn)
+    conn.execute("INSERT OR REPLACE INTO post_terms (post_id, terms) VALUES (?, ?)",
+                 (post_id, json.dumps(document_terms(title, keywords, content_html), ensure_ascii=False)))
+
+
+def similar_posts(title, keywords=None, content_html=None, top=5):
+    terms = document_terms(title, keywords, content_html)
+    with _LOCK:
+        return get_index().score(terms, top)
+
+
+def _best(matches, threshold):
+    return matches[0] if matches and matches[0]['similarity'] >= threshold else None
+
+
+def check_article(title, keywords=None, content_html=None, threshold=THRESHOLD):
+    """Closest published post at or above the threshold, or None (always None with mode off)"""
+    if MODE == MODE_OFF:
+        return None
+    return _best(similar_posts(title, keywords, content_html, top=1), threshold)
+
+
+def screen_plan(plan_id, seed, threshold=THRESHOLD):
+    """(admitted, match) for a plan about to be generated.
+
+    With CORPUS_SIMILARITY_MODE=skip a plan similar to a published post gets
+    status 'similar' and is not admitted; otherwise the match is only reported.
+    """
+    match = check_article(seed, threshold=threshold)
+    if match and MODE == MODE_SKIP:
+        conn = sqlite3.connect(DB_FILE, timeout=30)
+        conn.execute("UPDATE plans SET status = ? WHERE id = ? AND status = 'pending'", (STATUS_SIMILAR, plan_id))
+        conn.commit()
+        conn.close()
+        return False, match
+    return True, match
+
+
+def print_stats():
+    started = time.time()
+    index = get_index()
+    loaded = time.time() - started
+    entries = index.entries
+    print(f"📚 Статей в индексе: {len(index)}, ненулевых элементов: {entries} "
+          f"({entries / max(len(index), 1):.0f} на статью), загрузка {loaded * 1000:.0f} мс, "
+          f"{'numpy' if HAS_NUMPY else 'без numpy'}")
+    print(f"   Режим: {MODE}, порог {THRESHOLD:g}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Сходство тем с уже опубликованными статьями (TF-IDF)')
+    parser.add_argument('--check', metavar='TEXT', help='Тема или заголовок для проверки')
+    parser.add_argument('--keywords', default='', help='Ключевые слова через запятую (с --check)')
+    parser.add_argument('--top', type=int, default=5, help='Сколько похожих статей показать')
+    parser.add_argument('--stats', action='store_true', help='Размер индекса и время загрузки')
+    args = parser.parse_args()
+
+    if args.check:
+        index = get_index()
+        started = time.perf_counter()
+        keywords = [part.strip() for part in args.keywords.split(',') if part.strip()]
+        matches = index.score(document_terms(args.check, keywords), args.top)
+        elapsed = (time.perf_counter() - started) * 1000
+        print(f"🔎 Похожие статьи ({len(index)} в индексе, {elapsed:.1f} мс):")
+        for match in matches:
+            marker = '⚠️ ' if match['similarity'] >= THRESHOLD else '  '
+            print(f"   {marker}{match['similarity']:.2f}  [{match['wp_id']}] {match['title']}")
+        if not matches:
+            print("   Нет")
+    else:
+        print_stats()
@@ -0,0 +1,250 @@
+"""data_export.py
+
+Streaming export of `posts` and `plans` as NDJSON, CSV or Parquet.
+
+Rows are read from sqlite with `fetchmany` batches of EXPORT_BATCH_SIZE and
+encoded batch by batch into bytes chunks, so memory stays constant whatever
+the size of the history. main.py serves the chunks through
+`StreamingResponse`; the CLI writes them to a file or stdout.
+
+Posts carry their decoded keywords, category, WordPress id and the time the
+plan waited in the queue; plans carry their scheduling fields and the time
+from creation to publication. Parquet needs `pyarrow` (optional).
+
+Usage:
+    python data_export.py posts --format csv -o posts.csv
+    python data_export.py plans --format ndjson --status pending
+    python data_export.py posts --format parquet --since 2025-01-01 -o posts.parquet
+"""
+import io
+import ast
+import csv
+import json
+import sqlite3
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+import plan_scheduler
+
+DB_FILE = 'storage.db'
+
+EXPORT_BATCH_SIZE = 1000
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+_SECONDS_BETWEEN = "CAST((julianday({end}) - julianday({start})) * 86400 AS INTEGER)"
+
+# Колонки выгрузки: (имя, SQL-выражение, тип parquet)
+EXPORTS = {
+    'posts': {
+        'from': "posts LEFT JOIN plans ON plans.id = posts.plan_id",
+        'time_column': "posts.published_at",
+        'columns': (
+            ('id', "posts.id", 'int64'),
+            ('wp_id', "posts.wp_id", 'int64'),
+            ('title', "posts.title", 'string'),
+            ('slug', "posts.slug", 'string'),
+            ('category', "COALESCE(posts.category, plans.category)", 'string'),
+            ('keywords', "posts.seo_keywords", 'list'),
+            ('published_at', "posts.published_at", 'string'),
+            ('plan_id', "posts.plan_id", 'int64'),
+            ('plan_created_at', "plans.created_at", 'string'),
+            ('queue_seconds', _SECONDS_BETWEEN.format(end="posts.published_at", start="plans.created_at"), 'int64'),
+        ),
+    },
+    'plans': {
+        'from': "plans",
+        'time_column': "plans.created_at",
+        'columns': (
+            ('id', "id", 'int64'),
+            ('seed', "seed", 'string'),
+            ('seo_focus', "seo_focus", 'string'),
+            ('category', "category", 'string'),
+            ('status', "status", 'string'),
+            ('priority', "priority", 'int64'),
+            ('publish_after', "publish_after", 'string'),
+            ('created_at', "created_at", 'string'),
+            ('last_published_at', "last_published_at", 'string'),
+            ('queue_seconds', _SECONDS_BETWEEN.format(end="last_published_at", start="created_at"), 'int64'),
+        ),
+    },
+}
+
+
+def parse_keywords(value):
+    """Keywords stored as JSON or as a Python list repr -> list of strings"""
+    if not value:
+        return []
+    for parse in (json.loads, ast.literal_eval):
+        try:
+            parsed = parse(value)
+        except (ValueError, SyntaxError):
+            continue
+        if isinstance(parsed, (list, tuple)):
+            return [str(item) for item in parsed]
+    return [part.strip() for part in str(value).split(',') if part.strip()]
+
+
+def _connect():
+    # StreamingResponse читает генератор из разных потоков threadpool
+    conn = sqlite3.connect(DB_FILE, timeout=30, check_same_thread=False)
+    plan_scheduler.ensure_schema(conn)
+    return conn
+
+
+def iter_rows(table, since=None, status=None, category=None, batch_size=EXPORT_BATCH_SIZE):
+    """Yield lists of row dicts, `batch_size` rows at a time, from one server-side cursor"""
+    spec = EXPORTS[table]
+    names = [name for name, _expr, _type in spec['columns']]
+    sql = f"SELECT {', '.join(expr for _name, expr, _type in spec['columns'])} FROM {spec['from']} WHERE 1=1"
+    params = []
+    if since:
+        sql += f" AND {spec['time_column']} >= ?"
+        params.append(plan_scheduler.normalize_timestamp(since)[:19])
+    if status and table == 'plans':
+        sql += " AND status = ?"
+        params.append(status)
+    if category:
+        sql += " AND category = ?" if table == 'plans' else " AND COALESCE(posts.category, plans.category) = ?"
+        params.append(category)
+    sql += f" ORDER BY {table}.id"
+
+    conn = _connect()
+    try:
+        cur = conn.execute(sql, params)
+        while True:
+            batch = cur.fetchmany(batch_size)
+            if not batch:
+                break
+            rows = [dict(zip(names, row)) for row in batch]
+            if table == 'posts':
+                for row in rows:
+                    row['keywords'] = parse_keywords(row['keywords'])
+            yield rows
+    finally:
+        conn.close()
+
+
+def _ndjson_chunks(table, batches):
+    for rows in batches:
+        yield "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows).encode('utf-8')
+
+
+def _csv_chunks(table, batches):
+    names = [name for name, _expr, _type in EXPORTS[table]['columns']]
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=names)
+    writer.writeheader()
+    for rows in batches:
+        for row in rows:
+            if isinstance(row.get('keywords'), list):
+                row = dict(row, keywords=', '.join(row['keywords']))
+            writer.writerow(row)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file collecting bytes between reads (for ParquetWriter)"""
+
+    def __init__(self):
+        self.data = bytearray()
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.data += b
+        self.position += len(b)
+        return len(b)
+
+    def tell(self):
+        return self.position
+
+    def take(self):
+        chunk, self.data = bytes(self.data), bytearray()
+        return chunk
+
+
+def _parquet_schema(table):
+    types = {'int64': pa.int64(), 'string': pa.string(), 'list': pa.list_(pa.string())}
+    return pa.schema([(name, types[kind]) for name, _expr, kind in EXPORTS[table]['columns']])
+
+
+def _parquet_chunks(table, batches):
+    schema = _parquet_schema(table)
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        # Каждая порция строк - отдельная row group
+        for rows in batches:
+            writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+            chunk = sink.take()
+            if chunk:
+                yield chunk
+    finally:
+        writer.close()
+    yield sink.take()
+
+
+ENCODERS = {'ndjson': _ndjson_chunks, 'csv': _csv_chunks, 'parquet': _parquet_chunks}
+
+
+def export_chunks(table, fmt='ndjson', since=None, status=None, category=None):
+    """Bytes chunks of the export of `table` in `fmt`; raises ValueError for bad arguments"""
+    if table not in EXPORTS:
+        raise ValueError(f"unknown table {table!r}, expected one of {', '.join(EXPORTS)}")
+    if fmt not in ENCODERS:
+        raise ValueError(f"unknown format {fmt!r}, expected one of {', '.join(ENCODERS)}")
+    if fmt == 'parquet' and not HAS_PYARROW:
+        raise ValueError("parquet export needs pyarrow (pip install pyarrow)")
+    # Неверная дата должна дать ошибку сразу, а не посреди ответа
+    since = plan_scheduler.normalize_timestamp(since)
+    return ENCODERS[fmt](table, iter_rows(table, since=since, status=status, category=category))
+
+
+def export_filename(table, fmt):
+    return f"{table}.{fmt}"
+
+
+if __name__ == "__main__":
+    import sys
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Выгрузка постов и планов из storage.db')
+    parser.add_argument('table', choices=sorted(EXPORTS), help='Что выгружать')
+    parser.add_argument('--format', choices=sorted(ENCODERS), default='ndjson', help='Формат (по умолчанию ndjson)')
+    parser.add_argument('--since', help='Только записи не раньше этой даты (ISO)')
+    parser.add_argument('--status', help='Статус плана (только для plans)')
+    parser.add_argument('--category', help='Категория')
+    parser.add_argument('-o', '--output', help='Файл (по умолчанию stdout)')
+    args = parser.parse_args()
+
+    try:
+        chunks = export_chunks(args.table, args.format, since=args.since, status=args.status, category=args.category)
+        output = open(args.output, 'wb') if args.output else sys.stdout.buffer
+        written = 0
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+                written += len(chunk)
+        finally:
+            if args.output:
+                output.close()
+    except ValueError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        sys.exit(1)
+    if args.output:
+        print(f"✅ Выгружено в {args.output} ({written / 1024:.1f} KB)", file=sys.stderr)
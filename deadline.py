@@ -0,0 +1,99 @@
+"""deadline.py
+
+Per-run deadlines for the publish pipeline.
+
+A `Deadline` is created once per run (PUBLISH_DEADLINE_SECONDS) and passed
+down as `deadline=` through article/image generation, media upload, term
+resolution, post creation and social publishing. Each stage takes a child
+deadline with its own budget (never later than the parent), HTTP calls use
+the remaining time as their timeout, retries and backoff sleeps are cut
+short when the remaining budget is too small, and streaming calls stop
+reading once it expires. Every function keeps `deadline=None` as "no limit".
+
+Settings (.env):
+    PUBLISH_DEADLINE_SECONDS=900
+"""
+import os
+import time
+from dotenv import load_dotenv
+load_dotenv()
+
+PUBLISH_DEADLINE_SECONDS = float(os.getenv('PUBLISH_DEADLINE_SECONDS', '900'))
+
+# Бюджеты этапов публикации в секундах (ограничены общим дедлайном)
+STAGE_BUDGETS = {
+    'article': 420,
+    'image': 180,
+    'upload': 60,
+    'terms': 60,
+    'wordpress': 60,
+    'social': 180,
+}
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a stage runs out of its time budget"""
+
+
+class Deadline:
+    """Absolute point in time (monotonic clock) by which work must finish"""
+
+    def __init__(self, seconds, label='run', parent=None):
+        self.label = label
+        self.expires_at = time.monotonic() + seconds
+        if parent is not None:
+            self.expires_at = min(self.expires_at, parent.expires_at)
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def check(self, what=None):
+        """Raise DeadlineExceeded if no time is left"""
+        if self.expired():
+            raise DeadlineExceeded(f"deadline '{self.label}' exceeded" + (f" before {what}" if what else ""))
+
+    def child(self, label, seconds=None):
+        """Deadline for a stage: its own budget, but never later than this one"""
+        if seconds is None:
+            seconds = STAGE_BUDGETS.get(label, self.remaining())
+        return Deadline(seconds, label=label, parent=self)
+
+    def timeout(self, cap):
+        """Timeout for one blocking call: the remaining time, at most `cap`"""
+        self.check()
+        return min(cap, self.remaining()) if cap else self.remaining()
+
+    def sleep(self, seconds, what=None):
+        """Sleep unless the sleep itself would run past the deadline"""
+        if seconds >= self.remaining():
+            raise DeadlineExceeded(f"deadline '{self.label}' too close to wait {seconds:.1f}s"
+                                   + (f" before {what}" if what else ""))
+        time.sleep(seconds)
+
+    def __repr__(self):
+        return f"Deadline({self.label!r}, remaining={self.remaining():.1f}s)"
+
+
+def stage_deadline(deadline, label):
+    """Child deadline for a stage, or None when the run has no deadline"""
+    return deadline.child(label) if deadline is not None else None
+
+
+def request_timeout(deadline, default):
+    """Timeout for an HTTP call: `default` without a deadline, otherwise capped by it"""
+    return deadline.timeout(default) if deadline is not None else default
+
+
+def check(deadline, what=None):
+    if deadline is not None:
+        deadline.check(what)
+
+
+def sleep(deadline, seconds, what=None):
+    if deadline is not None:
+        deadline.sleep(seconds, what)
+    else:
+        time.sleep(seconds)
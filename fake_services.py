@@ -0,0 +1,471 @@
+"""fake_services.py
+
+Local stand-ins for every external service of the pipeline, on one port:
+
+    /wp-json/wp/v2/...        WordPress REST: tags, categories (search/create),
+                              media upload, posts (create, status change, list)
+    /v1beta/...               Gemini/Imagen: streamGenerateContent,
+                              generateContent, predict, cachedContents
+    /facebook/...             Graph API page feed
+    /vk/...                   VK wall.post with photo upload
+    /telegram/...             Bot API sendMessage/sendPhoto
+
+Gemini answers are canned but shaped like real ones: articles, outlines,
+sections and social posts built from the request topic, streamed in chunks,
+and PNG images of realistic size. A share of answers can be malformed
+(`malformed_rate`: truncated JSON or placeholder content that the validator
+rejects) or rate limited (`error_rate`: 429 RESOURCE_EXHAUSTED with a retry
+delay).
+
+Latency is drawn from a log-normal distribution around the median of each
+service (LATENCY_MS) times `latency_scale`; Gemini streams add a delay per
+chunk. `env()` returns the variables that point the clients here
+(WP_BASE_URL, GEMINI_BASE_URL, FACEBOOK_GRAPH_URL, VK_API_URL,
+TELEGRAM_API_URL and fake credentials).
+
+Usage:
+    python fake_services.py --port 8765 [--latency-scale 0.1] [--malformed-rate 0.1]
+"""
+import re
+import json
+import time
+import zlib
+import base64
+import random
+import struct
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Медианная задержка (мс) и разброс (sigma логнормального распределения)
+LATENCY_MS = {
+    'wordpress': (150, 0.4),
+    'wordpress_media': (450, 0.5),
+    'gemini_first_chunk': (900, 0.5),
+    'gemini_chunk': (40, 0.3),
+    'imagen': (3500, 0.3),
+    'social': (300, 0.5),
+}
+STREAM_CHUNK_CHARS = 400
+IMAGE_SIZE = (640, 360)
+
+
+def _png(width, height, seed=0):
+    """PNG of random pixels (incompressible, close to a real photo in size)"""
+    rng = random.Random(seed)
+    rows = b"".join(b"\x00" + rng.randbytes(width * 3) for _ in range(height))
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(rows, 1)) + chunk(b"IEND", b""))
+
+
+def _topic(prompt):
+    match = re.search(r"^(?:TOPIC|Title):\s*(.+)$", prompt, re.MULTILINE)
+    return (match.group(1).strip() if match else prompt.strip().split("\n")[0])[:120] or "Artificial intelligence"
+
+
+def _slugify(text):
+    return re.sub(r"[^a-z0-9]+", "-", text.lower()).strip("-")[:80] or "ai-article"
+
+
+def _keywords(topic):
+    words = [w.lower() for w in re.findall(r"[A-Za-z]{4,}", topic)]
+    return (list(dict.fromkeys(words)) + ["artificial intelligence", "automation", "technology"])[:5]
+
+
+def _paragraphs(topic, count):
+    return "".join(
+        f"<p>{topic} keeps changing how teams work. This part looks at practical example {i + 1}, "
+        f"the tools that make it possible and what to measure before and after adoption.</p>\n"
+        for i in range(count))
+
+
+def canned_article(topic):
+    title = topic if len(topic) >= 10 else f"{topic}: a practical guide"
+    body = "".join(f"<h2>Aspect {i + 1} of {topic}</h2>\n{_paragraphs(topic, 3)}" for i in range(5))
+    return {
+        "title": title[:70],
+        "slug": _slugify(title),
+        "meta_description": f"A practical guide to {topic}: tools, examples and what to measure."[:160],
+        "keywords": _keywords(topic),
+        "content_html": _paragraphs(topic, 2) + body,
+        "image_prompt": f"Professional editorial illustration about {topic}",
+        "headings_summary": [f"Aspect {i + 1} of {topic}" for i in range(5)],
+    }
+
+
+def canned_outline(topic):
+    article = canned_article(topic)
+    outline = {key: article[key] for key in ("title", "slug", "meta_description", "keywords", "image_prompt")}
+    outline["introduction"] = f"Why {topic} matters now."
+    outline["sections"] = [{"heading": f"Aspect {i + 1} of {topic}", "points": "Examples and tools."} for i in range(4)]
+    outline["sections"].append({"heading": "Conclusion", "points": "Summary and next steps."})
+    return outline
+
+
+def canned_social(topic):
+    tags = ["AI", "Technology", "Automation"]
+    return {platform: {"text": f"New on the blog: {topic}. What would you try first?", "hashtags": tags}
+            for platform in ("facebook", "twitter", "threads", "vk", "instagram", "telegram")}
+
+
+class FakeState:
+    """Shared state and failure injection of one fake server"""
+
+    def __init__(self, latency_scale=1.0, malformed_rate=0.0, error_rate=0.0, seed=0):
+        self.latency_scale = latency_scale
+        self.malformed_rate = malformed_rate
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.ids = {}
+        self.terms = {'tags': {}, 'categories': {}}
+        self.posts = []
+        self.caches = {}
+        self.requests = {}
+        self.image = _png(*IMAGE_SIZE, seed=seed)
+
+    def next_id(self, kind):
+        with self.lock:
+            self.ids[kind] = self.ids.get(kind, 0) + 1
+            return self.ids[kind]
+
+    def chance(self, rate):
+        with self.lock:
+            return rate > 0 and self.rng.random() < rate
+
+    def delay(self, name):
+        median, sigma = LATENCY_MS[name]
+        if self.latency_scale <= 0:
+            return
+        with self.lock:
+            ms = self.rng.lognormvariate(0, sigma) * median
+        time.sleep(ms * self.latency_scale / 1000)
+
+    def count(self, service):
+        with self.lock:
+            self.requests[service] = self.requests.get(service, 0) + 1
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    state = None  # FakeState, задается в make_server
+
+    def log_message(self, *args):
+        pass
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _json_body(self, raw):
+        try:
+            return json.loads(raw or b"{}")
+        except ValueError:
+            return {}
+
+    def _form(self, raw):
+        return {key: values[-1] for key, values in parse_qs(raw.decode('utf-8', 'replace')).items()}
+
+    def _send(self, status, payload, content_type='application/json', headers=None):
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._route('GET')
+
+    def do_POST(self):
+        self._route('POST')
+
+    def do_PATCH(self):
+        self._route('PATCH')
+
+    def _route(self, method):
+        url = urlparse(self.path)
+        raw = self._body()
+        path = url.path
+        try:
+            if path.startswith('/wp-json/'):
+                self.state.count('wordpress')
+                self._wordpress(method, path, parse_qs(url.query), raw)
+            elif path.startswith('/v1beta/'):
+                self.state.count('gemini')
+                self._gemini(method, path, raw)
+            elif path.startswith(('/facebook/', '/vk/', '/telegram/')):
+                self.state.count(path.split('/')[1])
+                self._social(path, raw)
+            else:
+                self._send(404, {'error': 'not found'})
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    # WordPress
+
+    def _wordpress(self, method, path, query, raw):
+        state = self.state
+        match = re.match(r"^/wp-json/wp/v2/(tags|categories|media|posts)(?:/(\d+))?$", path)
+        if not match:
+            self._send(404, {'code': 'rest_no_route'})
+            return
+        kind, item_id = match.groups()
+        state.delay('wordpress_media' if kind == 'media' else 'wordpress')
+        if kind in ('tags', 'categories'):
+            terms = state.terms[kind]
+            if method == 'GET':
+                search = (query.get('search') or [''])[0].lower()
+                include = {int(term_id) for term_id in (query.get('include') or [''])[0].split(',') if term_id}
+                self._send(200, [term for term in terms.values() if search in term['name'].lower()
+                                 and (not include or term['id'] in include)])
+                return
+            data = self._json_body(raw)
+            with state.lock:
+                existing = terms.get(data.get('name', '').lower())
+            if existing:
+                self._send(400, {'code': 'term_exists', 'data': {'term_id': existing['id']}})
+                return
+            term = {'id': state.next_id(kind), 'name': data.get('name', ''), 'slug': data.get('slug', '')}
+            with state.lock:
+                terms[term['name'].lower()] = term
+            self._send(201, term)
+        elif kind == 'media':
+            media_id = state.next_id('media')
+            self._send(201, {'id': media_id, 'source_url': f"http://{self.headers.get('Host')}/media/{media_id}.png",
+                             'size': len(raw)})
+        elif method == 'GET' and not item_id:
+            page = int((query.get('page') or ['1'])[0])
+            per_page = int((query.get('per_page') or ['10'])[0])
+            with state.lock:
+                posts = [post for post in state.posts if post['status'] == 'publish']
+            pages = max(1, -(-len(posts) // per_page))
+            self._send(200, posts[(page - 1) * per_page:page * per_page], headers={
+                'X-WP-Total': str(len(posts)), 'X-WP-TotalPages': str(pages)})
+        elif item_id:
+            data = self._json_body(raw)
+            with state.lock:
+                for post in state.posts:
+                    if post['id'] == int(item_id) and data.get('status'):
+                        post['status'] = data['status']
+            self._send(200, {'id': int(item_id), 'status': data.get('status', 'publish'),
+                             'link': f"http://{self.headers.get('Host')}/?p={item_id}"})
+        else:
+            data = self._json_body(raw)
+            post_id = state.next_id('posts')
+            post = {'id': post_id, 'status': data.get('status', 'publish'),
+                    'title': {'rendered': data.get('title', '')}, 'tags': data.get('tags') or [],
+                    'date_gmt': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime()),
+                    'link': f"http://{self.headers.get('Host')}/{data.get('slug') or post_id}/"}
+            with state.lock:
+                state.posts.append(post)
+            self._send(201, post)
+
+    # Gemini / Imagen
+
+    def _gemini(self, method, path, raw):
+        state = self.state
+        body = self._json_body(raw)
+        if path.startswith('/v1beta/cachedContents'):
+            self._gemini_cache(method, path, body)
+            return
+        match = re.match(r"^/v1beta/models/([^:]+):(\w+)$", path)
+        if not match:
+            self._send(404, {'error': {'code': 404, 'message': 'not found', 'status': 'NOT_FOUND'}})
+            return
+        model, action = match.groups()
+
+        if state.chance(state.error_rate):
+            state.delay('wordpress')
+            self._send(429, {'error': {
+                'code': 429, 'status': 'RESOURCE_EXHAUSTED',
+                'message': 'Resource has been exhausted (e.g. check quota). Please retry in 1s.',
+                'details': [{'@type': 'type.googleapis.com/google.rpc.RetryInfo', 'retryDelay': '1s'}]}})
+            return
+
+        if action == 'predict':
+            state.delay('imagen')
+            count = (body.get('parameters') or {}).get('sampleCount', 1)
+            image = base64.b64encode(state.image).decode('ascii')
+            self._send(200, {'predictions': [{'bytesBase64Encoded': image, 'mimeType': 'image/png'}] * count})
+            return
+
+        instruction = self._instruction(body)
+        prompt = " ".join(part.get('text', '') for content in body.get('contents', [])
+                          for part in content.get('parts', []))
+        if 'image' in model:
+            state.delay('imagen')
+            parts = [{'inlineData': {'mimeType': 'image/png', 'data': base64.b64encode(state.image).decode('ascii')}}]
+            self._stream_or_send(action, [parts], model, prompt)
+            return
+
+        topic = _topic(prompt)
+        if 'social media' in instruction or 'Generate the posts now' in prompt:
+            text = json.dumps(canned_social(topic))
+        elif 'ARTICLE OUTLINE' in prompt or 'ONE part' in instruction:
+            text = _paragraphs(topic, 3)
+        elif 'plan a comprehensive' in instruction:
+            text = json.dumps(canned_outline(topic))
+        else:
+            article = canned_article(topic)
+            if state.chance(state.malformed_rate):
+                if state.chance(0.5):
+                    article['content_html'] = "<p>Lorem ipsum placeholder</p>" + article['content_html']
+                    text = json.dumps(article)
+                else:
+                    text = json.dumps(article)[:-200]
+            else:
+                text = json.dumps(article)
+        state.delay('gemini_first_chunk')
+        pieces = [text[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(text), STREAM_CHUNK_CHARS)] or [""]
+        self._stream_or_send(action, [[{'text': piece}] for piece in pieces], model, prompt)
+
+    def _instruction(self, body):
+        instruction = body.get('systemInstruction') or {}
+        text = " ".join(part.get('text', '') for part in instruction.get('parts', []))
+        cached = body.get('cachedContent')
+        if cached:
+            with self.state.lock:
+                text += self.state.caches.get(cached, {}).get('instruction', '')
+        return text
+
+    def _gemini_cache(self, method, path, body):
+        state = self.state
+        if method == 'GET':
+            with state.lock:
+                caches = [{key: value for key, value in cache.items() if key != 'instruction'}
+                          for cache in state.caches.values()]
+            self._send(200, {'cachedContents': caches})
+            return
+        if method == 'PATCH':
+            name = path[len('/v1beta/'):]
+            with state.lock:
+                cache = state.caches.get(name)
+            self._send(200 if cache else 404, {key: value for key, value in (cache or {}).items()
+                                               if key != 'instruction'})
+            return
+        name = f"cachedContents/fake{state.next_id('caches')}"
+        instruction = " ".join(part.get('text', '') for part in
+                               (body.get('systemInstruction') or {}).get('parts', []))
+        cache = {'name': name, 'model': body.get('model'), 'displayName': body.get('displayName'),
+                 'expireTime': '2099-01-01T00:00:00Z', 'instruction': instruction,
+                 'usageMetadata': {'totalTokenCount': len(instruction) // 4}}
+        with state.lock:
+            state.caches[name] = cache
+        self._send(200, {key: value for key, value in cache.items() if key != 'instruction'})
+
+    def _response(self, parts, model, prompt, last):
+        response = {'candidates': [{'content': {'role': 'model', 'parts': parts}, 'index': 0}],
+                    'modelVersion': model}
+        if last:
+            response['candidates'][0]['finishReason'] = 'STOP'
+            response['usageMetadata'] = {'promptTokenCount': len(prompt) // 4,
+                                         'candidatesTokenCount': 500, 'totalTokenCount': len(prompt) // 4 + 500}
+        return response
+
+    def _stream_or_send(self, action, chunks, model, prompt):
+        if action != 'streamGenerateContent':
+            parts = [part for chunk in chunks for part in chunk]
+            if parts and 'text' in parts[0]:
+                parts = [{'text': "".join(part['text'] for part in parts)}]
+            self._send(200, self._response(parts, model, prompt, True))
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for index, parts in enumerate(chunks):
+            if index:
+                self.state.delay('gemini_chunk')
+            event = f"data: {json.dumps(self._response(parts, model, prompt, index == len(chunks) - 1))}\r\n\r\n"
+            data = event.encode('utf-8')
+            self.wfile.write(f"{len(data):X}\r\n".encode('ascii') + data + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    # Социальные сети
+
+    def _social(self, path, raw):
+        state = self.state
+        state.delay('social')
+        if path.startswith('/facebook/'):
+            self._send(200, {'id': f"page_{state.next_id('facebook')}"})
+        elif path == '/vk/upload':
+            self._send(200, {'server': 1, 'photo': '[{"photo":"fake"}]', 'hash': 'fakehash'})
+        elif path.startswith('/vk/method/photos.getWallUploadServer'):
+            self._send(200, {'response': {'upload_url': f"http://{self.headers.get('Host')}/vk/upload"}})
+        elif path.startswith('/vk/method/photos.saveWallPhoto'):
+            self._send(200, {'response': [{'owner_id': -1, 'id': state.next_id('vk_photo')}]})
+        elif path.startswith('/vk/method/wall.post'):
+            self._send(200, {'response': {'post_id': state.next_id('vk')}})
+        elif path.startswith('/telegram/'):
+            self._send(200, {'ok': True, 'result': {'message_id': state.next_id('telegram')}})
+        else:
+            self._send(404, {'error': 'not found'})
+
+
+def make_server(host='127.0.0.1', port=0, **options):
+    """ThreadingHTTPServer with its own FakeState (`server.state`), not started yet"""
+    state = FakeState(**options)
+    handler = type('FakeHandler', (_Handler,), {'state': state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.state = state
+    return server
+
+
+def env(base_url):
+    """Environment variables pointing every client at the fake server"""
+    return {
+        'WP_BASE_URL': base_url,
+        'WP_USERNAME': 'bench',
+        'WP_APP_PASSWORD': 'fake password',
+        'DISABLE_WP_PUBLISH': 'false',
+        'GEMINI_BASE_URL': base_url,
+        'GEMINI_API_KEYS': 'fake-gemini-key',
+        'GOOGLE_API_KEY': '',
+        'GEMINI_API_KEY': '',
+        'FACEBOOK_GRAPH_URL': f"{base_url}/facebook",
+        'FACEBOOK_PAGE_ID': '1000',
+        'FACEBOOK_ACCESS_TOKEN': 'fake',
+        'VK_API_URL': f"{base_url}/vk",
+        'VK_ACCESS_TOKEN': 'fake',
+        'VK_GROUP_ID': '1000',
+        'TELEGRAM_API_URL': f"{base_url}/telegram",
+        'TELEGRAM_BOT_TOKEN': 'fake',
+        'TELEGRAM_CHANNEL_ID': '@bench',
+        # Сервисы без заглушек отключаем, чтобы бенчмарк не ушел в реальные сети
+        'TWITTER_API_KEY': '', 'TWITTER_API_SECRET': '', 'TWITTER_ACCESS_TOKEN': '',
+        'TWITTER_ACCESS_SECRET': '', 'TWITTER_BEARER_TOKEN': '',
+        'INSTAGRAM_USERNAME': '', 'INSTAGRAM_PASSWORD': '', 'THREADS_USERNAME': '', 'THREADS_PASSWORD': '',
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Локальные заглушки WordPress, Gemini и соцсетей')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency-scale', type=float, default=1.0, help='Множитель задержек (0 = без задержек)')
+    parser.add_argument('--malformed-rate', type=float, default=0.0, help='Доля невалидных статей')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Доля ответов 429 от Gemini')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, latency_scale=args.latency_scale,
+                         malformed_rate=args.malformed_rate, error_rate=args.error_rate, seed=args.seed)
+    base_url = f"http://{args.host}:{server.server_address[1]}"
+    print(f"✅ Заглушки запущены на {base_url}")
+    for name, value in env(base_url).items():
+        print(f"{name}={value}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,382 @@
+"""gemini_batch.py
+
+Bulk article generation for large plan imports via the Gemini Batch API.
+
+N pending plans are turned into article prompts, submitted as one batch job,
+polled until the job finishes, and the results are parsed, validated and
+stored as checkpoints in `article_checkpoints`. When a plan with a checkpoint
+is published, only the image is generated (see generate_article_with_image).
+The interactive path is not involved.
+
+The backend is pluggable:
+    GeminiBatchBackend - real Gemini Batch API (client.batches)
+    LocalBatchBackend  - in-process stand-in that answers every request with a
+                         responder function (canned articles by default), for
+                         tests and dry runs without quota
+
+Usage:
+    python gemini_batch.py --limit 50
+    python gemini_batch.py --limit 5 --backend local
+    python gemini_batch.py --resume batches/123456
+    python gemini_batch.py --status
+"""
+import os
+import re
+import json
+import time
+import uuid
+import sqlite3
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+
+from gemini_client import (GeminiClient, validate_article, ARTICLE_MODEL, ARTICLE_GENERATION_CONFIG,
+                           ARTICLE_SYSTEM_INSTRUCTION, HAS_GENAI)
+import usage_ledger
+import plan_scheduler
+
+load_dotenv()
+
+DB_FILE = 'storage.db'
+
+BATCH_POLL_INTERVAL = float(os.getenv('GEMINI_BATCH_POLL_SECONDS', '30'))
+
+# Normalized job states
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_SUCCEEDED = 'succeeded'
+JOB_FAILED = 'failed'
+FINAL_STATES = (JOB_SUCCEEDED, JOB_FAILED)
+
+
+class BatchBackend:
+    """Interface of a batch generation backend"""
+
+    name = 'base'
+
+    def submit(self, prompts: list, display_name: str) -> str:
+        """Submit prompts as one job, return the job id"""
+        raise NotImplementedError("Must be implemented in subclass")
+
+    def poll(self, job_id: str) -> str:
+        """Return one of JOB_PENDING / JOB_RUNNING / JOB_SUCCEEDED / JOB_FAILED"""
+        raise NotImplementedError("Must be implemented in subclass")
+
+    def results(self, job_id: str) -> list:
+        """Return (text, error) per prompt, in submission order"""
+        raise NotImplementedError("Must be implemented in subclass")
+
+
+class GeminiBatchBackend(BatchBackend):
+    """Gemini Batch API with inlined requests"""
+
+    name = 'gemini'
+
+    _STATE_MAP = {
+        'JOB_STATE_PENDING': JOB_PENDING,
+        'JOB_STATE_QUEUED': JOB_PENDING,
+        'JOB_STATE_RUNNING': JOB_RUNNING,
+        'JOB_STATE_SUCCEEDED': JOB_SUCCEEDED,
+        'JOB_STATE_FAILED': JOB_FAILED,
+        'JOB_STATE_CANCELLED': JOB_FAILED,
+        'JOB_STATE_EXPIRED': JOB_FAILED,
+    }
+
+    def __init__(self, gemini_client: GeminiClient = None, model: str = ARTICLE_MODEL):
+        self.gemini = gemini_client or GeminiClient()
+        if not self.gemini.client:
+            raise RuntimeError("Gemini client is not available (check SDK installation and API key)")
+        self.model = model
+
+    def submit(self, prompts, display_name):
+        inlined_requests = [
+            {
+                'contents': [{'parts': [{'text': prompt}], 'role': 'user'}],
+                'config': dict(ARTICLE_GENERATION_CONFIG, system_instruction=ARTICLE_SYSTEM_INSTRUCTION),
+            }
+            for prompt in prompts
+        ]
+        job = self.gemini.client.batches.create(
+            model=self.model,
+            src=inlined_requests,
+            config={'display_name': display_name},
+        )
+        print(f"[gemini_batch] Submitted batch job {job.name} ({len(prompts)} requests)")
+        return job.name
+
+    def poll(self, job_id):
+        job = self.gemini.client.batches.get(name=job_id)
+        return self._STATE_MAP.get(job.state.name, JOB_RUNNING)
+
+    def results(self, job_id):
+        job = self.gemini.client.batches.get(name=job_id)
+        results = []
+        for inline_response in job.dest.inlined_responses:
+            if inline_response.response:
+                usage_ledger.record_call(self.model, 'batch', inline_response.response)
+                try:
+                    results.append((inline_response.response.text, None))
+                except Exception as e:
+                    results.append((None, str(e)))
+            else:
+                results.append((None, str(inline_response.error)))
+        return results
+
+
+def canned_article_responder(prompt: str) -> str:
+    """Default responder of LocalBatchBackend: a valid article JSON for the prompt's topic"""
+    match = re.search(r'^TOPIC:\s*(.+)$', prompt, re.MULTILINE)
+    topic = match.group(1).strip() if match else "AI Technology Insights"
+    slug = re.sub(r'[^a-z0-9]+', '-', topic.lower()).strip('-')[:80] or 'ai-article'
+    paragraphs = "".join(
+        f"<h2>Section {i}</h2><p>{topic} is reshaping how teams work. This section explains "
+        f"practical approaches, tools and trade-offs with concrete examples.</p>"
+        for i in range(1, 6)
+    )
+    return json.dumps({
+        "title": topic[:70],
+        "slug": slug,
+        "meta_description": f"A practical guide to {topic}: tools, examples and key insights for readers."[:160],
+        "keywords": ["artificial intelligence", "technology", "automation"],
+        "content_html": paragraphs,
+        "image_prompt": f"Modern professional illustration about {topic}",
+        "headings_summary": [f"Section {i}" for i in range(1, 6)]
+    })
+
+
+class LocalBatchBackend(BatchBackend):
+    """In-process stand-in for the Batch API.
+
+    Jobs complete `completion_delay` seconds after submission; every prompt is
+    answered by `responder(prompt)` (an exception becomes the item error).
+    """
+
+    name = 'local'
+
+    def __init__(self, responder=None, completion_delay: float = 0.0):
+        self.responder = responder or canned_article_responder
+        self.completion_delay = completion_delay
+        self._jobs = {}
+
+    def submit(self, prompts, display_name):
+        job_id = f"local-{uuid.uuid4().hex[:12]}"
+        self._jobs[job_id] = {'prompts': list(prompts), 'submitted': time.time(), 'name': display_name}
+        print(f"[gemini_batch] Submitted local batch job {job_id} ({len(prompts)} requests)")
+        return job_id
+
+    def poll(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is None:
+            return JOB_FAILED
+        if time.time() - job['submitted'] < self.completion_delay:
+            return JOB_RUNNING
+        return JOB_SUCCEEDED
+
+    def results(self, job_id):
+        results = []
+        for prompt in self._jobs[job_id]['prompts']:
+            try:
+                results.append((self.responder(prompt), None))
+            except Exception as e:
+                results.append((None, str(e)))
+        return results
+
+
+def ensure_schema(conn):
+    conn.execute("""CREATE TABLE IF NOT EXISTS article_checkpoints (
+        plan_id INTEGER PRIMARY KEY,
+        article_json TEXT,
+        source TEXT,
+        created_at TEXT
+    )""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS batch_jobs (
+        job_id TEXT PRIMARY KEY,
+        backend TEXT,
+        plan_ids TEXT,
+        state TEXT,
+        submitted_at TEXT,
+        completed_at TEXT,
+        ingested INTEGER DEFAULT 0,
+        rejected INTEGER DEFAULT 0
+    )""")
+    conn.commit()
+
+
+def _connect():
+    conn = sqlite3.connect(DB_FILE)
+    # select_plans сортирует по priority - колонку добавляет планировщик
+    plan_scheduler.ensure_schema(conn)
+    ensure_schema(conn)
+    return conn
+
+
+def load_checkpoint(plan_id):
+    """Pre-generated article for a plan, or None"""
+    if plan_id is None:
+        return None
+    conn = _connect()
+    cur = conn.execute("SELECT article_json FROM article_checkpoints WHERE plan_id=?", (plan_id,))
+    row = cur.fetchone()
+    conn.close()
+    return json.loads(row[0]) if row else None
+
+
+def select_plans(conn, limit):
+    """Pending plans without a checkpoint, in queue order"""
+    cur = conn.execute("""SELECT p.id, p.seed, p.seo_focus FROM plans p
+                          WHERE p.status='pending'
+                            AND NOT EXISTS (SELECT 1 FROM article_checkpoints c WHERE c.plan_id = p.id)
+                          ORDER BY p.priority DESC, p.created_at
+                          LIMIT ?""", (limit,))
+    return cur.fetchall()
+
+
+def submit_batch(backend: BatchBackend, limit: int = 50):
+    """Build prompts for up to `limit` plans and submit them. Returns job id or None."""
+    conn = _connect()
+    plans = select_plans(conn, limit)
+    if not plans:
+        conn.close()
+        print("[gemini_batch] No pending plans without checkpoints")
+        return None
+
+    builder = GeminiClient()
+    # Статическая инструкция передается как system_instruction, в запросах только переменная часть
+    prompts = [builder.build_article_request(seed, seo_focus or seed) for _plan_id, seed, seo_focus in plans]
+    display_name = f"articles-{datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')}"
+    job_id = backend.submit(prompts, display_name)
+
+    conn.execute("INSERT INTO batch_jobs (job_id, backend, plan_ids, state, submitted_at) VALUES (?, ?, ?, ?, ?)",
+                 (job_id, backend.name, json.dumps([plan[0] for plan in plans]), JOB_PENDING,
+                  datetime.now(timezone.utc).isoformat()))
+    conn.commit()
+    conn.close()
+    return job_id
+
+
+def wait_for_job(backend: BatchBackend, job_id: str, poll_interval: float = BATCH_POLL_INTERVAL, timeout: float = None):
+    """Poll until the job reaches a final state (or timeout). Returns the last state."""
+    started = time.time()
+    while True:
+        state = backend.poll(job_id)
+        conn = _connect()
+        conn.execute("UPDATE batch_jobs SET state=? WHERE job_id=?", (state, job_id))
+        conn.commit()
+        conn.close()
+        if state in FINAL_STATES:
+            return state
+        if timeout is not None and time.time() - started > timeout:
+            return state
+        print(f"[gemini_batch] Job {job_id}: {state}, next poll in {poll_interval:.0f}s")
+        time.sleep(poll_interval)
+
+
+def ingest_results(backend: BatchBackend, job_id: str):
+    """Parse, validate and checkpoint the results of a finished job"""
+    conn = _connect()
+    cur = conn.execute("SELECT plan_ids FROM batch_jobs WHERE job_id=?", (job_id,))
+    row = cur.fetchone()
+    if not row:
+        conn.close()
+        raise ValueError(f"Unknown batch job: {job_id}")
+    plan_ids = json.loads(row[0])
+
+    cur = conn.execute(f"SELECT id, seed FROM plans WHERE id IN ({','.join('?' * len(plan_ids))})", plan_ids)
+    seeds = dict(cur.fetchall())
+
+    parser = GeminiClient()
+    stats = {'ingested': 0, 'rejected': 0, 'errors': 0}
+    now = datetime.now(timezone.utc).isoformat()
+
+    for plan_id, (text, error) in zip(plan_ids, backend.results(job_id)):
+        seed = seeds.get(plan_id, '')
+        if error or not text:
+            print(f"[gemini_batch] Plan {plan_id}: request failed: {error}")
+            stats['errors'] += 1
+            continue
+        try:
+            article = parser.parse_article_response(text, seed)
+        except json.JSONDecodeError as e:
+            print(f"[gemini_batch] Plan {plan_id}: unparseable response: {e}")
+            stats['rejected'] += 1
+            continue
+
+        is_valid, error_msg = validate_article(article, seed)
+        if not is_valid:
+            print(f"[gemini_batch] Plan {plan_id}: validation failed: {error_msg}")
+            usage_ledger.record_rejection('batch', error_msg, ARTICLE_MODEL, wasted_tokens=len(text) // 4)
+            stats['rejected'] += 1
+            continue
+
+        conn.execute("INSERT OR REPLACE INTO article_checkpoints (plan_id, article_json, source, created_at) VALUES (?, ?, ?, ?)",
+                     (plan_id, json.dumps(article), f"batch:{job_id}", now))
+        stats['ingested'] += 1
+
+    conn.execute("UPDATE batch_jobs SET completed_at=?, ingested=?, rejected=? WHERE job_id=?",
+                 (now, stats['ingested'], stats['rejected'] + stats['errors'], job_id))
+    conn.commit()
+    conn.close()
+
+    print(f"[gemini_batch] Job {job_id}: {stats['ingested']} checkpoints, "
+          f"{stats['rejected']} rejected, {stats['errors']} failed requests")
+    return stats
+
+
+def run_batch(backend: BatchBackend, limit: int = 50, poll_interval: float = BATCH_POLL_INTERVAL):
+    """Submit, wait and ingest in one go"""
+    job_id = submit_batch(backend, limit)
+    if not job_id:
+        return None
+    state = wait_for_job(backend, job_id, poll_interval)
+    if state != JOB_SUCCEEDED:
+        print(f"[gemini_batch] ❌ Job {job_id} finished with state {state}")
+        return {'job_id': job_id, 'state': state}
+    stats = ingest_results(backend, job_id)
+    stats.update({'job_id': job_id, 'state': state})
+    return stats
+
+
+def show_status():
+    conn = _connect()
+    cur = conn.execute("SELECT COUNT(*) FROM article_checkpoints c JOIN plans p ON p.id = c.plan_id WHERE p.status='pending'")
+    ready = cur.fetchone()[0]
+    print(f"📦 Готовых статей (checkpoints) для ожидающих планов: {ready}")
+    cur = conn.execute("SELECT job_id, backend, state, submitted_at, ingested, rejected, plan_ids FROM batch_jobs ORDER BY submitted_at DESC LIMIT 10")
+    for job_id, backend, state, submitted_at, ingested, rejected, plan_ids in cur.fetchall():
+        print(f"   {job_id} [{backend}] {state}, {len(json.loads(plan_ids))} планов, "
+              f"принято {ingested or 0}, отклонено {rejected or 0} ({submitted_at[:16]})")
+    conn.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Пакетная генерация статей через Gemini Batch API')
+    parser.add_argument('--limit', type=int, default=50, help='Сколько планов отправить в одном пакете')
+    parser.add_argument('--backend', choices=['gemini', 'local'], default='gemini', help='Бэкенд пакетной генерации')
+    parser.add_argument('--resume', metavar='JOB_ID', help='Дождаться и загрузить результаты ранее отправленного пакета')
+    parser.add_argument('--poll', type=float, default=BATCH_POLL_INTERVAL, help='Интервал опроса, секунд')
+    parser.add_argument('--status', action='store_true', help='Показать пакеты и готовые checkpoints')
+    args = parser.parse_args()
+
+    if args.status:
+        show_status()
+    else:
+        if args.backend == 'local':
+            if args.resume:
+                parser.error('--resume is not supported for the local backend (jobs live in memory)')
+            backend = LocalBatchBackend()
+        else:
+            if not HAS_GENAI:
+                parser.error('google.genai SDK is not installed')
+            backend = GeminiBatchBackend()
+
+        if args.resume:
+            state = wait_for_job(backend, args.resume, args.poll)
+            if state == JOB_SUCCEEDED:
+                ingest_results(backend, args.resume)
+            else:
+                print(f"❌ Пакет {args.resume} завершился со статусом {state}")
+        else:
+            result = run_batch(backend, args.limit, args.poll)
+            print(f"✅ Результат: {result}")
+        show_status()
@@ -6,107 +6,66 @@ import os
 import re
 import json
 import time
+import html
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 load_dotenv()
 
+from prompt_cache import PROMPT_CACHE
+import usage_ledger
+import key_pool
+import tracing
+import traffic
+import model_router
+from model_router import MODEL_ROUTER
+from metrics import instrument, add_bytes
+from deadline import DeadlineExceeded, stage_deadline, check as check_deadline, sleep as deadline_sleep
+
 # Try to import Google GenAI SDK
 try:
     import google.genai as genai
-    from google.genai.types import GenerateContentConfig, GoogleSearch
+    from google.genai.types import GenerateContentConfig, GoogleSearch, HttpOptions
     HAS_GENAI = True
 except Exception as e:
     print(f"[gemini_client] Warning: google.genai SDK import failed: {e}")
     HAS_GENAI = False
 
-class GeminiClient:
-    def __init__(self):
-        # Try multiple environment variable names for API key
-        self.api_key = (os.getenv('GOOGLE_API_KEY') or
-                       os.getenv('GEMINI_API_KEY') or
-                       "KEY")
-
-        if not HAS_GENAI:
-            print("[gemini_client] Warning: google.genai SDK not installed. Using local stubs.")
-            self.client = None
-            return
-
-        if not self.api_key:
-            print("[gemini_client] Warning: No API key found. Using local stubs.")
-            self.client = None
-            return
-
-        # Initialize real client
-        self.client = genai.Client(api_key=self.api_key)
-        print("[gemini_client] Initialized with Gemini API")
-
-        # Rate limiting: track last request time
-        self.last_request_time = 0
-        self.min_request_interval = 2.0  # минимум 2 секунды между запросами
-
-    def _wait_for_rate_limit(self):
-        """Enforce rate limiting between API requests"""
-        time_since_last = time.time() - self.last_request_time
-        if time_since_last < self.min_request_interval:
-            sleep_time = self.min_request_interval - time_since_last
-            print(f"[gemini_client] Rate limiting: waiting {sleep_time:.1f}s before next request")
-            time.sleep(sleep_time)
-        self.last_request_time = time.time()
-
-    def _make_api_request_with_retry(self, request_func, max_retries=3):
-        """Make API request with exponential backoff retry on 429 errors"""
-        for attempt in range(max_retries):
-            try:
-                self._wait_for_rate_limit()
-                return request_func()
-            except Exception as e:
-                error_str = str(e)
-                # Check for 429 error
-                if "429" in error_str or "Too Many Requests" in error_str or "RESOURCE_EXHAUSTED" in error_str:
-                    # Try to extract retry delay from error message
-                    import re
-                    retry_match = re.search(r'retry in ([\d.]+)s', error_str)
-
-                    if retry_match:
-                        # API tells us exact time to wait
-                        suggested_wait = float(retry_match.group(1))
-                        # Add 1 second buffer
-                        wait_time = suggested_wait + 1
-                        print(f"[gemini_client] ⚠️ Quota exceeded. API suggests waiting {suggested_wait:.1f}s")
-                        print(f"[gemini_client] ⏳ Waiting {wait_time:.1f}s before retry {attempt + 1}/{max_retries}...")
-                    else:
-                        # Exponential backoff: 10s, 30s, 60s
-                        wait_time = 10 * (3 ** attempt)
-                        print(f"[gemini_client] ⚠️ Rate limit hit (429). Retry {attempt + 1}/{max_retries} after {wait_time}s...")
-
-                    if attempt < max_retries - 1:
-                        time.sleep(wait_time)
-                        continue
-                    else:
-                        print(f"[gemini_client] ❌ Rate limit exceeded after {max_retries} retries")
-                        print(f"[gemini_client] 💡 TIP: You may have exceeded your API quota. Check: https://ai.dev/usage?tab=rate-limit")
-                        raise
-                else:
-                    # Not a rate limit error, re-raise immediately
-                    raise
-        return None
-
-    def generate_article(self, brief_plan: str, seo_focus: str = "", tone="informative", word_count=900):
-        """Generate a full article using Gemini API with SEO optimization"""
-
-        if not self.client:
-            # Fallback to placeholder
-            return self._generate_placeholder_article(brief_plan, seo_focus)
-
-        try:
-            # Create a detailed prompt for article generation
-            prompt = f"""You are a professional content writer specializing in AI and technology topics.
-
-Write a comprehensive, SEO-optimized blog article with the following requirements:
-
-TOPIC: {brief_plan}
-SEO FOCUS: {seo_focus if seo_focus else brief_plan}
-TONE: {tone}
-TARGET LENGTH: {word_count} words
+# Article generation settings (shared by the interactive and batch paths)
+ARTICLE_MODEL = 'gemini-2.5-flash'
+# Model tiers for interactive generation, most preferred first (see model_router.py)
+ARTICLE_MODELS = model_router.models_from_env('GEMINI_ARTICLE_MODELS', [ARTICLE_MODEL, 'gemini-2.5-flash-lite'])
+ARTICLE_GENERATION_CONFIG = dict(
+    temperature=0.8,
+    top_p=0.95,
+    top_k=40,
+    max_output_tokens=8192,
+)
+
+# Article mode: "single" (one request), "sectioned" (outline, then sections in
+# parallel) or "auto" (sectioned from ARTICLE_SECTIONED_MIN_WORDS words)
+ARTICLE_MODE = os.getenv('ARTICLE_MODE', 'single').lower()
+ARTICLE_SECTIONED_MIN_WORDS = int(os.getenv('ARTICLE_SECTIONED_MIN_WORDS', '1500'))
+SECTION_CONCURRENCY = int(os.getenv('ARTICLE_SECTION_CONCURRENCY', '4'))
+OUTLINE_GENERATION_CONFIG = dict(ARTICLE_GENERATION_CONFIG, temperature=0.7, max_output_tokens=2048)
+SECTION_GENERATION_CONFIG = dict(ARTICLE_GENERATION_CONFIG, max_output_tokens=4096)
+# Stream article/outline JSON and abort as soon as a field is provably invalid
+ARTICLE_STREAM_VALIDATION = os.getenv('ARTICLE_STREAM_VALIDATION', 'true').lower() == 'true'
+OUTLINE_FIELDS = ('title', 'slug', 'keywords', 'meta_description', 'image_prompt')
+
+# Image generation models (Imagen first, Gemini Flash Image as fallback)
+IMAGEN_MODEL = "imagen-4.0-fast-generate-001"
+IMAGEN_MODELS = model_router.models_from_env('GEMINI_IMAGEN_MODELS', [IMAGEN_MODEL])
+GEMINI_IMAGE_MODEL = "gemini-2.5-flash-image"
+
+# Адрес Gemini API (для локальной заглушки, см. fake_services.py); пусто = официальный
+GEMINI_BASE_URL = os.getenv('GEMINI_BASE_URL', '')
+
+# Static part of the article prompt. Sent once as cached content (see
+# prompt_cache.py); each request only carries TOPIC/SEO FOCUS/TONE/LENGTH.
+ARTICLE_SYSTEM_INSTRUCTION = """You are a professional content writer specializing in AI and technology topics.
+
+For every request, write a comprehensive, SEO-optimized blog article on the given TOPIC, SEO FOCUS, TONE and TARGET LENGTH.
 
 REQUIREMENTS:
 1. Write a compelling, engaging article that provides real value to readers
@@ -125,15 +84,15 @@ CRITICAL OUTPUT FORMAT RULES:
 - All field values must be strings or arrays of strings (no nested objects)
 
 Return your response as a valid JSON object with this EXACT structure:
-{{
-    "title": "Compelling article title (60-70 characters max, SEO-optimized, NO special chars like {{}}, [], quotes)",
+{
+    "title": "Compelling article title (60-70 characters max, SEO-optimized, NO special chars like {}, [], quotes)",
     "slug": "url-friendly-slug-for-wordpress",
     "meta_description": "Engaging meta description (150-160 characters, describes article value)",
     "keywords": ["keyword1", "keyword2", "keyword3", "keyword4", "keyword5"],
     "content_html": "Full HTML article content with proper tags (minimum 500 words)",
     "image_prompt": "Detailed prompt for AI image generation (one sentence describing a relevant, professional image)",
     "headings_summary": ["List of main H2 headings used"]
-}}
+}
 
 IMPORTANT FIELD REQUIREMENTS:
 - "title": Must be 10-70 characters, plain text, NO JSON syntax characters
@@ -142,72 +101,375 @@ IMPORTANT FIELD REQUIREMENTS:
 - "content_html": Must be valid HTML, minimum 500 characters, NO raw JSON
 - "meta_description": Must be 50-160 characters
 
-The article should be comprehensive, interesting, with examples of available resources or solutions, and compel the reader to return to the site. Article MUST be in English.
+The article should be comprehensive, interesting, with examples of available resources or solutions, and compel the reader to return to the site. Article MUST be in English."""
+
+# Sectioned mode, step 1: the outline carries every field except content_html
+OUTLINE_SYSTEM_INSTRUCTION = """You are a professional content writer specializing in AI and technology topics.
+
+For every request, plan a comprehensive, SEO-optimized blog article on the given TOPIC, SEO FOCUS, TONE and TARGET LENGTH. Do not write the article itself.
+
+Return ONLY a valid JSON object (no markdown, no text around it) with this EXACT structure:
+{
+    "title": "Compelling article title (10-70 characters, plain text, NO JSON syntax characters)",
+    "slug": "url-friendly-slug-for-wordpress (lowercase, hyphens only)",
+    "meta_description": "Engaging meta description (50-160 characters)",
+    "keywords": ["3-10 simple keywords, each 1-3 words"],
+    "image_prompt": "One sentence describing a relevant, professional image",
+    "introduction": "2-3 sentences on what the introduction should cover",
+    "sections": [
+        {"heading": "H2 heading text", "points": "2-4 sentences on what this section must cover"}
+    ]
+}
+
+The "sections" list must have 4-8 entries in reading order, and the last one must be the conclusion. Headings are plain text without numbering. Everything MUST be in English."""
+
+# Sectioned mode, step 2: one section of an outlined article
+SECTION_SYSTEM_INSTRUCTION = """You are a professional content writer specializing in AI and technology topics.
+
+Each request gives the outline of a blog article and asks for ONE part of it. Write only that part, in an accessible, conversational style with practical examples and natural keyword usage, consistent with the rest of the outline (do not repeat what other sections cover).
+
+OUTPUT RULES:
+- Return ONLY the HTML body of the requested part, no markdown, no code blocks, no JSON
+- Do NOT include the section's H2 heading, it is added separately
+- Use p, h3, ul, ol, li, strong and em tags only
+- Everything MUST be in English"""
+
+def _make_genai_client(api_key):
+    options = {}
+    if GEMINI_BASE_URL:
+        options['base_url'] = GEMINI_BASE_URL
+    # Запись/воспроизведение трафика Gemini (см. traffic.py)
+    transport = traffic.httpx_transport()
+    if transport is not None:
+        options['client_args'] = {'transport': transport}
+    if options:
+        return genai.Client(api_key=api_key, http_options=HttpOptions(**options))
+    return genai.Client(api_key=api_key)
+
+
+def http_options_for(deadline):
+    """Config kwargs limiting one request's HTTP timeout to the remaining deadline"""
+    if deadline is None or not HAS_GENAI:
+        return {}
+    return {'http_options': HttpOptions(timeout=int(deadline.timeout(None) * 1000))}
+
+
+def report_progress(on_progress, event, **data):
+    """Pass a pipeline event to an optional `on_progress(event, data)` callback"""
+    if on_progress is not None:
+        on_progress(event, data)
+
+
+def _report_stream_progress(on_progress, values, sent):
+    """Report fields of a streamed article that completed since the last chunk.
+
+    `values` is IncrementalArticleValidator.values; `sent` keeps what was
+    already reported for this stream. The growing content_html goes out as
+    `html` events with the offset the text starts at (a restarted or
+    re-decoded stream resends from the first differing character).
+    """
+    for field, (value, complete) in values.items():
+        if field == 'content_html':
+            previous = sent.get('html', '')
+            if value != previous and isinstance(value, str):
+                offset = len(os.path.commonprefix([previous, value]))
+                sent['html'] = value
+                report_progress(on_progress, 'html', offset=offset, text=value[offset:])
+        if complete and field not in sent:
+            sent[field] = True
+            report_progress(on_progress, 'field', field=field,
+                            value=value if field != 'content_html' else None,
+                            chars=len(value) if isinstance(value, str) else None)
+
+
+class GeminiClient:
+    def __init__(self):
+        # Keys from GEMINI_API_KEYS plus the single-key variables (see key_pool.py)
+        api_keys = key_pool.load_api_keys() or ["KEY"]
+        self.api_key = api_keys[0]
+
+        if not HAS_GENAI:
+            print("[gemini_client] Warning: google.genai SDK not installed. Using local stubs.")
+            self.client = None
+            self.pool = None
+            return
+
+        if not self.api_key:
+            print("[gemini_client] Warning: No API key found. Using local stubs.")
+            self.client = None
+            self.pool = None
+            return
+
+        # One client per key, shared by every GeminiClient of the process; self.client is the primary key
+        self.pool = key_pool.shared_pool(api_keys, _make_genai_client)
+        self.client = self.pool.primary.client
+        print(f"[gemini_client] Initialized with Gemini API ({len(self.pool)} key(s))")
+
+    def _make_api_request_with_retry(self, request_func, max_retries=3, stage='gemini', model=None, deadline=None):
+        """Make API request on the key pool, failing over to another key on 429 errors.
+
+        `request_func(client)` is called with the client of the chosen key. A
+        rate-limited key is put on cooldown and the request moves to the next
+        key at once; only when every key is cooling down does it wait, at most
+        `max_retries - 1` times. With a `deadline`, no attempt starts after it
+        expires and a wait that would run past it raises DeadlineExceeded
+        instead. Every call is recorded in the usage ledger; a request cut
+        short by the deadline is recorded as a timeout and counts against
+        neither the key nor the model.
+        """
+        wait_total = 0.0
+        waits = 0
+        retries = 0
+        last_error = None
+        while True:
+            check_deadline(deadline, f"{stage} request")
+            key, wait_time = self.pool.acquire()
+            if key is None:
+                if waits >= max_retries - 1:
+                    print(f"[gemini_client] ❌ Rate limit exceeded after {max_retries} retries")
+                    print(f"[gemini_client] 💡 TIP: You may have exceeded your API quota. Check: https://ai.dev/usage?tab=rate-limit")
+                    usage_ledger.record_call(model, stage, wait_ms=wait_total * 1000, retries=retries,
+                                             outcome=usage_ledger.OUTCOME_RATE_LIMITED, error=last_error)
+                    raise last_error or RuntimeError("All Gemini API keys are cooling down")
+                waits += 1
+                print(f"[gemini_client] ⏳ All {len(self.pool)} key(s) rate limited. "
+                      f"Waiting {wait_time:.1f}s before retry {waits}/{max_retries - 1}...")
+                with tracing.span(f"gemini {stage} backoff", tracing.CAT_WAIT, seconds=round(wait_time, 2)):
+                    deadline_sleep(deadline, wait_time, f"{stage} retry")
+                wait_total += wait_time
+                continue
+
+            started = time.time()
+            try:
+                with tracing.span(f"gemini {stage}", tracing.CAT_GEMINI, model=model, key=key.key_id,
+                                  attempt=retries + 1):
+                    response = request_func(key.client)
+            except DeadlineExceeded as e:
+                # Время задачи вышло посреди запроса: ни ключ, ни модель не виноваты
+                usage_ledger.record_call(model, stage, latency_ms=(time.time() - started) * 1000,
+                                         wait_ms=wait_total * 1000, retries=retries,
+                                         outcome=usage_ledger.OUTCOME_TIMEOUT, error=e, key_id=key.key_id)
+                self.pool.report_success(key)
+                raise
+            except Exception as e:
+                error_str = str(e)
+                # Check for 429 error
+                if "429" in error_str or "Too Many Requests" in error_str or "RESOURCE_EXHAUSTED" in error_str:
+                    MODEL_ROUTER.observe(stage, model, (time.time() - started) * 1000, usage_ledger.OUTCOME_RATE_LIMITED)
+                    # API tells us exact time to wait; add 1 second buffer
+                    suggested_wait = key_pool.parse_retry_delay(error_str)
+                    if suggested_wait is not None:
+                        print(f"[gemini_client] ⚠️ Quota exceeded. API suggests waiting {suggested_wait:.1f}s")
+                    self.pool.report_rate_limited(key, e, suggested_wait + 1 if suggested_wait is not None else None)
+                    last_error = e
+                    retries += 1
+                    continue
+                if isinstance(e, ArticleRejected):
+                    # Модель ответила, но статья невалидна: платим за полученный текст (~4 символа на токен)
+                    wasted = len(e.text) // 4
+                    usage_ledger.record_call(model, stage, latency_ms=(time.time() - started) * 1000,
+                                             wait_ms=wait_total * 1000, retries=retries,
+                                             outcome=usage_ledger.OUTCOME_REJECTED, error=e,
+                                             tokens=(0, 0, wasted, wasted), key_id=key.key_id)
+                    usage_ledger.record_rejection(stage, e.reason, model, wasted_tokens=wasted, aborted_early=True)
+                    self.pool.report_success(key)
+                    raise
+                # Not a rate limit error, re-raise immediately
+                MODEL_ROUTER.observe(stage, model, (time.time() - started) * 1000, usage_ledger.OUTCOME_ERROR)
+                usage_ledger.record_call(model, stage, latency_ms=(time.time() - started) * 1000,
+                                         wait_ms=wait_total * 1000, retries=retries,
+                                         outcome=usage_ledger.OUTCOME_ERROR, error=e, key_id=key.key_id)
+                self.pool.report_error(key, e)
+                raise
+
+            latency_ms = (time.time() - started) * 1000
+            MODEL_ROUTER.observe(stage, model, latency_ms, usage_ledger.OUTCOME_OK)
+            usage_ledger.record_call(model, stage, response, latency_ms=latency_ms,
+                                     wait_ms=wait_total * 1000, retries=retries, key_id=key.key_id)
+            self.pool.report_success(key)
+            return response
+
+    def build_article_request(self, brief_plan: str, seo_focus: str = "", tone="informative", word_count=900):
+        """Variable part of the article prompt (the static part is ARTICLE_SYSTEM_INSTRUCTION)"""
+        return f"""Write a comprehensive, SEO-optimized blog article with the following requirements:
+
+TOPIC: {brief_plan}
+SEO FOCUS: {seo_focus if seo_focus else brief_plan}
+TONE: {tone}
+TARGET LENGTH: {word_count} words
 
 Write the article now as valid JSON ONLY:"""
 
-            # Generate content using Gemini with retry logic
-            def make_request():
-                return self.client.models.generate_content(
-                    # model='gemini-2.0-flash-exp',
-                    model='gemini-2.5-flash',
-                    contents=prompt,
-                    config=GenerateContentConfig(
-                        temperature=0.8,
-                        top_p=0.95,
-                        top_k=40,
-                        max_output_tokens=8192,
-                    )
-                )
+    def build_article_prompt(self, brief_plan: str, seo_focus: str = "", tone="informative", word_count=900):
+        """Full single-message article prompt (static instruction + variable request)"""
+        return f"{ARTICLE_SYSTEM_INSTRUCTION}\n\n{self.build_article_request(brief_plan, seo_focus, tone, word_count)}"
 
-            response = self._make_api_request_with_retry(make_request)
+    def parse_article_response(self, response_text: str, brief_plan: str):
+        """Parse model output into an article dict.
 
-            # Extract the text response
-            response_text = response.text.strip()
+        Raises json.JSONDecodeError when no strategy (direct parse, repair,
+        regex extraction) produces an article.
+        """
+        response_text = response_text.strip()
 
-            # Try to extract JSON from the response
-            # Sometimes Gemini wraps JSON in markdown code blocks
-            json_match = re.search(r'```(?:json)?\s*(\{.*?\})\s*```', response_text, re.DOTALL)
+        # Try to extract JSON from the response
+        # Sometimes Gemini wraps JSON in markdown code blocks
+        json_match = re.search(r'```(?:json)?\s*(\{.*?\})\s*```', response_text, re.DOTALL)
+        if json_match:
+            json_str = json_match.group(1)
+        else:
+            # Try to find JSON directly
+            json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
             if json_match:
-                json_str = json_match.group(1)
+                json_str = json_match.group(0)
             else:
-                # Try to find JSON directly
-                json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-                if json_match:
-                    json_str = json_match.group(0)
+                json_str = response_text
+
+        # Parse JSON with retry using repair techniques
+        article_data = None
+        parse_error = None
+
+        for attempt in range(3):
+            try:
+                if attempt == 0:
+                    # First attempt: direct parse
+                    article_data = json.loads(json_str)
+                elif attempt == 1:
+                    # Second attempt: try to fix common issues
+                    fixed_json = self._repair_json(json_str)
+                    article_data = json.loads(fixed_json)
                 else:
-                    json_str = response_text
+                    # Third attempt: extract fields manually
+                    article_data = self._extract_article_fields(json_str, brief_plan)
+                break
+            except json.JSONDecodeError as e:
+                parse_error = e
+                print(f"[gemini_client] JSON parse attempt {attempt + 1} failed: {e}")
+                continue
+
+        if article_data is None:
+            raise json.JSONDecodeError(str(parse_error), json_str, 0)
+
+        # Validate required fields
+        required_fields = ['title', 'slug', 'meta_description', 'keywords', 'content_html', 'image_prompt']
+        for field in required_fields:
+            if field not in article_data:
+                article_data[field] = self._get_fallback_value(field, brief_plan)
+
+        return article_data
+
+    def _generate_validated(self, model, system_instruction, prompt, generation_config, stage,
+                            deadline=None, fields=None, on_progress=None):
+        """Stream a JSON article, validating fields as they arrive.
+
+        Returns (text, chunks). Raises ArticleRejected as soon as a field
+        breaks a validate_article rule; the stream is closed, so the rest of
+        the response is neither generated nor paid for. Valid fields are
+        reported to `on_progress` as soon as they are complete.
+        """
+        def make_request(client):
+            validator = IncrementalArticleValidator(fields)
+            sent = {}
+            chunks = []
+            stream = PROMPT_CACHE.generate_content_stream(
+                client,
+                model,
+                system_instruction,
+                contents=prompt,
+                **generation_config,
+                **http_options_for(deadline)
+            )
+            try:
+                for chunk in stream:
+                    chunks.append(chunk)
+                    reason = validator.feed(chunk.text)
+                    if reason:
+                        raise ArticleRejected(reason, validator.text)
+                    if on_progress is not None:
+                        _report_stream_progress(on_progress, validator.values, sent)
+                    check_deadline(deadline, f"end of {stage} stream")
+            finally:
+                stream.close()
+            return chunks
+
+        chunks = self._make_api_request_with_retry(make_request, stage=stage, model=model, deadline=deadline)
+        text = "".join(chunk.text or "" for chunk in chunks)
+        add_bytes(bytes_in=len(text.encode('utf-8')), bytes_out=len(str(prompt).encode('utf-8')))
+        return text, chunks
+
+    @staticmethod
+    def _usage_chunk(chunks):
+        """Last streamed chunk carrying usage_metadata (for _log_token_usage)"""
+        return next((c for c in reversed(chunks) if getattr(c, 'usage_metadata', None)), None)
+
+    def _log_token_usage(self, response, label):
+        """Print prompt/cached/response token counts from usage_metadata"""
+        usage = getattr(response, 'usage_metadata', None)
+        if not usage:
+            return
+        print(f"[gemini_client] {label} tokens: prompt={usage.prompt_token_count}, "
+              f"cached={getattr(usage, 'cached_content_token_count', None) or 0}, "
+              f"response={usage.candidates_token_count}")
+
+    @instrument('article', falsy_is_error=True)
+    def generate_article(self, brief_plan: str, seo_focus: str = "", tone="informative", word_count=900, deadline=None,
+                         mode=None, on_progress=None):
+        """Generate a full article using Gemini API with SEO optimization.
+
+        `mode` (default ARTICLE_MODE) selects one request or the sectioned
+        outline-then-sections path; a failed sectioned run falls back to one request.
+        `on_progress(event, data)` receives `field`, `html` and `section` events
+        while the article is streamed.
+        """
 
-            # Parse JSON with retry using repair techniques
-            article_data = None
-            parse_error = None
+        if not self.client:
+            # Fallback to placeholder
+            return self._generate_placeholder_article(brief_plan, seo_focus)
 
-            for attempt in range(3):
-                try:
-                    if attempt == 0:
-                        # First attempt: direct parse
-                        article_data = json.loads(json_str)
-                    elif attempt == 1:
-                        # Second attempt: try to fix common issues
-                        fixed_json = self._repair_json(json_str)
-                        article_data = json.loads(fixed_json)
-                    else:
-                        # Third attempt: extract fields manually
-                        article_data = self._extract_article_fields(json_str, brief_plan)
-                    break
-                except json.JSONDecodeError as e:
-                    parse_error = e
-                    print(f"[gemini_client] JSON parse attempt {attempt + 1} failed: {e}")
-                    continue
+        if self._article_mode(word_count, mode) == 'sectioned':
+            try:
+                return self.generate_article_sectioned(brief_plan, seo_focus, tone, word_count, deadline=deadline,
+                                                       on_progress=on_progress)
+            except DeadlineExceeded:
+                raise
+            except ArticleRejected as e:
+                print(f"[gemini_client] ❌ Outline rejected mid-stream: {e.reason}")
+                return None
+            except Exception as e:
+                print(f"[gemini_client] Sectioned generation failed, falling back to single request: {e}")
+
+        response_text = ""
+        try:
+            # Only the variable part is sent; the static instruction comes from the context cache
+            prompt = self.build_article_request(brief_plan, seo_focus, tone, word_count)
+            model = MODEL_ROUTER.choose('article', ARTICLE_MODELS)
+
+            if ARTICLE_STREAM_VALIDATION:
+                # Стрим с проверкой полей по мере поступления
+                response_text, chunks = self._generate_validated(model, ARTICLE_SYSTEM_INSTRUCTION, prompt,
+                                                                 ARTICLE_GENERATION_CONFIG, 'article', deadline,
+                                                                 on_progress=on_progress)
+                self._log_token_usage(self._usage_chunk(chunks), f"article ({model})")
+            else:
+                # Generate content using Gemini with retry logic
+                def make_request(client):
+                    return PROMPT_CACHE.generate_content(
+                        client,
+                        model,
+                        ARTICLE_SYSTEM_INSTRUCTION,
+                        contents=prompt,
+                        **ARTICLE_GENERATION_CONFIG,
+                        **http_options_for(deadline)
+                    )
 
-            if article_data is None:
-                raise json.JSONDecodeError(str(parse_error), json_str, 0)
+                response = self._make_api_request_with_retry(make_request, stage='article', model=model, deadline=deadline)
+                self._log_token_usage(response, f"article ({model})")
+                response_text = response.text
 
-            # Validate required fields
-            required_fields = ['title', 'slug', 'meta_description', 'keywords', 'content_html', 'image_prompt']
-            for field in required_fields:
-                if field not in article_data:
-                    article_data[field] = self._get_fallback_value(field, brief_plan)
+            # Extract the text response
+            response_text = response_text.strip()
+
+            article_data = self.parse_article_response(response_text, brief_plan)
 
             print(f"[gemini_client] Article generated: {article_data['title'][:50]}...")
             return article_data
@@ -217,10 +479,145 @@ Write the article now as valid JSON ONLY:"""
             print(f"[gemini_client] Response was: {response_text[:200]}...")
             # Return a structured article from the text
             return self._parse_unstructured_response(response_text, brief_plan, seo_focus)
+        except DeadlineExceeded:
+            raise
+        except ArticleRejected as e:
+            # Изображение для такой статьи не генерируется
+            print(f"[gemini_client] ❌ Article rejected mid-stream, generation aborted: {e.reason}")
+            return None
         except Exception as e:
             print(f"[gemini_client] Error generating article: {e}")
             return self._generate_placeholder_article(brief_plan, seo_focus)
 
+    def _article_mode(self, word_count, mode=None):
+        mode = (mode or ARTICLE_MODE).lower()
+        if mode == 'auto':
+            return 'sectioned' if word_count >= ARTICLE_SECTIONED_MIN_WORDS else 'single'
+        return mode
+
+    def generate_outline(self, brief_plan: str, seo_focus: str = "", tone="informative", word_count=900, deadline=None,
+                         on_progress=None):
+        """Outline of a sectioned article: all fields except content_html, plus `sections`"""
+        prompt = self.build_article_request(brief_plan, seo_focus, tone, word_count).replace(
+            "Write the article now as valid JSON ONLY:", "Plan the article now as valid JSON ONLY:")
+        model = MODEL_ROUTER.choose('outline', ARTICLE_MODELS)
+
+        if ARTICLE_STREAM_VALIDATION:
+            response_text, chunks = self._generate_validated(model, OUTLINE_SYSTEM_INSTRUCTION, prompt,
+                                                             OUTLINE_GENERATION_CONFIG, 'outline', deadline,
+                                                             fields=OUTLINE_FIELDS, on_progress=on_progress)
+            self._log_token_usage(self._usage_chunk(chunks), f"outline ({model})")
+        else:
+            def make_request(client):
+                return PROMPT_CACHE.generate_content(
+                    client,
+                    model,
+                    OUTLINE_SYSTEM_INSTRUCTION,
+                    contents=prompt,
+                    **OUTLINE_GENERATION_CONFIG,
+                    **http_options_for(deadline)
+                )
+
+            response = self._make_api_request_with_retry(make_request, stage='outline', model=model, deadline=deadline)
+            self._log_token_usage(response, f"outline ({model})")
+            response_text = response.text
+
+        outline = self.parse_article_response(response_text.strip(), brief_plan)
+        sections = [s for s in outline.get('sections') or []
+                    if isinstance(s, dict) and str(s.get('heading', '')).strip()]
+        if len(sections) < 2:
+            raise ValueError(f"Outline has {len(sections)} usable sections")
+        outline['sections'] = sections
+        return outline
+
+    def _outline_summary(self, outline):
+        lines = [f"TITLE: {outline['title']}", f"KEYWORDS: {', '.join(outline.get('keywords') or [])}",
+                 f"INTRODUCTION: {outline.get('introduction', '')}"]
+        for number, section in enumerate(outline['sections'], 1):
+            lines.append(f"{number}. {section['heading']}: {section.get('points', '')}")
+        return "\n".join(lines)
+
+    def generate_section(self, outline, index, words, tone="informative", deadline=None):
+        """HTML body of one outline part (index -1 = introduction), without its H2"""
+        if index < 0:
+            part = "the INTRODUCTION (before the first section, no heading)"
+        else:
+            section = outline['sections'][index]
+            part = f"section {index + 1}: \"{section['heading']}\" - {section.get('points', '')}"
+        prompt = f"""ARTICLE OUTLINE:
+{self._outline_summary(outline)}
+
+WRITE: {part}
+TONE: {tone}
+LENGTH: about {words} words
+
+Write this part now as HTML ONLY:"""
+        model = MODEL_ROUTER.choose('section', ARTICLE_MODELS)
+
+        def make_request(client):
+            return PROMPT_CACHE.generate_content(
+                client,
+                model,
+                SECTION_SYSTEM_INSTRUCTION,
+                contents=prompt,
+                **SECTION_GENERATION_CONFIG,
+                **http_options_for(deadline)
+            )
+
+        response = self._make_api_request_with_retry(make_request, stage='section', model=model, deadline=deadline)
+        return self._clean_section_html(response.text)
+
+    @staticmethod
+    def _clean_section_html(text):
+        """Strip code fences and a leading heading; demote stray h1/h2 to h3 to keep the heading structure"""
+        text = re.sub(r'^```(?:html)?\s*|\s*```$', '', (text or '').strip())
+        text = re.sub(r'^\s*<h[12][^>]*>.*?</h[12]>\s*', '', text, flags=re.DOTALL | re.IGNORECASE)
+        text = re.sub(r'<(/?)h[12]([^>]*)>', r'<\1h3\2>', text, flags=re.IGNORECASE)
+        return text.strip()
+
+    def generate_article_sectioned(self, brief_plan: str, seo_focus: str = "", tone="informative", word_count=900,
+                                   deadline=None, on_progress=None):
+        """Outline first, then the introduction and every section concurrently.
+
+        Section requests share the key pool (and its per-key rate limiting),
+        so wall time is close to the outline plus the slowest section. The
+        result has the same fields as a single-request article. Each finished
+        part is reported to `on_progress` as a `section` event (index -1 is
+        the introduction).
+        """
+        started = time.time()
+        outline = self.generate_outline(brief_plan, seo_focus, tone, word_count, deadline=deadline,
+                                        on_progress=on_progress)
+        sections = outline['sections']
+        words = max(120, word_count // (len(sections) + 1))
+        print(f"[gemini_client] Outline: {outline['title'][:50]}... ({len(sections)} sections, ~{words} words each)")
+
+        with ThreadPoolExecutor(max_workers=max(1, SECTION_CONCURRENCY)) as executor:
+            # Копия контекста: повторы и байты секций засчитываются этапу article
+            futures = {executor.submit(contextvars.copy_context().run, self.generate_section,
+                                       outline, index, words, tone, deadline): index
+                       for index in range(-1, len(sections))}
+            bodies = {}
+            for future in as_completed(futures):
+                index = futures[future]
+                bodies[index] = future.result()
+                report_progress(on_progress, 'section', index=index,
+                                heading=sections[index]['heading'].strip() if index >= 0 else None,
+                                html=bodies[index])
+            parts = [bodies[index] for index in range(-1, len(sections))]
+
+        content_html = parts[0] + "".join(
+            f"\n<h2>{html.escape(section['heading'].strip())}</h2>\n{body}"
+            for section, body in zip(sections, parts[1:]))
+
+        article = {field: outline.get(field) for field in
+                   ('title', 'slug', 'meta_description', 'keywords', 'image_prompt')}
+        article['content_html'] = content_html
+        article['headings_summary'] = [section['heading'].strip() for section in sections]
+        print(f"[gemini_client] Sectioned article generated in {time.time() - started:.1f}s: "
+              f"{len(content_html)} chars")
+        return article
+
     def _generate_placeholder_article(self, _brief_plan, _seo_focus):
         """Generate a simple placeholder article"""
         print(f"[gemini_client] WARNING: Falling back to placeholder, returning None to prevent bad article")
@@ -360,7 +757,7 @@ Write the article now as valid JSON ONLY:"""
         print(f"[gemini_client] Extracted fields via regex: title='{title[:50]}...', content_len={len(content)}")
         return result
 
-    def generate_image(self, image_prompt: str, size="1600x900", aspect_ratio="16:9"):
+    def generate_image(self, image_prompt: str, size="1600x900", aspect_ratio="16:9", deadline=None):
         """Generate image using Imagen 4 API with proper aspect ratio support
 
         Args:
@@ -368,60 +765,72 @@ Write the article now as valid JSON ONLY:"""
             size: Ignored (kept for backwards compatibility)
             aspect_ratio: Aspect ratio for the image (default "16:9")
                          Supported: "1:1", "3:4", "4:3", "9:16", "16:9"
+            deadline: Optional Deadline; when it expires the local fallback image is used
         """
 
         if not self.client:
             print("[gemini_client] No client available, using fallback image generation")
             return self._generate_fallback_image(image_prompt)
 
-        # Сначала пробуем Imagen 4 (поддерживает aspect_ratio)
-        result = self._generate_image_imagen(image_prompt, aspect_ratio)
-        if result:
-            return result
+        try:
+            # Сначала пробуем Imagen 4 (поддерживает aspect_ratio)
+            result = self._generate_image_imagen(image_prompt, aspect_ratio, deadline)
+            if result:
+                return result
 
-        # Fallback на Gemini Flash Image (только 1:1)
-        print("[gemini_client] Imagen failed, trying Gemini Flash Image...")
-        result = self._generate_image_gemini(image_prompt)
-        if result:
-            return result
+            # Fallback на Gemini Flash Image (только 1:1)
+            print("[gemini_client] Imagen failed, trying Gemini Flash Image...")
+            result = self._generate_image_gemini(image_prompt, deadline)
+            if result:
+                return result
+        except DeadlineExceeded as e:
+            print(f"[gemini_client] ⏱️ Image generation stopped: {e}")
 
         # Последний fallback - локальная генерация
         return self._generate_fallback_image(image_prompt)
 
-    def _generate_image_imagen(self, image_prompt: str, aspect_ratio: str = "16:9"):
+    @instrument('image', 'imagen', falsy_is_error=True)
+    def _generate_image_imagen(self, image_prompt: str, aspect_ratio: str = "16:9", deadline=None):
         """Generate image using Imagen 4 with proper aspect ratio"""
         try:
             from google.genai import types
 
-            print(f"[gemini_client] Generating image with Imagen 4 (aspect_ratio={aspect_ratio})...")
+            model = MODEL_ROUTER.choose('image', IMAGEN_MODELS)
+            print(f"[gemini_client] Generating image with {model} (aspect_ratio={aspect_ratio})...")
             print(f"[gemini_client] Prompt: {image_prompt[:100]}...")
 
-            def make_imagen_request():
-                return self.client.models.generate_images(
-                    model="imagen-4.0-fast-generate-001",
+            def make_imagen_request(client):
+                return client.models.generate_images(
+                    model=model,
                     prompt=f"Professional, high-quality image for a blog article. {image_prompt}. Visually appealing, modern, highly detailed, sharp focus.",
                     config=types.GenerateImagesConfig(
                         number_of_images=1,
                         aspect_ratio=aspect_ratio,
+                        **http_options_for(deadline)
                     )
                 )
 
-            response = self._make_api_request_with_retry(make_imagen_request)
+            response = self._make_api_request_with_retry(make_imagen_request, stage='image', model=model,
+                                                         deadline=deadline)
 
             if response and response.generated_images:
                 img = response.generated_images[0]
                 image_bytes = img.image.image_bytes
+                add_bytes(bytes_in=len(image_bytes))
                 print(f"[gemini_client] ✅ Image generated successfully via Imagen 4 ({len(image_bytes)} bytes)")
                 return image_bytes, "image/png"
 
             print("[gemini_client] Imagen 4: no image in response")
             return None
 
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             print(f"[gemini_client] Imagen 4 error: {e}")
             return None
 
-    def _generate_image_gemini(self, image_prompt: str):
+    @instrument('image', 'gemini-image', falsy_is_error=True)
+    def _generate_image_gemini(self, image_prompt: str, deadline=None):
         """Generate image using Gemini Flash Image (fallback, 1:1 only)"""
         try:
             from google.genai.types import Content, Part, GenerateContentConfig
@@ -437,21 +846,31 @@ Write the article now as valid JSON ONLY:"""
 
             generate_content_config = GenerateContentConfig(
                 response_modalities=["IMAGE", "TEXT"],
+                **http_options_for(deadline)
             )
 
             print(f"[gemini_client] Generating image with Gemini Flash Image...")
 
-            def make_image_request():
+            def make_image_request(client):
                 result = []
-                for chunk in self.client.models.generate_content_stream(
-                    model="gemini-2.5-flash-image",
+                stream = client.models.generate_content_stream(
+                    model=GEMINI_IMAGE_MODEL,
                     contents=contents,
                     config=generate_content_config,
-                ):
-                    result.append(chunk)
+                )
+                try:
+                    for chunk in stream:
+                        result.append(chunk)
+                        # Дедлайн истек - прекращаем чтение стрима
+                        check_deadline(deadline, "end of image stream")
+                finally:
+                    # Закрываем генератор, чтобы освободить HTTP-соединение
+                    if hasattr(stream, 'close'):
+                        stream.close()
                 return result
 
-            chunks = self._make_api_request_with_retry(make_image_request)
+            chunks = self._make_api_request_with_retry(make_image_request, stage='image', model=GEMINI_IMAGE_MODEL,
+                                                       deadline=deadline)
 
             for chunk in chunks:
                 if (
@@ -467,6 +886,7 @@ Write the article now as valid JSON ONLY:"""
                     inline_data = chunk.candidates[0].content.parts[0].inline_data
                     data_buffer = inline_data.data
                     mime_type = inline_data.mime_type
+                    add_bytes(bytes_in=len(data_buffer))
 
                     print(f"[gemini_client] ✅ Image generated via Gemini Flash Image")
                     return data_buffer, mime_type
@@ -474,10 +894,13 @@ Write the article now as valid JSON ONLY:"""
             print("[gemini_client] Gemini Flash Image: no image in stream")
             return None
 
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             print(f"[gemini_client] Gemini Flash Image error: {e}")
             return None
 
+    @instrument('image', 'local')
     def _generate_fallback_image(self, image_prompt: str):
         """Generate a fallback image when Gemini API is not available"""
         try:
@@ -538,73 +961,181 @@ Write the article now as valid JSON ONLY:"""
         return placeholder, 'image/png'
     
 
-def validate_article(article: dict, _topic: str) -> tuple[bool, str]:
-    """
-    Validate article quality before publishing
-    Returns: (is_valid, error_message)
-    """
-    if not article:
-        return False, "Article is None or empty"
-
-    # Check title
-    title = article.get("title", "")
-    if not title or len(title) < 10:
-        return False, "Title is missing or too short"
+def _check_title(title, complete=True):
+    if complete and (not title or len(title) < 10):
+        return "Title is missing or too short"
     if len(title) > 200:
-        return False, "Title is too long (max 200 chars)"
+        return "Title is too long (max 200 chars)"
     # Check if title contains JSON-like syntax
     if "{" in title or "}" in title or "[" in title or "]" in title:
-        return False, "Title contains JSON syntax - malformed response"
+        return "Title contains JSON syntax - malformed response"
+    return ""
 
-    # Check slug
-    slug = article.get("slug", "")
-    if not slug or len(slug) < 5:
-        return False, "Slug is missing or too short"
 
-    # Check content
-    content = article.get("content_html", "")
-    if not content or len(content) < 100:
-        return False, "Content is missing or too short (min 100 chars)"
+def _check_slug(slug, complete=True):
+    if complete and (not slug or len(slug) < 5):
+        return "Slug is missing or too short"
+    return ""
+
+
+def _check_content(content, complete=True):
+    if complete and (not content or len(content) < 100):
+        return "Content is missing or too short (min 100 chars)"
     # Check if content is just JSON
-    if content.strip().startswith("{") and content.strip().endswith("}"):
-        return False, "Content appears to be raw JSON - malformed response"
+    if complete and content.strip().startswith("{") and content.strip().endswith("}"):
+        return "Content appears to be raw JSON - malformed response"
     # Check for placeholder text
     if "placeholder" in content.lower() or "lorem ipsum" in content.lower():
-        return False, "Content contains placeholder text"
+        return "Content contains placeholder text"
+    return ""
+
 
-    # Check keywords
-    keywords = article.get("keywords", [])
+def _check_keywords(keywords, complete=True):
     if not keywords or not isinstance(keywords, list):
-        return False, "Keywords are missing or invalid"
+        return "Keywords are missing or invalid"
     if len(keywords) < 2:
-        return False, "Not enough keywords (min 2)"
+        return "Not enough keywords (min 2)"
     # Check each keyword is a proper string (not a sentence)
     for keyword in keywords:
         if not isinstance(keyword, str) or len(keyword) > 50:
-            return False, f"Invalid keyword format: {keyword}"
+            return f"Invalid keyword format: {keyword}"
         if "\n" in keyword or len(keyword.split()) > 5:
-            return False, f"Keyword is too long or contains newlines: {keyword}"
+            return f"Keyword is too long or contains newlines: {keyword}"
+    return ""
+
+
+def _check_meta_description(meta, complete=True):
+    if complete and (not meta or len(meta) < 50):
+        return "Meta description is missing or too short"
+    return ""
 
-    # Check meta description
-    meta = article.get("meta_description", "")
-    if not meta or len(meta) < 50:
-        return False, "Meta description is missing or too short"
 
-    # Check image prompt
-    image_prompt = article.get("image_prompt", "")
-    if not image_prompt or len(image_prompt) < 10:
-        return False, "Image prompt is missing or too short"
+def _check_image_prompt(image_prompt, complete=True):
+    if complete and (not image_prompt or len(image_prompt) < 10):
+        return "Image prompt is missing or too short"
+    return ""
 
-    print(f"[validate_article] Article validation passed for: {title[:50]}...")
+
+# Field rules in the order validate_article applies them. With complete=False
+# only the rules that more text cannot fix are applied (used while streaming).
+ARTICLE_FIELD_CHECKS = (
+    ('title', _check_title),
+    ('slug', _check_slug),
+    ('content_html', _check_content),
+    ('keywords', _check_keywords),
+    ('meta_description', _check_meta_description),
+    ('image_prompt', _check_image_prompt),
+)
+
+
+def validate_article(article: dict, _topic: str) -> tuple[bool, str]:
+    """
+    Validate article quality before publishing
+    Returns: (is_valid, error_message)
+    """
+    if not article:
+        return False, "Article is None or empty"
+
+    for field, check in ARTICLE_FIELD_CHECKS:
+        error = check(article.get(field, [] if field == 'keywords' else ""))
+        if error:
+            return False, error
+
+    print(f"[validate_article] Article validation passed for: {article['title'][:50]}...")
     return True, ""
 
 
-def generate_article_with_image(topic: str):
-    """Wrapper: возвращает словарь с title, content, image_url"""
+class ArticleRejected(ValueError):
+    """Streamed article is provably invalid; generation was aborted"""
+
+    def __init__(self, reason, text=""):
+        super().__init__(reason)
+        self.reason = reason
+        self.text = text
+
+
+def _streamed_string_field(text, field):
+    """(value, complete) of a JSON string field in a partial response, or (None, False)"""
+    match = re.search(r'"%s"\s*:\s*"' % re.escape(field), text)
+    if not match:
+        return None, False
+    raw = text[match.end():]
+    # Строка закрыта только кавычкой, за которой идёт `,` или `}`: неэкранированная
+    # кавычка внутри HTML (`<a href="...">`) или кавычка в конце чанка ещё не конец поля
+    closing = re.search(r'(?<!\\)(?:\\\\)*"(?=\s*[,}])', raw)
+    complete = closing is not None
+    if complete:
+        raw = raw[:closing.end() - 1]
+    else:
+        raw = raw.rstrip('\\')
+    try:
+        return json.loads(f'"{raw}"'), complete
+    except json.JSONDecodeError:
+        # Обрезанная escape-последовательность в середине стрима
+        return raw, complete
+
+
+def _streamed_list_field(text, field):
+    match = re.search(r'"%s"\s*:\s*\[' % re.escape(field), text)
+    if not match:
+        return None, False
+    closing = text.find(']', match.end())
+    if closing < 0:
+        return None, False
+    try:
+        return json.loads(text[match.end() - 1:closing + 1]), True
+    except json.JSONDecodeError:
+        return None, False
+
+
+class IncrementalArticleValidator:
+    """Applies the validate_article rules to a streamed JSON article as its fields arrive"""
+
+    def __init__(self, fields=None):
+        self.fields = [(f, c) for f, c in ARTICLE_FIELD_CHECKS if fields is None or f in fields]
+        self.text = ""
+        self.done = set()
+        self.values = {}  # field -> (value, complete) as last seen
+
+    def feed(self, chunk_text):
+        """Add streamed text; return the rejection reason, or "" while the article may still be valid"""
+        self.text += chunk_text or ""
+        for field, check in self.fields:
+            if field in self.done:
+                continue
+            if field == 'keywords':
+                value, complete = _streamed_list_field(self.text, field)
+            else:
+                value, complete = _streamed_string_field(self.text, field)
+            if value is None:
+                continue
+            self.values[field] = (value, complete)
+            error = check(value, complete)
+            if error:
+                return error
+            if complete:
+                self.done.add(field)
+        return ""
+
+
+def generate_article_with_image(topic: str, article: dict = None, deadline=None, on_progress=None):
+    """Wrapper: возвращает словарь с title, content, image_url
+
+    Если передан `article` (например, checkpoint из пакетной генерации
+    gemini_batch.py), текст заново не генерируется - только изображение.
+    `deadline` ограничивает время генерации (бюджеты этапов 'article' и 'image').
+    `on_progress(event, data)` получает события генерации (поля статьи,
+    `article`, `image`).
+    """
     client = GeminiClient()
 
     # 1️⃣ Генерируем текст статьи
-    article = client.generate_article(brief_plan=topic, seo_focus=topic)
+    if article is None:
+        article = client.generate_article(brief_plan=topic, seo_focus=topic,
+                                          deadline=stage_deadline(deadline, 'article'),
+                                          on_progress=on_progress)
+    else:
+        print(f"[generate_article_with_image] Using pre-generated article: {article.get('title', '')[:50]}...")
 
     # VALIDATE: Check if article generation failed
     if not article:
@@ -614,17 +1145,22 @@ def generate_article_with_image(topic: str):
     # VALIDATE: Check article quality
     is_valid, error_msg = validate_article(article, topic)
     if not is_valid:
+        # Статья отклонена до генерации изображения: потеряны только токены текста
+        usage_ledger.record_rejection('article', error_msg, wasted_tokens=len(json.dumps(article)) // 4)
         print(f"[generate_article_with_image] ERROR: Article validation failed: {error_msg}")
         print(f"[generate_article_with_image] Article data: {article}")
         return None
+    report_progress(on_progress, 'article', title=article['title'], slug=article.get('slug'),
+                    keywords=article.get('keywords') or [], chars=len(article.get('content_html') or ''))
 
     # 2️⃣ Генерируем изображение через Gemini API
     # Добавляем дополнительную задержку перед генерацией изображения
+    image_deadline = stage_deadline(deadline, 'image')
     print(f"[generate_article_with_image] Waiting 3 seconds before generating image...")
-    time.sleep(3)
+    deadline_sleep(image_deadline, 3, "image generation")
 
     image_prompt = article.get("image_prompt", f"Professional illustration for article about {topic}")
-    image_bytes, mime_type = client.generate_image(image_prompt)
+    image_bytes, mime_type = client.generate_image(image_prompt, deadline=image_deadline)
 
     # Сохраняем изображение локально
     import os
@@ -646,6 +1182,7 @@ def generate_article_with_image(topic: str):
         f.write(image_bytes)
 
     print(f"[generate_article_with_image] Image saved to: {path}")
+    report_progress(on_progress, 'image', path=path, mime_type=mime_type, bytes=len(image_bytes))
     print(f"[generate_article_with_image] Article validated and ready to publish: {article['title'][:50]}...")
 
     # 3️⃣ Возвращаем словарь с нужными полями
@@ -0,0 +1,44 @@
+"""http_client.py
+
+Shared entry point for HTTP calls to WordPress and social networks.
+
+`request(service, method, url, **kwargs)` is `requests.request` plus:
+    - a tracing span named "<service> <METHOD> <path template>" with the
+      status code (sanitized like recordings: no bot tokens, no ids, no query),
+    - request/response sizes added to the current metrics stage
+      (bytes_in/bytes_out of run_ledger),
+    - recording or replay of the exchange when HTTP_RECORD_FILE or
+      HTTP_REPLAY_FILE is set (see traffic.py).
+"""
+import time
+
+import requests
+
+import metrics
+import tracing
+import traffic
+
+
+def _body_size(body):
+    if isinstance(body, str):
+        return len(body.encode('utf-8'))
+    return len(body) if isinstance(body, bytes) else 0
+
+
+def request(service, method, url, **kwargs):
+    """Send one HTTP request (same arguments as requests.request)"""
+    method = method.upper()
+    name = f"{service} {method} {traffic.url_template(traffic.sanitize_url(url))}"
+    with tracing.span(name, tracing.CAT_HTTP, service=service) as span:
+        if traffic.REPLAYER is not None:
+            resp = traffic.REPLAYER.respond(service, method, url, **kwargs)
+        else:
+            started_at = time.time()
+            started = time.perf_counter()
+            resp = requests.request(method, url, **kwargs)
+            if traffic.RECORDER is not None:
+                traffic.RECORDER.record_response(service, resp, started_at, time.perf_counter() - started)
+        span['status'] = resp.status_code
+    sent = _body_size(resp.request.body) if resp.request is not None else 0
+    metrics.add_bytes(bytes_in=len(resp.content or b''), bytes_out=sent)
+    return resp
@@ -0,0 +1,452 @@
+"""internal_links.py
+
+Internal links from new articles to our earlier posts.
+
+An inverted index maps link phrases to post URLs. The phrases are the SEO
+keywords of our posts (`posts.seo_keywords`) and the tag names of posts on
+WordPress. The index lives in the `link_targets` table (one row per URL with
+its phrases) and is fed from two sources:
+- every publication (`record_post`, called from save_post_record), so the
+  index grows incrementally;
+- the WordPress posts list (`sync_wordpress`, run by the publisher daemon
+  every INTERNAL_LINKS_SYNC_HOURS or with --sync), which also covers posts
+  published by hand and fills `posts.link`. It is never run on the publish
+  path, so a slow WordPress listing can't delay a publication.
+
+`add_links(content_html)` rewrites the article in one pass before
+create_wp_post. Text outside tags, links, headings, code and scripts is
+matched word by word (HTML entities decoded, so `AI&nbsp;tools` matches "AI
+tools" and `&amp;` is not a word) against an Aho-Corasick automaton of all phrases, so the
+cost is linear in the article size whatever the size of the index. The
+longest leftmost match wins, every URL is linked at most once and at most
+INTERNAL_LINKS_MAX links are inserted. A phrase shared by several posts links
+to the most recently published one.
+
+The automaton is built once per process. Phrases that arrive later go into a
+small second automaton, merged into the main one every REBUILD_EVERY phrases.
+
+Settings (.env):
+    INTERNAL_LINKS_MAX=3                  # 0 = off
+    INTERNAL_LINK_MIN_PHRASE_CHARS=6
+    INTERNAL_LINKS_SYNC_HOURS=24          # WordPress posts list refresh by the daemon, 0 = only --sync
+
+Usage:
+    python internal_links.py --sync
+    python internal_links.py --stats
+    python internal_links.py --preview article.html
+"""
+import os
+import re
+import html
+import json
+import time
+import sqlite3
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+
+from data_export import parse_keywords
+
+load_dotenv()
+
+DB_FILE = 'storage.db'
+
+MAX_LINKS = int(os.getenv('INTERNAL_LINKS_MAX', '3'))
+MIN_PHRASE_CHARS = int(os.getenv('INTERNAL_LINK_MIN_PHRASE_CHARS', '6'))
+SYNC_HOURS = float(os.getenv('INTERNAL_LINKS_SYNC_HOURS', '24'))
+REBUILD_EVERY = 500
+SOURCE_LOCAL = 'local'
+SOURCE_WORDPRESS = 'wordpress'
+
+_WORD = re.compile(r'\w+')
+_ENTITY = re.compile(r'&(?:#[0-9]+|#[xX][0-9a-fA-F]+|[A-Za-z][A-Za-z0-9]*);')
+_MARKUP = re.compile(r'(<!--.*?-->|<[^>]*>)', re.DOTALL)
+_TAG_NAME = re.compile(r'<\s*(/?)\s*([a-zA-Z][a-zA-Z0-9]*)')
+# Внутри этих элементов ссылки не вставляются
+SKIP_TAGS = {'a', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'code', 'pre', 'script', 'style', 'button', 'figcaption'}
+
+
+def phrase_key(phrase):
+    """Lower-cased words of a link phrase, or None if the phrase is too short to link"""
+    # Имена меток WordPress приходят с HTML-сущностями ("AI &amp; ML")
+    words = tuple(_WORD.findall(html.unescape(str(phrase)).lower()))
+    if not words or len(' '.join(words)) < MIN_PHRASE_CHARS:
+        return None
+    return words
+
+
+def _word_spans(text):
+    """(start, end) in `text` and lower-cased form of every word, with HTML entities decoded.
+
+    A word never ends inside an entity, so a link wrapped around the raw
+    span keeps the entity intact.
+    """
+    if '&' not in text:
+        return [((m.start(), m.end()), m.group().lower()) for m in _WORD.finditer(text)]
+    decoded, starts, ends, position = [], [], [], 0
+    for entity in _ENTITY.finditer(text):
+        for index in range(position, entity.start()):
+            decoded.append(text[index])
+            starts.append(index)
+            ends.append(index + 1)
+        for char in html.unescape(entity.group()):
+            decoded.append(char)
+            starts.append(entity.start())
+            ends.append(entity.end())
+        position = entity.end()
+    for index in range(position, len(text)):
+        decoded.append(text[index])
+        starts.append(index)
+        ends.append(index + 1)
+    decoded = ''.join(decoded)
+    return [((starts[m.start()], ends[m.end() - 1]), m.group().lower()) for m in _WORD.finditer(decoded)]
+
+
+class Automaton:
+    """Aho-Corasick automaton over phrases given as word tuples"""
+
+    def __init__(self, keys=()):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [()]
+        for key in keys:
+            self._insert(key)
+        self._link()
+
+    def _insert(self, key):
+        node = 0
+        for word in key:
+            child = self.goto[node].get(word)
+            if child is None:
+                child = len(self.goto)
+                self.goto[node][word] = child
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append(())
+            node = child
+        self.out[node] = (key,)
+
+    def _link(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for word, child in self.goto[node].items():
+                queue.append(child)
+                state = self.fail[node]
+                while state and word not in self.goto[state]:
+                    state = self.fail[state]
+                self.fail[child] = self.goto[state].get(word, 0)
+                self.out[child] = self.out[child] + self.out[self.fail[child]]
+
+    def search(self, words):
+        """(first word, last word + 1, key) of every occurrence"""
+        goto, fail, out = self.goto, self.fail, self.out
+        node = 0
+        for index, word in enumerate(words):
+            while node and word not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(word, 0)
+            for key in out[node]:
+                yield index + 1 - len(key), index + 1, key
+
+
+def ensure_schema(conn):
+    conn.execute("""CREATE TABLE IF NOT EXISTS link_targets (
+        url TEXT PRIMARY KEY,
+        wp_id INTEGER,
+        title TEXT,
+        phrases TEXT,
+        source TEXT,
+        published_at TEXT
+    )""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS link_index_meta (
+        name TEXT PRIMARY KEY,
+        value TEXT
+    )""")
+    try:
+        conn.execute('ALTER TABLE posts ADD COLUMN link TEXT')
+    except sqlite3.OperationalError:
+        pass  # Колонка уже есть (или таблицы posts еще нет)
+    conn.commit()
+
+
+def _connect():
+    conn = sqlite3.connect(DB_FILE, timeout=30)
+    ensure_schema(conn)
+    return conn
+
+
+class LinkIndex:
+    """Phrase -> URLs index with its automata, synced from `link_targets` by rowid"""
+
+    def __init__(self):
+        self.targets = {}  # url -> {'wp_id', 'title', 'published_at', 'keys'}
+        self.phrases = {}  # ключ фразы -> {url}
+        self.loaded_through = 0
+        self.posts_through = 0
+        self._main = Automaton()
+        self._main_keys = set()
+        self._recent_keys = set()
+        self._recent = Automaton()
+
+    def sync(self, conn):
+        """Add targets for posts with a link but no target row, then load the target rows added since last time"""
+        try:
+            missing = conn.execute("""SELECT posts.id, posts.wp_id, posts.link, posts.title, posts.seo_keywords,
+                                             posts.published_at
+                                      FROM posts LEFT JOIN link_targets ON link_targets.url = posts.link
+                                      WHERE posts.id > ? AND posts.link IS NOT NULL AND link_targets.url IS NULL""",
+                                   (self.posts_through,)).fetchall()
+            self.posts_through = conn.execute("SELECT COALESCE(MAX(id), 0) FROM posts").fetchone()[0]
+        except sqlite3.OperationalError:
+            missing = []  # Таблицы posts еще нет
+        if missing:
+            with conn:
+                for _post_id, wp_id, link, title, keywords, published_at in missing:
+                    _store_target(conn, link, wp_id, title, parse_keywords(keywords), SOURCE_LOCAL, published_at)
+
+        new_keys = set()
+        for rowid, url, wp_id, title, phrases, published_at in conn.execute(
+                """SELECT rowid, url, wp_id, title, phrases, published_at FROM link_targets
+                   WHERE rowid > ? ORDER BY rowid""", (self.loaded_through,)):
+            new_keys |= self._set_target(url, wp_id, title, json.loads(phrases or '[]'), published_at)
+            self.loaded_through = rowid
+        self._extend(new_keys)
+
+    def _set_target(self, url, wp_id, title, phrases, published_at):
+        old = self.targets.get(url)
+        for key in old['keys'] if old else ():
+            self.phrases.get(key, set()).discard(url)
+        keys = {key for key in map(phrase_key, phrases) if key}
+        self.targets[url] = {'wp_id': wp_id, 'title': title, 'published_at': published_at or '', 'keys': keys}
+        for key in keys:
+            self.phrases.setdefault(key, set()).add(url)
+        return keys - self._main_keys - self._recent_keys
+
+    def _extend(self, new_keys):
+        if not new_keys:
+            return
+        self._recent_keys |= new_keys
+        if not self._main_keys or len(self._recent_keys) >= REBUILD_EVERY:
+            # Перестраиваем основной автомат целиком
+            self._main_keys |= self._recent_keys
+            self._recent_keys = set()
+            self._main = Automaton(self._main_keys)
+        self._recent = Automaton(self._recent_keys)
+
+    def _matches(self, words):
+        found = list(self._main.search(words))
+        if self._recent_keys:
+            found += self._recent.search(words)
+        # Самое левое, затем самое длинное совпадение
+        found.sort(key=lambda match: (match[0], match[0] - match[1]))
+        return found
+
+    def _target(self, key, used):
+        urls = [url for url in self.phrases.get(key, ()) if url not in used]
+        return max(urls, key=lambda url: self.targets[url]['published_at']) if urls else None
+
+    def _link_text(self, text, used, limit):
+        """Insert up to `limit` links into a text node; returns (text, inserted links)"""
+        found = _word_spans(text)
+        if not found:
+            return text, []
+        spans = [span for span, _word in found]
+        words = [word for _span, word in found]
+        pieces, links, position, free_from = [], [], 0, 0
+        for first, last, key in self._matches(words):
+            if len(links) >= limit:
+                break
+            if first < free_from or key in used:
+                continue
+            url = self._target(key, used)
+            if url is None:
+                continue
+            start, end = spans[first][0], spans[last - 1][1]
+            pieces.append(text[position:start])
+            pieces.append(f'<a href="{html.escape(url)}">{text[start:end]}</a>')
+            position, free_from = end, last
+            # Каждая цель и каждая фраза - не больше одной ссылки на статью
+            used.update((url, key))
+            links.append({'phrase': html.unescape(text[start:end]), 'url': url, 'title': self.targets[url]['title']})
+        pieces.append(text[position:])
+        return ''.join(pieces), links
+
+    def add_links(self, content_html, exclude=(), limit=MAX_LINKS):
+        """Article HTML with up to `limit` internal links; returns (html, inserted links)"""
+        if limit <= 0 or not self.phrases or not content_html:
+            return content_html, []
+        used = set(exclude)
+        links = []
+        skip = {}
+        parts = _MARKUP.split(content_html)
+        for index, part in enumerate(parts):
+            if index % 2:
+                tag = _TAG_NAME.match(part)
+                if tag and tag.group(2).lower() in SKIP_TAGS and not part.endswith('/>'):
+                    name = tag.group(2).lower()
+                    skip[name] = max(0, skip.get(name, 0) + (-1 if tag.group(1) else 1))
+                continue
+            if len(links) >= limit or any(skip.values()) or not part.strip():
+                continue
+            parts[index], inserted = self._link_text(part, used, limit - len(links))
+            links += inserted
+        return ''.join(parts), links
+
+
+_INDEX = None
+# Индекс общий для воркеров JobQueue (main.py): синхронизация и вставка ссылок по очереди
+_LOCK = threading.RLock()
+
+
+def _meta(conn, name):
+    row = conn.execute("SELECT value FROM link_index_meta WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else None
+
+
+def _set_meta(conn, name, value):
+    conn.execute("""INSERT INTO link_index_meta (name, value) VALUES (?, ?)
+                    ON CONFLICT(name) DO UPDATE SET value = excluded.value""", (name, str(value)))
+    conn.commit()
+
+
+def get_index(conn=None):
+    """Process-wide index, synced with storage.db on every call"""
+    global _INDEX
+    own = conn is None
+    conn = conn or _connect()
+    try:
+        with _LOCK:
+            if _INDEX is None:
+                _INDEX = LinkIndex()
+            ensure_schema(conn)
+            _INDEX.sync(conn)
+    finally:
+        if own:
+            conn.close()
+    return _INDEX
+
+
+def add_links(content_html, exclude=(), limit=MAX_LINKS):
+    """Insert internal links into an article before it is posted; returns (html, inserted links)"""
+    if limit <= 0:
+        return content_html, []
+    try:
+        with _LOCK:
+            return get_index().add_links(content_html, exclude, limit)
+    except Exception as e:
+        # Без ссылок статья публикуется как есть
+        print(f"[internal_links] Links not added: {e}")
+        return content_html, []
+
+
+def _store_target(conn, url, wp_id, title, phrases, source, published_at):
+    conn.execute("""INSERT OR REPLACE INTO link_targets (url, wp_id, title, phrases, source, published_at)
+                    VALUES (?, ?, ?, ?, ?, ?)""",
+                 (url, wp_id, title, json.dumps(sorted({str(phrase) for phrase in phrases}), ensure_ascii=False),
+                  source, published_at))
+
+
+def record_post(conn, wp_id, link, title, keywords, published_at=None):
+    """Make a just published post a link target (in the caller's transaction)"""
+    if not link:
+        return
+    ensure_schema(conn)
+    _store_target(conn, link, wp_id, title, keywords or [], SOURCE_LOCAL,
+                  published_at or datetime.now(timezone.utc).isoformat())
+
+
+def sync_wordpress(conn, deadline=None):
+    """Load the WordPress posts list: targets for every post (tags + our keywords) and posts.link"""
+    from wordpress_client import list_wp_posts, get_tag_names
+
+    posts, page, pages = [], 1, 1
+    while page <= pages:
+        batch, pages = list_wp_posts(page, deadline=deadline)
+        posts += batch
+        page += 1
+    tag_names = get_tag_names([tag for post in posts for tag in post.get('tags') or []], deadline=deadline)
+    local = {wp_id: parse_keywords(keywords) for wp_id, keywords in
+             conn.execute("SELECT wp_id, seo_keywords FROM posts WHERE wp_id IS NOT NULL")}
+    current = {url: (title, phrases) for url, title, phrases in
+               conn.execute("SELECT url, title, phrases FROM link_targets")}
+    changed = 0
+    with conn:
+        for post in posts:
+            url = post.get('link')
+            if not url:
+                continue
+            title = html.unescape((post.get('title') or {}).get('rendered', ''))
+            phrases = [tag_names[tag] for tag in post.get('tags') or [] if tag in tag_names]
+            phrases += local.get(post['id'], [])
+            phrases_json = json.dumps(sorted(set(phrases)), ensure_ascii=False)
+            conn.execute("UPDATE posts SET link = ? WHERE wp_id = ? AND link IS NULL", (url, post['id']))
+            # Неизмененные цели не перезаписываем, чтобы не перегружать их в индексе
+            if current.get(url) != (title, phrases_json):
+                _store_target(conn, url, post['id'], title, phrases, SOURCE_WORDPRESS, post.get('date_gmt'))
+                changed += 1
+    _set_meta(conn, 'wordpress_synced_at', datetime.now(timezone.utc).isoformat())
+    print(f"[internal_links] WordPress posts: {len(posts)}, updated targets: {changed}")
+    return len(posts)
+
+
+def sync_wordpress_if_due(deadline=None):
+    """Run sync_wordpress if the last attempt is older than SYNC_HOURS (publisher daemon loop).
+
+    Returns the number of WordPress posts, or None if no sync was due or it failed.
+    """
+    if SYNC_HOURS <= 0:
+        return None
+    conn = _connect()
+    try:
+        last_sync = float(_meta(conn, 'wordpress_sync_attempt') or 0)
+        if time.time() - last_sync <= SYNC_HOURS * 3600:
+            return None
+        # Попытка засчитывается и при ошибке: недоступный WordPress не опрашиваем каждые 5 минут
+        _set_meta(conn, 'wordpress_sync_attempt', time.time())
+        try:
+            return sync_wordpress(conn, deadline)
+        except Exception as e:
+            print(f"[internal_links] WordPress posts list not loaded: {e}")
+            return None
+    finally:
+        conn.close()
+
+
+def print_stats():
+    started = time.time()
+    index = get_index()
+    elapsed = time.time() - started
+    print(f"🔗 Целей ссылок: {len(index.targets)}, фраз: {len(index.phrases)}, "
+          f"узлов автомата: {len(index._main.goto) + len(index._recent.goto)}, загрузка {elapsed * 1000:.0f} мс")
+    conn = _connect()
+    print(f"   Синхронизация с WordPress: {_meta(conn, 'wordpress_synced_at') or 'не было'}")
+    conn.close()
+    print(f"   Ссылок на статью: до {MAX_LINKS}, минимальная длина фразы: {MIN_PHRASE_CHARS}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Внутренние ссылки на опубликованные статьи')
+    parser.add_argument('--sync', action='store_true', help='Загрузить список постов из WordPress')
+    parser.add_argument('--stats', action='store_true', help='Размер индекса')
+    parser.add_argument('--preview', metavar='FILE', help='Показать ссылки, которые будут вставлены в HTML-файл')
+    args = parser.parse_args()
+
+    if args.sync:
+        conn = _connect()
+        sync_wordpress(conn)
+        conn.close()
+    if args.preview:
+        with open(args.preview, encoding='utf-8') as f:
+            content = f.read()
+        started = time.perf_counter()
+        _html, inserted = add_links(content)
+        elapsed = (time.perf_counter() - started) * 1000
+        print(f"🔗 Ссылок: {len(inserted)} ({len(content)} символов, {elapsed:.1f} мс)")
+        for link in inserted:
+            print(f"   \"{link['phrase']}\" -> {link['url']} ({link['title']})")
+    if args.stats or not (args.sync or args.preview):
+        print_stats()
@@ -0,0 +1,292 @@
+"""job_queue.py
+
+Bounded worker pool for long-running API jobs (article generation, publishing).
+
+`JobQueue.submit` puts a job into a fixed-size queue served by JOB_WORKERS
+threads and returns at once; when the queue is full it raises `QueueFull` so
+the API can answer 429 instead of piling up work. A job function receives its
+`Job` as the first argument and reports progress with `job.stage(name)`, which
+records per-stage timings; `job.emit(event, data)` adds a progress event that
+clients can follow live (main.py streams them as server-sent events). Job state (status, current stage, timings, result
+or error) is kept in memory while the process runs and mirrored to the `jobs`
+table of storage.db, so finished jobs stay inspectable after a restart. A job
+whose result is `{'published': False, 'reason': ...}` published nothing and
+is marked failed with that reason (the result is kept).
+
+Settings (.env):
+    JOB_WORKERS=2
+    JOB_QUEUE_SIZE=20
+"""
+import os
+import json
+import time
+import uuid
+import queue
+import sqlite3
+import threading
+import traceback
+from collections import deque
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+load_dotenv()
+
+DB_FILE = 'storage.db'
+
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))
+JOB_QUEUE_SIZE = int(os.getenv('JOB_QUEUE_SIZE', '20'))
+# Сколько завершенных задач держать в памяти (остальные - в таблице jobs)
+MAX_FINISHED_IN_MEMORY = 200
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_SUCCEEDED = 'succeeded'
+STATUS_FAILED = 'failed'
+
+
+class QueueFull(Exception):
+    """No room for another job"""
+
+
+def ensure_schema(conn):
+    conn.execute("""CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        kind TEXT,
+        status TEXT,
+        stage TEXT,
+        params TEXT,
+        created_at TEXT,
+        started_at TEXT,
+        finished_at TEXT,
+        timings TEXT,
+        result TEXT,
+        error TEXT
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs(created_at)")
+    conn.commit()
+
+
+def _connect():
+    conn = sqlite3.connect(DB_FILE, timeout=30)
+    ensure_schema(conn)
+    return conn
+
+
+def _now_iso():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class Job:
+    """One queued unit of work and its progress"""
+
+    def __init__(self, kind, params=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.params = params or {}
+        self.status = STATUS_QUEUED
+        self.stage_name = None
+        self.created_at = _now_iso()
+        self.started_at = None
+        self.finished_at = None
+        self.timings = []  # [{'stage': ..., 'seconds': ...}]
+        self.result = None
+        self.error = None
+        self._stage_started = None
+        self._created = time.monotonic()
+        self.events = []  # [{'id', 'event', 'elapsed', 'data'}], только в памяти
+        self._lock = threading.Lock()
+
+    def stage(self, name):
+        """Mark the start of a pipeline stage (closes the previous one)"""
+        with self._lock:
+            self._close_stage()
+            self.stage_name = name
+            self._stage_started = time.monotonic()
+        self.emit('stage', {'stage': name})
+        self.save()
+
+    def emit(self, event, data=None):
+        """Append a progress event (usable as an `on_progress` callback)"""
+        with self._lock:
+            self.events.append({'id': len(self.events), 'event': event,
+                                'elapsed': round(time.monotonic() - self._created, 3), 'data': data or {}})
+
+    def events_since(self, index):
+        """Events from position `index` on"""
+        with self._lock:
+            return self.events[index:]
+
+    @property
+    def finished(self):
+        return self.status in (STATUS_SUCCEEDED, STATUS_FAILED)
+
+    def _close_stage(self):
+        if self.stage_name and self._stage_started is not None:
+            self.timings.append({'stage': self.stage_name,
+                                 'seconds': round(time.monotonic() - self._stage_started, 3)})
+        self._stage_started = None
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'id': self.id,
+                'kind': self.kind,
+                'status': self.status,
+                'stage': self.stage_name,
+                'params': self.params,
+                'created_at': self.created_at,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at,
+                'timings': list(self.timings),
+                'result': self.result,
+                'error': self.error,
+            }
+
+    def save(self):
+        data = self.to_dict()
+        try:
+            conn = _connect()
+            conn.execute("""INSERT OR REPLACE INTO jobs
+                            (id, kind, status, stage, params, created_at, started_at, finished_at, timings, result, error)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                         (data['id'], data['kind'], data['status'], data['stage'], json.dumps(data['params']),
+                          data['created_at'], data['started_at'], data['finished_at'], json.dumps(data['timings']),
+                          json.dumps(data['result'], default=str) if data['result'] is not None else None,
+                          data['error']))
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            print(f"[job_queue] Could not save job {self.id}: {e}")
+
+
+def _row_to_dict(row):
+    keys = ('id', 'kind', 'status', 'stage', 'params', 'created_at', 'started_at', 'finished_at',
+            'timings', 'result', 'error')
+    data = dict(zip(keys, row))
+    data['params'] = json.loads(data['params']) if data['params'] else {}
+    data['timings'] = json.loads(data['timings']) if data['timings'] else []
+    data['result'] = json.loads(data['result']) if data['result'] else None
+    return data
+
+
+class JobQueue:
+    """Fixed pool of worker threads fed by a bounded queue"""
+
+    def __init__(self, workers=JOB_WORKERS, max_queued=JOB_QUEUE_SIZE):
+        self.workers = max(1, workers)
+        self._queue = queue.Queue(maxsize=max(1, max_queued))
+        self._jobs = {}
+        self._threads = []
+        self._durations = deque(maxlen=20)
+        self._lock = threading.Lock()
+
+    def _start_workers(self):
+        with self._lock:
+            if self._threads:
+                return
+            # Задачи предыдущего процесса уже не выполнятся
+            conn = _connect()
+            conn.execute("UPDATE jobs SET status=?, error=?, finished_at=? WHERE status IN (?, ?)",
+                         (STATUS_FAILED, 'interrupted by restart', _now_iso(), STATUS_QUEUED, STATUS_RUNNING))
+            conn.commit()
+            conn.close()
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f"job-worker-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, kind, func, *args, params=None, **kwargs):
+        """Enqueue `func(job, *args, **kwargs)`; returns the Job or raises QueueFull"""
+        self._start_workers()
+        job = Job(kind, params)
+        try:
+            self._queue.put_nowait((job, func, args, kwargs))
+        except queue.Full:
+            raise QueueFull(f"job queue is full ({self._queue.maxsize} waiting)")
+        with self._lock:
+            self._jobs[job.id] = job
+        job.save()
+        return job
+
+    def _worker(self):
+        while True:
+            job, func, args, kwargs = self._queue.get()
+            job.status = STATUS_RUNNING
+            job.started_at = _now_iso()
+            started = time.monotonic()
+            job.save()
+            try:
+                job.result = func(job, *args, **kwargs)
+                if isinstance(job.result, dict) and job.result.get('published') is False:
+                    # Прогон ничего не опубликовал (нет планов, генерация не удалась, квота)
+                    job.status = STATUS_FAILED
+                    job.error = job.result.get('reason') or 'nothing published'
+                else:
+                    job.status = STATUS_SUCCEEDED
+            except Exception as e:
+                job.status = STATUS_FAILED
+                job.error = str(e)
+                print(f"[job_queue] Job {job.id} ({job.kind}) failed: {e}")
+                print(traceback.format_exc())
+            finally:
+                with job._lock:
+                    job._close_stage()
+                job.finished_at = _now_iso()
+                job.save()
+                if job.status == STATUS_SUCCEEDED:
+                    job.emit('done', {'result': job.result})
+                else:
+                    job.emit('error', {'error': job.error, 'result': job.result})
+                self._finished(job, time.monotonic() - started)
+                self._queue.task_done()
+
+    def _finished(self, job, duration):
+        with self._lock:
+            self._durations.append(duration)
+            finished = [j for j in self._jobs.values() if j.finished]
+            for old in finished[:max(0, len(finished) - MAX_FINISHED_IN_MEMORY)]:
+                del self._jobs[old.id]
+
+    def retry_after(self):
+        """Rough seconds until a queue slot frees up (for Retry-After)"""
+        with self._lock:
+            average = sum(self._durations) / len(self._durations) if self._durations else 60
+        return max(1, int(average / self.workers))
+
+    def live(self, job_id):
+        """In-memory Job object (None once it was dropped or after a restart)"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def get(self, job_id):
+        """Job as a dict (live state first, then the jobs table), or None"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job:
+            return job.to_dict()
+        conn = _connect()
+        row = conn.execute("SELECT * FROM jobs WHERE id=?", (job_id,)).fetchone()
+        conn.close()
+        return _row_to_dict(row) if row else None
+
+    def list(self, status=None, kind=None, limit=50):
+        """Most recent jobs, newest first"""
+        sql = "SELECT * FROM jobs WHERE 1=1"
+        params = []
+        if status:
+            sql += " AND status=?"
+            params.append(status)
+        if kind:
+            sql += " AND kind=?"
+            params.append(kind)
+        sql += " ORDER BY created_at DESC LIMIT ?"
+        params.append(int(limit))
+        conn = _connect()
+        rows = conn.execute(sql, params).fetchall()
+        conn.close()
+        return [_row_to_dict(row) for row in rows]
+
+    def stats(self):
+        with self._lock:
+            running = sum(1 for job in self._jobs.values() if job.status == STATUS_RUNNING)
+        return {'workers': self.workers, 'running': running,
+                'queued': self._queue.qsize(), 'capacity': self._queue.maxsize}
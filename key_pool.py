@@ -0,0 +1,285 @@
+"""key_pool.py
+
+Pool of Gemini API keys with quota-aware rotation.
+
+Each key gets its own `genai.Client`, its own request spacing and a cooldown.
+Requests go to the available key with the fewest requests in the last minute;
+when a key hits 429 it is put on cooldown for the delay the API suggests
+(`retry in Xs`, or GEMINI_KEY_COOLDOWN seconds) and the request fails over to
+the next key immediately instead of sleeping. Only when every key is cooling
+down does the caller have to wait.
+
+There is one pool per key set in the process (`shared_pool`), so the request
+spacing and the GEMINI_KEY_RPM window cover every GeminiClient. Cooldowns and
+per-key counters are persisted in the `api_keys` table of storage.db and
+re-read every STATE_REFRESH_SECONDS, so a 429 seen by another process (daemon
+vs API server) or a restarted daemon does not hammer a key that is still
+exhausted. Keys are stored only as a hash id and the last four characters.
+
+Settings (.env):
+    GEMINI_API_KEYS=key1,key2,key3     # in addition to GOOGLE_API_KEY/GEMINI_API_KEY
+    GEMINI_KEY_COOLDOWN=60
+    GEMINI_KEY_RPM=0                   # per-key requests per minute, 0 = unlimited
+
+Usage:
+    python key_pool.py                 # per-key usage and cooldown state
+"""
+import os
+import re
+import time
+import hashlib
+import sqlite3
+import threading
+import weakref
+from collections import deque
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+load_dotenv()
+
+DB_FILE = 'storage.db'
+
+KEY_COOLDOWN_SECONDS = float(os.getenv('GEMINI_KEY_COOLDOWN', '60'))
+KEY_RPM = int(os.getenv('GEMINI_KEY_RPM', '0'))
+MIN_REQUEST_INTERVAL = 2.0  # минимум 2 секунды между запросами одного ключа
+STATE_REFRESH_SECONDS = 5.0  # как часто перечитывать cooldown_until из storage.db
+
+# genai-клиент -> key_id (prompt_cache.py хранит кэши по ключу, а не по объекту клиента)
+_CLIENT_KEY_IDS = weakref.WeakKeyDictionary()
+
+
+def ensure_schema(conn):
+    conn.execute("""CREATE TABLE IF NOT EXISTS api_keys (
+        key_id TEXT PRIMARY KEY,
+        label TEXT,
+        requests INTEGER DEFAULT 0,
+        rate_limited INTEGER DEFAULT 0,
+        errors INTEGER DEFAULT 0,
+        cooldown_until REAL DEFAULT 0,
+        last_used_at TEXT,
+        last_error TEXT
+    )""")
+    conn.commit()
+
+
+def _connect():
+    conn = sqlite3.connect(DB_FILE, timeout=30)
+    ensure_schema(conn)
+    return conn
+
+
+def key_id(api_key):
+    return 'key-' + hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:8]
+
+
+def parse_retry_delay(error_str):
+    """Seconds suggested by a 429 error (`retry in 12.3s` / `retryDelay: '12s'`), or None"""
+    match = re.search(r'retry in ([\d.]+)s', error_str) or re.search(r"retryDelay['\"]?:\s*['\"]?([\d.]+)s", error_str)
+    return float(match.group(1)) if match else None
+
+
+def load_api_keys():
+    """Unique keys from GEMINI_API_KEYS, GOOGLE_API_KEY and GEMINI_API_KEY, in that order"""
+    keys = [k.strip() for k in os.getenv('GEMINI_API_KEYS', '').split(',')]
+    keys += [os.getenv('GOOGLE_API_KEY') or '', os.getenv('GEMINI_API_KEY') or '']
+    unique = []
+    for key in keys:
+        if key and key not in unique:
+            unique.append(key)
+    return unique
+
+
+class ApiKey:
+    """One key, its client and its budget state"""
+
+    def __init__(self, api_key, client):
+        self.key_id = key_id(api_key)
+        self.label = '…' + api_key[-4:]
+        self.client = client
+        if client is not None:
+            _CLIENT_KEY_IDS[client] = self.key_id
+        self.cooldown_until = 0.0
+        self.last_request_time = 0.0
+        self.recent = deque()  # время запросов за последнюю минуту
+
+    def requests_last_minute(self, now):
+        while self.recent and now - self.recent[0] > 60:
+            self.recent.popleft()
+        return len(self.recent)
+
+    def available(self, now):
+        if self.cooldown_until > now:
+            return False
+        return not KEY_RPM or self.requests_last_minute(now) < KEY_RPM
+
+
+class KeyPool:
+    """Routes requests across API keys and tracks cooldowns"""
+
+    def __init__(self, api_keys, client_factory, persist=True):
+        self.keys = [ApiKey(api_key, client_factory(api_key)) for api_key in api_keys]
+        self.persist = persist
+        self._lock = threading.Lock()
+        self._state_loaded_at = 0.0
+        if persist and self.keys:
+            self._load_state()
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def primary(self):
+        return self.keys[0] if self.keys else None
+
+    def _load_state(self):
+        try:
+            conn = _connect()
+            for key in self.keys:
+                conn.execute("INSERT OR IGNORE INTO api_keys (key_id, label) VALUES (?, ?)", (key.key_id, key.label))
+                row = conn.execute("SELECT cooldown_until FROM api_keys WHERE key_id=?", (key.key_id,)).fetchone()
+                key.cooldown_until = row[0] or 0.0
+            conn.commit()
+            conn.close()
+            self._state_loaded_at = time.time()
+        except Exception as e:
+            print(f"[key_pool] Could not load key state: {e}")
+
+    def _refresh_cooldowns(self, now):
+        """Pick up cooldowns set by other processes (called under the lock)"""
+        if not self.persist or now - self._state_loaded_at < STATE_REFRESH_SECONDS:
+            return
+        self._state_loaded_at = now
+        try:
+            conn = _connect()
+            stored = dict(conn.execute("SELECT key_id, cooldown_until FROM api_keys").fetchall())
+            conn.close()
+        except Exception as e:
+            print(f"[key_pool] Could not refresh key state: {e}")
+            return
+        for key in self.keys:
+            key.cooldown_until = max(key.cooldown_until, stored.get(key.key_id) or 0.0)
+
+    def _save(self, key, column=None, error=None):
+        if not self.persist:
+            return
+        try:
+            conn = _connect()
+            increment = f", {column} = {column} + 1" if column else ""
+            conn.execute(f"""UPDATE api_keys SET cooldown_until = ?, last_used_at = ?,
+                                 last_error = COALESCE(?, last_error){increment}
+                             WHERE key_id = ?""",
+                         (key.cooldown_until, datetime.now(timezone.utc).isoformat(),
+                          str(error)[:300] if error else None, key.key_id))
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            print(f"[key_pool] Could not save key state: {e}")
+
+    def acquire(self, exclude=()):
+        """Reserve the least loaded available key.
+
+        Returns (key, 0) or (None, seconds until the first key frees up).
+        Waits out the per-key request spacing of the chosen key.
+        """
+        with self._lock:
+            now = time.time()
+            self._refresh_cooldowns(now)
+            candidates = [k for k in self.keys if k.key_id not in exclude and k.available(now)]
+            if not candidates:
+                pending = [k for k in self.keys if k.key_id not in exclude] or self.keys
+                free_at = min(max(k.cooldown_until, k.recent[0] + 60 if KEY_RPM and k.recent else 0)
+                              for k in pending)
+                return None, max(0.0, free_at - now)
+            key = min(candidates, key=lambda k: (k.requests_last_minute(now), k.last_request_time))
+            sleep_time = key.last_request_time + MIN_REQUEST_INTERVAL - now
+            key.last_request_time = max(now, key.last_request_time + MIN_REQUEST_INTERVAL)
+            key.recent.append(key.last_request_time)
+
+        if sleep_time > 0:
+            print(f"[key_pool] Rate limiting: waiting {sleep_time:.1f}s before next request on {key.label}")
+            time.sleep(sleep_time)
+        return key, 0
+
+    def report_success(self, key):
+        self._save(key, 'requests')
+
+    def report_rate_limited(self, key, error, retry_after=None):
+        """Put a key on cooldown after 429"""
+        cooldown = retry_after if retry_after is not None else KEY_COOLDOWN_SECONDS
+        with self._lock:
+            key.cooldown_until = max(key.cooldown_until, time.time() + cooldown)
+        print(f"[key_pool] ⚠️ Key {key.label} rate limited, cooling down for {cooldown:.0f}s")
+        self._save(key, 'rate_limited', error)
+
+    def report_error(self, key, error):
+        self._save(key, 'errors', error)
+
+    def snapshot(self):
+        """In-process state of each key"""
+        now = time.time()
+        return [{
+            'key_id': k.key_id,
+            'label': k.label,
+            'available': k.available(now),
+            'cooldown_remaining': max(0.0, k.cooldown_until - now),
+            'requests_last_minute': k.requests_last_minute(now),
+        } for k in self.keys]
+
+
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def shared_pool(api_keys, client_factory):
+    """Process-wide pool for a set of keys (created on first use)"""
+    ids = tuple(key_id(api_key) for api_key in api_keys)
+    with _POOLS_LOCK:
+        pool = _POOLS.get(ids)
+        if pool is None:
+            pool = _POOLS[ids] = KeyPool(api_keys, client_factory)
+        return pool
+
+
+def client_key_id(client):
+    """key_id of a client created by a pool, or None"""
+    try:
+        return _CLIENT_KEY_IDS.get(client)
+    except TypeError:
+        return None
+
+
+def key_stats():
+    """Persisted per-key counters and cooldowns"""
+    conn = _connect()
+    cur = conn.execute("""SELECT key_id, label, requests, rate_limited, errors, cooldown_until, last_used_at, last_error
+                          FROM api_keys ORDER BY key_id""")
+    keys = ('key_id', 'label', 'requests', 'rate_limited', 'errors', 'cooldown_until', 'last_used_at', 'last_error')
+    rows = [dict(zip(keys, row)) for row in cur.fetchall()]
+    conn.close()
+    configured = {key_id(k) for k in load_api_keys()}
+    now = time.time()
+    for row in rows:
+        row['configured'] = row['key_id'] in configured
+        row['cooldown_remaining'] = max(0.0, (row['cooldown_until'] or 0) - now)
+    return rows
+
+
+def print_key_stats():
+    rows = key_stats()
+    print(f"🔑 Ключи Gemini API: {sum(1 for r in rows if r['configured'])} настроено")
+    if not rows:
+        print("   Нет данных")
+        return
+    print(f"\n   {'Ключ':<14}{'':<8}{'Запросы':>9}{'429':>6}{'Ошибки':>8}  {'Состояние':<22}{'Последний запрос'}")
+    for row in rows:
+        state = f"пауза {row['cooldown_remaining']:.0f}s" if row['cooldown_remaining'] else 'доступен'
+        if not row['configured']:
+            state = 'не настроен'
+        last_used = (row['last_used_at'] or '-')[:19]
+        print(f"   {row['key_id']:<14}{row['label']:<8}{row['requests']:>9}{row['rate_limited']:>6}"
+              f"{row['errors']:>8}  {state:<22}{last_used}")
+        if row['last_error'] and row['cooldown_remaining']:
+            print(f"      {row['last_error'][:100]}")
+
+
+if __name__ == "__main__":
+    print_key_stats()
@@ -11,6 +11,9 @@ import os
 from datetime import datetime, timezone
 from pathlib import Path
 
+import plan_scheduler
+import near_duplicates
+
 # Маппинг категорий на существующие на портале
 CATEGORY_MAPPING = {
     'Culture': 'AI & Culture',
@@ -75,11 +78,18 @@ def load_csv_plan(csv_file_path):
     except sqlite3.OperationalError:
         # Колонка уже существует
         pass
+
+    # Колонки приоритета/окна публикации и индекс очереди
+    plan_scheduler.ensure_schema(conn)
     
+    # Индекс похожих тем (MinHash/LSH, near_duplicates.py)
+    topics = near_duplicates.open_index(conn)
+
     stats = {
         "total_rows": 0,
         "added": 0,
         "skipped_duplicates": 0,
+        "near_duplicates": 0,
         "errors": 0
     }
     
@@ -118,6 +128,14 @@ def load_csv_plan(csv_file_path):
                 print(f"⏭️  Строка {row_num}: пропущена (дубликат) - '{title[:50]}...'")
                 stats["skipped_duplicates"] += 1
                 continue
+
+            # Проверяем на похожие темы
+            match = topics.find(title) if topics is not None else None
+            if match:
+                stats["near_duplicates"] += 1
+                print(f"🔁 Строка {row_num}: похоже ({match['similarity']:.0%}) на '{match['seed'][:50]}...'")
+                if near_duplicates.MODE == near_duplicates.MODE_REJECT:
+                    continue
             
             # Добавляем в базу
             current_time = datetime.now(timezone.utc).isoformat()
@@ -125,6 +143,8 @@ def load_csv_plan(csv_file_path):
                 INSERT INTO plans (seed, seo_focus, created_at, status, category)
                 VALUES (?, ?, ?, ?, ?)
             ''', (title, '', current_time, 'pending', category))
+            if topics is not None:
+                topics.add(cur.lastrowid, title)
             
             # Показываем маппинг категории
             mapping_info = f"{original_category} → {category}" if original_category != category else category
@@ -231,6 +251,8 @@ def main():
     print(f"   Всего строк обработано: {stats['total_rows']}")
     print(f"   ✅ Добавлено новых статей: {stats['added']}")
     print(f"   ⏭️  Пропущено дубликатов: {stats['skipped_duplicates']}")
+    print(f"   🔁 Похожих тем: {stats['near_duplicates']}"
+          f"{' (пропущены)' if near_duplicates.MODE == near_duplicates.MODE_REJECT else ''}")
     print(f"   ❌ Ошибок: {stats['errors']}")
     
     # Показываем обновленный статус
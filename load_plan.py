@@ -8,6 +8,9 @@ import re
 from datetime import datetime
 import os
 
+import plan_scheduler
+import near_duplicates
+
 DB_FILE = 'storage.db'
 
 def init_db():
@@ -31,6 +34,7 @@ def init_db():
         seo_keywords TEXT
     )""")
     conn.commit()
+    plan_scheduler.ensure_schema(conn)
     conn.close()
 
 def parse_plan_file(filename='plan.txt'):
@@ -58,7 +62,7 @@ def parse_plan_file(filename='plan.txt'):
     
     return articles
 
-def add_article_to_db(title, seo_focus):
+def add_article_to_db(title, seo_focus, topics=None):
     """Добавление статьи в базу данных, если она еще не существует"""
     conn = sqlite3.connect(DB_FILE)
     cur = conn.cursor()
@@ -71,12 +75,23 @@ def add_article_to_db(title, seo_focus):
         print(f"⚠️  Статья уже существует в базе: {title[:50]}...")
         conn.close()
         return False
-    
+
+    # Проверяем на похожие темы (near_duplicates.py)
+    match = topics.find(title) if topics is not None else None
+    if match:
+        print(f"🔁 Похоже ({match['similarity']:.0%}) на план [{match['plan_id']}]: {match['seed'][:50]}...")
+        if near_duplicates.MODE == near_duplicates.MODE_REJECT:
+            conn.close()
+            return False
+
     # Добавляем новую статью
     cur.execute('INSERT INTO plans (seed, seo_focus, created_at, status) VALUES (?, ?, ?, ?)',
                 (title, seo_focus, datetime.utcnow().isoformat(), 'pending'))
     conn.commit()
+    plan_id = cur.lastrowid
     conn.close()
+    if topics is not None:
+        topics.add(plan_id, title, commit=True)
     
     print(f"✅ Добавлена статья: {title[:50]}...")
     return True
@@ -99,9 +114,12 @@ def load_plan_to_db():
     
     # Добавляем статьи в базу данных
     added_count = 0
+    topics = near_duplicates.open_index()
     for article in articles:
-        if add_article_to_db(article['title'], article['seo_focus']):
+        if add_article_to_db(article['title'], article['seo_focus'], topics):
             added_count += 1
+    if topics is not None:
+        topics.conn.close()
     
     print(f"✅ Загружено {added_count} новых статей в базу данных")
     
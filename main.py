@@ -2,17 +2,34 @@
 
 FastAPI app that schedules periodic article generation & publishing.
 Endpoints:
-- POST /plan {seed, seo_focus}
-- POST /publish-now
-- GET /status
+- POST /plan {seed, seo_focus}  (409 for a near-duplicate topic, see near_duplicates.py)
+- POST /publish-now        -> 202 {job_id}
+- POST /generate {topic}   -> 202 {job_id}
+- POST /generate/stream {topic, stream_html} -> text/event-stream
+- GET /jobs, GET /jobs/{job_id}, GET /jobs/{job_id}/events (SSE)
+- GET /status               (trigger-maintained counters)
+- GET /plans?status=&category=&after=&limit=  (keyset pagination, ETag)
+- POST /plans/bulk           (streamed NDJSON or CSV body)
+- GET /plans/duplicates      (groups of near-duplicate plans)
+- GET /export/{posts|plans}?format=ndjson|csv|parquet  (streamed)
+- GET /metrics               (Prometheus text format)
+
+Generation and publishing run in a bounded worker pool (job_queue.py); when
+its queue is full the API answers 429 with Retry-After.
 """
 import os
 import sqlite3
 import json
+import time
+import asyncio
+import codecs
+import hashlib
 from datetime import datetime
+from typing import Optional
 from dotenv import load_dotenv
-from fastapi import FastAPI, BackgroundTasks
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, Header, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
 from apscheduler.schedulers.background import BackgroundScheduler
 from gemini_client import generate_article_with_image
@@ -21,6 +38,19 @@ from wordpress_client import create_wp_post
 load_dotenv()
 from gemini_client import GeminiClient
 from wordpress_client import upload_image_to_wp, create_wp_post, get_or_create_tag
+import plan_scheduler
+import usage_ledger
+import job_queue
+import plan_ingest
+import near_duplicates
+import corpus_index
+import internal_links
+import prefetch_worker
+import data_export
+import metrics
+import run_ledger
+import profiling
+from deadline import Deadline, PUBLISH_DEADLINE_SECONDS, stage_deadline
 
 # PUBLISH_INTERVAL_DAYS = int(os.getenv('PUBLISH_INTERVAL_DAYS', '3'))
 DB_FILE = 'storage.db'
@@ -45,57 +75,160 @@ def init_db():
         seo_keywords TEXT
     )""")
     conn.commit()
+    plan_scheduler.ensure_schema(conn)
+    job_queue.ensure_schema(conn)
+    corpus_index.ensure_schema(conn)
+    internal_links.ensure_schema(conn)
+    # Планы, захваченные прогонами упавшего процесса, возвращаются в очередь;
+    # более свежие захваты могут принадлежать соседнему воркеру uvicorn
+    plan_scheduler.release_stale_claims(conn, PUBLISH_DEADLINE_SECONDS)
     conn.close()
 
 init_db()
 gemini = GeminiClient()
 app = FastAPI(title='AutoPoster')
+JOBS = job_queue.JobQueue()
+metrics.gauge('autoposter_jobs', 'API jobs waiting and running', ('state',),
+              callback=lambda: {(state,): JOBS.stats()[state] for state in ('queued', 'running')})
 
 class PlanIn(BaseModel):
     seed: str
     seo_focus: str = ''
+    category: Optional[str] = None
+    priority: int = 0
+    publish_after: Optional[str] = None  # ISO time, naive values are UTC
 
 @app.post('/plan')
 def add_plan(plan: PlanIn):
     conn = sqlite3.connect(DB_FILE)
+    topics = near_duplicates.open_index(conn)
+    match = topics.find(plan.seed) if topics is not None else None
+    if match and near_duplicates.MODE == near_duplicates.MODE_REJECT:
+        conn.close()
+        return JSONResponse(status_code=409, content={'error': 'near-duplicate topic', 'similar_to': match})
     cur = conn.cursor()
-    cur.execute('INSERT INTO plans (seed, seo_focus, created_at, status) VALUES (?, ?, ?, ?)',
-                (plan.seed, plan.seo_focus, datetime.utcnow().isoformat(), 'pending'))
+    cur.execute('INSERT INTO plans (seed, seo_focus, created_at, status, category, priority, publish_after) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (plan.seed, plan.seo_focus, datetime.utcnow().isoformat(), 'pending',
+                 plan.category, plan.priority, plan_scheduler.normalize_timestamp(plan.publish_after)))
+    if topics is not None:
+        topics.add(cur.lastrowid, plan.seed)
     conn.commit()
     conn.close()
+    if match:
+        return {'status': 'ok', 'near_duplicate': match}
     return {'status':'ok'}
 
 def get_next_plan():
     conn = sqlite3.connect(DB_FILE)
-    cur = conn.cursor()
-    cur.execute("SELECT id, seed, seo_focus, created_at, last_published_at FROM plans WHERE status='pending' ORDER BY created_at LIMIT 1")
-    row = cur.fetchone()
+    row = plan_scheduler.select_next_plan(conn)
     conn.close()
     return row
 
-def mark_plan_published(plan_id):
+def _screen_plan(plan):
+    # Тема уже раскрыта опубликованной статьей (CORPUS_SIMILARITY_MODE=skip) - берем следующий план
+    admitted = corpus_index.screen_plan(plan[0], plan[1])[0]
+    if not admitted:
+        print('Plan set aside as similar to a published post:', plan[0])
+    return admitted
+
+def claim_next_plan():
+    """Next plan to publish, already claimed ('publishing') so a concurrent run can't take it too"""
+    return prefetch_worker.claim_next_plan(screen=_screen_plan)
+
+def release_plan(plan_id):
+    conn = sqlite3.connect(DB_FILE, timeout=30)
+    plan_scheduler.release_plan(conn, plan_id)
+    conn.close()
+
+def mark_plan_published(plan_id, category=None):
+    published_at = datetime.utcnow().isoformat()
     conn = sqlite3.connect(DB_FILE)
     cur = conn.cursor()
-    cur.execute('UPDATE plans SET last_published_at=?, status=? WHERE id=?', (datetime.utcnow().isoformat(), 'published', plan_id))
+    cur.execute('UPDATE plans SET last_published_at=?, status=? WHERE id=?', (published_at, 'published', plan_id))
     conn.commit()
+    plan_scheduler.record_category_publish(conn, category, published_at)
     conn.close()
 
-def save_post_record(title, slug, wp_id, keywords):
+def save_post_record(title, slug, wp_id, keywords, plan_id=None, category=None, content_html=None, link=None):
+    published_at = datetime.utcnow().isoformat()
     conn = sqlite3.connect(DB_FILE)
     cur = conn.cursor()
-    cur.execute('INSERT INTO posts (title, slug, wp_id, published_at, seo_keywords) VALUES (?, ?, ?, ?, ?)',
-                (title, slug, wp_id, datetime.utcnow().isoformat(), json.dumps(keywords)))
+    cur.execute('INSERT INTO posts (title, slug, wp_id, published_at, seo_keywords, plan_id, category, link) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (title, slug, wp_id, published_at, json.dumps(keywords), plan_id, category, link))
+    corpus_index.record_post(conn, cur.lastrowid, title, keywords, content_html)
+    internal_links.record_post(conn, wp_id, link, title, keywords, published_at)
     conn.commit()
     conn.close()
 
-def publish_next():
-    plan = get_next_plan()
+def _stage(job, name):
+    if job is not None:
+        job.stage(name)
+
+def _quota_refusal(**result):
+    """Failed-job result if the Gemini quotas can't take another article (usage_ledger.check_admission), else None"""
+    admitted, reason, retry_after = usage_ledger.check_admission()
+    if admitted:
+        return None
+    print(f'Gemini quota exceeded ({reason}), retry in ~{retry_after:.0f}s')
+    return {**result, 'published': False, 'reason': f'quota: {reason}', 'retry_after': round(retry_after)}
+
+@run_ledger.recorded('api-publish')
+def publish_next(job=None):
+    plan = claim_next_plan()
     if not plan:
         print('No pending plans.')
-        return
-    plan_id, seed, seo_focus, created_at, last_pub = plan
+        return {'published': False, 'reason': 'no pending plans'}
+    plan_id = plan[0]
+    run_ledger.annotate(plan_id=plan_id)
+    try:
+        result = _publish_plan(plan, job)
+    except BaseException:
+        release_plan(plan_id)
+        raise
+    if not result['published']:
+        release_plan(plan_id)
+        run_ledger.annotate(outcome=metrics.OUTCOME_ERROR, error=result['reason'])
+    return result
+
+def _publish_plan(plan, job=None):
+    """Publish a claimed plan; if the run fails the caller returns it to the queue.
+
+    The plan is marked published as soon as its WordPress post exists, so a
+    later failure can't send it back to the queue and publish it twice.
+    """
+    plan_id, seed, seo_focus, created_at, last_pub, category = plan
+    deadline = Deadline(PUBLISH_DEADLINE_SECONDS, label='publish')
+    prefetched = prefetch_worker.get_prefetched(plan_id)
+    if prefetched:
+        # Статья уже сгенерирована и загружена (черновик или future-пост) - достаточно сменить статус
+        print('Publishing prefetched plan:', plan_id, '-> WP', prefetched['wp_id'])
+        prefetch_worker.record_hit()
+        _stage(job, 'wordpress')
+        wp_post = prefetch_worker.go_live(prefetched, deadline=stage_deadline(deadline, 'wordpress'))
+        title, slug, keywords = prefetched['title'], prefetched['slug'], prefetched['keywords']
+        # Записи буфера без content_html (до миграции): индекс строится по заголовку и ключевым словам
+        content_html = prefetched['content_html']
+        wp_id = wp_post.get('id')
+        mark_plan_published(plan_id, category)
+        prefetch_worker.mark_consumed(plan_id)
+        save_post_record(title, slug, wp_id, keywords, plan_id, category, content_html, wp_post.get('link'))
+        print('Published', title, '->', wp_id)
+        return {'published': True, 'plan_id': plan_id, 'post_id': wp_id, 'title': title,
+                'link': wp_post.get('link'), 'prefetched': True}
+
+    # Контроль квот: не начинаем генерацию, если прогноз превысит лимиты
+    refusal = _quota_refusal(plan_id=plan_id)
+    if refusal:
+        return refusal
+    if prefetch_worker.PREFETCH_ENABLED:
+        prefetch_worker.record_miss()
     print('Publishing plan:', plan_id, seed)
-    result = gemini.generate_article(brief_plan=seed, seo_focus=seo_focus, word_count=900)
+    _stage(job, 'article')
+    result = gemini.generate_article(brief_plan=seed, seo_focus=seo_focus, word_count=900,
+                                     deadline=stage_deadline(deadline, 'article'))
+    if not result:
+        print('Article generation failed for plan:', plan_id)
+        return {'published': False, 'plan_id': plan_id, 'reason': 'article generation failed'}
     title = result.get('title') or 'Auto article'
     slug = result.get('slug')
     meta = result.get('meta_description')
@@ -103,20 +236,25 @@ def publish_next():
     content_html = result.get('content_html') or result.get('content') or ''
     image_prompt = result.get('image_prompt') or f'Illustration for: {seed}'
     # Generate image
+    _stage(job, 'image')
     try:
-        image_bytes, mime = gemini.generate_image(image_prompt)
+        image_bytes, mime = gemini.generate_image(image_prompt, deadline=stage_deadline(deadline, 'image'))
     except Exception as e:
         print('Image gen failed:', e)
         image_bytes, mime = None, None
     featured_media_id = None
     if image_bytes:
-        upload = upload_image_to_wp(image_bytes, filename=f"{(slug or 'img')}_{int(datetime.utcnow().timestamp())}.png", mime_type=mime)
+        _stage(job, 'upload')
+        upload = upload_image_to_wp(image_bytes, filename=f"{(slug or 'img')}_{int(datetime.utcnow().timestamp())}.png", mime_type=mime, deadline=stage_deadline(deadline, 'upload'))
         featured_media_id = upload.get('id')
-    wp_post = create_wp_post(title=title, content_html=content_html, slug=slug, status='publish', featured_media_id=featured_media_id, meta_description=meta)
+    content_html, _links = internal_links.add_links(content_html)
+    _stage(job, 'wordpress')
+    wp_post = create_wp_post(title=title, content_html=content_html, slug=slug, status='publish', featured_media_id=featured_media_id, meta_description=meta, deadline=stage_deadline(deadline, 'wordpress'))
     wp_id = wp_post.get('id')
-    save_post_record(title, slug, wp_id, keywords)
-    mark_plan_published(plan_id)
+    mark_plan_published(plan_id, category)
+    save_post_record(title, slug, wp_id, keywords, plan_id, category, content_html, wp_post.get('link'))
     print('Published', title, '->', wp_id)
+    return {'published': True, 'plan_id': plan_id, 'post_id': wp_id, 'title': title, 'link': wp_post.get('link')}
 
 # scheduler = BackgroundScheduler()
 # scheduler.add_job(publish_next, 'interval', days=PUBLISH_INTERVAL_DAYS, next_run_time=datetime.utcnow())
@@ -125,92 +263,293 @@ def publish_next():
 # ВНИМАНИЕ: Планировщик отключен для избежания конфликтов с thenextai_publisher.py
 # Используйте только thenextai_publisher.py для автоматической публикации
 
+def _etag(*parts):
+    return 'W/"' + hashlib.sha1(json.dumps(parts, default=str).encode()).hexdigest()[:16] + '"'
+
+def _not_modified(etag, if_none_match):
+    return if_none_match is not None and etag in [tag.strip() for tag in if_none_match.split(',')]
+
 @app.get('/status')
-def status():
+def status(response: Response, if_none_match: Optional[str] = Header(None)):
     conn = sqlite3.connect(DB_FILE)
-    cur = conn.cursor()
-    cur.execute('SELECT COUNT(*) FROM posts')
-    posts = cur.fetchone()[0]
-    cur.execute('SELECT id, seed, status FROM plans')
-    plans = cur.fetchall()
+    counts = plan_scheduler.status_counts(conn)
+    conn.close()
+    etag = _etag('status', counts)
+    if _not_modified(etag, if_none_match):
+        return Response(status_code=304, headers={'ETag': etag})
+    response.headers['ETag'] = etag
+    return {
+        'published_posts': counts['posts'],
+        'plans': {'total': counts['plans'], 'by_status': counts['by_status']},
+        'categories': counts['by_category'],
+    }
+
+@app.post('/plans/bulk')
+async def bulk_plans(request: Request, format: Optional[str] = None):
+    """Stream NDJSON (application/x-ndjson) or CSV (text/csv) plans into the queue"""
+    content_type = request.headers.get('content-type', '')
+    fmt = format or ('csv' if 'csv' in content_type else 'ndjson' if 'json' in content_type else None)
+    if fmt not in (None, 'ndjson', 'csv'):
+        raise HTTPException(status_code=400, detail='format must be ndjson or csv')
+
+    conn = await run_in_threadpool(plan_ingest._connect)
+    try:
+        # Открытие индекса похожих тем может доиндексировать планы - не в цикле событий
+        ingester = await run_in_threadpool(plan_ingest.PlanIngester, conn, fmt)
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        tail = ''
+        # Тело читается по частям: строки разбираются сразу, вставка - порциями в потоке
+        async for chunk in request.stream():
+            lines = (tail + decoder.decode(chunk)).split('\n')
+            tail = lines.pop()
+            for line in lines:
+                ingester.feed_line(line + '\n')
+            if ingester.ready:
+                await run_in_threadpool(ingester.flush)
+        tail += decoder.decode(b'', final=True)
+        if tail:
+            ingester.feed_line(tail)
+        stats = await run_in_threadpool(ingester.finish)
+    finally:
+        conn.close()
+    return stats
+
+@app.get('/export/{table}')
+def export(table: str, format: str = 'ndjson', since: Optional[str] = None, status: Optional[str] = None,
+           category: Optional[str] = None):
+    """Stream posts or plans; rows are read and encoded in batches, never all at once"""
+    try:
+        chunks = data_export.export_chunks(table, format, since=since, status=status, category=category)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(chunks, media_type=data_export.FORMATS[format], headers={
+        'Content-Disposition': f'attachment; filename="{data_export.export_filename(table, format)}"'
+    })
+
+@app.get('/metrics')
+def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
+
+@app.get('/plans')
+def list_plans(response: Response, status: Optional[str] = None, category: Optional[str] = None,
+               after: int = 0, limit: int = 50, if_none_match: Optional[str] = Header(None)):
+    """Plans ordered by id; pass `next_after` of a page as `after` to get the next one"""
+    limit = max(1, min(limit, 500))
+    conn = sqlite3.connect(DB_FILE)
+    # Ревизия меняется при любом изменении plans - проверка без чтения самих строк
+    etag = _etag('plans', plan_scheduler.plans_revision(conn), status, category, after, limit)
+    if _not_modified(etag, if_none_match):
+        conn.close()
+        return Response(status_code=304, headers={'ETag': etag})
+    rows, next_after = plan_scheduler.list_plans(conn, status=status, category=category, after_id=after, limit=limit)
+    conn.close()
+    response.headers['ETag'] = etag
+    return {'plans': rows, 'next_after': next_after}
+
+@app.get('/plans/duplicates')
+def plan_duplicates(limit: int = 50):
+    """Groups of near-duplicate plans (MinHash/LSH), largest first"""
+    conn = sqlite3.connect(DB_FILE)
+    groups = near_duplicates.TopicIndex(conn).clusters()
     conn.close()
-    return {'published_posts': posts, 'plans': plans}
+    return {'groups': groups[:max(1, limit)], 'total_groups': len(groups),
+            'redundant_plans': sum(len(group) - 1 for group in groups)}
+
+def _submit(kind, func, *args, params=None):
+    """Submit a job; (job, None) or (None, 429 response) when the queue is full"""
+    try:
+        return JOBS.submit(kind, func, *args, params=params), None
+    except job_queue.QueueFull as e:
+        retry_after = JOBS.retry_after()
+        return None, JSONResponse(status_code=429, headers={'Retry-After': str(retry_after)},
+                                  content={'error': str(e), 'retry_after': retry_after})
+
+def _enqueue(kind, func, *args, params=None):
+    """Submit a job; 202 with its id, or 429 when the queue is full"""
+    job, rejected = _submit(kind, func, *args, params=params)
+    if rejected:
+        return rejected
+    return JSONResponse(status_code=202, content={
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': f'/jobs/{job.id}'
+    })
+
+def _profiled(func, profile, x_profile):
+    """`func` wrapped in the profiler when ?profile= or X-Profile asks for it"""
+    mode = profile or x_profile
+    if not mode:
+        return func
+    mode = profiling.MODE_SAMPLING if mode.lower() in ('1', 'true', 'yes') else mode.lower()
+    if mode not in profiling.MODES:
+        raise HTTPException(status_code=400, detail=f"profile must be one of {', '.join(profiling.MODES)}")
+    return profiling.profiled(func, mode)
 
 @app.post('/publish-now')
-def publish_now(background: BackgroundTasks):
-    background.add_task(publish_next)
-    return {'status':'publishing started'}
+def publish_now(profile: Optional[str] = None, x_profile: Optional[str] = Header(None)):
+    return _enqueue('publish', _profiled(publish_next, profile, x_profile))
 
 class GenerateRequest(BaseModel):
     topic: str
     seo_focus: str = ""
     status: str = "publish"  # 'publish' or 'draft'
 
+class GenerateStreamRequest(GenerateRequest):
+    stream_html: bool = False  # also stream content_html while it is generated
+
+@run_ledger.recorded('api-generate')
+def run_generate(job, topic, seo_focus, post_status, stream_html=False):
+    """Generate, illustrate and publish one article (runs in a job worker)"""
+    print(f"[Main] Generating article on topic: {topic}")
+
+    deadline = Deadline(PUBLISH_DEADLINE_SECONDS, label='generate')
+
+    def on_progress(event, data):
+        # HTML статьи передаем только по запросу клиента
+        if not stream_html:
+            if event == 'html':
+                return
+            if event == 'section':
+                data = {key: value for key, value in data.items() if key != 'html'}
+        job.emit(event, data)
+
+    # Контроль квот: не начинаем генерацию, если прогноз превысит лимиты
+    refusal = _quota_refusal(topic=topic)
+    if refusal:
+        run_ledger.annotate(outcome=metrics.OUTCOME_ERROR, error=refusal['reason'])
+        return refusal
+
+    # 1️⃣ Генерируем статью и изображение
+    job.stage('article')
+    article = generate_article_with_image(topic=topic, deadline=deadline, on_progress=on_progress)
+    if not article:
+        raise RuntimeError('article generation failed')
+
+    # 2️⃣ Загружаем изображение на WordPress
+    featured_media_id = None
+    if article.get("image_url"):
+        job.stage('upload')
+        # Читаем локальное изображение
+        with open(article["image_url"], "rb") as f:
+            image_bytes = f.read()
+
+        # Загружаем на WordPress
+        filename = os.path.basename(article["image_url"])
+        upload_result = upload_image_to_wp(image_bytes, filename, mime_type='image/png',
+                                           deadline=stage_deadline(deadline, 'upload'))
+        featured_media_id = upload_result.get('id')
+        job.emit('media', {'id': featured_media_id, 'url': upload_result.get('source_url')})
+        print(f"[Main] Image uploaded: {featured_media_id}")
+
+    # 3️⃣ Создаем или находим теги
+    tag_ids = []
+    if article.get("keywords"):
+        job.stage('tags')
+        print(f"[Main] Processing {len(article['keywords'])} keywords as tags...")
+        terms_deadline = stage_deadline(deadline, 'terms')
+        for keyword in article["keywords"]:
+            tag_id = get_or_create_tag(keyword, deadline=terms_deadline)
+            if tag_id:
+                tag_ids.append(tag_id)
+        job.emit('tags', {'ids': tag_ids})
+        print(f"[Main] Tag IDs: {tag_ids}")
+
+    # 4️⃣ Публикуем статью на сайт
+    job.stage('wordpress')
+    result = create_wp_post(
+        title=article["title"],
+        content_html=article["content"],
+        featured_media_id=featured_media_id,
+        tags=tag_ids if tag_ids else None,
+        status=post_status,
+        deadline=stage_deadline(deadline, 'wordpress')
+    )
+    job.emit('post', {'id': result.get('id'), 'link': result.get('link'), 'status': post_status})
+
+    return {
+        "message": "Article published successfully!",
+        "post_id": result.get('id'),
+        "title": article["title"],
+        "link": result.get('link'),
+        "featured_image": featured_media_id,
+        "tags": tag_ids,
+        "status": post_status
+    }
+
 @app.post("/generate")
-async def generate(request: GenerateRequest = None):
-    try:
-        # Default topic if none provided
-        if request is None:
-            topic = "AI Technology Insights"
-            seo_focus = ""
-        else:
-            topic = request.topic
-            seo_focus = request.seo_focus if request.seo_focus else request.topic
-
-        print(f"[Main] Generating article on topic: {topic}")
-
-        # 1️⃣ Генерируем статью и изображение
-        article = generate_article_with_image(topic=topic)
-
-        # 2️⃣ Загружаем изображение на WordPress
-        featured_media_id = None
-        if article.get("image_url"):
-            # Читаем локальное изображение
-            with open(article["image_url"], "rb") as f:
-                image_bytes = f.read()
-
-            # Загружаем на WordPress
-            import os
-            filename = os.path.basename(article["image_url"])
-            upload_result = upload_image_to_wp(image_bytes, filename, mime_type='image/png')
-            featured_media_id = upload_result.get('id')
-            print(f"[Main] Image uploaded: {featured_media_id}")
-
-        # 3️⃣ Создаем или находим теги
-        tag_ids = []
-        if article.get("keywords"):
-            print(f"[Main] Processing {len(article['keywords'])} keywords as tags...")
-            for keyword in article["keywords"]:
-                tag_id = get_or_create_tag(keyword)
-                if tag_id:
-                    tag_ids.append(tag_id)
-            print(f"[Main] Tag IDs: {tag_ids}")
-
-        # 4️⃣ Публикуем статью на сайт
-        post_status = request.status if request else "publish"
-        result = create_wp_post(
-            title=article["title"],
-            content_html=article["content"],
-            featured_media_id=featured_media_id,
-            tags=tag_ids if tag_ids else None,
-            status=post_status
-        )
-
-        return JSONResponse(content={
-            "message": "Article published successfully!",
-            "post_id": result.get('id'),
-            "title": article["title"],
-            "link": result.get('link'),
-            "featured_image": featured_media_id,
-            "tags": tag_ids,
-            "status": post_status
-        })
+def generate(request: GenerateRequest = None, profile: Optional[str] = None, x_profile: Optional[str] = Header(None)):
+    # Default topic if none provided
+    if request is None:
+        topic, seo_focus, post_status = "AI Technology Insights", "", "publish"
+    else:
+        topic = request.topic
+        seo_focus = request.seo_focus if request.seo_focus else request.topic
+        post_status = request.status
+    return _enqueue('generate', _profiled(run_generate, profile, x_profile), topic, seo_focus, post_status,
+                    params={'topic': topic, 'seo_focus': seo_focus, 'status': post_status})
 
-    except Exception as e:
-        import traceback
-        print(f"[Main] Error: {e}")
-        print(traceback.format_exc())
-        return JSONResponse(
-            status_code=500,
-            content={"error": str(e), "traceback": traceback.format_exc()}
-        )
\ No newline at end of file
+@app.post("/generate/stream")
+def generate_stream(request: GenerateStreamRequest):
+    seo_focus = request.seo_focus if request.seo_focus else request.topic
+    job, rejected = _submit('generate', run_generate, request.topic, seo_focus, request.status, request.stream_html,
+                            params={'topic': request.topic, 'seo_focus': seo_focus, 'status': request.status})
+    if rejected:
+        return rejected
+    return _event_stream(job)
+
+SSE_KEEPALIVE_SECONDS = 15
+SSE_POLL_SECONDS = 0.2
+
+def _sse(event, data, event_id=None):
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+def _event_stream(job, start=0):
+    """Server-sent events of a live job, from event `start` until it finishes"""
+    async def events():
+        if start == 0:
+            yield _sse('job', {'job_id': job.id, 'status_url': f'/jobs/{job.id}'})
+        index = start
+        last_sent = time.monotonic()
+        while True:
+            batch = job.events_since(index)
+            for event in batch:
+                yield _sse(event['event'], dict(event['data'], elapsed=event['elapsed']), event['id'])
+                if event['event'] in ('done', 'error'):
+                    return
+            index += len(batch)
+            if batch:
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent > SSE_KEEPALIVE_SECONDS:
+                yield ": keep-alive\n\n"
+                last_sent = time.monotonic()
+            await asyncio.sleep(SSE_POLL_SECONDS)
+
+    return StreamingResponse(events(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.get('/jobs')
+def list_jobs(status: Optional[str] = None, kind: Optional[str] = None, limit: int = 50):
+    return {'queue': JOBS.stats(), 'jobs': JOBS.list(status=status, kind=kind, limit=min(limit, 500))}
+
+@app.get('/jobs/{job_id}')
+def get_job(job_id: str):
+    job = JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail='job not found')
+    return job
+
+@app.get('/jobs/{job_id}/events')
+def job_events(job_id: str, last_event_id: Optional[str] = Header(None)):
+    """Follow a job as server-sent events (resumes after Last-Event-ID)"""
+    job = JOBS.live(job_id)
+    if job is None:
+        stored = JOBS.get(job_id)
+        if stored is None:
+            raise HTTPException(status_code=404, detail='job not found')
+        # Событий в памяти уже нет - отдаем только итог
+        event = 'done' if stored['status'] == job_queue.STATUS_SUCCEEDED else 'error'
+        data = {'result': stored['result']} if event == 'done' else {'error': stored['error'] or stored['status']}
+        return StreamingResponse(iter([_sse(event, data)]), media_type='text/event-stream')
+    start = int(last_event_id) + 1 if last_event_id and last_event_id.isdigit() else 0
+    return _event_stream(job, start)
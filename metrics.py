@@ -0,0 +1,308 @@
+"""metrics.py
+
+In-process metrics registry with Prometheus text exposition.
+
+Pipeline stages are instrumented with `@instrument(stage, backend)` (or the
+`timer()` context manager for inline blocks). Each stage gets:
+
+    autoposter_stage_duration_seconds{stage, backend}   histogram
+    autoposter_stage_total{stage, backend, outcome}     counter (ok / error / timeout)
+
+Every Gemini call recorded in the usage ledger also feeds
+`autoposter_gemini_request_seconds{stage, model}`,
+`autoposter_gemini_requests_total{stage, model, outcome}` and
+`autoposter_gemini_retries_total{stage, model}`. Queue depths (plans per
+status, prefetch buffer, API job queue) are gauges read when scraped.
+
+The innermost running timer is kept in a context variable, so code inside
+a stage can add transferred bytes (`add_bytes`) and Gemini retries are
+attributed to it; stage listeners (run_ledger.py) receive every finished
+timer.
+
+main.py serves `render()` at GET /metrics. The daemon starts a small HTTP
+listener with the same output when METRICS_PORT is set.
+
+Settings (.env):
+    METRICS_PORT=9108     # daemon listener, 0 = off
+"""
+import os
+import time
+import functools
+import contextvars
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dotenv import load_dotenv
+load_dotenv()
+
+from deadline import DeadlineExceeded
+
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+
+# Границы гистограмм в секундах: от быстрых вызовов WordPress до генерации статьи
+DEFAULT_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+
+OUTCOME_OK = 'ok'
+OUTCOME_ERROR = 'error'
+OUTCOME_TIMEOUT = 'timeout'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_str(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_label_str(self.label_names, key)} {_number(value)}"
+                                for key, value in items]
+
+
+class Gauge(_Metric):
+    """Gauge read from `callback()` at scrape time: a number or {label tuple: value}"""
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, labels=(), callback=None):
+        super().__init__(name, help_text, labels)
+        self.callback = callback
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        if self.callback is not None:
+            try:
+                result = self.callback()
+                values.update(result if isinstance(result, dict) else {(): result})
+            except Exception as e:
+                print(f"[metrics] Gauge {self.name} failed: {e}")
+        return self.header() + [f"{self.name}{_label_str(self.label_names, key)} {_number(value)}"
+                                for key, value in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def render(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        lines = self.header()
+        for key, (counts, total) in items:
+            for bound, count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_label_str(self.label_names, key, [('le', _number(bound))])} {count}")
+            lines.append(f"{self.name}_sum{_label_str(self.label_names, key)} {total:.6f}")
+            lines.append(f"{self.name}_count{_label_str(self.label_names, key)} {counts[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """Add a metric; registering the same name again returns the existing one"""
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help_text, labels=()):
+    return REGISTRY.register(Counter(name, help_text, labels))
+
+
+def histogram(name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, help_text, labels, buckets))
+
+
+def gauge(name, help_text, labels=(), callback=None):
+    return REGISTRY.register(Gauge(name, help_text, labels, callback))
+
+
+def render():
+    return REGISTRY.render()
+
+
+STAGE_DURATION = histogram('autoposter_stage_duration_seconds', 'Duration of pipeline stages',
+                           ('stage', 'backend'))
+STAGE_TOTAL = counter('autoposter_stage_total', 'Pipeline stage runs by outcome', ('stage', 'backend', 'outcome'))
+GEMINI_SECONDS = histogram('autoposter_gemini_request_seconds', 'Latency of Gemini API calls', ('stage', 'model'))
+GEMINI_REQUESTS = counter('autoposter_gemini_requests_total', 'Gemini API calls by outcome',
+                          ('stage', 'model', 'outcome'))
+GEMINI_RETRIES = counter('autoposter_gemini_retries_total', 'Retries after 429 responses', ('stage', 'model'))
+
+
+_current_timer = contextvars.ContextVar('metrics_timer', default=None)
+_stage_listeners = []
+
+
+def add_stage_listener(listener):
+    """Call `listener(timer)` for every finished stage timer"""
+    _stage_listeners.append(listener)
+
+
+class timer:
+    """Time a block as one run of `stage`; set `.outcome` to mark a handled failure"""
+
+    def __init__(self, stage, backend=''):
+        self.stage = stage
+        self.backend = backend
+        self.outcome = OUTCOME_OK
+        self.error = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.retries = 0
+
+    def __enter__(self):
+        self.started_at = time.time()
+        self.started = time.monotonic()
+        self._token = _current_timer.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_timer.reset(self._token)
+        self.duration = time.monotonic() - self.started
+        if exc_type is not None:
+            self.outcome = OUTCOME_TIMEOUT if issubclass(exc_type, DeadlineExceeded) else OUTCOME_ERROR
+            self.error = str(exc)
+        STAGE_DURATION.observe(self.duration, stage=self.stage, backend=self.backend)
+        STAGE_TOTAL.inc(stage=self.stage, backend=self.backend, outcome=self.outcome)
+        for listener in _stage_listeners:
+            try:
+                listener(self)
+            except Exception as e:
+                print(f"[metrics] Stage listener failed: {e}")
+        return False
+
+
+def current_timer():
+    """Innermost stage timer running in this context, or None"""
+    return _current_timer.get()
+
+
+def add_bytes(bytes_in=0, bytes_out=0):
+    """Count bytes received/sent by the current stage"""
+    current = _current_timer.get()
+    if current is not None:
+        current.bytes_in += bytes_in
+        current.bytes_out += bytes_out
+
+
+def instrument(stage, backend='', falsy_is_error=False):
+    """Decorator timing every call of a function as a run of `stage`.
+
+    With `falsy_is_error`, a None/False result (how most clients here report
+    a handled failure) counts as an error.
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(stage, backend) as t:
+                result = func(*args, **kwargs)
+                if falsy_is_error and not result:
+                    t.outcome = OUTCOME_ERROR
+                return result
+        return wrapper
+    return decorate
+
+
+def observe_gemini_call(stage, model, outcome, latency_ms=None, retries=0):
+    """Called for every Gemini call recorded in the usage ledger"""
+    model = model or ''
+    GEMINI_REQUESTS.inc(stage=stage, model=model, outcome=outcome)
+    if latency_ms is not None:
+        GEMINI_SECONDS.observe(latency_ms / 1000, stage=stage, model=model)
+    if retries:
+        GEMINI_RETRIES.inc(retries, stage=stage, model=model)
+        current = _current_timer.get()
+        if current is not None:
+            current.retries += retries
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        # Не засоряем auto_publisher.log запросами Prometheus
+        pass
+
+
+def start_http_server(port=None, host='0.0.0.0'):
+    """Serve /metrics from a daemon thread; returns the server or None when disabled"""
+    port = METRICS_PORT if port is None else port
+    if not port:
+        return None
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    print(f"[metrics] Listening on http://{host}:{port}/metrics")
+    return server
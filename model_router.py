@@ -0,0 +1,196 @@
+"""model_router.py
+
+Adaptive routing of Gemini calls across model tiers.
+
+Each stage has an ordered list of models (most preferred first, e.g.
+gemini-2.5-flash, then gemini-2.5-flash-lite). The router keeps rolling
+statistics per (stage, model) over the last ROUTER_WINDOW_MINUTES (latency
+p95, share of 429 responses, share of other errors) fed by every call made
+through GeminiClient, and sends each call to the first model of the list that
+is not degraded for that stage. Stages are kept apart because their latencies
+differ by an order of magnitude: a 40 s article is healthy, a 40 s social post
+is not.
+
+A model becomes degraded when, with at least ROUTER_MIN_SAMPLES calls in the
+window, its p95 latency exceeds the stage limit or its 429/error share crosses
+the degrade threshold. It returns only after ROUTER_HOLD_MINUTES and once its
+figures are back under the lower recovery thresholds (hysteresis), or once its
+old samples have aged out so a probe call can measure it again. If every
+model is degraded, the last one in the list is used.
+
+On start the window is seeded from the api_usage ledger (usage_ledger.py).
+
+Settings (.env):
+    GEMINI_ARTICLE_MODELS=gemini-2.5-flash,gemini-2.5-flash-lite
+    GEMINI_SOCIAL_MODELS=gemini-2.5-flash,gemini-2.5-flash-lite
+    GEMINI_IMAGEN_MODELS=imagen-4.0-fast-generate-001
+    ROUTER_WINDOW_MINUTES=15
+    ROUTER_HOLD_MINUTES=5
+    ROUTER_MIN_SAMPLES=4
+    ROUTER_P95_MS_ARTICLE=90000   # also _OUTLINE, _SECTION, _SOCIAL, _IMAGE
+
+Usage:
+    python model_router.py        # per-model statistics and current choice per stage
+"""
+import os
+import time
+import threading
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+load_dotenv()
+
+import usage_ledger
+
+WINDOW_SECONDS = float(os.getenv('ROUTER_WINDOW_MINUTES', '15')) * 60
+HOLD_SECONDS = float(os.getenv('ROUTER_HOLD_MINUTES', '5')) * 60
+MIN_SAMPLES = int(os.getenv('ROUTER_MIN_SAMPLES', '4'))
+
+# Пороги деградации и (более строгие) пороги восстановления
+RATE_LIMIT_DEGRADE = 0.3
+RATE_LIMIT_RECOVER = 0.1
+ERROR_DEGRADE = 0.5
+ERROR_RECOVER = 0.2
+LATENCY_RECOVER_FACTOR = 0.8
+
+DEFAULT_P95_LIMIT_MS = {
+    'article': 90000,
+    'outline': 30000,
+    'section': 60000,
+    'social': 30000,
+    'image': 60000,
+}
+
+
+def models_from_env(env_name, default):
+    """Ordered model list from a comma-separated env variable"""
+    models = [m.strip() for m in os.getenv(env_name, '').split(',') if m.strip()]
+    return models or list(default)
+
+
+def p95_limit_ms(stage):
+    return float(os.getenv(f'ROUTER_P95_MS_{stage.upper()}', DEFAULT_P95_LIMIT_MS.get(stage, 60000)))
+
+
+class ModelRouter:
+    """Rolling per-(stage, model) statistics and tier selection with hysteresis"""
+
+    def __init__(self, window_seconds=WINDOW_SECONDS, hold_seconds=HOLD_SECONDS,
+                 min_samples=MIN_SAMPLES, seed_from_ledger=True):
+        self.window_seconds = window_seconds
+        self.hold_seconds = hold_seconds
+        self.min_samples = min_samples
+        self._samples = {}    # (stage, model) -> deque of (ts, latency_ms, outcome)
+        self._degraded = {}   # (stage, model) -> time it was marked degraded
+        self._lock = threading.Lock()
+        self._seeded = not seed_from_ledger
+
+    def _seed(self):
+        """Load the current window from the usage ledger once"""
+        self._seeded = True
+        try:
+            since = datetime.now(timezone.utc) - timedelta(seconds=self.window_seconds)
+            conn = usage_ledger._connect()
+            cur = conn.execute("""SELECT ts, stage, model, latency_ms, outcome FROM api_usage
+                                  WHERE ts >= ? ORDER BY ts""", (since.isoformat(),))
+            for ts, stage, model, latency_ms, outcome in cur.fetchall():
+                self._samples.setdefault((stage, model), deque()).append(
+                    (datetime.fromisoformat(ts).timestamp(), latency_ms, outcome))
+            conn.close()
+        except Exception as e:
+            print(f"[model_router] Could not seed statistics from ledger: {e}")
+
+    def observe(self, stage, model, latency_ms, outcome):
+        """Record the result of one call made for `stage`"""
+        if not model:
+            return
+        with self._lock:
+            self._samples.setdefault((stage, model), deque()).append((time.time(), latency_ms, outcome))
+
+    def stats(self, stage, model, now=None):
+        """Calls, p95 latency (ok calls), 429 share and error share in the window"""
+        now = now or time.time()
+        samples = self._samples.get((stage, model), deque())
+        while samples and now - samples[0][0] > self.window_seconds:
+            samples.popleft()
+        calls = len(samples)
+        latencies = sorted(s[1] for s in samples if s[2] == usage_ledger.OUTCOME_OK and s[1] is not None)
+        rate_limited = sum(1 for s in samples if s[2] == usage_ledger.OUTCOME_RATE_LIMITED)
+        errors = sum(1 for s in samples if s[2] == usage_ledger.OUTCOME_ERROR)
+        return {
+            'calls': calls,
+            'p95_ms': usage_ledger.percentile(latencies, 95),
+            'rate_limited_share': rate_limited / calls if calls else 0.0,
+            'error_share': errors / calls if calls else 0.0,
+        }
+
+    def _update_state(self, stage, model, now):
+        stats = self.stats(stage, model, now)
+        limit = p95_limit_ms(stage)
+        p95 = stats['p95_ms'] or 0
+        key = (stage, model)
+        degraded_at = self._degraded.get(key)
+
+        if degraded_at is None:
+            if stats['calls'] >= self.min_samples and (
+                    p95 > limit or stats['rate_limited_share'] >= RATE_LIMIT_DEGRADE
+                    or stats['error_share'] >= ERROR_DEGRADE):
+                self._degraded[key] = now
+                print(f"[model_router] ⚠️ {model} degraded for {stage}: p95={p95 / 1000:.1f}s, "
+                      f"429={stats['rate_limited_share']:.0%}, errors={stats['error_share']:.0%}")
+                return False
+            return True
+
+        if now - degraded_at < self.hold_seconds:
+            return False
+        recovered = (p95 <= limit * LATENCY_RECOVER_FACTOR
+                     and stats['rate_limited_share'] <= RATE_LIMIT_RECOVER
+                     and stats['error_share'] <= ERROR_RECOVER)
+        if stats['calls'] < self.min_samples or recovered:
+            # Мало свежих данных - пробуем модель снова, новые вызовы решат дальше
+            del self._degraded[key]
+            print(f"[model_router] ✅ {model} back in rotation for {stage}")
+            return True
+        return False
+
+    def choose(self, stage, models):
+        """First healthy model of `models` for `stage` (the last one if none is healthy)"""
+        with self._lock:
+            if not self._seeded:
+                self._seed()
+            now = time.time()
+            for model in models:
+                if self._update_state(stage, model, now):
+                    return model
+            return models[-1]
+
+    def snapshot(self, stage, models):
+        now = time.time()
+        with self._lock:
+            if not self._seeded:
+                self._seed()
+            return [dict(self.stats(stage, model, now), model=model, degraded=(stage, model) in self._degraded)
+                    for model in models]
+
+
+# Общий маршрутизатор процесса
+MODEL_ROUTER = ModelRouter()
+
+
+def print_router_status():
+    from gemini_client import ARTICLE_MODELS, IMAGEN_MODELS
+    from social_content_generator import SOCIAL_MODELS
+
+    for stage, models in (('article', ARTICLE_MODELS), ('outline', ARTICLE_MODELS), ('section', ARTICLE_MODELS),
+                          ('social', SOCIAL_MODELS), ('image', IMAGEN_MODELS)):
+        chosen = MODEL_ROUTER.choose(stage, models)
+        print(f"🧭 {stage}: {' → '.join(models)} (сейчас: {chosen}, лимит p95 {p95_limit_ms(stage) / 1000:.0f}s)")
+        for row in MODEL_ROUTER.snapshot(stage, models):
+            p95 = f"{row['p95_ms'] / 1000:.1f}s" if row['p95_ms'] is not None else "-"
+            print(f"   {row['model']:<34}{'деградация' if row['degraded'] else 'ok':<12}"
+                  f"вызовов {row['calls']:>4}  p95 {p95:>7}  429 {row['rate_limited_share']:>4.0%}  "
+                  f"ошибки {row['error_share']:>4.0%}")
+
+
+if __name__ == "__main__":
+    print_router_status()
@@ -0,0 +1,322 @@
+"""near_duplicates.py
+
+Near-duplicate topic detection for plans (MinHash + LSH).
+
+A seed is normalized (lower case, punctuation and stop words dropped, plural
+"s" stripped, "&" = "and") into a set of words, so "AI in Education: Tools
+and Workflows" and "AI and Education: Tools for Workflows" become the same
+set. The set gets a MinHash signature of NEAR_DUPLICATE_PERMUTATIONS values,
+cut into LSH bands; every band is hashed into one bucket id. The buckets of
+all plans live in the `plan_lsh` table of storage.db (bucket, plan_id),
+written in the same transaction as the plan, so the index is persistent and
+grows incrementally. Plans added by other means are indexed the next time
+the index is opened.
+
+A lookup is one `IN (...)` query on the bucket primary key plus a fetch of
+the few candidate seeds, whose real word-set Jaccard similarity decides. The
+band layout is derived from the threshold so that a pair at the threshold
+becomes a candidate with >= 95% probability; changing the threshold or the
+permutation count rebuilds the index.
+
+Settings (.env):
+    NEAR_DUPLICATE_MODE=reject       # reject | flag (insert, but report) | off
+    NEAR_DUPLICATE_THRESHOLD=0.7     # Jaccard similarity of the word sets
+    NEAR_DUPLICATE_PERMUTATIONS=64
+
+Usage:
+    python near_duplicates.py --check "AI and Education: Tools for Teachers"
+    python near_duplicates.py --clusters [--limit 20]
+"""
+import os
+import re
+import zlib
+import random
+import hashlib
+import sqlite3
+from dotenv import load_dotenv
+load_dotenv()
+
+DB_FILE = 'storage.db'
+
+MODE_REJECT = 'reject'
+MODE_FLAG = 'flag'
+MODE_OFF = 'off'
+MODE = os.getenv('NEAR_DUPLICATE_MODE', MODE_REJECT).lower()
+THRESHOLD = float(os.getenv('NEAR_DUPLICATE_THRESHOLD', '0.7'))
+PERMUTATIONS = int(os.getenv('NEAR_DUPLICATE_PERMUTATIONS', '64'))
+# Вероятность, с которой пара на пороге становится кандидатом
+TARGET_RECALL = 0.95
+INDEX_VERSION = 1
+
+_MERSENNE = (1 << 61) - 1
+_WORD = re.compile(r'[a-z0-9а-яё]+')
+_STOPWORDS = {
+    'a', 'an', 'the', 'and', 'or', 'of', 'in', 'on', 'for', 'to', 'with', 'by', 'at', 'from', 'about', 'into',
+    'how', 'what', 'why', 'your', 'you', 'is', 'are', 'vs', 'its',
+    'и', 'в', 'во', 'на', 'для', 'с', 'со', 'по', 'о', 'об', 'к', 'от', 'из', 'как', 'или', 'что',
+}
+
+
+def words(text):
+    """Normalized words of a text in order: stop words dropped, plural "s" stripped"""
+    result = []
+    for word in _WORD.findall(str(text).lower().replace('&', ' and ')):
+        if word in _STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        result.append(word)
+    return result
+
+
+def normalize(seed):
+    """Word set of a seed used for similarity"""
+    return set(words(seed))
+
+
+def jaccard(a, b):
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def band_layout(threshold, permutations=PERMUTATIONS):
+    """(bands, rows): most rows per band that still finds a pair at `threshold` with TARGET_RECALL"""
+    best = (permutations, 1)
+    for rows in range(1, permutations + 1):
+        bands = permutations // rows
+        if 1 - (1 - threshold ** rows) ** bands >= TARGET_RECALL:
+            best = (bands, rows)
+    return best
+
+
+def _permutations(count):
+    # Универсальное хеширование (a*x + b) mod p. Коэффициенты - во всем диапазоне p: при малых a*x
+    # остаток не "заворачивается", и все перестановки выбирают одно и то же слово
+    rng = random.Random(INDEX_VERSION)
+    return [(rng.randrange(1, _MERSENNE), rng.randrange(0, _MERSENNE)) for _ in range(count)]
+
+
+_PERMS = _permutations(PERMUTATIONS)
+
+
+def signature(words, perms=_PERMS):
+    """MinHash signature of a word set"""
+    hashes = [int.from_bytes(hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest(), 'big')
+              for word in words] or [0]
+    return list(map(min, zip(*[[(a * h + b) % _MERSENNE for a, b in perms] for h in hashes])))
+
+
+def buckets(words, layout):
+    """Bucket id of every LSH band: band number in the high bits, CRC32 of the band's values in the low"""
+    bands, rows = layout
+    values = signature(words)
+    return [(band << 32) | zlib.crc32(repr(values[band * rows:(band + 1) * rows]).encode('ascii'))
+            for band in range(bands)]
+
+
+def ensure_schema(conn):
+    conn.execute("""CREATE TABLE IF NOT EXISTS plan_lsh (
+        bucket INTEGER,
+        plan_id INTEGER,
+        PRIMARY KEY (bucket, plan_id)
+    ) WITHOUT ROWID""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS plan_lsh_meta (
+        name TEXT PRIMARY KEY,
+        value TEXT
+    )""")
+    conn.commit()
+
+
+def _connect():
+    conn = sqlite3.connect(DB_FILE, timeout=30)
+    ensure_schema(conn)
+    return conn
+
+
+class TopicIndex:
+    """LSH index of plan seeds in storage.db.
+
+    Writes go through the caller's connection and are committed with the
+    caller's transaction. Seeds passed to `remember` (rows of an upload not
+    inserted yet) are matched from memory until `forget_pending`.
+    """
+
+    def __init__(self, conn, threshold=THRESHOLD):
+        self.conn = conn
+        # Раскладка полос - по настройке порога; `threshold` лишь решает, что считать дубликатом
+        self.threshold = threshold
+        self.layout = band_layout(THRESHOLD)
+        self.pending = {}
+        # Бакеты последней проверенной и запомненных тем, чтобы не считать подпись повторно
+        self._last = (None, None)
+        self._pending_keys = {}
+        ensure_schema(conn)
+        self._sync()
+
+    def _meta(self, name):
+        row = self.conn.execute("SELECT value FROM plan_lsh_meta WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, name, value):
+        self.conn.execute("""INSERT INTO plan_lsh_meta (name, value) VALUES (?, ?)
+                             ON CONFLICT(name) DO UPDATE SET value = excluded.value""", (name, str(value)))
+
+    def _sync(self):
+        """Rebuild after a layout change, then index plans added past the index"""
+        config = f"v{INDEX_VERSION}:{PERMUTATIONS}:{self.layout[0]}x{self.layout[1]}"
+        with self.conn:
+            if self._meta('config') != config:
+                self.conn.execute("DELETE FROM plan_lsh")
+                self._set_meta('config', config)
+                self._set_meta('indexed_through', 0)
+            indexed_through = int(self._meta('indexed_through') or 0)
+            try:
+                rows = self.conn.execute("SELECT id, seed FROM plans WHERE id > ? ORDER BY id",
+                                         (indexed_through,)).fetchall()
+            except sqlite3.OperationalError:
+                rows = []
+            if rows:
+                self._insert(rows)
+                if len(rows) > 1000:
+                    print(f"[near_duplicates] Indexed {len(rows)} plans")
+
+    def _buckets(self, seed):
+        if self._last[0] == seed:
+            return self._last[1]
+        keys = self._pending_keys.get(seed)
+        return keys if keys is not None else buckets(normalize(seed), self.layout)
+
+    def _insert(self, rows):
+        self.conn.executemany("INSERT OR IGNORE INTO plan_lsh (bucket, plan_id) VALUES (?, ?)",
+                              [(bucket, plan_id) for plan_id, seed in rows for bucket in self._buckets(seed)])
+        last = max(plan_id for plan_id, _seed in rows)
+        if last > int(self._meta('indexed_through') or 0):
+            self._set_meta('indexed_through', last)
+
+    def find(self, seed):
+        """Most similar plan at or above the threshold: {'plan_id', 'seed', 'similarity'} or None.
+
+        `plan_id` is None for a match among remembered (not yet inserted) seeds.
+        """
+        words = normalize(seed)
+        keys = buckets(words, self.layout)
+        self._last = (seed, keys)
+        best = None
+        for pending_seed in {s for key in keys for s in self.pending.get(key, ())}:
+            similarity = jaccard(words, normalize(pending_seed))
+            if similarity >= self.threshold and (best is None or similarity > best['similarity']):
+                best = {'plan_id': None, 'seed': pending_seed, 'similarity': round(similarity, 3)}
+        rows = self.conn.execute(f"""SELECT id, seed FROM plans WHERE id IN (
+                                         SELECT plan_id FROM plan_lsh WHERE bucket IN ({','.join('?' * len(keys))}))""",
+                                 keys).fetchall()
+        for plan_id, candidate in rows:
+            similarity = jaccard(words, normalize(candidate))
+            if similarity >= self.threshold and (best is None or similarity > best['similarity']):
+                best = {'plan_id': plan_id, 'seed': candidate, 'similarity': round(similarity, 3)}
+        return best
+
+    def remember(self, seed):
+        keys = self._buckets(seed)
+        self._pending_keys[seed] = keys
+        for key in keys:
+            self.pending.setdefault(key, []).append(seed)
+
+    def forget_pending(self):
+        self.pending = {}
+        self._pending_keys = {}
+
+    def add(self, plan_id, seed, commit=False):
+        """Index an inserted plan (in the caller's transaction unless `commit`)"""
+        self._insert([(plan_id, seed)])
+        if commit:
+            self.conn.commit()
+
+    def add_seeds(self, seeds):
+        """Index plans just inserted with these seeds (in the caller's transaction)"""
+        rows = []
+        for start in range(0, len(seeds), 500):
+            part = seeds[start:start + 500]
+            rows += self.conn.execute(f"""SELECT MAX(id), seed FROM plans WHERE seed IN ({','.join('?' * len(part))})
+                                          GROUP BY seed""", part).fetchall()
+        if rows:
+            self._insert(rows)
+
+    def clusters(self, min_size=2):
+        """Groups of plans that are near-duplicates of each other, largest first"""
+        pairs = set()
+        for (members,) in self.conn.execute("""SELECT group_concat(plan_id) FROM plan_lsh
+                                               GROUP BY bucket HAVING COUNT(*) > 1"""):
+            ids = sorted(int(plan_id) for plan_id in members.split(','))
+            pairs.update((a, b) for i, a in enumerate(ids) for b in ids[i + 1:])
+        involved = sorted({plan_id for pair in pairs for plan_id in pair})
+        plans = {}
+        for start in range(0, len(involved), 500):
+            part = involved[start:start + 500]
+            for plan_id, seed, status in self.conn.execute(
+                    f"SELECT id, seed, status FROM plans WHERE id IN ({','.join('?' * len(part))})", part):
+                plans[plan_id] = (seed, status, normalize(seed))
+
+        parent = {}
+
+        def root(plan_id):
+            while parent.get(plan_id, plan_id) != plan_id:
+                parent[plan_id] = parent.get(parent[plan_id], parent[plan_id])
+                plan_id = parent[plan_id]
+            return plan_id
+
+        for a, b in pairs:
+            if a in plans and b in plans and jaccard(plans[a][2], plans[b][2]) >= self.threshold:
+                parent[root(a)] = root(b)
+        groups = {}
+        for plan_id in plans:
+            groups.setdefault(root(plan_id), []).append(plan_id)
+        result = [[{'plan_id': plan_id, 'seed': plans[plan_id][0], 'status': plans[plan_id][1]}
+                   for plan_id in sorted(members)]
+                  for members in groups.values() if len(members) >= min_size]
+        result.sort(key=lambda group: (-len(group), group[0]['plan_id']))
+        return result
+
+
+def open_index(conn=None, threshold=THRESHOLD):
+    """TopicIndex for ingestion, or None when NEAR_DUPLICATE_MODE=off"""
+    if MODE == MODE_OFF:
+        return None
+    return TopicIndex(conn or _connect(), threshold)
+
+
+def print_clusters(limit=20, threshold=THRESHOLD):
+    conn = _connect()
+    groups = TopicIndex(conn, threshold).clusters()
+    conn.close()
+    duplicates = sum(len(group) - 1 for group in groups)
+    print(f"🔁 Групп похожих тем: {len(groups)}, лишних планов: {duplicates} (порог {threshold:g})")
+    for group in groups[:limit]:
+        print(f"\n   {len(group)} плана(ов):")
+        for plan in group:
+            print(f"   [{plan['plan_id']}] ({plan['status']}) {plan['seed'][:80]}")
+    if len(groups) > limit:
+        print(f"\n   ... и еще {len(groups) - limit} групп(ы)")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Поиск похожих тем в очереди планов (MinHash/LSH)')
+    parser.add_argument('--check', metavar='SEED', help='Проверить тему на похожие планы')
+    parser.add_argument('--clusters', action='store_true', help='Показать группы похожих планов')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='Порог сходства (Jaccard); ниже NEAR_DUPLICATE_THRESHOLD часть пар не найдется')
+    parser.add_argument('--limit', type=int, default=20, help='Сколько групп показать')
+    args = parser.parse_args()
+
+    if args.check:
+        conn = _connect()
+        match = TopicIndex(conn, args.threshold).find(args.check)
+        conn.close()
+        if match:
+            print(f"⚠️  Похоже на план [{match['plan_id']}] ({match['similarity']:.0%}): {match['seed']}")
+        else:
+            print("✅ Похожих планов нет")
+    else:
+        print_clusters(args.limit, args.threshold)
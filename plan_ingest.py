@@ -0,0 +1,270 @@
+"""plan_ingest.py
+
+Bulk ingestion of plans from NDJSON or CSV.
+
+Rows are parsed and normalized one line at a time (`PlanIngester.feed_line`),
+so a body of any size is never held in memory, and inserted in chunked
+transactions of INGEST_CHUNK_SIZE rows with one `executemany` each. Seeds are
+deduplicated against the table (one `IN (...)` lookup per chunk on
+idx_plans_seed) and within the upload itself. Near-duplicate topics (see
+near_duplicates.py) are rejected or only reported, per NEAR_DUPLICATE_MODE.
+
+NDJSON rows are objects with `seed` (or `title` / `topic`) and optional
+`seo_focus`, `category`, `priority` and `publish_after`. CSV bodies either
+start with a header naming the same columns, or use the load_csv_plan.py
+layout `category,title` without a header (categories are mapped the same way).
+
+Settings (.env):
+    INGEST_CHUNK_SIZE=1000
+
+Usage:
+    python plan_ingest.py topics.ndjson
+    python plan_ingest.py topics.csv
+"""
+import os
+import csv
+import json
+import time
+import sqlite3
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+load_dotenv()
+
+import plan_scheduler
+import near_duplicates
+
+DB_FILE = 'storage.db'
+
+INGEST_CHUNK_SIZE = int(os.getenv('INGEST_CHUNK_SIZE', '1000'))
+MAX_SEED_LENGTH = 500
+MAX_CATEGORY_LENGTH = 100
+MAX_REPORTED_ERRORS = 20
+
+SEED_COLUMNS = ('seed', 'title', 'topic')
+PLAN_FIELDS = ('seo_focus', 'category', 'priority', 'publish_after')
+
+
+def _clean_text(value):
+    return ' '.join(str(value).split()) if value is not None else ''
+
+
+def normalize_plan(row):
+    """Validated plan dict from a raw row; raises ValueError for invalid rows"""
+    if not isinstance(row, dict):
+        raise ValueError('row is not an object')
+    seed = ''
+    for column in SEED_COLUMNS:
+        seed = _clean_text(row.get(column))
+        if seed:
+            break
+    if not seed:
+        raise ValueError('seed is missing')
+    if len(seed) > MAX_SEED_LENGTH:
+        raise ValueError(f'seed is longer than {MAX_SEED_LENGTH} chars')
+
+    category = _clean_text(row.get('category')) or None
+    if category and len(category) > MAX_CATEGORY_LENGTH:
+        raise ValueError(f'category is longer than {MAX_CATEGORY_LENGTH} chars')
+    priority = row.get('priority')
+    try:
+        priority = int(priority) if priority not in (None, '') else 0
+    except (TypeError, ValueError):
+        raise ValueError(f'priority is not an integer: {priority!r}')
+    publish_after = row.get('publish_after')
+    try:
+        publish_after = plan_scheduler.normalize_timestamp(publish_after or None)
+    except ValueError:
+        raise ValueError(f'publish_after is not an ISO time: {publish_after!r}')
+
+    return {
+        'seed': seed,
+        'seo_focus': _clean_text(row.get('seo_focus')),
+        'category': category,
+        'priority': priority,
+        'publish_after': publish_after,
+    }
+
+
+class PlanIngester:
+    """Incremental NDJSON/CSV parser feeding chunked, deduplicated inserts"""
+
+    def __init__(self, conn, fmt=None, chunk_size=INGEST_CHUNK_SIZE):
+        self.conn = conn
+        self.fmt = fmt  # 'ndjson' | 'csv' | None (угадать по первой строке)
+        self.chunk_size = max(1, chunk_size)
+        self.buffer = []
+        self.seen = set()
+        self.line_no = 0
+        self.header = None
+        self._csv_pending = ''
+        self._started = time.time()
+        self.topics = near_duplicates.open_index(conn)
+        self.stats = {'received': 0, 'inserted': 0, 'duplicates': 0, 'near_duplicates': 0, 'invalid': 0,
+                      'chunks': 0, 'errors': [], 'similar': []}
+
+    @property
+    def ready(self):
+        """True when a full chunk is buffered and should be flushed"""
+        return len(self.buffer) >= self.chunk_size
+
+    def _invalid(self, line_no, error):
+        self.stats['invalid'] += 1
+        if len(self.stats['errors']) < MAX_REPORTED_ERRORS:
+            self.stats['errors'].append({'line': line_no, 'error': str(error)})
+
+    def feed_line(self, line):
+        """Parse one line of the body; complete rows go into the buffer"""
+        self.line_no += 1
+        if self.fmt is None:
+            if not line.strip():
+                return
+            self.fmt = 'ndjson' if line.lstrip().startswith('{') else 'csv'
+        if self.fmt == 'ndjson':
+            self._feed_ndjson(line)
+        else:
+            self._feed_csv(line)
+
+    def _feed_ndjson(self, line):
+        if not line.strip():
+            return
+        self.stats['received'] += 1
+        try:
+            self._add(normalize_plan(json.loads(line)))
+        except (ValueError, json.JSONDecodeError) as e:
+            self._invalid(self.line_no, e)
+
+    def _feed_csv(self, line):
+        # Поле в кавычках может содержать перевод строки: ждем закрывающую кавычку
+        text = self._csv_pending + line
+        if text.count('"') % 2:
+            self._csv_pending = text if text.endswith('\n') else text + '\n'
+            return
+        self._csv_pending = ''
+        if not text.strip():
+            return
+        cells = next(csv.reader([text]))
+        if self.header is None and self.stats['received'] == 0:
+            columns = [cell.strip().lower() for cell in cells]
+            if any(column in SEED_COLUMNS for column in columns):
+                self.header = columns
+                return
+            self.header = False
+        self.stats['received'] += 1
+        try:
+            if self.header:
+                row = dict(zip(self.header, cells))
+            else:
+                row = self._legacy_row(cells)
+            self._add(normalize_plan(row))
+        except ValueError as e:
+            self._invalid(self.line_no, e)
+
+    @staticmethod
+    def _legacy_row(cells):
+        """`category,title` rows of load_csv_plan.py"""
+        from load_csv_plan import map_category
+
+        if len(cells) < 2:
+            raise ValueError('expected "category,title"')
+        return {'category': map_category(cells[0].strip()), 'seed': ','.join(cells[1:])}
+
+    def _add(self, plan):
+        if plan['seed'] in self.seen:
+            self.stats['duplicates'] += 1
+            return
+        self.seen.add(plan['seed'])
+        if self.topics is not None:
+            match = self.topics.find(plan['seed'])
+            # Точное совпадение с таблицей отсеется как обычный дубликат в flush
+            if match and match['seed'] != plan['seed']:
+                self.stats['near_duplicates'] += 1
+                if len(self.stats['similar']) < MAX_REPORTED_ERRORS:
+                    self.stats['similar'].append({'line': self.line_no, 'seed': plan['seed'], 'similar_to': match['seed'],
+                                                  'plan_id': match['plan_id'], 'similarity': match['similarity']})
+                if near_duplicates.MODE == near_duplicates.MODE_REJECT:
+                    return
+            self.topics.remember(plan['seed'])
+        self.buffer.append(plan)
+
+    def flush(self):
+        """Insert the buffered rows that are not in the table yet, in one transaction"""
+        if not self.buffer:
+            return 0
+        chunk, self.buffer = self.buffer, []
+        seeds = [plan['seed'] for plan in chunk]
+        existing = set()
+        # Лимит параметров sqlite: проверяем порциями
+        for start in range(0, len(seeds), 500):
+            part = seeds[start:start + 500]
+            cur = self.conn.execute(f"SELECT seed FROM plans WHERE seed IN ({','.join('?' * len(part))})", part)
+            existing.update(row[0] for row in cur.fetchall())
+        now = datetime.now(timezone.utc).isoformat()
+        rows = [(p['seed'], p['seo_focus'], now, 'pending', p['category'], p['priority'], p['publish_after'])
+                for p in chunk if p['seed'] not in existing]
+        with self.conn:
+            self.conn.executemany("""INSERT INTO plans (seed, seo_focus, created_at, status, category, priority, publish_after)
+                                     VALUES (?, ?, ?, ?, ?, ?, ?)""", rows)
+            if self.topics is not None and rows:
+                self.topics.add_seeds([row[0] for row in rows])
+        if self.topics is not None:
+            self.topics.forget_pending()
+        self.stats['inserted'] += len(rows)
+        self.stats['duplicates'] += len(chunk) - len(rows)
+        self.stats['chunks'] += 1
+        return len(rows)
+
+    def finish(self):
+        """Flush the tail and return the statistics"""
+        if self._csv_pending:
+            self.stats['received'] += 1
+            self._invalid(self.line_no, 'unterminated quoted field')
+            self._csv_pending = ''
+        self.flush()
+        self.stats['format'] = self.fmt
+        self.stats['seconds'] = round(time.time() - self._started, 3)
+        return self.stats
+
+
+def _connect():
+    # Соединение используется последовательно из разных потоков (FastAPI threadpool)
+    conn = sqlite3.connect(DB_FILE, timeout=30, check_same_thread=False)
+    plan_scheduler.ensure_schema(conn)
+    return conn
+
+
+def ingest_lines(lines, fmt=None, chunk_size=INGEST_CHUNK_SIZE):
+    """Ingest an iterable of text lines; returns the statistics"""
+    conn = _connect()
+    try:
+        ingester = PlanIngester(conn, fmt, chunk_size)
+        for line in lines:
+            ingester.feed_line(line)
+            if ingester.ready:
+                ingester.flush()
+        return ingester.finish()
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Массовая загрузка планов из NDJSON или CSV')
+    parser.add_argument('file', help='Файл .ndjson/.jsonl или .csv')
+    parser.add_argument('--format', choices=['ndjson', 'csv'], help='Формат (по умолчанию по расширению)')
+    args = parser.parse_args()
+
+    fmt = args.format
+    if fmt is None and args.file.endswith(('.ndjson', '.jsonl')):
+        fmt = 'ndjson'
+    elif fmt is None and args.file.endswith('.csv'):
+        fmt = 'csv'
+    with open(args.file, encoding='utf-8', newline='') as f:
+        stats = ingest_lines(f, fmt)
+    print(f"✅ Добавлено: {stats['inserted']}, дубликатов: {stats['duplicates']}, "
+          f"похожих тем: {stats['near_duplicates']}, ошибок: {stats['invalid']} "
+          f"(строк: {stats['received']}, {stats['seconds']}s)")
+    for error in stats['errors']:
+        print(f"   ⚠️  Строка {error['line']}: {error['error']}")
+    for similar in stats['similar']:
+        print(f"   🔁 Строка {similar['line']}: похоже ({similar['similarity']:.0%}) на '{similar['similar_to'][:60]}'")
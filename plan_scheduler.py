@@ -0,0 +1,479 @@
+"""plan_scheduler.py
+
+Priority and publish-window scheduling for the `plans` queue.
+
+Every plan carries a `priority` (higher goes first), an optional
+`publish_after` (earliest publish time, ISO UTC) and a `category`. Each
+category may have its own minimum interval between publications
+(`category_cadence` table), and the global interval adapts to the size of the
+backlog so large queues drain faster.
+
+The queue is served straight from sqlite: the composite index
+`idx_plans_queue (status, category, priority DESC, created_at)` makes the head
+of every category an O(log n) index seek, and the distinct categories are
+enumerated with a loose index scan, so picking the next plan costs
+O(C log n) for C categories instead of scanning the table.
+
+Status counters are maintained by sqlite triggers: `plan_counters` holds the
+number of plans per (category, status) and `table_stats` the number of posts
+and a revision number bumped on every change to `plans`, so status endpoints
+read a handful of rows instead of counting the tables, and the revision
+serves as a cheap ETag.
+
+Usage:
+    python plan_scheduler.py --queue
+    python plan_scheduler.py --priority 42 10
+    python plan_scheduler.py --publish-after 42 2025-11-01T09:00:00
+    python plan_scheduler.py --category-interval "News" 24
+"""
+import os
+import sqlite3
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+load_dotenv()
+
+import metrics
+
+DB_FILE = 'storage.db'
+
+# Базовый интервал публикации (как в thenextai_publisher.py), можно переопределить через .env
+PUBLISH_INTERVAL_DAYS = float(os.getenv('PUBLISH_INTERVAL_DAYS', '3'))
+# Когда ожидающих статей больше порога, интервал сжимается пропорционально размеру очереди
+BURST_BACKLOG_THRESHOLD = int(os.getenv('BURST_BACKLOG_THRESHOLD', '30'))
+# Нижняя граница интервала в режиме burst
+BURST_MIN_INTERVAL_HOURS = float(os.getenv('BURST_MIN_INTERVAL_HOURS', '12'))
+
+PLAN_COLUMNS = "id, seed, seo_focus, created_at, last_published_at, category"
+
+# План захвачен прогоном публикации и не выдается другим воркерам
+STATUS_PUBLISHING = 'publishing'
+
+
+def _now_iso():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def normalize_timestamp(value):
+    """Parse an ISO timestamp (naive values are treated as UTC) and return it
+    in the canonical `+00:00` form used for string comparison in sqlite."""
+    if value is None or value == '':
+        return None
+    if isinstance(value, datetime):
+        dt = value
+    else:
+        dt = datetime.fromisoformat(str(value).strip().replace('Z', '+00:00'))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc).isoformat()
+
+
+def ensure_schema(conn):
+    """Add scheduling columns, the queue index and the cadence table if missing"""
+    cur = conn.cursor()
+    for column, ddl in (
+        ('category', 'ALTER TABLE plans ADD COLUMN category TEXT'),
+        ('priority', 'ALTER TABLE plans ADD COLUMN priority INTEGER DEFAULT 0'),
+        ('publish_after', 'ALTER TABLE plans ADD COLUMN publish_after TEXT'),
+        ('claimed_at', 'ALTER TABLE plans ADD COLUMN claimed_at TEXT'),
+    ):
+        try:
+            cur.execute(ddl)
+        except sqlite3.OperationalError:
+            # Колонка уже существует
+            pass
+    cur.execute("UPDATE plans SET priority = 0 WHERE priority IS NULL")
+    cur.execute("""CREATE INDEX IF NOT EXISTS idx_plans_queue
+                   ON plans(status, category, priority DESC, created_at)""")
+    cur.execute("""CREATE TABLE IF NOT EXISTS category_cadence (
+        category TEXT PRIMARY KEY,
+        min_interval_hours REAL DEFAULT 0,
+        last_published_at TEXT
+    )""")
+    # Индексы для постраничного списка планов (rowid = id идет последним в индексе)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_plans_status ON plans(status)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_plans_category ON plans(category, status)")
+    # Проверка дубликатов по seed (загрузчики, POST /plans/bulk)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_plans_seed ON plans(seed)")
+    _ensure_counters(cur)
+    conn.commit()
+
+
+def _bump_stat(name, delta):
+    return f"""INSERT INTO table_stats (name, value) VALUES ('{name}', {delta})
+               ON CONFLICT(name) DO UPDATE SET value = value + ({delta});"""
+
+
+def _count_plan(row, delta):
+    return f"""INSERT INTO plan_counters (category, status, count)
+               VALUES (COALESCE({row}.category, ''), COALESCE({row}.status, ''), {delta})
+               ON CONFLICT(category, status) DO UPDATE SET count = count + ({delta});"""
+
+
+PLAN_TRIGGERS = {
+    'trg_plans_count_insert': f"""AFTER INSERT ON plans BEGIN
+        {_count_plan('NEW', 1)} {_bump_stat('plans_revision', 1)} END""",
+    'trg_plans_count_delete': f"""AFTER DELETE ON plans BEGIN
+        {_count_plan('OLD', -1)} {_bump_stat('plans_revision', 1)} END""",
+    'trg_plans_count_update': f"""AFTER UPDATE OF status, category ON plans
+        WHEN OLD.status IS NOT NEW.status OR OLD.category IS NOT NEW.category BEGIN
+        {_count_plan('OLD', -1)} {_count_plan('NEW', 1)} END""",
+    'trg_plans_revision_update': f"""AFTER UPDATE ON plans BEGIN
+        {_bump_stat('plans_revision', 1)} END""",
+}
+
+POST_TRIGGERS = {
+    'trg_posts_count_insert': f"AFTER INSERT ON posts BEGIN {_bump_stat('posts', 1)} END",
+    'trg_posts_count_delete': f"AFTER DELETE ON posts BEGIN {_bump_stat('posts', -1)} END",
+}
+
+
+def _ensure_counters(cur):
+    """Create the counter tables and triggers; backfill counters when the triggers are new"""
+    cur.execute("""CREATE TABLE IF NOT EXISTS plan_counters (
+        category TEXT NOT NULL,
+        status TEXT NOT NULL,
+        count INTEGER DEFAULT 0,
+        PRIMARY KEY (category, status)
+    )""")
+    cur.execute("""CREATE TABLE IF NOT EXISTS table_stats (
+        name TEXT PRIMARY KEY,
+        value INTEGER DEFAULT 0
+    )""")
+    cur.execute("SELECT name FROM sqlite_master WHERE type IN ('trigger', 'table')")
+    existing = {row[0] for row in cur.fetchall()}
+
+    if not set(PLAN_TRIGGERS) <= existing:
+        # Триггеры создаются впервые - пересчитываем счетчики в той же транзакции
+        for name, body in PLAN_TRIGGERS.items():
+            cur.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+        cur.execute("DELETE FROM plan_counters")
+        cur.execute("""INSERT INTO plan_counters (category, status, count)
+                       SELECT COALESCE(category, ''), COALESCE(status, ''), COUNT(*) FROM plans
+                       GROUP BY COALESCE(category, ''), COALESCE(status, '')""")
+
+    # Таблицу posts создают не все скрипты (load_csv_plan.py)
+    if 'posts' in existing and not set(POST_TRIGGERS) <= existing:
+        for name, body in POST_TRIGGERS.items():
+            cur.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+        cur.execute("""INSERT INTO table_stats (name, value) SELECT 'posts', COUNT(*) FROM posts WHERE 1
+                       ON CONFLICT(name) DO UPDATE SET value = excluded.value""")
+    if 'posts' in existing:
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_posts_published ON posts(published_at)")
+        # Связь поста с планом и его категорией (для выгрузки и статистики)
+        for ddl in ('ALTER TABLE posts ADD COLUMN plan_id INTEGER', 'ALTER TABLE posts ADD COLUMN category TEXT'):
+            try:
+                cur.execute(ddl)
+            except sqlite3.OperationalError:
+                pass
+
+
+def status_counts(conn):
+    """Trigger-maintained counters: plans per status, per category ('' = none) and status, posts, revision"""
+    by_category = {}
+    by_status = {}
+    for category, status, count in conn.execute(
+            "SELECT category, status, count FROM plan_counters WHERE count > 0"):
+        by_category.setdefault(category, {})[status] = count
+        by_status[status] = by_status.get(status, 0) + count
+    stats = dict(conn.execute("SELECT name, value FROM table_stats").fetchall())
+    return {
+        'plans': sum(by_status.values()),
+        'by_status': by_status,
+        'by_category': by_category,
+        'posts': stats.get('posts', 0),
+        'revision': stats.get('plans_revision', 0),
+    }
+
+
+def _plans_gauge():
+    conn = sqlite3.connect(DB_FILE, timeout=30)
+    try:
+        return {(status,): count for status, count in status_counts(conn)['by_status'].items()}
+    finally:
+        conn.close()
+
+
+metrics.gauge('autoposter_plans', 'Plans by status (trigger-maintained counters)', ('status',), callback=_plans_gauge)
+
+
+def plans_revision(conn):
+    row = conn.execute("SELECT value FROM table_stats WHERE name='plans_revision'").fetchone()
+    return row[0] if row else 0
+
+
+def list_plans(conn, status=None, category=None, after_id=0, limit=50):
+    """One page of plans ordered by id (keyset pagination: pass the last id as `after_id`).
+
+    Returns (rows, next_after_id); next_after_id is None on the last page.
+    """
+    sql = """SELECT id, seed, seo_focus, category, status, priority, publish_after, created_at, last_published_at
+             FROM plans WHERE id > ?"""
+    params = [int(after_id or 0)]
+    if status:
+        sql += " AND status = ?"
+        params.append(status)
+    if category:
+        sql += " AND category = ?"
+        params.append(category)
+    sql += " ORDER BY id LIMIT ?"
+    params.append(int(limit) + 1)
+    keys = ('id', 'seed', 'seo_focus', 'category', 'status', 'priority', 'publish_after', 'created_at',
+            'last_published_at')
+    rows = [dict(zip(keys, row)) for row in conn.execute(sql, params).fetchall()]
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return rows, (rows[-1]['id'] if has_more else None)
+
+
+def _pending_categories(cur):
+    """Enumerate distinct categories of pending plans via a loose index scan.
+
+    Each step is a single seek on idx_plans_queue, so this is O(C log n)
+    rather than a scan over every pending row.
+    """
+    categories = []
+    cur.execute("SELECT 1 FROM plans WHERE status='pending' AND category IS NULL LIMIT 1")
+    if cur.fetchone():
+        categories.append(None)
+
+    cur.execute("SELECT MIN(category) FROM plans WHERE status='pending' AND category IS NOT NULL")
+    row = cur.fetchone()
+    while row and row[0] is not None:
+        categories.append(row[0])
+        cur.execute("SELECT MIN(category) FROM plans WHERE status='pending' AND category > ?", (row[0],))
+        row = cur.fetchone()
+    return categories
+
+
+def _category_head(cur, category, now_iso, exclude_ids=()):
+    """Highest-priority pending plan of a category whose publish window is open"""
+    exclude_sql = ''
+    if exclude_ids:
+        exclude_sql = f"AND id NOT IN ({','.join('?' * len(exclude_ids))})"
+    cur.execute(f"""SELECT {PLAN_COLUMNS}, priority FROM plans
+                    WHERE status='pending' AND category IS ?
+                      AND (publish_after IS NULL OR publish_after <= ?)
+                      {exclude_sql}
+                    ORDER BY priority DESC, created_at
+                    LIMIT 1""", (category, now_iso, *exclude_ids))
+    return cur.fetchone()
+
+
+def _cadence_map(cur):
+    cur.execute("SELECT category, min_interval_hours, last_published_at FROM category_cadence")
+    return {row[0]: (row[1] or 0, row[2]) for row in cur.fetchall()}
+
+
+def _category_ready_at(cadence, category):
+    """Earliest time the category may publish again (None = no restriction)"""
+    if category not in cadence:
+        return None
+    interval_hours, last_published_at = cadence[category]
+    if not interval_hours or not last_published_at:
+        return None
+    last = datetime.fromisoformat(normalize_timestamp(last_published_at))
+    return last + timedelta(hours=interval_hours)
+
+
+def eligible_plans(conn, now=None, limit=None):
+    """Return eligible category heads ordered by scheduling preference.
+
+    Order: priority DESC, then the category that published least recently
+    (keeps categories balanced), then created_at.
+    """
+    now = now or datetime.now(timezone.utc)
+    now_iso = normalize_timestamp(now)
+    cur = conn.cursor()
+    cadence = _cadence_map(cur)
+
+    heads = []
+    for category in _pending_categories(cur):
+        ready_at = _category_ready_at(cadence, category)
+        if ready_at and ready_at > now:
+            continue
+        head = _category_head(cur, category, now_iso)
+        if head:
+            last_category_publish = cadence.get(category, (0, None))[1] or ''
+            heads.append((head, last_category_publish))
+
+    heads.sort(key=lambda item: (-(item[0][6] or 0), item[1], item[0][3] or ''))
+    rows = [head[:6] for head, _ in heads]
+    return rows[:limit] if limit else rows
+
+
+def upcoming_plans(conn, limit, exclude_ids=(), horizon=None):
+    """Predict the next `limit` picks of the scheduler, in order.
+
+    Category cadence is not enforced (the picks lie in the future), but the
+    balancing rule is simulated: a category that was just picked goes to the
+    back of the tie-break order. Plans in `exclude_ids` are skipped.
+    """
+    horizon_iso = normalize_timestamp(horizon or datetime.now(timezone.utc))
+    cur = conn.cursor()
+    cadence = _cadence_map(cur)
+    last_pick = {category: last or '' for category, (_hours, last) in cadence.items()}
+    excluded = list(exclude_ids)
+    categories = _pending_categories(cur)
+
+    picks = []
+    tick = 0
+    while len(picks) < limit:
+        heads = []
+        for category in categories:
+            head = _category_head(cur, category, horizon_iso, excluded)
+            if head:
+                heads.append((head, last_pick.get(category, '')))
+        if not heads:
+            break
+        heads.sort(key=lambda item: (-(item[0][6] or 0), item[1], item[0][3] or ''))
+        head = heads[0][0]
+        picks.append(head[:6])
+        excluded.append(head[0])
+        tick += 1
+        # "~" сортируется после ISO-дат: категория уходит в конец очереди
+        last_pick[head[5]] = f"~{tick:08d}"
+    return picks
+
+
+def select_next_plan(conn, now=None):
+    """Pick the next plan to publish: (id, seed, seo_focus, created_at, last_published_at, category)"""
+    rows = eligible_plans(conn, now=now, limit=1)
+    return rows[0] if rows else None
+
+
+def claim_plan(conn, plan_id):
+    """Atomically move a pending plan to 'publishing' and return its row.
+
+    Returns None if another worker claimed or published the plan first.
+    """
+    cur = conn.execute("UPDATE plans SET status = ?, claimed_at = ? WHERE id = ? AND status = 'pending'",
+                       (STATUS_PUBLISHING, _now_iso(), plan_id))
+    conn.commit()
+    if cur.rowcount != 1:
+        return None
+    return conn.execute(f"SELECT {PLAN_COLUMNS} FROM plans WHERE id = ?", (plan_id,)).fetchone()
+
+
+def release_plan(conn, plan_id):
+    """Return a claimed plan to the queue (no-op once it is published)"""
+    conn.execute("UPDATE plans SET status = 'pending' WHERE id = ? AND status = ?",
+                 (plan_id, STATUS_PUBLISHING))
+    conn.commit()
+
+
+def release_stale_claims(conn, max_age_seconds):
+    """Return plans claimed more than `max_age_seconds` ago to the queue.
+
+    A run can't hold a plan longer than its deadline, so such claims belong to
+    a process that died; younger ones may still be published by a sibling
+    worker process and are left alone. Returns the number of released plans.
+    """
+    cutoff = (datetime.now(timezone.utc) - timedelta(seconds=max_age_seconds)).isoformat()
+    cur = conn.execute("""UPDATE plans SET status = 'pending'
+                          WHERE status = ? AND (claimed_at IS NULL OR claimed_at < ?)""",
+                       (STATUS_PUBLISHING, cutoff))
+    conn.commit()
+    return cur.rowcount
+
+
+def record_category_publish(conn, category, published_at=None):
+    """Remember the publication time of a category for its cadence"""
+    if category is None:
+        return
+    conn.execute("""INSERT INTO category_cadence (category, last_published_at) VALUES (?, ?)
+                    ON CONFLICT(category) DO UPDATE SET last_published_at = excluded.last_published_at""",
+                 (category, normalize_timestamp(published_at) or _now_iso()))
+    conn.commit()
+
+
+def set_category_interval(conn, category, hours):
+    conn.execute("""INSERT INTO category_cadence (category, min_interval_hours) VALUES (?, ?)
+                    ON CONFLICT(category) DO UPDATE SET min_interval_hours = excluded.min_interval_hours""",
+                 (category, float(hours)))
+    conn.commit()
+
+
+def set_plan_priority(conn, plan_id, priority):
+    cur = conn.execute("UPDATE plans SET priority = ? WHERE id = ?", (int(priority), plan_id))
+    conn.commit()
+    return cur.rowcount > 0
+
+
+def set_plan_publish_after(conn, plan_id, publish_after):
+    cur = conn.execute("UPDATE plans SET publish_after = ? WHERE id = ?",
+                       (normalize_timestamp(publish_after), plan_id))
+    conn.commit()
+    return cur.rowcount > 0
+
+
+def publish_interval(pending_count, interval_days=None, burst_threshold=None, burst_min_hours=None):
+    """Adaptive global interval between publications.
+
+    Below BURST_BACKLOG_THRESHOLD pending plans the base PUBLISH_INTERVAL_DAYS
+    applies. Above it the interval shrinks proportionally to the backlog
+    (base * threshold / pending), never going below BURST_MIN_INTERVAL_HOURS.
+    The keyword arguments override the settings (simulator.py what-ifs).
+    """
+    interval_days = PUBLISH_INTERVAL_DAYS if interval_days is None else interval_days
+    burst_threshold = BURST_BACKLOG_THRESHOLD if burst_threshold is None else burst_threshold
+    burst_min_hours = BURST_MIN_INTERVAL_HOURS if burst_min_hours is None else burst_min_hours
+    base = timedelta(days=interval_days)
+    if burst_threshold <= 0 or pending_count <= burst_threshold:
+        return base
+    burst = base * (burst_threshold / pending_count)
+    floor = timedelta(hours=burst_min_hours)
+    return max(burst, min(floor, base))
+
+
+def show_queue(limit=10):
+    conn = sqlite3.connect(DB_FILE)
+    ensure_schema(conn)
+    cur = conn.cursor()
+    pending = status_counts(conn)['by_status'].get('pending', 0)
+    interval = publish_interval(pending)
+
+    print(f"📊 Ожидают публикации: {pending}")
+    print(f"⏱️  Текущий интервал публикации: {interval} "
+          f"({'burst' if interval < timedelta(days=PUBLISH_INTERVAL_DAYS) else 'обычный'})")
+
+    cadence = _cadence_map(cur)
+    if cadence:
+        print("\n📂 Интервалы по категориям:")
+        for category, (hours, last) in sorted(cadence.items()):
+            ready_at = _category_ready_at(cadence, category)
+            ready_str = ready_at.strftime('%Y-%m-%d %H:%M') if ready_at else 'сейчас'
+            print(f"   {category}: каждые {hours or 0:g} ч, следующая: {ready_str}")
+
+    rows = eligible_plans(conn, limit=limit)
+    print(f"\n⏭️  Доступны для публикации ({len(rows)}):")
+    for i, (plan_id, seed, _seo, _created, _last, category) in enumerate(rows, 1):
+        print(f"   {i}. [{plan_id}] {seed[:60]}... ({category or '-'})")
+    conn.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Управление очередью планов публикации')
+    parser.add_argument('--queue', action='store_true', help='Показать очередь')
+    parser.add_argument('--priority', nargs=2, metavar=('PLAN_ID', 'PRIORITY'), help='Установить приоритет плана')
+    parser.add_argument('--publish-after', nargs=2, metavar=('PLAN_ID', 'ISO_TIME'), help='Не публиковать план раньше указанного времени')
+    parser.add_argument('--category-interval', nargs=2, metavar=('CATEGORY', 'HOURS'), help='Минимальный интервал публикации категории')
+
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(DB_FILE)
+    ensure_schema(conn)
+    if args.priority:
+        ok = set_plan_priority(conn, int(args.priority[0]), int(args.priority[1]))
+        print("✅ Приоритет обновлен" if ok else "❌ План не найден")
+    if args.publish_after:
+        ok = set_plan_publish_after(conn, int(args.publish_after[0]), args.publish_after[1])
+        print("✅ Время публикации обновлено" if ok else "❌ План не найден")
+    if args.category_interval:
+        set_category_interval(conn, args.category_interval[0], args.category_interval[1])
+        print(f"✅ Интервал категории {args.category_interval[0]}: {args.category_interval[1]} ч")
+    conn.close()
+
+    if args.queue or not (args.priority or args.publish_after or args.category_interval):
+        show_queue()
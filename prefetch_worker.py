@@ -0,0 +1,346 @@
+"""prefetch_worker.py
+
+Keeps a buffer of the next K plans fully prepared ahead of their publish time:
+article generated and validated, image uploaded, tags/categories resolved and
+the post created on WordPress as a `draft` (or as a `future` post with a
+`date_gmt`, so WordPress publishes it by itself). At due time the publisher
+only flips the draft to `publish` (or just finalizes a post that is already
+live), so a Gemini outage or 429 at that moment no longer costs a slot.
+
+Prefetching runs only inside the off-peak window PREFETCH_HOURS (UTC hours,
+e.g. "1-6"; empty = any time) unless forced from the CLI.
+
+Settings (.env):
+    ENABLE_PREFETCH=true
+    PREFETCH_DEPTH=3
+    PREFETCH_WP_STATUS=draft   # or "future"
+    PREFETCH_HOURS=1-6
+
+Usage:
+    python prefetch_worker.py            # refill the buffer now
+    python prefetch_worker.py --status
+"""
+import os
+import json
+import sqlite3
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+
+import metrics
+import run_ledger
+import plan_scheduler
+import usage_ledger
+import corpus_index
+from deadline import Deadline, PUBLISH_DEADLINE_SECONDS, stage_deadline
+
+load_dotenv()
+
+DB_FILE = 'storage.db'
+
+PREFETCH_ENABLED = os.getenv('ENABLE_PREFETCH', 'false').lower() == 'true'
+PREFETCH_DEPTH = int(os.getenv('PREFETCH_DEPTH', '3'))
+PREFETCH_WP_STATUS = os.getenv('PREFETCH_WP_STATUS', 'draft').lower()
+PREFETCH_HOURS = os.getenv('PREFETCH_HOURS', '')
+
+
+def ensure_schema(conn):
+    conn.execute("""CREATE TABLE IF NOT EXISTS prefetch_buffer (
+        plan_id INTEGER PRIMARY KEY,
+        wp_id INTEGER,
+        link TEXT,
+        title TEXT,
+        slug TEXT,
+        keywords TEXT,
+        content_preview TEXT,
+        image_path TEXT,
+        wp_status TEXT,
+        scheduled_for TEXT,
+        created_at TEXT,
+        state TEXT
+    )""")
+    try:
+        # Полный HTML для индекса корпуса; content_preview остается для соцсетей и --status
+        conn.execute('ALTER TABLE prefetch_buffer ADD COLUMN content_html TEXT')
+    except sqlite3.OperationalError:
+        # Колонка уже существует
+        pass
+    conn.execute("""CREATE TABLE IF NOT EXISTS prefetch_stats (
+        name TEXT PRIMARY KEY,
+        value INTEGER DEFAULT 0
+    )""")
+    conn.commit()
+
+
+def _connect():
+    conn = sqlite3.connect(DB_FILE)
+    ensure_schema(conn)
+    return conn
+
+
+def in_prefetch_window(now=None):
+    """True if `now` falls into PREFETCH_HOURS ("start-end" in UTC hours, may wrap midnight)"""
+    if not PREFETCH_HOURS.strip():
+        return True
+    now = now or datetime.now(timezone.utc)
+    start, end = (int(part) for part in PREFETCH_HOURS.split('-', 1))
+    if start <= end:
+        return start <= now.hour < end
+    return now.hour >= start or now.hour < end
+
+
+def _bump(conn, name):
+    conn.execute("""INSERT INTO prefetch_stats (name, value) VALUES (?, 1)
+                    ON CONFLICT(name) DO UPDATE SET value = value + 1""", (name,))
+    conn.commit()
+
+
+def record_hit():
+    conn = _connect()
+    _bump(conn, 'hits')
+    conn.close()
+
+
+def record_miss():
+    conn = _connect()
+    _bump(conn, 'misses')
+    conn.close()
+
+
+def _row_to_entry(row):
+    keys = ('plan_id', 'wp_id', 'link', 'title', 'slug', 'keywords', 'content_preview',
+            'image_path', 'wp_status', 'scheduled_for', 'created_at', 'state', 'content_html')
+    entry = dict(zip(keys, row))
+    entry['keywords'] = json.loads(entry['keywords'] or '[]')
+    return entry
+
+
+def get_prefetched(plan_id):
+    """Ready buffer entry for a plan, or None"""
+    conn = _connect()
+    cur = conn.execute("SELECT * FROM prefetch_buffer WHERE plan_id=? AND state='ready'", (plan_id,))
+    row = cur.fetchone()
+    conn.close()
+    return _row_to_entry(row) if row else None
+
+
+def due_scheduled_plan_id(now=None):
+    """Plan of the earliest `future` post whose scheduled time has come.
+
+    Such posts are already live on WordPress, so they must be finalized before
+    anything else is picked from the queue.
+    """
+    now_iso = plan_scheduler.normalize_timestamp(now or datetime.now(timezone.utc))
+    conn = _connect()
+    cur = conn.execute("""SELECT plan_id FROM prefetch_buffer
+                          WHERE state='ready' AND wp_status='future' AND scheduled_for <= ?
+                          ORDER BY scheduled_for LIMIT 1""", (now_iso,))
+    row = cur.fetchone()
+    conn.close()
+    return row[0] if row else None
+
+
+def claim_next_plan(screen=None):
+    """Claim the next plan to publish (status 'publishing'), or return None.
+
+    A due `future` post comes first, then the head of the queue. `screen(plan)`
+    returning False sets a plan aside (corpus similarity); prefetched plans are
+    not screened again. A plan claimed by a concurrent run (API job, daemon) is
+    skipped.
+    """
+    conn = sqlite3.connect(DB_FILE, timeout=30)
+    try:
+        due_plan_id = due_scheduled_plan_id()
+        if due_plan_id:
+            plan = plan_scheduler.claim_plan(conn, due_plan_id)
+            if plan:
+                return plan
+        while True:
+            plan = plan_scheduler.select_next_plan(conn)
+            if not plan:
+                return None
+            if screen is not None and not get_prefetched(plan[0]) and not screen(plan):
+                continue
+            plan = plan_scheduler.claim_plan(conn, plan[0])
+            if plan:
+                return plan
+    finally:
+        conn.close()
+
+
+def go_live(entry, deadline=None):
+    """Make a prefetched post public. Returns the WordPress post dict."""
+    from wordpress_client import update_wp_post_status
+
+    # Черновик переводим в publish; future-пост WordPress публикует сам,
+    # но повторный publish дешев и страхует от пропущенного wp-cron
+    wp_post = update_wp_post_status(entry['wp_id'], status='publish', deadline=deadline)
+    wp_post.setdefault('link', entry['link'])
+    return wp_post
+
+
+def mark_consumed(plan_id):
+    conn = _connect()
+    conn.execute("UPDATE prefetch_buffer SET state='consumed' WHERE plan_id=?", (plan_id,))
+    conn.commit()
+    conn.close()
+
+
+@run_ledger.recorded('prefetch', falsy_is_error=True)
+def prefetch_plan(plan, scheduled_for=None):
+    """Fully prepare one plan and create its WordPress post as draft/future"""
+    # Ленивый импорт: thenextai_publisher сам импортирует этот модуль
+    from thenextai_publisher import prepare_article
+    from wordpress_client import create_wp_post
+
+    plan_id, seed, _seo_focus, _created_at, _last_pub, category = plan
+    run_ledger.annotate(plan_id=plan_id)
+    print(f"[prefetch] Preparing plan {plan_id}: {seed[:50]}...")
+
+    # Каждая предгенерация ограничена тем же дедлайном, что и обычная публикация
+    deadline = Deadline(PUBLISH_DEADLINE_SECONDS, label='prefetch')
+    prepared = prepare_article(seed, category, plan_id, deadline=deadline)
+    if not prepared:
+        print(f"[prefetch] ❌ Plan {plan_id}: generation failed, will retry later")
+        return False
+
+    wp_status = 'future' if PREFETCH_WP_STATUS == 'future' and scheduled_for else 'draft'
+    date_gmt = None
+    if wp_status == 'future':
+        # WordPress ожидает date_gmt без смещения
+        date_gmt = scheduled_for.astimezone(timezone.utc).replace(tzinfo=None).isoformat(timespec='seconds')
+
+    wp_post = create_wp_post(
+        title=prepared['title'],
+        content_html=prepared['content_html'],
+        slug=prepared['slug'],
+        status=wp_status,
+        featured_media_id=prepared['featured_media_id'],
+        meta_description=prepared['meta_description'],
+        tags=prepared['tag_ids'] or None,
+        categories=prepared['category_ids'] or None,
+        date_gmt=date_gmt,
+        deadline=stage_deadline(deadline, 'wordpress')
+    )
+
+    conn = _connect()
+    conn.execute("""INSERT OR REPLACE INTO prefetch_buffer
+                    (plan_id, wp_id, link, title, slug, keywords, content_preview, image_path,
+                     wp_status, scheduled_for, created_at, state, content_html)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'ready', ?)""",
+                 (plan_id, wp_post.get('id'), wp_post.get('link'), prepared['title'], prepared['slug'],
+                  json.dumps(prepared['keywords']), prepared['content_html'][:1000], prepared['image_path'],
+                  wp_status, plan_scheduler.normalize_timestamp(scheduled_for) if wp_status == 'future' else None,
+                  datetime.now(timezone.utc).isoformat(), prepared['content_html']))
+    if wp_status == 'future':
+        # Планировщик не должен выбрать этот план раньше запланированного времени
+        plan_scheduler.set_plan_publish_after(conn, plan_id, scheduled_for)
+    conn.commit()
+    conn.close()
+
+    print(f"[prefetch] ✅ Plan {plan_id} buffered as WP {wp_status} post {wp_post.get('id')}")
+    return True
+
+
+def refill_buffer(next_publish=None, interval=None, force=False, now=None):
+    """Top the buffer up to PREFETCH_DEPTH ready entries. Returns the number prepared.
+
+    In `future` mode consecutive slots are assigned starting from
+    `next_publish`, spaced by `interval`.
+    """
+    now = now or datetime.now(timezone.utc)
+    if not force and not in_prefetch_window(now):
+        return 0
+
+    conn = _connect()
+    cur = conn.execute("SELECT plan_id FROM prefetch_buffer WHERE state='ready'")
+    buffered = [row[0] for row in cur.fetchall()]
+    need = PREFETCH_DEPTH - len(buffered)
+    if need <= 0:
+        conn.close()
+        return 0
+
+    plans = plan_scheduler.upcoming_plans(conn, need, exclude_ids=buffered, horizon=now + timedelta(days=1))
+    cur = conn.execute("SELECT MAX(scheduled_for) FROM prefetch_buffer WHERE state='ready' AND wp_status='future'")
+    last_slot = cur.fetchone()[0]
+    conn.close()
+
+    slot = None
+    if PREFETCH_WP_STATUS == 'future' and next_publish and interval:
+        slot = max(next_publish, now + timedelta(minutes=10))
+        if last_slot:
+            slot = max(slot, datetime.fromisoformat(last_slot) + interval)
+
+    prepared = 0
+    for plan in plans:
+        admitted, reason, _retry_after = usage_ledger.check_admission()
+        if not admitted:
+            print(f"[prefetch] ⏸️ Quota limit reached, stopping refill: {reason}")
+            break
+        topic_admitted, match = corpus_index.screen_plan(plan[0], plan[1])
+        if not topic_admitted:
+            print(f"[prefetch] ⏭️ Plan {plan[0]} set aside: similar to published post "
+                  f"[{match['wp_id']}] ({match['similarity']:.0%})")
+            continue
+        try:
+            if prefetch_plan(plan, scheduled_for=slot):
+                prepared += 1
+                if slot:
+                    slot = slot + interval
+        except Exception as e:
+            print(f"[prefetch] ❌ Plan {plan[0]}: {e}")
+    return prepared
+
+
+def buffer_stats(now=None):
+    """Depth, age of the oldest entry and hit rate of the buffer"""
+    now = now or datetime.now(timezone.utc)
+    conn = _connect()
+    cur = conn.execute("SELECT COUNT(*), MIN(created_at) FROM prefetch_buffer WHERE state='ready'")
+    depth, oldest = cur.fetchone()
+    cur = conn.execute("SELECT name, value FROM prefetch_stats")
+    counters = dict(cur.fetchall())
+    conn.close()
+
+    hits = counters.get('hits', 0)
+    misses = counters.get('misses', 0)
+    oldest_age = None
+    if oldest:
+        oldest_age = now - datetime.fromisoformat(oldest)
+    return {
+        'enabled': PREFETCH_ENABLED,
+        'target_depth': PREFETCH_DEPTH,
+        'depth': depth,
+        'oldest_age': oldest_age,
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / (hits + misses) if hits + misses else None
+    }
+
+
+metrics.gauge('autoposter_prefetch_buffer_depth', 'Ready entries in the prefetch buffer',
+              callback=lambda: buffer_stats()['depth'])
+
+
+def print_buffer_stats():
+    stats = buffer_stats()
+    hit_rate = f"{stats['hit_rate']:.0%}" if stats['hit_rate'] is not None else "-"
+    oldest = str(stats['oldest_age']).split('.')[0] if stats['oldest_age'] else "-"
+    print(f"   Буфер предгенерации: {stats['depth']}/{stats['target_depth']} "
+          f"({'включен' if stats['enabled'] else 'выключен'}, {PREFETCH_WP_STATUS})")
+    print(f"   Возраст старейшего черновика: {oldest}")
+    print(f"   Попадания в буфер: {stats['hits']} из {stats['hits'] + stats['misses']} ({hit_rate})")
+
+
+if __name__ == "__main__":
+    import sys
+
+    if '--status' in sys.argv:
+        print_buffer_stats()
+    else:
+        # Ручной запуск игнорирует окно PREFETCH_HOURS
+        from thenextai_publisher import init_db, get_status
+        init_db()
+        status = get_status()
+        count = refill_buffer(status['next_publish'], status['publish_interval'], force=True)
+        print(f"✅ Подготовлено статей: {count}")
+        print_buffer_stats()
@@ -0,0 +1,259 @@
+"""profiling.py
+
+Profiling of a single publish run.
+
+Two modes:
+    sampling   a background thread samples the stacks of the run's threads
+               every PROFILE_INTERVAL_MS (the calling thread and every thread
+               started during the run, e.g. section generation). Each sample
+               is classified as CPU or waiting by the thread's own CPU clock,
+               and waits by the leaf frame: network (socket/ssl/HTTP client
+               reads), lock (thread joins, futures, queues) or other (sleeps,
+               backoff). Stacks are written in the collapsed format
+               ("frame;frame;frame count") read by flamegraph.pl and
+               speedscope; waits end with a `[network]`/`[lock]`/`[wait]` frame.
+    cprofile   deterministic cProfile of the calling thread, written as
+               .pstats (snakeviz, `python -m pstats`).
+
+Both write a text summary with wall time, process CPU time and the
+breakdown. Files are named after the run_ledger run id:
+PROFILE_DIR/<run_id>.txt plus <run_id>.collapsed or <run_id>.pstats.
+
+With DISABLE_WP_PUBLISH=true nothing is written to WordPress or social
+networks, so a profile can be taken locally against real Gemini calls.
+
+Settings (.env):
+    PROFILE_DIR=profiles
+    PROFILE_INTERVAL_MS=5
+
+Usage:
+    python thenextai_publisher.py --publish-now --profile            # sampling
+    python thenextai_publisher.py --publish-now --profile cprofile
+    curl -X POST -H 'X-Profile: sampling' http://localhost:8000/publish-now
+"""
+import io
+import os
+import sys
+import time
+import pstats
+import cProfile
+import threading
+import functools
+from collections import Counter
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+load_dotenv()
+
+import run_ledger
+
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '5'))
+
+MODE_SAMPLING = 'sampling'
+MODE_CPROFILE = 'cprofile'
+MODES = (MODE_SAMPLING, MODE_CPROFILE)
+
+STATE_CPU = 'cpu'
+STATE_NETWORK = 'network'
+STATE_LOCK = 'lock'
+STATE_WAIT = 'wait'
+
+# Листовые кадры, в которых поток ждет сеть или другой поток
+_NETWORK_FILES = ('socket.py', 'ssl.py', 'selectors.py')
+_NETWORK_PACKAGES = ('httpcore', 'urllib3', 'h11', 'http/client.py', 'grpc')
+_LOCK_FILES = ('threading.py', 'queue.py', 'concurrent/futures')
+
+# Доля интервала, которую поток должен провести на CPU, чтобы выборка считалась CPU
+_CPU_SHARE = 0.5
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _wait_kind(frame):
+    path = frame.f_code.co_filename.replace('\\', '/')
+    if path.endswith(_NETWORK_FILES) or any(package in path for package in _NETWORK_PACKAGES):
+        return STATE_NETWORK
+    if any(part in path for part in _LOCK_FILES):
+        return STATE_LOCK
+    return STATE_WAIT
+
+
+def _thread_cpu(ident):
+    """CPU seconds of a thread (Linux/BSD), or None where unsupported"""
+    if not hasattr(time, 'pthread_getcpuclockid'):
+        return None
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(ident))
+    except (OSError, OverflowError):
+        return None
+
+
+class SamplingProfiler:
+    """Wall-clock stack sampler for the calling thread and threads it starts"""
+
+    def __init__(self, interval=PROFILE_INTERVAL_MS / 1000):
+        self.interval = interval
+        self.stacks = Counter()
+        self.states = Counter()
+        self.leaves = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        own = threading.get_ident()
+        # Потоки, существовавшие до запуска (кроме вызывающего), к прогону не относятся
+        self._ignored = {thread.ident for thread in threading.enumerate()} - {own}
+        self._cpu = {}
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        me = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for ident, frame in frames.items():
+                if ident == me or ident in self._ignored:
+                    continue
+                self._sample(ident, names.get(ident, str(ident)), frame)
+
+    def _sample(self, ident, thread_name, frame):
+        cpu = _thread_cpu(ident)
+        previous = self._cpu.get(ident)
+        self._cpu[ident] = cpu
+        if cpu is not None and previous is not None:
+            on_cpu = cpu - previous >= self.interval * _CPU_SHARE
+            state = STATE_CPU if on_cpu else _wait_kind(frame)
+        else:
+            # Без часов потока судим только по листовому кадру
+            state = _wait_kind(frame)
+            state = STATE_CPU if state == STATE_WAIT else state
+
+        labels = []
+        leaf = frame
+        while frame is not None:
+            labels.append(_frame_label(frame.f_code))
+            frame = frame.f_back
+        labels.append(thread_name)
+        labels.reverse()
+        if state != STATE_CPU:
+            labels.append(f"[{state}]")
+        self.stacks[';'.join(labels)] += 1
+        self.states[state] += 1
+        self.leaves[(state, _frame_label(leaf.f_code))] += 1
+        self.samples += 1
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def _summary_lines(report, details):
+    lines = [
+        f"Run: {report['run_id']} ({report['mode']}), {report['started_at']}",
+        f"Wall time: {report['wall_seconds']:.2f}s, process CPU: {report['cpu_seconds']:.2f}s "
+        f"({report['cpu_seconds'] / report['wall_seconds']:.0%} of wall)" if report['wall_seconds'] else "",
+    ]
+    breakdown = report.get('breakdown')
+    if breakdown:
+        total = sum(breakdown.values())
+        lines.append(f"Samples: {total} (every {PROFILE_INTERVAL_MS:g} ms per thread)")
+        for state in (STATE_CPU, STATE_NETWORK, STATE_LOCK, STATE_WAIT):
+            lines.append(f"  {state:<8}{breakdown.get(state, 0):>8}  {breakdown.get(state, 0) / total:.0%}")
+    return lines + [""] + details
+
+
+def _write(run_id, suffix, data, mode='w'):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{run_id}{suffix}")
+    with open(path, mode) as f:
+        f.write(data)
+    return path
+
+
+def profile_call(func, *args, mode=MODE_SAMPLING, **kwargs):
+    """Run `func` under the profiler; returns (result, report dict).
+
+    The report has the run id, wall and CPU seconds, the sample breakdown
+    (sampling mode) and the paths of the written files. An exception of
+    `func` is re-raised after the profile is written.
+    """
+    if mode not in MODES:
+        raise ValueError(f"unknown profile mode {mode!r}, expected one of {', '.join(MODES)}")
+    started_at = datetime.now(timezone.utc).isoformat()
+    profiler = SamplingProfiler() if mode == MODE_SAMPLING else cProfile.Profile()
+    wall_started = time.perf_counter()
+    cpu_started = time.process_time()
+    result = error = None
+    if mode == MODE_SAMPLING:
+        profiler.start()
+    else:
+        profiler.enable()
+    try:
+        result = func(*args, **kwargs)
+    except Exception as e:
+        error = e
+    finally:
+        if mode == MODE_SAMPLING:
+            profiler.stop()
+        else:
+            profiler.disable()
+
+    run_id = run_ledger.last_run_id() or datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')
+    report = {
+        'run_id': run_id, 'mode': mode, 'started_at': started_at,
+        'wall_seconds': round(time.perf_counter() - wall_started, 3),
+        'cpu_seconds': round(time.process_time() - cpu_started, 3),
+        'files': [],
+    }
+    if mode == MODE_SAMPLING:
+        report['breakdown'] = dict(profiler.states)
+        report['files'].append(_write(run_id, '.collapsed', profiler.collapsed()))
+        details = ["Top leaf frames:"]
+        for (state, label), count in profiler.leaves.most_common(25):
+            details.append(f"  {count:>6}  {state:<8}{label}")
+    else:
+        path = os.path.join(PROFILE_DIR, f"{run_id}.pstats")
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profiler.dump_stats(path)
+        report['files'].append(path)
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(30)
+        details = [stream.getvalue()]
+    report['files'].insert(0, _write(run_id, '.txt', "\n".join(_summary_lines(report, details)) + "\n"))
+
+    if error is not None:
+        raise error
+    return result, report
+
+
+def profiled(func, mode=MODE_SAMPLING):
+    """Wrap `func` so that every call is profiled; dict results get a `profile` key"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        result, report = profile_call(func, *args, mode=mode, **kwargs)
+        if isinstance(result, dict):
+            result = dict(result, profile=report)
+        return result
+    return wrapper
+
+
+def print_summary(report):
+    print(f"🔬 Профиль прогона {report['run_id']} ({report['mode']}):")
+    print(f"   Время: {report['wall_seconds']:.2f}s, CPU процесса: {report['cpu_seconds']:.2f}s")
+    breakdown = report.get('breakdown')
+    if breakdown:
+        total = sum(breakdown.values()) or 1
+        print("   " + ", ".join(f"{state} {breakdown.get(state, 0) / total:.0%}"
+                               for state in (STATE_CPU, STATE_NETWORK, STATE_LOCK, STATE_WAIT)))
+    for path in report['files']:
+        print(f"   📄 {path}")
@@ -0,0 +1,231 @@
+"""prompt_cache.py
+
+Context caching of static prompt prefixes (Gemini cached content).
+
+The article and social prompts consist of a long, fixed instruction block and
+a short variable part. The fixed block is sent once as cached content with a
+managed TTL and each request only carries the variable part plus a reference
+to the cache. Cache entries are keyed by sha256(model + instruction), so a
+changed instruction automatically gets a new cache, and an existing cache
+with the same key is reused after a restart. Caches belong to the project of
+the API key, so entries are kept per key_id of the shared key pool.
+
+If explicit caching is unavailable (SDK without `caches`, instruction below
+the model's minimum cacheable token count, API error), the instruction is sent
+as `system_instruction` instead. It stays byte-identical and first in the
+request, which still lets the API apply implicit prefix caching. An
+instruction estimated below the minimum (MIN_CACHE_TOKENS, ~4 characters per
+token) is not even tried; a failed create is remembered per (key, model,
+instruction) and retried after an hour.
+
+Settings (.env):
+    GEMINI_PROMPT_CACHE=true
+    GEMINI_PROMPT_CACHE_TTL=3600
+"""
+import os
+import time
+import hashlib
+import threading
+from dotenv import load_dotenv
+load_dotenv()
+
+import key_pool
+
+try:
+    from google.genai.types import GenerateContentConfig, CreateCachedContentConfig, UpdateCachedContentConfig
+    HAS_GENAI = True
+except Exception:
+    HAS_GENAI = False
+
+PROMPT_CACHE_ENABLED = os.getenv('GEMINI_PROMPT_CACHE', 'true').lower() == 'true'
+PROMPT_CACHE_TTL = int(os.getenv('GEMINI_PROMPT_CACHE_TTL', '3600'))
+
+DISPLAY_NAME_PREFIX = 'autoposter-'
+
+# Минимальный размер явного кэша (токены); меньшие инструкции отправляются как system_instruction
+MIN_CACHE_TOKENS = {'gemini-2.5-pro': 4096}
+DEFAULT_MIN_CACHE_TOKENS = 1024
+CHARS_PER_TOKEN = 4
+
+
+def min_cache_tokens(model: str) -> int:
+    for prefix, tokens in MIN_CACHE_TOKENS.items():
+        if model.startswith(prefix):
+            return tokens
+    return DEFAULT_MIN_CACHE_TOKENS
+
+
+class PromptCache:
+    """Creates, reuses and extends cached contents for static instructions"""
+
+    def __init__(self, ttl_seconds: int = PROMPT_CACHE_TTL, refresh_margin: int = 120,
+                 retry_unsupported_after: int = 3600, enabled: bool = PROMPT_CACHE_ENABLED):
+        self.ttl_seconds = ttl_seconds
+        self.refresh_margin = refresh_margin
+        self.retry_unsupported_after = retry_unsupported_after
+        self.enabled = enabled
+        self._entries = {}       # (key_id, key) -> {'name': ..., 'expires_at': ...}
+        self._unsupported = {}   # (key_id, model, key) -> time when caching failed
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'created': 0, 'extended': 0, 'fallbacks': 0}
+
+    @staticmethod
+    def cache_key(model: str, system_instruction: str) -> str:
+        return hashlib.sha256(f"{model}\0{system_instruction}".encode('utf-8')).hexdigest()[:16]
+
+    @staticmethod
+    def _key_id(client):
+        # Клиенты пула общие для процесса; чужой клиент (тесты, скрипты) - по объекту
+        return key_pool.client_key_id(client) or f"client-{id(client)}"
+
+    def _find_existing(self, client, key):
+        """Look for a live cache created earlier (e.g. by a previous process)"""
+        try:
+            for cached in client.caches.list():
+                if cached.display_name == DISPLAY_NAME_PREFIX + key and cached.expire_time:
+                    expires_at = cached.expire_time.timestamp()
+                    if expires_at - time.time() > self.refresh_margin:
+                        return {'name': cached.name, 'expires_at': expires_at}
+        except Exception as e:
+            print(f"[prompt_cache] Could not list caches: {e}")
+        return None
+
+    def _create(self, client, model, system_instruction, key):
+        cached = client.caches.create(
+            model=model,
+            config=CreateCachedContentConfig(
+                display_name=DISPLAY_NAME_PREFIX + key,
+                system_instruction=system_instruction,
+                ttl=f"{self.ttl_seconds}s",
+            )
+        )
+        self.stats['created'] += 1
+        print(f"[prompt_cache] Created cache {cached.name} for {model} (ttl={self.ttl_seconds}s)")
+        return {'name': cached.name, 'expires_at': time.time() + self.ttl_seconds}
+
+    def _extend(self, client, entry):
+        client.caches.update(
+            name=entry['name'],
+            config=UpdateCachedContentConfig(ttl=f"{self.ttl_seconds}s")
+        )
+        self.stats['extended'] += 1
+        return {'name': entry['name'], 'expires_at': time.time() + self.ttl_seconds}
+
+    def cached_content_name(self, client, model: str, system_instruction: str):
+        """Name of a live cache holding `system_instruction`, or None to fall back"""
+        if not self.enabled or not HAS_GENAI or client is None:
+            return None
+        if len(system_instruction) // CHARS_PER_TOKEN < min_cache_tokens(model):
+            return None
+
+        key = self.cache_key(model, system_instruction)
+        key_id = self._key_id(client)
+        slot = (key_id, key)
+        unsupported_slot = (key_id, model, key)
+        with self._lock:
+            failed_at = self._unsupported.get(unsupported_slot)
+            if failed_at and time.time() - failed_at < self.retry_unsupported_after:
+                return None
+
+            entry = self._entries.get(slot)
+            try:
+                if entry is None:
+                    entry = self._find_existing(client, key)
+                if entry is not None and entry['expires_at'] - time.time() <= 0:
+                    entry = None
+                if entry is None:
+                    entry = self._create(client, model, system_instruction, key)
+                elif entry['expires_at'] - time.time() < self.refresh_margin:
+                    entry = self._extend(client, entry)
+                else:
+                    self.stats['hits'] += 1
+            except Exception as e:
+                # Например, инструкция короче минимального размера кэша для модели
+                print(f"[prompt_cache] Caching unavailable for {model}, using system_instruction: {e}")
+                self._unsupported[unsupported_slot] = time.time()
+                self._entries.pop(slot, None)
+                return None
+
+            self._entries[slot] = entry
+            return entry['name']
+
+    def invalidate(self, client, model: str, system_instruction: str):
+        """Forget a cache (e.g. after 'cached content not found')"""
+        with self._lock:
+            self._entries.pop((self._key_id(client), self.cache_key(model, system_instruction)), None)
+
+    def generation_config(self, client, model: str, system_instruction: str, **generation_kwargs):
+        """GenerateContentConfig referencing the cached instruction (or carrying it inline)"""
+        name = self.cached_content_name(client, model, system_instruction)
+        if name:
+            return GenerateContentConfig(cached_content=name, **generation_kwargs)
+        self.stats['fallbacks'] += 1
+        return GenerateContentConfig(system_instruction=system_instruction, **generation_kwargs)
+
+    def generate_content(self, client, model: str, system_instruction: str, contents, **generation_kwargs):
+        """client.models.generate_content with the instruction taken from the cache.
+
+        If the API no longer knows the cache (expired or deleted), the cache is
+        recreated and the request repeated once.
+        """
+        try:
+            return client.models.generate_content(
+                model=model,
+                contents=contents,
+                config=self.generation_config(client, model, system_instruction, **generation_kwargs)
+            )
+        except Exception as e:
+            if not is_cache_miss_error(e):
+                raise
+            print(f"[prompt_cache] Cache for {model} is gone, recreating: {e}")
+            self.invalidate(client, model, system_instruction)
+            return client.models.generate_content(
+                model=model,
+                contents=contents,
+                config=self.generation_config(client, model, system_instruction, **generation_kwargs)
+            )
+
+
+    def generate_content_stream(self, client, model: str, system_instruction: str, contents, **generation_kwargs):
+        """Streaming counterpart of generate_content (a generator of chunks).
+
+        A missing cache surfaces when the first chunk is read, so the stream
+        is reopened once in that case. Closing this generator closes the
+        underlying stream.
+        """
+        for attempt in range(2):
+            stream = client.models.generate_content_stream(
+                model=model,
+                contents=contents,
+                config=self.generation_config(client, model, system_instruction, **generation_kwargs)
+            )
+            try:
+                iterator = iter(stream)
+                try:
+                    first = next(iterator)
+                except StopIteration:
+                    return
+                except Exception as e:
+                    if attempt or not is_cache_miss_error(e):
+                        raise
+                    print(f"[prompt_cache] Cache for {model} is gone, recreating: {e}")
+                    self.invalidate(client, model, system_instruction)
+                    continue
+                yield first
+                yield from iterator
+                return
+            finally:
+                if hasattr(stream, 'close'):
+                    stream.close()
+
+
+def is_cache_miss_error(error: Exception) -> bool:
+    """True if the API rejected a request because the referenced cache is gone"""
+    error_str = str(error).lower()
+    return 'cachedcontent' in error_str.replace(' ', '').replace('_', '') and (
+        'not found' in error_str or 'expired' in error_str or 'permission' in error_str
+    )
+
+
+# Общий кэш для всех клиентов процесса
+PROMPT_CACHE = PromptCache()
@@ -0,0 +1,285 @@
+"""run_ledger.py
+
+Persistent per-run, per-stage timings of the publishing pipeline.
+
+A pipeline run (a scheduled publication, a prefetch, an API job) is wrapped
+in `run(kind)`; every metrics stage timer finished inside it (article, image,
+upload, terms, wordpress, social, publish) becomes one row of
+`pipeline_stages`: start and end time, duration, bytes received/sent,
+Gemini retries and outcome. The run itself goes to `pipeline_runs`. Rows are
+buffered in memory and written in one transaction when the run ends.
+
+`report(days)` compares p50/p95/p99 of every stage over the last `days`
+with the window of the same length before it and flags stages whose p95
+grew by more than RUN_REGRESSION_THRESHOLD.
+
+Settings (.env):
+    RUN_REGRESSION_THRESHOLD=0.2   # +20% p95 = regression
+    RUN_REPORT_MIN_SAMPLES=5       # fewer samples in a window = no verdict
+
+Usage:
+    python run_ledger.py [--days 7]
+    python thenextai_publisher.py --report [--days 7]
+"""
+import os
+import time
+import uuid
+import sqlite3
+import functools
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+load_dotenv()
+
+import metrics
+import tracing
+from usage_ledger import percentile
+from deadline import DeadlineExceeded
+
+DB_FILE = 'storage.db'
+
+REGRESSION_THRESHOLD = float(os.getenv('RUN_REGRESSION_THRESHOLD', '0.2'))
+MIN_SAMPLES = int(os.getenv('RUN_REPORT_MIN_SAMPLES', '5'))
+
+_current_run = contextvars.ContextVar('pipeline_run', default=None)
+_last_run_id = contextvars.ContextVar('last_pipeline_run_id', default=None)
+
+
+def ensure_schema(conn):
+    conn.execute("""CREATE TABLE IF NOT EXISTS pipeline_runs (
+        run_id TEXT PRIMARY KEY,
+        kind TEXT,
+        plan_id INTEGER,
+        started_at TEXT,
+        finished_at TEXT,
+        duration_ms REAL,
+        outcome TEXT,
+        error TEXT
+    )""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS pipeline_stages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        run_id TEXT,
+        stage TEXT,
+        backend TEXT,
+        started_at TEXT,
+        ended_at TEXT,
+        duration_ms REAL,
+        bytes_in INTEGER DEFAULT 0,
+        bytes_out INTEGER DEFAULT 0,
+        retries INTEGER DEFAULT 0,
+        outcome TEXT,
+        error TEXT
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_pipeline_stages_stage ON pipeline_stages(stage, started_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_pipeline_runs_started ON pipeline_runs(started_at)")
+    conn.commit()
+
+
+def _connect():
+    conn = sqlite3.connect(DB_FILE, timeout=30)
+    ensure_schema(conn)
+    return conn
+
+
+def _iso(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+
+class Run:
+    """One pipeline run; set `.outcome` to mark a handled failure"""
+
+    def __init__(self, kind, plan_id=None):
+        self.run_id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.plan_id = plan_id
+        self.outcome = metrics.OUTCOME_OK
+        self.error = None
+        self.stages = []
+
+    def add_stage(self, stage_timer):
+        self.stages.append((self.run_id, stage_timer.stage, stage_timer.backend, _iso(stage_timer.started_at),
+                            _iso(stage_timer.started_at + stage_timer.duration),
+                            round(stage_timer.duration * 1000, 1), stage_timer.bytes_in, stage_timer.bytes_out,
+                            stage_timer.retries, stage_timer.outcome, stage_timer.error))
+
+    def save(self, started_at, duration):
+        try:
+            conn = _connect()
+            with conn:
+                conn.execute("""INSERT OR REPLACE INTO pipeline_runs
+                                (run_id, kind, plan_id, started_at, finished_at, duration_ms, outcome, error)
+                                VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                             (self.run_id, self.kind, self.plan_id, _iso(started_at), _iso(started_at + duration),
+                              round(duration * 1000, 1), self.outcome, self.error))
+                conn.executemany("""INSERT INTO pipeline_stages
+                                    (run_id, stage, backend, started_at, ended_at, duration_ms,
+                                     bytes_in, bytes_out, retries, outcome, error)
+                                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", self.stages)
+            conn.close()
+        except Exception as e:
+            print(f"[run_ledger] Could not save run {self.run_id}: {e}")
+
+
+@contextmanager
+def run(kind, plan_id=None):
+    """Record the stages finished inside the block as one pipeline run"""
+    current = Run(kind, plan_id)
+    token = _current_run.set(current)
+    started_at = time.time()
+    started = time.monotonic()
+    try:
+        with tracing.trace(current.run_id, kind):
+            yield current
+    except BaseException as e:
+        current.outcome = metrics.OUTCOME_TIMEOUT if isinstance(e, DeadlineExceeded) else metrics.OUTCOME_ERROR
+        current.error = str(e)
+        raise
+    finally:
+        _current_run.reset(token)
+        _last_run_id.set(current.run_id)
+        current.save(started_at, time.monotonic() - started)
+
+
+def recorded(kind, falsy_is_error=False):
+    """Decorator running every call of a function as a pipeline run of `kind`"""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with run(kind) as current:
+                result = func(*args, **kwargs)
+                if falsy_is_error and not result:
+                    current.outcome = metrics.OUTCOME_ERROR
+                return result
+        return wrapper
+    return decorate
+
+
+def current_run_id():
+    """Id of the run in progress in this context, or None"""
+    current = _current_run.get()
+    return current.run_id if current is not None else None
+
+
+def last_run_id():
+    """Id of the last run finished in this thread/context (profiling.py names its files after it)"""
+    return _last_run_id.get()
+
+
+def annotate(**fields):
+    """Set fields (e.g. plan_id) of the run in progress, if any"""
+    current = _current_run.get()
+    if current is not None:
+        for name, value in fields.items():
+            setattr(current, name, value)
+
+
+def _on_stage(stage_timer):
+    current = _current_run.get()
+    if current is not None:
+        current.add_stage(stage_timer)
+
+
+metrics.add_stage_listener(_on_stage)
+
+
+def _window_stats(conn, since, until):
+    """{(stage, backend): {...}} for stages started in [since, until)"""
+    cur = conn.execute("""SELECT stage, backend, duration_ms, bytes_in, bytes_out, retries, outcome
+                          FROM pipeline_stages WHERE started_at >= ? AND started_at < ?
+                          ORDER BY stage, backend, duration_ms""", (since, until))
+    stats = {}
+    for stage, backend, duration_ms, bytes_in, bytes_out, retries, outcome in cur.fetchall():
+        entry = stats.setdefault((stage, backend or ''), {'durations': [], 'bytes_in': 0, 'bytes_out': 0,
+                                                          'retries': 0, 'failures': 0})
+        entry['durations'].append(duration_ms)
+        entry['bytes_in'] += bytes_in or 0
+        entry['bytes_out'] += bytes_out or 0
+        entry['retries'] += retries or 0
+        if outcome != metrics.OUTCOME_OK:
+            entry['failures'] += 1
+    return stats
+
+
+def report(days=7, now=None):
+    """Per-stage percentiles for the last `days` against the previous window"""
+    now = now or datetime.now(timezone.utc)
+    until = now.isoformat()
+    since = (now - timedelta(days=days)).isoformat()
+    previous_since = (now - timedelta(days=2 * days)).isoformat()
+    conn = _connect()
+    current = _window_stats(conn, since, until)
+    previous = _window_stats(conn, previous_since, since)
+
+    cur = conn.execute("""SELECT kind, COUNT(*), SUM(CASE WHEN outcome != 'ok' THEN 1 ELSE 0 END)
+                          FROM pipeline_runs WHERE started_at >= ? AND started_at < ?
+                          GROUP BY kind ORDER BY kind""", (since, until))
+    runs = [{'kind': kind, 'runs': count, 'failures': failures} for kind, count, failures in cur.fetchall()]
+    conn.close()
+
+    stages = []
+    for key in sorted(set(current) | set(previous)):
+        now_stats = current.get(key)
+        before = previous.get(key)
+        durations = now_stats['durations'] if now_stats else []
+        previous_durations = before['durations'] if before else []
+        row = {
+            'stage': key[0], 'backend': key[1], 'count': len(durations),
+            'p50_ms': percentile(durations, 50), 'p95_ms': percentile(durations, 95),
+            'p99_ms': percentile(durations, 99),
+            'previous_count': len(previous_durations), 'previous_p95_ms': percentile(previous_durations, 95),
+            'bytes_in': now_stats['bytes_in'] if now_stats else 0,
+            'bytes_out': now_stats['bytes_out'] if now_stats else 0,
+            'retries': now_stats['retries'] if now_stats else 0,
+            'failures': now_stats['failures'] if now_stats else 0,
+            'change': None, 'regression': False,
+        }
+        # Сравниваем только при достаточном числе замеров в обоих окнах
+        if len(durations) >= MIN_SAMPLES and len(previous_durations) >= MIN_SAMPLES and row['previous_p95_ms']:
+            row['change'] = row['p95_ms'] / row['previous_p95_ms'] - 1
+            row['regression'] = row['change'] > REGRESSION_THRESHOLD
+        stages.append(row)
+    return {'days': days, 'since': since, 'until': until, 'runs': runs, 'stages': stages}
+
+
+def print_report(days=7):
+    data = report(days)
+
+    def fmt_ms(value):
+        return f"{value / 1000:.1f}s" if value is not None else "-"
+
+    def fmt_kb(value):
+        return f"{value / 1024:.1f}K" if value else "-"
+
+    print(f"⏱️  Этапы конвейера за {days} дн. (сравнение с предыдущими {days} дн.):")
+    if not data['stages']:
+        print("   Нет данных")
+        return
+    for row in data['runs']:
+        print(f"   Запуски {row['kind']}: {row['runs']} (ошибок: {row['failures']})")
+
+    print(f"\n   {'Этап':<24}{'N':>6}{'p50':>8}{'p95':>8}{'p99':>8}{'Вход':>8}{'Выход':>8}"
+          f"{'Повт.':>6}{'Ошиб.':>6}{'p95 было':>10}{'Δ':>8}")
+    for row in data['stages']:
+        name = f"{row['stage']}/{row['backend']}" if row['backend'] else row['stage']
+        change = f"{row['change']:+.0%}" if row['change'] is not None else "-"
+        flag = "  ⚠️  регрессия" if row['regression'] else ""
+        print(f"   {name:<24}{row['count']:>6}{fmt_ms(row['p50_ms']):>8}{fmt_ms(row['p95_ms']):>8}"
+              f"{fmt_ms(row['p99_ms']):>8}{fmt_kb(row['bytes_in']):>8}{fmt_kb(row['bytes_out']):>8}"
+              f"{row['retries']:>6}{row['failures']:>6}{fmt_ms(row['previous_p95_ms']):>10}{change:>8}{flag}")
+
+    regressions = [row for row in data['stages'] if row['regression']]
+    if regressions:
+        print(f"\n   ⚠️  Регрессии p95 (> +{REGRESSION_THRESHOLD:.0%}): "
+              f"{', '.join(row['stage'] + ('/' + row['backend'] if row['backend'] else '') for row in regressions)}")
+    else:
+        print(f"\n   ✅ Регрессий p95 (> +{REGRESSION_THRESHOLD:.0%}) нет")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Отчет о длительности этапов конвейера')
+    parser.add_argument('--days', type=int, default=7, help='Период отчета в днях')
+    args = parser.parse_args()
+    print_report(args.days)
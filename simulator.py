@@ -0,0 +1,403 @@
+"""simulator.py
+
+Discrete-event simulation of the publishing scheduler in virtual time.
+
+Takes the current `plans` queue (priorities, publish windows, categories and
+their cadence) and replays the scheduler of thenextai_publisher.py against it:
+a check every 5 minutes, the adaptive publish interval
+(plan_scheduler.publish_interval), category cadence, quota admission
+(usage_ledger.check_admission) and the 60 minute pause after a failed
+attempt. Each attempt draws a past publish run from the run ledger (its
+duration and outcome), so the measured latency distribution and failure
+rate carry over; Gemini tokens and requests per attempt come from the usage
+ledger. Without history the defaults below are used.
+
+With several workers a new publication may start while others are running
+(the interval is counted from the latest start or publication; a category
+with a cadence runs one publication at a time), and Gemini
+requests of overlapping runs queue for the key pool (every key serves one
+request per key_pool.MIN_REQUEST_INTERVAL, or GEMINI_KEY_RPM).
+
+Predicts the backlog drain date, publications, failures and quota usage per
+day and worker utilization; several --workers values are compared side by
+side. Prefetch is not modelled. Nothing is written to storage.db.
+
+Usage:
+    python simulator.py                                # current settings, 1 worker
+    python simulator.py --workers 1,2,4 --interval-days 0
+    python simulator.py --burst-min-hours 6 --daily-tokens 2000000
+    python simulator.py --extra-plans 20000 --stage-scale image=0.5 --json
+"""
+import math
+import json
+import heapq
+import random
+import sqlite3
+import argparse
+from collections import defaultdict, deque
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+load_dotenv()
+
+import key_pool
+import usage_ledger
+import plan_scheduler
+from plan_scheduler import normalize_timestamp
+
+DB_FILE = 'storage.db'
+
+# Как в thenextai_publisher.py: проверка каждые 5 минут, пауза после ошибки 1 час
+CHECK_INTERVAL_SECONDS = 300
+RETRY_DELAY_MINUTES = 60
+
+# Прогон без истории в журнале прогонов
+DEFAULT_RUN_SECONDS = 120
+DEFAULT_FAILURE_RATE = 0.05
+HISTORY_DAYS = 30
+MAX_DAYS = 3650
+
+OUTCOME_OK = 'ok'
+
+
+def _rows(conn, sql, params=()):
+    """Query result, or [] when the table does not exist yet"""
+    try:
+        return conn.execute(sql, params).fetchall()
+    except sqlite3.OperationalError as e:
+        # Любая другая ошибка (нет колонки, БД заблокирована) не должна выглядеть как пустая очередь
+        if 'no such table' not in str(e):
+            raise
+        return []
+
+
+def _ts(value):
+    value = normalize_timestamp(value)
+    return datetime.fromisoformat(value).timestamp() if value else None
+
+
+def load_queue(conn):
+    """Pending plans, category cadence and the last publication time"""
+    plans = [(plan_id, category, priority or 0, created_at or '', _ts(publish_after))
+             for plan_id, category, priority, created_at, publish_after in _rows(conn, """
+                 SELECT id, category, priority, created_at, publish_after FROM plans WHERE status = 'pending'""")]
+    cadence = {category: ((hours or 0) * 3600, _ts(last))
+               for category, hours, last in _rows(conn, """
+                   SELECT category, min_interval_hours, last_published_at FROM category_cadence""")}
+    last = _rows(conn, "SELECT published_at FROM posts ORDER BY published_at DESC LIMIT 1")
+    return plans, cadence, (_ts(last[0][0]) if last and last[0][0] else None)
+
+
+def load_history(conn, days=HISTORY_DAYS):
+    """Past publish runs: [(seconds, ok, {stage: seconds})] plus Gemini usage per attempt"""
+    since = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
+    stages = defaultdict(dict)
+    for run_id, stage, seconds in _rows(conn, """
+            SELECT s.run_id, s.stage, SUM(s.duration_ms) / 1000.0 FROM pipeline_stages s
+            JOIN pipeline_runs r ON r.run_id = s.run_id
+            WHERE r.kind = 'publish' AND r.started_at >= ? AND s.stage != 'publish'
+            GROUP BY s.run_id, s.stage""", (since,)):
+        stages[run_id][stage] = seconds
+    # Прогоны без плана (очередь пуста) - не попытки публикации
+    runs = [(duration_ms / 1000, outcome == OUTCOME_OK, stages.get(run_id, {}))
+            for run_id, duration_ms, outcome in _rows(conn, """
+                SELECT run_id, duration_ms, outcome FROM pipeline_runs
+                WHERE kind = 'publish' AND plan_id IS NOT NULL AND started_at >= ?""", (since,))]
+    job_tokens, job_requests = usage_ledger.estimate_job_usage(conn, window_days=days) \
+        if _rows(conn, "SELECT 1 FROM api_usage LIMIT 1") else (usage_ledger.DEFAULT_JOB_TOKENS,
+                                                                usage_ledger.DEFAULT_JOB_REQUESTS)
+    return {'runs': runs, 'job_tokens': job_tokens, 'job_requests': job_requests}
+
+
+def synthetic_plans(count, categories, start_id):
+    """Extra pending plans spread over the existing categories (what-if on a larger backlog)"""
+    categories = categories or [None]
+    return [(start_id + index, categories[index % len(categories)], 0, f"~{index:08d}", None)
+            for index in range(count)]
+
+
+class Simulation:
+    """One scenario; `run()` returns the result dict"""
+
+    def __init__(self, plans, cadence, last_publish, history, workers=1, interval_days=None, burst_threshold=None,
+                 burst_min_hours=None, quotas=None, keys=1, failure_rate=None, stage_scale=None, seed=0,
+                 start=None, max_days=MAX_DAYS):
+        self.rng = random.Random(seed)
+        self.workers = workers
+        self.interval = dict(interval_days=interval_days, burst_threshold=burst_threshold,
+                             burst_min_hours=burst_min_hours)
+        self.quotas = quotas or {}
+        self.job_tokens = history['job_tokens']
+        self.job_requests = history['job_requests']
+        self.failure_rate = failure_rate
+        self.start = start if start is not None else datetime.now(timezone.utc).timestamp()
+        self.horizon = self.start + max_days * 86400
+        self._prepare_runs(history['runs'], stage_scale or {})
+
+        rate = 1 / key_pool.MIN_REQUEST_INTERVAL if key_pool.MIN_REQUEST_INTERVAL else math.inf
+        if key_pool.KEY_RPM:
+            rate = min(rate, key_pool.KEY_RPM / 60)
+        self.request_gap = 1 / (rate * max(1, keys))
+        self.keys_free_at = 0.0
+
+        self.heads = defaultdict(list)
+        self.future = []
+        for plan_id, category, priority, created_at, publish_after in plans:
+            item = (-priority, created_at, plan_id)
+            if publish_after and publish_after > self.start:
+                self.future.append((publish_after, category, item))
+            else:
+                self.heads[category].append(item)
+        for heap in self.heads.values():
+            heapq.heapify(heap)
+        heapq.heapify(self.future)
+        self.pending = len(plans)
+        self.cadence = {category: hours for category, (hours, _last) in cadence.items()}
+        self.category_published = {category: last for category, (_hours, last) in cadence.items() if last}
+        self.last_publish = last_publish
+        self.last_start = None
+        self.in_flight = defaultdict(int)
+
+    def _prepare_runs(self, runs, stage_scale):
+        """Run durations with the --stage-scale what-if applied, split by outcome"""
+        self.ok_runs, self.failed_runs = [], []
+        for seconds, ok, stages in runs:
+            seconds -= sum(stages.get(stage, 0) * (1 - scale) for stage, scale in stage_scale.items())
+            (self.ok_runs if ok else self.failed_runs).append(max(0.0, seconds))
+        measured = len(self.failed_runs) / len(runs) if runs else DEFAULT_FAILURE_RATE
+        if self.failure_rate is None:
+            self.failure_rate = measured
+        self.ok_runs = self.ok_runs or self.failed_runs or [DEFAULT_RUN_SECONDS]
+        self.failed_runs = self.failed_runs or self.ok_runs
+
+    def _next_tick(self, at):
+        ticks = math.ceil((at - self.start) / CHECK_INTERVAL_SECONDS)
+        return self.start + max(0, ticks) * CHECK_INTERVAL_SECONDS
+
+    def _release(self, now):
+        while self.future and self.future[0][0] <= now:
+            _at, category, item = heapq.heappop(self.future)
+            heapq.heappush(self.heads[category], item)
+
+    def _category_ready_at(self, category):
+        interval = self.cadence.get(category)
+        last = self.category_published.get(category)
+        return last + interval if interval and last else None
+
+    def _pick(self, now):
+        """(category,) of the head the scheduler would choose now (same order as eligible_plans), or None"""
+        best = None
+        for category, heap in self.heads.items():
+            if not heap:
+                continue
+            ready_at = self._category_ready_at(category)
+            if ready_at and ready_at > now:
+                continue
+            # Категория с интервалом не публикуется дважды одновременно
+            if self.in_flight[category] and self.cadence.get(category):
+                continue
+            key = (heap[0][0], self.category_published.get(category, -1.0), heap[0][1])
+            if best is None or key < best[0]:
+                best = (key, category)
+        return (best[1],) if best else None
+
+    def _next_allowed(self):
+        marks = [mark for mark in (self.last_publish, self.last_start) if mark is not None]
+        if not marks:
+            return self.start
+        interval = plan_scheduler.publish_interval(self.pending, **self.interval).total_seconds()
+        return max(marks) + interval
+
+    def _admit(self, now, day):
+        """Mirror of usage_ledger.check_admission in virtual time"""
+        while self.minute_window and self.minute_window[0][0] <= now - 60:
+            self.minute_window.popleft()
+        minute_tokens = sum(tokens for _at, tokens, _requests in self.minute_window)
+        minute_requests = sum(requests for _at, _tokens, requests in self.minute_window)
+        checks = (
+            ('daily_tokens', day['tokens'], self.job_tokens),
+            ('daily_requests', day['requests'], self.job_requests),
+            ('minute_tokens', minute_tokens, self.job_tokens),
+            ('minute_requests', minute_requests, self.job_requests),
+        )
+        return all(not self.quotas.get(name) or used + projected <= self.quotas[name]
+                   for name, used, projected in checks)
+
+    def _duration(self, now):
+        ok = self.rng.random() >= self.failure_rate
+        seconds = self.rng.choice(self.ok_runs if ok else self.failed_runs)
+        # Запросы Gemini пересекающихся прогонов ждут свободный ключ
+        queued = max(0.0, self.keys_free_at - now)
+        self.keys_free_at = max(self.keys_free_at, now) + self.job_requests * self.request_gap
+        return seconds + queued, ok
+
+    def run(self):
+        days = defaultdict(lambda: {'published': 0, 'attempts': 0, 'failures': 0, 'quota_refusals': 0,
+                                    'tokens': 0, 'requests': 0})
+        self.minute_window = deque()
+        running = []
+        free = self.workers
+        busy_seconds = 0.0
+        retry_at = None
+        now = self.start
+        drained_at = self.start if not self.pending else None
+
+        while self.pending and now <= self.horizon:
+            while running and running[0][0] <= now:
+                finished, _seq, category, item, ok = heapq.heappop(running)
+                free += 1
+                self.in_flight[category] -= 1
+                day = days[datetime.fromtimestamp(finished, timezone.utc).date()]
+                if ok:
+                    self.pending -= 1
+                    self.last_publish = finished
+                    self.category_published[category] = finished
+                    day['published'] += 1
+                else:
+                    heapq.heappush(self.heads[category], item)
+                    day['failures'] += 1
+                    retry_at = finished + RETRY_DELAY_MINUTES * 60
+            if not self.pending:
+                drained_at = self.last_publish
+                break
+
+            self._release(now)
+            while free and (retry_at is None or retry_at <= now) and self._next_allowed() <= now:
+                picked = self._pick(now)
+                if picked is None:
+                    break
+                category, = picked
+                day = days[datetime.fromtimestamp(now, timezone.utc).date()]
+                day['attempts'] += 1
+                if not self._admit(now, day):
+                    day['quota_refusals'] += 1
+                    retry_at = now + RETRY_DELAY_MINUTES * 60
+                    break
+                item = heapq.heappop(self.heads[category])
+                seconds, ok = self._duration(now)
+                day['tokens'] += self.job_tokens
+                day['requests'] += self.job_requests
+                self.minute_window.append((now, self.job_tokens, self.job_requests))
+                heapq.heappush(running, (now + seconds, item[2], category, item, ok))
+                busy_seconds += seconds
+                self.last_start = now
+                self.in_flight[category] += 1
+                free -= 1
+
+            # Следующее событие: конец прогона или проверка, когда что-то может измениться
+            wake = [self._next_allowed(), retry_at]
+            wake += [self.future[0][0]] if self.future else []
+            wake += [self._category_ready_at(category) for category, heap in self.heads.items() if heap]
+            wake = [self._next_tick(at) for at in wake if at is not None and at > now]
+            candidates = wake + ([running[0][0]] if running else [])
+            if not candidates:
+                break
+            now = min(candidates)
+
+        elapsed = ((drained_at or now) - self.start) or 1
+        return {
+            'workers': self.workers,
+            'drained_at': datetime.fromtimestamp(drained_at, timezone.utc) if drained_at else None,
+            'remaining': self.pending,
+            'published': sum(day['published'] for day in days.values()),
+            'attempts': sum(day['attempts'] for day in days.values()),
+            'failures': sum(day['failures'] for day in days.values()),
+            'quota_refusals': sum(day['quota_refusals'] for day in days.values()),
+            'utilization': min(1.0, busy_seconds / (elapsed * self.workers)),
+            'days': [dict(date=date.isoformat(), **day) for date, day in sorted(days.items())],
+        }
+
+
+def simulate(workers=(1,), extra_plans=0, history_days=HISTORY_DAYS, **options):
+    """Load the queue and history from storage.db and run one scenario per worker count"""
+    conn = sqlite3.connect(DB_FILE)
+    if _rows(conn, "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'plans'"):
+        # Колонки category/priority/publish_after в базе, созданной до планировщика
+        plan_scheduler.ensure_schema(conn)
+    plans, cadence, last_publish = load_queue(conn)
+    history = load_history(conn, history_days)
+    conn.close()
+    if extra_plans:
+        categories = sorted({plan[1] for plan in plans}, key=str)
+        plans += synthetic_plans(extra_plans, categories, max((plan[0] for plan in plans), default=0) + 1)
+    results = [Simulation(plans, cadence, last_publish, history, workers=count, **options).run()
+               for count in workers]
+    return {
+        'plans': len(plans),
+        'history_runs': len(history['runs']),
+        'job_tokens': history['job_tokens'],
+        'job_requests': history['job_requests'],
+        'scenarios': results,
+    }
+
+
+def _quota_share(used, quota):
+    return f" ({used / quota:.0%})" if quota else ""
+
+
+def print_simulation(result, quotas, show_days=7):
+    print(f"🧮 Симуляция: {result['plans']} планов в очереди, история: {result['history_runs']} прогонов, "
+          f"~{result['job_tokens']} токенов и {result['job_requests']} запросов Gemini на публикацию")
+    if not result['history_runs']:
+        print(f"   ⚠️  Журнал прогонов пуст: прогон {DEFAULT_RUN_SECONDS} с, ошибки {DEFAULT_FAILURE_RATE:.0%}")
+    print(f"\n   {'Воркеры':>8}  {'Очередь опустеет':<18}{'Дней':>7}{'Опубл.':>8}{'Ошибок':>8}{'Квота':>7}"
+          f"{'Загрузка':>10}{'Токенов/день (пик)':>22}")
+    for scenario in result['scenarios']:
+        drained = scenario['drained_at']
+        days = len(scenario['days'])
+        peak = max((day['tokens'] for day in scenario['days']), default=0)
+        when = drained.strftime('%Y-%m-%d %H:%M') if drained else f"нет (+{scenario['remaining']})"
+        print(f"   {scenario['workers']:>8}  {when:<18}{days:>7}{scenario['published']:>8}{scenario['failures']:>8}"
+              f"{scenario['quota_refusals']:>7}{scenario['utilization']:>10.1%}"
+              f"{peak:>14}{_quota_share(peak, quotas.get('daily_tokens')):>8}")
+
+    scenario = result['scenarios'][0]
+    if scenario['days'] and show_days:
+        print(f"\n   По дням ({scenario['workers']} воркер(ов), первые {show_days}):")
+        print(f"   {'Дата':<12}{'Опубл.':>8}{'Попыток':>9}{'Ошибок':>8}{'Квота':>7}{'Токены':>12}{'Запросы':>9}")
+        for day in scenario['days'][:show_days]:
+            print(f"   {day['date']:<12}{day['published']:>8}{day['attempts']:>9}{day['failures']:>8}"
+                  f"{day['quota_refusals']:>7}{day['tokens']:>12}{day['requests']:>9}"
+                  f"{_quota_share(day['requests'], quotas.get('daily_requests'))}")
+
+
+def _stage_scale(values):
+    scale = {}
+    for value in values or []:
+        stage, _, factor = value.partition('=')
+        scale[stage] = float(factor)
+    return scale
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Симуляция очереди публикаций и квот в виртуальном времени')
+    parser.add_argument('--workers', default='1', help='Число воркеров, через запятую для сравнения (1,2,4)')
+    parser.add_argument('--interval-days', type=float, help='PUBLISH_INTERVAL_DAYS для симуляции')
+    parser.add_argument('--burst-threshold', type=int, help='BURST_BACKLOG_THRESHOLD для симуляции')
+    parser.add_argument('--burst-min-hours', type=float, help='BURST_MIN_INTERVAL_HOURS для симуляции')
+    parser.add_argument('--daily-tokens', type=int, default=usage_ledger.DAILY_TOKEN_QUOTA)
+    parser.add_argument('--daily-requests', type=int, default=usage_ledger.DAILY_REQUEST_QUOTA)
+    parser.add_argument('--minute-tokens', type=int, default=usage_ledger.MINUTE_TOKEN_QUOTA)
+    parser.add_argument('--minute-requests', type=int, default=usage_ledger.MINUTE_REQUEST_QUOTA)
+    parser.add_argument('--keys', type=int, default=max(1, len(key_pool.load_api_keys())), help='Число ключей Gemini')
+    parser.add_argument('--failure-rate', type=float, help='Доля неудачных прогонов (по умолчанию из журнала)')
+    parser.add_argument('--stage-scale', action='append', metavar='STAGE=K',
+                        help='Изменить длительность этапа, например image=0.5 (можно повторять)')
+    parser.add_argument('--extra-plans', type=int, default=0, help='Добавить синтетические планы к очереди')
+    parser.add_argument('--history-days', type=int, default=HISTORY_DAYS, help='Период истории прогонов')
+    parser.add_argument('--max-days', type=int, default=MAX_DAYS, help='Горизонт симуляции в днях')
+    parser.add_argument('--show-days', type=int, default=7, help='Сколько дней показать в таблице по дням')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help='Результат в JSON')
+    args = parser.parse_args()
+
+    quotas = {'daily_tokens': args.daily_tokens, 'daily_requests': args.daily_requests,
+              'minute_tokens': args.minute_tokens, 'minute_requests': args.minute_requests}
+    result = simulate(
+        workers=[int(count) for count in args.workers.split(',')], extra_plans=args.extra_plans,
+        history_days=args.history_days, interval_days=args.interval_days, burst_threshold=args.burst_threshold,
+        burst_min_hours=args.burst_min_hours, quotas=quotas, keys=args.keys, failure_rate=args.failure_rate,
+        stage_scale=_stage_scale(args.stage_scale), seed=args.seed, max_days=args.max_days)
+    if args.json:
+        print(json.dumps(result, default=str, indent=2))
+    else:
+        print_simulation(result, quotas, args.show_days)
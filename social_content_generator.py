@@ -6,44 +6,22 @@
 import time
 import re
 import json
-from gemini_client import GeminiClient
-
-
-class SocialContentGenerator:
-    """Генератор контента для публикаций в социальных сетях"""
-
-    def __init__(self):
-        self.client = GeminiClient()
-
-    def generate_social_posts(self, article_title: str, article_url: str, article_content: str = "", keywords: list = None):
-        """
-        Генерирует посты для всех социальных сетей
-
-        Args:
-            article_title: Заголовок статьи
-            article_url: URL опубликованной статьи
-            article_content: Содержимое статьи (опционально, для лучшего саммари)
-            keywords: Ключевые слова статьи
-
-        Returns:
-            dict: Посты для каждой социальной сети
-        """
-        if not self.client.client:
-            print("[social_content] Gemini client not available, using fallback")
-            return self._generate_fallback_posts(article_title, article_url, keywords)
-
-        try:
-            # Подготовка промпта
-            keywords_str = ", ".join(keywords) if keywords else "AI, technology"
-            content_preview = article_content[:500] if article_content else ""
-
-            prompt = f"""You are a social media marketing expert. Create engaging social media posts for an article.
-
-ARTICLE INFO:
-Title: {article_title}
-URL: {article_url}
-Keywords: {keywords_str}
-Content preview: {content_preview}
+from gemini_client import GeminiClient, http_options_for
+from prompt_cache import PROMPT_CACHE
+import model_router
+from model_router import MODEL_ROUTER
+
+SOCIAL_MODEL = 'gemini-2.5-flash'
+SOCIAL_MODELS = model_router.models_from_env('GEMINI_SOCIAL_MODELS', [SOCIAL_MODEL, 'gemini-2.5-flash-lite'])
+SOCIAL_GENERATION_CONFIG = dict(
+    temperature=0.9,
+    top_p=0.95,
+    top_k=40,
+    max_output_tokens=2048,
+)
+
+# Static part of the social prompt, sent once as cached content (see prompt_cache.py)
+SOCIAL_SYSTEM_INSTRUCTION = """You are a social media marketing expert. Create engaging social media posts for the article described in each request.
 
 TASK: Create social media posts for different platforms with these requirements:
 
@@ -87,58 +65,96 @@ TASK: Create social media posts for different platforms with these requirements:
 
 IMPORTANT OUTPUT FORMAT:
 Return ONLY valid JSON with this EXACT structure (no markdown, no code blocks):
-{{
-    "facebook": {{
+{
+    "facebook": {
         "text": "Engaging post text here",
         "hashtags": ["hashtag1", "hashtag2", "hashtag3"]
-    }},
-    "twitter": {{
+    },
+    "twitter": {
         "text": "Tweet text here",
         "hashtags": ["hashtag1", "hashtag2"]
-    }},
-    "threads": {{
+    },
+    "threads": {
         "text": "Threads post text here",
         "hashtags": ["hashtag1", "hashtag2", "hashtag3"]
-    }},
-    "vk": {{
+    },
+    "vk": {
         "text": "VK post text here",
         "hashtags": ["hashtag1", "hashtag2", "hashtag3"]
-    }},
-    "instagram": {{
+    },
+    "instagram": {
         "text": "Instagram caption here",
         "hashtags": ["hashtag1", "hashtag2", "hashtag3", "hashtag4", "hashtag5"]
-    }},
-    "telegram": {{
+    },
+    "telegram": {
         "text": "Telegram message here",
         "hashtags": ["hashtag1", "hashtag2", "hashtag3"]
-    }}
-}}
+    }
+}
 
 HASHTAG RULES:
 - Use topic-relevant hashtags
 - Mix popular and niche hashtags
 - Include "AI", "ArtificialIntelligence", "Technology" when relevant
 - NO spaces in hashtags
-- Capitalize words in hashtags for readability (e.g., #ArtificialIntelligence)
+- Capitalize words in hashtags for readability (e.g., #ArtificialIntelligence)"""
+
+
+class SocialContentGenerator:
+    """Генератор контента для публикаций в социальных сетях"""
+
+    def __init__(self):
+        self.client = GeminiClient()
+
+    def generate_social_posts(self, article_title: str, article_url: str, article_content: str = "", keywords: list = None, deadline=None):
+        """
+        Генерирует посты для всех социальных сетей
+
+        Args:
+            article_title: Заголовок статьи
+            article_url: URL опубликованной статьи
+            article_content: Содержимое статьи (опционально, для лучшего саммари)
+            keywords: Ключевые слова статьи
+            deadline: Дедлайн этапа (при нехватке времени используются шаблонные посты)
+
+        Returns:
+            dict: Посты для каждой социальной сети
+        """
+        if not self.client.client:
+            print("[social_content] Gemini client not available, using fallback")
+            return self._generate_fallback_posts(article_title, article_url, keywords)
+
+        try:
+            # Подготовка промпта
+            keywords_str = ", ".join(keywords) if keywords else "AI, technology"
+            content_preview = article_content[:500] if article_content else ""
+
+            # Статическая инструкция (SOCIAL_SYSTEM_INSTRUCTION) идет из кэша контекста,
+            # в запросе только данные статьи
+            prompt = f"""ARTICLE INFO:
+Title: {article_title}
+URL: {article_url}
+Keywords: {keywords_str}
+Content preview: {content_preview}
 
 Generate the posts now as valid JSON ONLY:"""
 
-            # Генерируем контент с retry logic
-            from google.genai.types import GenerateContentConfig
+            # Генерируем контент с retry logic на модели, выбранной маршрутизатором
+            model = MODEL_ROUTER.choose('social', SOCIAL_MODELS)
 
-            def make_request():
-                return self.client.client.models.generate_content(
-                    model='gemini-2.5-flash',
+            def make_request(client):
+                return PROMPT_CACHE.generate_content(
+                    client,
+                    model,
+                    SOCIAL_SYSTEM_INSTRUCTION,
                     contents=prompt,
-                    config=GenerateContentConfig(
-                        temperature=0.9,
-                        top_p=0.95,
-                        top_k=40,
-                        max_output_tokens=2048,
-                    )
+                    **SOCIAL_GENERATION_CONFIG,
+                    **http_options_for(deadline)
                 )
 
-            response = self.client._make_api_request_with_retry(make_request)
+            response = self.client._make_api_request_with_retry(make_request, stage='social', model=model,
+                                                             deadline=deadline)
+            self.client._log_token_usage(response, "social")
             response_text = response.text.strip()
 
             # Парсим JSON
@@ -5,11 +5,21 @@
 """
 import os
 import time
-import requests
 from dotenv import load_dotenv
+from deadline import request_timeout, check as check_deadline
+import metrics
+import http_client
+import tracing
 
 load_dotenv()
 
+# Адреса API (переопределяются для локальных заглушек, см. fake_services.py)
+FACEBOOK_GRAPH_URL = os.getenv('FACEBOOK_GRAPH_URL', 'https://graph.facebook.com').rstrip('/')
+VK_API_URL = os.getenv('VK_API_URL', 'https://api.vk.com').rstrip('/')
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org').rstrip('/')
+# Пауза между публикациями в разные сети
+SOCIAL_POST_PAUSE = float(os.getenv('SOCIAL_POST_PAUSE_SECONDS', '2'))
+
 
 class SocialMediaPublisher:
     """Базовый класс для публикации в социальные сети"""
@@ -18,7 +28,7 @@ class SocialMediaPublisher:
         self.platform_name = platform_name
         self.enabled = False
 
-    def publish(self, text: str, url: str = None, image_path: str = None):
+    def publish(self, text: str, url: str = None, image_path: str = None, deadline=None):
         """Публикует пост в социальную сеть"""
         raise NotImplementedError("Must be implemented in subclass")
 
@@ -41,14 +51,14 @@ class FacebookPublisher(SocialMediaPublisher):
         else:
             print(f"[{self.platform_name}] Disabled (missing credentials)")
 
-    def publish(self, text: str, url: str = None, image_path: str = None):
+    def publish(self, text: str, url: str = None, image_path: str = None, deadline=None):
         """Публикует пост на Facebook Page"""
         if not self.enabled:
             print(f"[{self.platform_name}] Skipped (not configured)")
             return None
 
         try:
-            api_url = f"https://graph.facebook.com/v18.0/{self.page_id}/feed"
+            api_url = f"{FACEBOOK_GRAPH_URL}/v18.0/{self.page_id}/feed"
 
             # Подготовка данных
             data = {
@@ -60,7 +70,7 @@ class FacebookPublisher(SocialMediaPublisher):
                 data['link'] = url
 
             # Публикация
-            response = requests.post(api_url, data=data, timeout=30)
+            response = http_client.request(self.platform_name, 'POST', api_url, data=data, timeout=request_timeout(deadline, 30))
             response.raise_for_status()
 
             result = response.json()
@@ -96,7 +106,7 @@ class TwitterPublisher(SocialMediaPublisher):
         else:
             print(f"[{self.platform_name}] Disabled (missing credentials)")
 
-    def publish(self, text: str, url: str = None, image_path: str = None):
+    def publish(self, text: str, url: str = None, image_path: str = None, deadline=None):
         """Публикует твит"""
         if not self.enabled:
             print(f"[{self.platform_name}] Skipped (not configured)")
@@ -111,6 +121,8 @@ class TwitterPublisher(SocialMediaPublisher):
                 print(f"[{self.platform_name}] ⚠️ tweepy not installed. Install: pip install tweepy")
                 return None
 
+            check_deadline(deadline, "tweet")
+
             # Аутентификация
             client = tweepy.Client(
                 bearer_token=self.bearer_token,
@@ -171,7 +183,7 @@ class ThreadsPublisher(SocialMediaPublisher):
             self.api = None
             return False
 
-    def publish(self, text: str, url: str = None, image_path: str = None):
+    def publish(self, text: str, url: str = None, image_path: str = None, deadline=None):
         """Публикует пост в Threads"""
         if not self.enabled:
             print(f"[{self.platform_name}] Skipped (temporarily disabled)")
@@ -229,7 +241,7 @@ class VKPublisher(SocialMediaPublisher):
         else:
             print(f"[{self.platform_name}] Disabled (missing credentials)")
 
-    def publish(self, text: str, url: str = None, image_path: str = None):
+    def publish(self, text: str, url: str = None, image_path: str = None, deadline=None):
         """Публикует пост на стену VK группы с изображением"""
         if not self.enabled:
             print(f"[{self.platform_name}] Skipped (not configured)")
@@ -254,14 +266,14 @@ class VKPublisher(SocialMediaPublisher):
             if image_path and os.path.exists(image_path):
                 try:
                     # Шаг 1: Получить upload URL
-                    upload_url_api = "https://api.vk.com/method/photos.getWallUploadServer"
+                    upload_url_api = f"{VK_API_URL}/method/photos.getWallUploadServer"
                     upload_params = {
                         'group_id': self.group_id,
                         'access_token': self.access_token,
                         'v': '5.131'
                     }
 
-                    response = requests.get(upload_url_api, params=upload_params, timeout=30)
+                    response = http_client.request(self.platform_name, 'GET', upload_url_api, params=upload_params, timeout=request_timeout(deadline, 30))
                     upload_url_data = response.json()
 
                     if 'error' in upload_url_data:
@@ -272,11 +284,11 @@ class VKPublisher(SocialMediaPublisher):
                         # Шаг 2: Загрузить фото на сервер VK
                         with open(image_path, 'rb') as photo:
                             files = {'photo': photo}
-                            upload_response = requests.post(upload_url, files=files, timeout=30)
+                            upload_response = http_client.request(self.platform_name, 'POST', upload_url, files=files, timeout=request_timeout(deadline, 30))
                             upload_result = upload_response.json()
 
                         # Шаг 3: Сохранить фото
-                        save_url = "https://api.vk.com/method/photos.saveWallPhoto"
+                        save_url = f"{VK_API_URL}/method/photos.saveWallPhoto"
                         save_params = {
                             'group_id': self.group_id,
                             'photo': upload_result['photo'],
@@ -286,7 +298,7 @@ class VKPublisher(SocialMediaPublisher):
                             'v': '5.131'
                         }
 
-                        save_response = requests.post(save_url, data=save_params, timeout=30)
+                        save_response = http_client.request(self.platform_name, 'POST', save_url, data=save_params, timeout=request_timeout(deadline, 30))
                         save_result = save_response.json()
 
                         if 'response' in save_result and len(save_result['response']) > 0:
@@ -300,8 +312,8 @@ class VKPublisher(SocialMediaPublisher):
                     # Продолжаем публикацию без изображения
 
             # Публикация поста
-            api_url = "https://api.vk.com/method/wall.post"
-            response = requests.post(api_url, data=params, timeout=30)
+            api_url = f"{VK_API_URL}/method/wall.post"
+            response = http_client.request(self.platform_name, 'POST', api_url, data=params, timeout=request_timeout(deadline, 30))
             response.raise_for_status()
 
             result = response.json()
@@ -375,7 +387,7 @@ class InstagramPublisher(SocialMediaPublisher):
             self.client = None
             return False
 
-    def publish(self, text: str, url: str = None, image_path: str = None):
+    def publish(self, text: str, url: str = None, image_path: str = None, deadline=None):
         """
         Публикует пост в Instagram с изображением
         ВАЖНО: Instagram требует изображение для публикации
@@ -389,6 +401,8 @@ class InstagramPublisher(SocialMediaPublisher):
             return None
 
         try:
+            check_deadline(deadline, "Instagram upload")
+
             # Аутентификация
             if not self.client:
                 if not self.authenticate():
@@ -429,7 +443,7 @@ class TelegramPublisher(SocialMediaPublisher):
         else:
             print(f"[{self.platform_name}] Disabled (missing credentials)")
 
-    def publish(self, text: str, url: str = None, image_path: str = None):
+    def publish(self, text: str, url: str = None, image_path: str = None, deadline=None):
         """Публикует пост в Telegram канал"""
         if not self.enabled:
             print(f"[{self.platform_name}] Skipped (not configured)")
@@ -443,7 +457,7 @@ class TelegramPublisher(SocialMediaPublisher):
 
             # Если есть изображение
             if image_path and os.path.exists(image_path):
-                api_url = f"https://api.telegram.org/bot{self.bot_token}/sendPhoto"
+                api_url = f"{TELEGRAM_API_URL}/bot{self.bot_token}/sendPhoto"
 
                 with open(image_path, 'rb') as photo:
                     files = {'photo': photo}
@@ -452,17 +466,17 @@ class TelegramPublisher(SocialMediaPublisher):
                         'caption': message[:1024],  # Telegram limit
                         'parse_mode': 'Markdown'
                     }
-                    response = requests.post(api_url, files=files, data=data, timeout=30)
+                    response = http_client.request(self.platform_name, 'POST', api_url, files=files, data=data, timeout=request_timeout(deadline, 30))
             else:
                 # Только текст
-                api_url = f"https://api.telegram.org/bot{self.bot_token}/sendMessage"
+                api_url = f"{TELEGRAM_API_URL}/bot{self.bot_token}/sendMessage"
                 data = {
                     'chat_id': self.channel_id,
                     'text': message,
                     'parse_mode': 'Markdown',
                     'disable_web_page_preview': False
                 }
-                response = requests.post(api_url, data=data, timeout=30)
+                response = http_client.request(self.platform_name, 'POST', api_url, data=data, timeout=request_timeout(deadline, 30))
 
             response.raise_for_status()
             result = response.json()
@@ -497,7 +511,7 @@ class SocialMediaCoordinator:
         enabled_count = sum(1 for p in self.publishers.values() if p.is_enabled())
         print(f"\n[SocialMediaCoordinator] Initialized with {enabled_count}/6 platforms enabled")
 
-    def publish_to_all(self, posts_data: dict, image_path: str = None):
+    def publish_to_all(self, posts_data: dict, image_path: str = None, deadline=None):
         """
         Публикует во все настроенные социальные сети
 
@@ -505,6 +519,7 @@ class SocialMediaCoordinator:
             posts_data: dict с данными постов для каждой платформы
                         Формат: {'facebook': {'text': '...', 'hashtags': [...], 'url': '...'}, ...}
             image_path: Путь к изображению (для Instagram)
+            deadline: Дедлайн этапа; после его истечения оставшиеся платформы пропускаются
 
         Returns:
             dict: Результаты публикаций для каждой платформы
@@ -520,6 +535,11 @@ class SocialMediaCoordinator:
                 results[platform_name] = {'success': False, 'reason': 'not_configured'}
                 continue
 
+            if deadline is not None and deadline.expired():
+                print(f"[{platform_name}] ⏱️ Skipped (deadline exceeded)")
+                results[platform_name] = {'success': False, 'reason': 'deadline_exceeded'}
+                continue
+
             if platform_name not in posts_data:
                 print(f"[{platform_name}] ⚠️ No post data provided")
                 results[platform_name] = {'success': False, 'reason': 'no_data'}
@@ -542,11 +562,15 @@ class SocialMediaCoordinator:
 
             try:
                 # Публикуем
-                post_id = publisher.publish(
-                    text=formatted_text,
-                    url=url,
-                    image_path=image_path
-                )
+                with metrics.timer('social', platform_name) as timing:
+                    post_id = publisher.publish(
+                        text=formatted_text,
+                        url=url,
+                        image_path=image_path,
+                        deadline=deadline
+                    )
+                    if not post_id:
+                        timing.outcome = metrics.OUTCOME_ERROR
 
                 if post_id:
                     results[platform_name] = {
@@ -557,8 +581,10 @@ class SocialMediaCoordinator:
                 else:
                     results[platform_name] = {'success': False, 'reason': 'publish_failed'}
 
-                # Задержка между публикациями
-                time.sleep(2)
+                # Задержка между публикациями (если хватает времени до дедлайна)
+                if SOCIAL_POST_PAUSE and (deadline is None or deadline.remaining() > SOCIAL_POST_PAUSE):
+                    with tracing.span('social pause', tracing.CAT_WAIT):
+                        time.sleep(SOCIAL_POST_PAUSE)
 
             except Exception as e:
                 print(f"[{platform_name}] ❌ Exception: {e}")
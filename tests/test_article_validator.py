@@ -0,0 +1,61 @@
+import os
+import sys
+import json
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gemini_client import IncrementalArticleValidator
+
+ARTICLE = {
+    'title': 'How small teams ship AI features',
+    'slug': 'small-teams-ai-features',
+    'content_html': '<p>Start with <a href="https://example.com/guide">the guide</a> and '
+                    'measure every step before scaling the rollout to more users.</p>' * 2,
+    'keywords': ['ai', 'product teams'],
+    'meta_description': 'A practical guide to shipping AI features with a small product team.',
+    'image_prompt': 'Small team around a whiteboard',
+}
+
+
+def feed_in_chunks(validator, text, size=7):
+    for start in range(0, len(text), size):
+        reason = validator.feed(text[start:start + size])
+        if reason:
+            return reason
+    return ""
+
+
+def test_valid_article_passes_in_any_chunking():
+    text = json.dumps(ARTICLE)
+    for size in (1, 7, 64, len(text)):
+        validator = IncrementalArticleValidator()
+        assert feed_in_chunks(validator, text, size) == ""
+        assert validator.done == set(dict(ARTICLE))
+        assert validator.values['content_html'] == (ARTICLE['content_html'], True)
+
+
+def test_unescaped_attribute_quote_does_not_end_content():
+    # Модель иногда не экранирует кавычки атрибутов внутри HTML
+    text = ('{"title": "%s", "content_html": "<p>See <a href="https://example.com">this</a>'
+            % ARTICLE['title'])
+    validator = IncrementalArticleValidator()
+
+    assert validator.feed(text) == ""
+    assert 'content_html' not in validator.done
+    assert validator.feed(' page, it covers the setup.</p>' * 4 + '", "keywords": ["a", "b"]') == ""
+    assert 'content_html' in validator.done
+
+
+def test_quote_at_chunk_end_is_not_a_closed_field():
+    validator = IncrementalArticleValidator()
+
+    assert validator.feed('{"title": "Short"') == ""
+    assert validator.values['title'] == ('Short"', False)
+    assert validator.feed(', ') == "Title is missing or too short"
+
+
+def test_placeholder_rejected_before_field_completes():
+    validator = IncrementalArticleValidator()
+
+    reason = validator.feed('{"title": "%s", "content_html": "<p>Lorem ipsum dolor' % ARTICLE['title'])
+    assert reason == "Content contains placeholder text"
@@ -0,0 +1,72 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import corpus_index
+from corpus_index import CorpusIndex, document_terms
+
+POSTS = [
+    ("AI in Education: Tools and Workflows", ['ai tools', 'teachers'], '<h2>Grading with AI</h2>'),
+    ("Remote Work Security Checklist", ['vpn', 'security'], '<h2>Password managers</h2>'),
+    ("Cloud Cost Optimization Guide", ['cloud', 'finops'], '<h2>Reserved instances</h2>'),
+]
+
+# Путь без numpy проверяется всегда, numpy - если установлен
+PATHS = [False, pytest.param(True, marks=pytest.mark.skipif(not corpus_index.HAS_NUMPY,
+                                                           reason='numpy not installed'))]
+
+
+def make_index():
+    index = CorpusIndex()
+    for post_id, (title, keywords, html) in enumerate(POSTS, start=1):
+        index.add(post_id, 100 + post_id, title, title.lower().replace(' ', '-'),
+                  document_terms(title, keywords, html))
+    return index
+
+
+def test_document_terms_weigh_title_keywords_and_headings():
+    terms = document_terms("AI Tools", ['ai tools'], '<p>body</p><h2>Grading <em>tools</em></h2>')
+
+    assert terms['ai'] == corpus_index.TITLE_WEIGHT + corpus_index.KEYWORD_WEIGHT
+    assert terms['ai tool'] == corpus_index.TITLE_WEIGHT + corpus_index.KEYWORD_WEIGHT
+    assert terms['grading tool'] == corpus_index.HEADING_WEIGHT
+    assert 'body' not in terms
+
+
+@pytest.mark.parametrize('use_numpy', PATHS)
+def test_score_ranks_the_matching_post_first(monkeypatch, use_numpy):
+    monkeypatch.setattr(corpus_index, 'HAS_NUMPY', use_numpy)
+    index = make_index()
+
+    title, keywords, html = POSTS[1]
+    matches = index.score(document_terms(title, keywords, html))
+    assert matches[0]['post_id'] == 2
+    assert matches[0]['wp_id'] == 102
+    assert matches[0]['similarity'] == 1.0
+    assert all(match['similarity'] < 0.5 for match in matches[1:])
+    assert index.score(document_terms("Sourdough baking at home")) == []
+
+
+@pytest.mark.parametrize('use_numpy', PATHS)
+def test_posts_added_after_a_query_are_scored(monkeypatch, use_numpy):
+    monkeypatch.setattr(corpus_index, 'HAS_NUMPY', use_numpy)
+    index = make_index()
+    assert index.score(document_terms("Kubernetes autoscaling")) == []
+
+    index.add(4, 104, "Kubernetes Autoscaling", 'k8s', document_terms("Kubernetes Autoscaling", ['kubernetes']))
+    assert index.score(document_terms("Kubernetes autoscaling"), top=1)[0]['post_id'] == 4
+
+
+def test_numpy_and_python_scores_agree(monkeypatch):
+    if not corpus_index.HAS_NUMPY:
+        pytest.skip('numpy not installed')
+    query = document_terms("AI security tools for cloud teams", ['security', 'ai tools'])
+    results = []
+    for use_numpy in (True, False):
+        monkeypatch.setattr(corpus_index, 'HAS_NUMPY', use_numpy)
+        results.append(make_index().score(query))
+
+    assert results[0] == results[1]
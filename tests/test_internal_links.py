@@ -0,0 +1,65 @@
+import os
+import sys
+import sqlite3
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import internal_links
+from internal_links import LinkIndex
+
+AI_TOOLS = 'https://example.com/ai-tools/'
+CLOUD = 'https://example.com/cloud-costs/'
+CLOUD_OLD = 'https://example.com/cloud-costs-2023/'
+
+
+def make_index(targets):
+    """LinkIndex over an in-memory storage.db with (url, phrases, published_at) targets"""
+    conn = sqlite3.connect(':memory:')
+    internal_links.ensure_schema(conn)
+    for wp_id, (url, phrases, published_at) in enumerate(targets, start=1):
+        internal_links._store_target(conn, url, wp_id, url, phrases, internal_links.SOURCE_LOCAL, published_at)
+    index = LinkIndex()
+    index.sync(conn)
+    return index
+
+
+def test_entities_are_matched_and_kept_intact():
+    index = make_index([(AI_TOOLS, ['AI tools'], '2026-01-01')])
+
+    html, links = index.add_links('<p>Teachers love AI&nbsp;tools &amp; more.</p>')
+    assert html == f'<p>Teachers love <a href="{AI_TOOLS}">AI&nbsp;tools</a> &amp; more.</p>'
+    assert links == [{'phrase': 'AI\xa0tools', 'url': AI_TOOLS, 'title': AI_TOOLS}]
+
+
+def test_no_links_inside_skipped_elements():
+    index = make_index([(AI_TOOLS, ['AI tools'], '2026-01-01')])
+    article = ('<h2>AI tools</h2><p><a href="/x">best AI tools</a> <code>ai tools</code></p>'
+               '<p>Pick AI tools carefully.</p>')
+
+    html, links = index.add_links(article)
+    assert [link['url'] for link in links] == [AI_TOOLS]
+    assert html.startswith('<h2>AI tools</h2><p><a href="/x">best AI tools</a> <code>ai tools</code></p>')
+    assert html.endswith(f'<p>Pick <a href="{AI_TOOLS}">AI tools</a> carefully.</p>')
+
+
+def test_each_url_and_phrase_is_linked_once_and_newest_post_wins():
+    index = make_index([
+        (CLOUD_OLD, ['cloud costs'], '2023-05-01'),
+        (CLOUD, ['cloud costs', 'finops practices'], '2026-02-01'),
+        (AI_TOOLS, ['AI tools'], '2026-01-01'),
+    ])
+    article = '<p>Cloud costs grow. FinOps practices help. Cloud costs again, AI tools too.</p>'
+
+    html, links = index.add_links(article, limit=5)
+    assert [link['url'] for link in links] == [CLOUD, AI_TOOLS]
+    assert html.count(f'href="{CLOUD}"') == 1
+    assert 'FinOps practices help' in html
+
+
+def test_limit_and_excluded_urls():
+    index = make_index([(AI_TOOLS, ['AI tools'], '2026-01-01'), (CLOUD, ['cloud costs'], '2026-02-01')])
+    article = '<p>AI tools and cloud costs.</p>'
+
+    assert [link['url'] for link in index.add_links(article, limit=1)[1]] == [AI_TOOLS]
+    assert [link['url'] for link in index.add_links(article, exclude={AI_TOOLS})[1]] == [CLOUD]
+    assert index.add_links(article, limit=0) == (article, [])
@@ -0,0 +1,39 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import key_pool
+
+
+class FakeClient:
+    def __init__(self, api_key):
+        self.api_key = api_key
+
+
+def make_client(api_key):
+    return FakeClient(api_key)
+
+
+def test_shared_pool_is_one_per_key_set(monkeypatch, tmp_path):
+    monkeypatch.setattr(key_pool, 'DB_FILE', str(tmp_path / 'storage.db'))
+    monkeypatch.setattr(key_pool, '_POOLS', {})
+    first = key_pool.shared_pool(['key-a', 'key-b'], make_client)
+
+    assert key_pool.shared_pool(['key-a', 'key-b'], make_client) is first
+    assert key_pool.shared_pool(['key-c'], make_client) is not first
+    assert key_pool.client_key_id(first.primary.client) == key_pool.key_id('key-a')
+
+
+def test_cooldown_from_another_process_is_picked_up(monkeypatch, tmp_path):
+    monkeypatch.setattr(key_pool, 'DB_FILE', str(tmp_path / 'storage.db'))
+    monkeypatch.setattr(key_pool, 'MIN_REQUEST_INTERVAL', 0)
+    ours = key_pool.KeyPool(['key-a', 'key-b'], make_client)
+    theirs = key_pool.KeyPool(['key-a', 'key-b'], make_client)
+
+    theirs.report_rate_limited(theirs.keys[0], RuntimeError('429'), retry_after=600)
+    ours._state_loaded_at = 0
+    for _ in range(3):
+        key, wait = ours.acquire()
+        assert key.key_id == key_pool.key_id('key-b')
+        assert wait == 0
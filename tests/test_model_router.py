@@ -0,0 +1,43 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import usage_ledger
+from model_router import ModelRouter
+
+MODELS = ['gemini-2.5-flash', 'gemini-2.5-flash-lite']
+
+
+def make_router():
+    return ModelRouter(window_seconds=900, hold_seconds=300, min_samples=4, seed_from_ledger=False)
+
+
+def test_long_article_calls_do_not_degrade_model_for_other_stages():
+    router = make_router()
+    for _ in range(30):
+        router.observe('article', 'gemini-2.5-flash', 40000, usage_ledger.OUTCOME_OK)
+
+    assert router.choose('social', MODELS) == 'gemini-2.5-flash'
+    assert router.choose('article', MODELS) == 'gemini-2.5-flash'
+
+
+def test_stage_degrades_on_its_own_latency_limit():
+    router = make_router()
+    for _ in range(30):
+        router.observe('article', 'gemini-2.5-flash', 40000, usage_ledger.OUTCOME_OK)
+        router.observe('social', 'gemini-2.5-flash', 40000, usage_ledger.OUTCOME_OK)
+
+    assert router.choose('social', MODELS) == 'gemini-2.5-flash-lite'
+    assert router.choose('article', MODELS) == 'gemini-2.5-flash'
+
+
+def test_short_calls_of_one_stage_do_not_dilute_another_stage_p95():
+    router = make_router()
+    for _ in range(30):
+        router.observe('social', 'gemini-2.5-flash', 2000, usage_ledger.OUTCOME_OK)
+    for _ in range(5):
+        router.observe('article', 'gemini-2.5-flash', 120000, usage_ledger.OUTCOME_OK)
+
+    assert router.stats('article', 'gemini-2.5-flash')['p95_ms'] == 120000
+    assert router.choose('article', MODELS) == 'gemini-2.5-flash-lite'
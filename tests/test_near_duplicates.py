@@ -0,0 +1,50 @@
+import os
+import sys
+import sqlite3
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import near_duplicates
+from near_duplicates import TopicIndex, band_layout, normalize
+
+
+def make_index(seeds=()):
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE plans (id INTEGER PRIMARY KEY, seed TEXT, status TEXT DEFAULT 'pending')")
+    conn.executemany("INSERT INTO plans (seed) VALUES (?)", [(seed,) for seed in seeds])
+    return TopicIndex(conn, threshold=0.7)
+
+
+def test_normalize_ignores_stop_words_plurals_and_ampersand():
+    assert normalize("AI in Education: Tools and Workflows") == normalize("AI & Education - tool for workflow")
+    assert normalize("Business class") == {'business', 'class'}
+    assert normalize("Как ИИ меняет образование") == {'ии', 'меняет', 'образование'}
+
+
+def test_band_layout_finds_pairs_at_the_threshold():
+    for threshold in (0.5, 0.7, 0.9):
+        bands, rows = band_layout(threshold, 64)
+        assert bands * rows <= 64
+        assert 1 - (1 - threshold ** rows) ** bands >= near_duplicates.TARGET_RECALL
+    assert band_layout(0.9, 64)[1] > band_layout(0.5, 64)[1]
+
+
+def test_find_matches_indexed_plans_above_threshold_only():
+    index = make_index(["AI in Education: Tools and Workflows", "Remote work security checklist"])
+
+    match = index.find("AI and Education: Tools for Workflows")
+    assert match == {'plan_id': 1, 'seed': "AI in Education: Tools and Workflows", 'similarity': 1.0}
+    assert index.find("Quantum computing for beginners") is None
+
+
+def test_find_sees_added_and_remembered_seeds():
+    index = make_index()
+    index.conn.execute("INSERT INTO plans (seed) VALUES ('Cloud cost optimization guide')")
+    index.add(1, 'Cloud cost optimization guide')
+    index.remember('Kubernetes autoscaling best practices')
+
+    assert index.find('Guide to cloud cost optimization')['plan_id'] == 1
+    assert index.find('Kubernetes autoscaling: best practices') == {
+        'plan_id': None, 'seed': 'Kubernetes autoscaling best practices', 'similarity': 1.0}
+    index.forget_pending()
+    assert index.find('Kubernetes autoscaling: best practices') is None
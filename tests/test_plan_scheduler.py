@@ -0,0 +1,85 @@
+import os
+import sys
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import plan_scheduler
+from plan_scheduler import select_next_plan
+
+NOW = datetime(2026, 3, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def make_db():
+    conn = sqlite3.connect(':memory:')
+    conn.execute("""CREATE TABLE plans (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        seed TEXT,
+        seo_focus TEXT,
+        created_at TEXT,
+        last_published_at TEXT,
+        status TEXT
+    )""")
+    plan_scheduler.ensure_schema(conn)
+    return conn
+
+
+def add_plan(conn, seed, category=None, priority=0, publish_after=None, age_hours=1):
+    created_at = (NOW - timedelta(hours=age_hours)).isoformat()
+    cur = conn.execute("""INSERT INTO plans (seed, seo_focus, created_at, status, category, priority, publish_after)
+                          VALUES (?, ?, ?, 'pending', ?, ?, ?)""",
+                       (seed, seed, created_at, category, priority, plan_scheduler.normalize_timestamp(publish_after)))
+    conn.commit()
+    return cur.lastrowid
+
+
+def next_id(conn, now=NOW):
+    plan = select_next_plan(conn, now=now)
+    return plan[0] if plan else None
+
+
+def test_higher_priority_first_then_oldest():
+    conn = make_db()
+    old = add_plan(conn, 'old', age_hours=48)
+    add_plan(conn, 'new', age_hours=1)
+    urgent = add_plan(conn, 'urgent', priority=5, age_hours=1)
+
+    assert next_id(conn) == urgent
+    plan_scheduler.set_plan_priority(conn, urgent, 0)
+    assert next_id(conn) == old
+
+
+def test_publish_after_holds_plan_until_its_window():
+    conn = make_db()
+    later = add_plan(conn, 'later', priority=5, publish_after=NOW + timedelta(hours=2))
+    now_plan = add_plan(conn, 'now')
+
+    assert next_id(conn) == now_plan
+    assert next_id(conn, now=NOW + timedelta(hours=3)) == later
+
+
+def test_category_cadence_and_balancing():
+    conn = make_db()
+    news = add_plan(conn, 'news', category='News', age_hours=10)
+    guide = add_plan(conn, 'guide', category='Guides', age_hours=1)
+    plan_scheduler.set_category_interval(conn, 'News', 24)
+    plan_scheduler.record_category_publish(conn, 'News', NOW - timedelta(hours=6))
+
+    # News опубликовала 6 часов назад при интервале 24 часа
+    assert next_id(conn) == guide
+    plan_scheduler.record_category_publish(conn, 'Guides', NOW - timedelta(hours=1))
+    # Интервал прошел: обе категории доступны, первой идет дольше молчавшая
+    assert next_id(conn, now=NOW + timedelta(hours=19)) == news
+
+
+def test_claimed_plan_is_not_selected_until_released():
+    conn = make_db()
+    first = add_plan(conn, 'first', age_hours=2)
+    second = add_plan(conn, 'second', age_hours=1)
+
+    assert plan_scheduler.claim_plan(conn, first)[0] == first
+    assert plan_scheduler.claim_plan(conn, first) is None
+    assert next_id(conn) == second
+    plan_scheduler.release_plan(conn, first)
+    assert next_id(conn) == first
@@ -0,0 +1,73 @@
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import key_pool
+import prompt_cache
+from prompt_cache import PromptCache
+
+pytestmark = pytest.mark.skipif(not prompt_cache.HAS_GENAI, reason='google-genai not installed')
+
+MODEL = 'gemini-2.5-flash'
+LONG_INSTRUCTION = 'Write clearly. ' * 400    # ~1500 токенов
+SHORT_INSTRUCTION = 'Write clearly. ' * 40
+
+
+class FakeCaches:
+    def __init__(self, fail_create=False):
+        self.fail_create = fail_create
+        self.calls = []
+
+    def list(self):
+        self.calls.append('list')
+        return []
+
+    def create(self, model, config):
+        self.calls.append('create')
+        if self.fail_create:
+            raise RuntimeError('400 Cached content is too small')
+        return SimpleNamespace(name=f'cachedContents/{len(self.calls)}')
+
+
+class FakeClient:
+    def __init__(self, caches):
+        self.caches = caches
+
+
+def pool_client(api_key, caches):
+    """Client registered in a key pool, as GeminiClient gets them"""
+    client = FakeClient(caches)
+    key_pool.ApiKey(api_key, client)
+    return client
+
+
+def test_entry_is_reused_across_clients_of_the_same_key():
+    cache = PromptCache(enabled=True)
+    caches = FakeCaches()
+    first = cache.cached_content_name(pool_client('key-a', caches), MODEL, LONG_INSTRUCTION)
+    second = cache.cached_content_name(pool_client('key-a', caches), MODEL, LONG_INSTRUCTION)
+
+    assert first == second
+    assert caches.calls == ['list', 'create']
+    assert cache.stats['hits'] == 1
+
+
+def test_failed_create_is_remembered_per_key():
+    cache = PromptCache(enabled=True)
+    caches = FakeCaches(fail_create=True)
+    for _ in range(3):
+        assert cache.cached_content_name(pool_client('key-a', caches), MODEL, LONG_INSTRUCTION) is None
+
+    assert caches.calls == ['list', 'create']
+
+
+def test_instruction_below_model_minimum_makes_no_api_calls():
+    cache = PromptCache(enabled=True)
+    caches = FakeCaches()
+
+    assert cache.cached_content_name(pool_client('key-a', caches), MODEL, SHORT_INSTRUCTION) is None
+    assert caches.calls == []
@@ -0,0 +1,60 @@
+import os
+import sys
+import json
+import glob
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import http_client
+import tracing
+
+BOT_TOKEN = '123456789:AAH-secret-bot-token'
+ACCESS_TOKEN = 'EAAG-secret-page-token'
+TELEGRAM_URL = f'https://api.telegram.org/bot{BOT_TOKEN}/sendMessage'
+GRAPH_URL = f'https://graph.facebook.com/v19.0/1234567890/feed?access_token={ACCESS_TOKEN}'
+
+
+class FakeResponse:
+    status_code = 200
+    content = b'{}'
+    request = None
+
+
+def traced_run(tmp_path, monkeypatch, fake_request):
+    monkeypatch.setattr(tracing, 'TRACING_ENABLED', True)
+    monkeypatch.setattr(tracing, 'TRACE_DIR', str(tmp_path))
+    monkeypatch.setattr(http_client.requests, 'request', fake_request)
+    with tracing.trace('run1', 'publish'):
+        for service, url in (('telegram', TELEGRAM_URL), ('facebook', GRAPH_URL)):
+            try:
+                http_client.request(service, 'post', url, data={'text': 'hi'})
+            except requests.RequestException:
+                pass
+    [path] = glob.glob(os.path.join(str(tmp_path), '*.trace.json'))
+    with open(path) as f:
+        return f.read()
+
+
+def test_successful_calls_keep_tokens_out_of_the_trace(tmp_path, monkeypatch):
+    text = traced_run(tmp_path, monkeypatch, lambda method, url, **kwargs: FakeResponse())
+
+    assert BOT_TOKEN not in text
+    assert ACCESS_TOKEN not in text
+    names = [event['name'] for event in json.loads(text)['traceEvents']]
+    assert 'telegram POST /bot{token}/sendMessage' in names
+    assert 'facebook POST /v19.0/{id}/feed' in names
+
+
+def test_failed_calls_keep_urls_out_of_the_trace(tmp_path, monkeypatch):
+    def fail(method, url, **kwargs):
+        raise requests.ConnectionError(f"Max retries exceeded with url: {url}")
+
+    text = traced_run(tmp_path, monkeypatch, fail)
+
+    assert BOT_TOKEN not in text
+    assert ACCESS_TOKEN not in text
+    errors = [event['args']['error'] for event in json.loads(text)['traceEvents']
+              if 'error' in event.get('args', {})]
+    assert errors == ['ConnectionError', 'ConnectionError']
@@ -6,6 +6,7 @@
 
 import os
 import sys
+import json
 import time
 import logging
 import sqlite3
@@ -16,9 +17,20 @@ from dotenv import load_dotenv
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from gemini_client import generate_article_with_image
-from wordpress_client import upload_image_to_wp, create_wp_post, get_or_create_tag, get_or_create_category
+from wordpress_client import upload_image_to_wp, create_wp_post, get_or_create_tag, get_or_create_category, DISABLE_PUBLISH
 from social_content_generator import SocialContentGenerator
 from social_media_clients import SocialMediaCoordinator
+import plan_scheduler
+import metrics
+import run_ledger
+import profiling
+import prefetch_worker
+import gemini_batch
+import usage_ledger
+import key_pool
+import corpus_index
+import internal_links
+from deadline import Deadline, DeadlineExceeded, PUBLISH_DEADLINE_SECONDS, stage_deadline
 
 load_dotenv()
 
@@ -68,188 +80,343 @@ def init_db():
         seo_keywords TEXT
     )""")
     conn.commit()
+    # Приоритеты, окна публикации и интервалы категорий
+    plan_scheduler.ensure_schema(conn)
+    prefetch_worker.ensure_schema(conn)
+    gemini_batch.ensure_schema(conn)
+    usage_ledger.ensure_schema(conn)
+    key_pool.ensure_schema(conn)
+    corpus_index.ensure_schema(conn)
+    internal_links.ensure_schema(conn)
+    # Захваты планов упавшими прогонами (старше дедлайна публикации) возвращаем в очередь
+    plan_scheduler.release_stale_claims(conn, PUBLISH_DEADLINE_SECONDS)
     conn.close()
 
 def get_next_plan():
-    """Получить следующую статью для публикации"""
+    """Получить следующую статью для публикации (приоритет, окно публикации, интервал категории)"""
     conn = sqlite3.connect(DB_FILE)
-    cur = conn.cursor()
-    cur.execute("SELECT id, seed, seo_focus, created_at, last_published_at, category FROM plans WHERE status='pending' ORDER BY created_at LIMIT 1")
-    row = cur.fetchone()
+    row = plan_scheduler.select_next_plan(conn)
     conn.close()
     return row
 
-def mark_plan_published(plan_id):
+def mark_plan_published(plan_id, category=None):
     """Отметить план как опубликованный"""
+    published_at = datetime.now(timezone.utc).isoformat()
     conn = sqlite3.connect(DB_FILE)
     cur = conn.cursor()
     cur.execute('UPDATE plans SET last_published_at=?, status=? WHERE id=?', 
-                (datetime.now(timezone.utc).isoformat(), 'published', plan_id))
+                (published_at, 'published', plan_id))
     conn.commit()
+    plan_scheduler.record_category_publish(conn, category, published_at)
     conn.close()
 
-def save_post_record(title, slug, wp_id, keywords):
-    """Сохранить запись о опубликованном посте"""
+def save_post_record(title, slug, wp_id, keywords, plan_id=None, category=None, content_html=None, link=None):
+    """Сохранить запись о опубликованном посте (термы для corpus_index.py, цель ссылок для internal_links.py)"""
+    published_at = datetime.now(timezone.utc).isoformat()
     conn = sqlite3.connect(DB_FILE)
     cur = conn.cursor()
-    cur.execute('INSERT INTO posts (title, slug, wp_id, published_at, seo_keywords) VALUES (?, ?, ?, ?, ?)',
-                (title, slug, wp_id, datetime.now(timezone.utc).isoformat(), str(keywords)))
+    cur.execute('INSERT INTO posts (title, slug, wp_id, published_at, seo_keywords, plan_id, category, link) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (title, slug, wp_id, published_at, json.dumps(keywords, ensure_ascii=False), plan_id, category, link))
+    corpus_index.record_post(conn, cur.lastrowid, title, keywords, content_html)
+    internal_links.record_post(conn, wp_id, link, title, keywords, published_at)
     conn.commit()
     conn.close()
 
-def publish_next_article():
-    """Опубликовать следующую статью"""
+def screen_plan(plan):
+    """Проверить тему плана на сходство с опубликованными статьями; False - план отложен"""
+    plan_id, seed = plan[0], plan[1]
+    admitted, match = corpus_index.screen_plan(plan_id, seed)
+    if match:
+        logger.warning(f"⚠️  План {plan_id} похож на опубликованную статью ({match['similarity']:.0%}): "
+                       f"[{match['wp_id']}] {match['title']}")
+    if not admitted:
+        logger.warning(f"⏭️  План {plan_id} отложен (статус '{corpus_index.STATUS_SIMILAR}'), берем следующий")
+    return admitted
+
+def upload_featured_image(image_path, deadline=None):
+    """Загрузить изображение статьи на WordPress, вернуть ID медиа или None"""
+    if not image_path:
+        return None
+    try:
+        with open(image_path, "rb") as f:
+            image_bytes = f.read()
+
+        filename = os.path.basename(image_path)
+        upload_result = upload_image_to_wp(image_bytes, filename, mime_type='image/png', deadline=deadline)
+        featured_media_id = upload_result.get('id')
+        logger.info(f"Изображение загружено: {featured_media_id}")
+        return featured_media_id
+    except Exception as e:
+        logger.error(f"Ошибка загрузки изображения: {e}")
+        return None
+
+def resolve_terms(keywords, category, deadline=None):
+    """Создать/найти теги и категорию, вернуть (tag_ids, category_ids).
+
+    Если бюджет этапа исчерпан, оставшиеся теги пропускаются.
+    """
+    # Создаем теги
+    tag_ids = []
+    if keywords:
+        for index, keyword in enumerate(keywords):
+            if deadline is not None and deadline.expired():
+                logger.warning(f"⏱️  Время на теги истекло, пропущено тегов: {len(keywords) - index}")
+                break
+            try:
+                tag_id = get_or_create_tag(keyword, deadline=deadline)
+                if tag_id:
+                    tag_ids.append(tag_id)
+            except Exception as e:
+                logger.warning(f"Ошибка создания тега {keyword}: {e}")
+
+    # Получаем ID категории
+    category_ids = []
+    if category:
+        try:
+            category_id = get_or_create_category(category, deadline=deadline)
+            if category_id:
+                category_ids.append(category_id)
+                logger.info(f"Категория установлена: {category} (ID: {category_id})")
+        except Exception as e:
+            logger.warning(f"Ошибка создания категории {category}: {e}")
+
+    return tag_ids, category_ids
+
+def prepare_article(seed, category, plan_id=None, deadline=None):
+    """Сгенерировать статью и изображение, загрузить медиа и подготовить теги/категории.
+
+    Возвращает dict с полями для create_wp_post или None, если статью публиковать нельзя.
+    Используется как при публикации, так и воркером предгенерации (prefetch_worker.py).
+    При истечении `deadline` выбрасывает DeadlineExceeded.
+    """
+    # Статья могла быть заранее сгенерирована пакетом (gemini_batch.py)
+    checkpoint = gemini_batch.load_checkpoint(plan_id)
+    if checkpoint:
+        logger.info("📦 Используем статью из пакетной генерации (checkpoint)")
+
+    # Генерируем статью и изображение
+    logger.info("🔍 [DEBUG] Генерируем статью...")
+    article = generate_article_with_image(topic=seed, article=checkpoint, deadline=deadline)
+
+    # CRITICAL: Validate article was generated successfully
+    if not article:
+        logger.error(f"❌ FAILED: Article generation failed for topic: {seed}")
+        logger.error("❌ Article will NOT be published. Skipping to prevent bad content.")
+        logger.info("💡 TIP: Will retry this article on next run")
+        return None
+
+    # Extract and validate all required fields
+    title = article.get('title')
+    slug = article.get('slug')
+    content_html = article.get('content')
+
+    # Double-check critical fields
+    if not title or not slug or not content_html:
+        logger.error(f"❌ FAILED: Missing critical fields in article")
+        logger.error(f"   Title: {bool(title)}, Slug: {bool(slug)}, Content: {bool(content_html)}")
+        # Изображение уже сгенерировано - учитываем потерянный вызов
+        usage_ledger.record_rejection('article', 'missing critical fields', image_calls=1)
+        logger.error("❌ Article will NOT be published. Skipping to prevent incomplete content.")
+        return None
+
+    keywords = article.get('keywords') or []
+
+    # Каннибализация ключевых слов: статья уже сгенерирована, поэтому только предупреждаем
+    match = corpus_index.check_article(title, keywords, content_html)
+    if match:
+        logger.warning(f"⚠️  Статья похожа на опубликованную ({match['similarity']:.0%}): "
+                       f"[{match['wp_id']}] {match['title']}")
+
+    # Внутренние ссылки на ранее опубликованные статьи
+    content_html, links = internal_links.add_links(content_html)
+    if links:
+        logger.info(f"🔗 Внутренних ссылок: {len(links)} ({', '.join(link['phrase'] for link in links)})")
+
+    # Загружаем изображение на WordPress
+    featured_media_id = upload_featured_image(article.get("image_url"), deadline=stage_deadline(deadline, 'upload'))
+
+    tag_ids, category_ids = resolve_terms(keywords, category, deadline=stage_deadline(deadline, 'terms'))
+
+    return {
+        'title': title,
+        'slug': slug,
+        'meta_description': article.get('meta_description'),
+        'keywords': keywords,
+        'content_html': content_html,
+        'image_path': article.get("image_url"),
+        'featured_media_id': featured_media_id,
+        'tag_ids': tag_ids,
+        'category_ids': category_ids
+    }
+
+def publish_to_social(title, wp_url, content_html, keywords, image_path, deadline=None):
+    """Публикация в социальные сети (ошибки и нехватка времени не прерывают публикацию)"""
+    enable_social_media = os.getenv('ENABLE_SOCIAL_MEDIA', 'true').lower() == 'true'
+
+    if not enable_social_media:
+        logger.info("📱 Публикация в социальные сети отключена (ENABLE_SOCIAL_MEDIA=false)")
+        return
+    if DISABLE_PUBLISH:
+        # Ссылка ведет на фиктивный пост - не публикуем ее в соцсетях
+        logger.info("📱 Публикация в социальные сети пропущена (DISABLE_WP_PUBLISH=true)")
+        return
+
+    logger.info("📱 Начинаем публикацию в социальные сети...")
+    try:
+        # Генерируем контент для социальных сетей
+        social_generator = SocialContentGenerator()
+        social_posts = social_generator.generate_social_posts(
+            article_title=title,
+            article_url=wp_url,
+            article_content=content_html[:1000],  # Первые 1000 символов для контекста
+            keywords=keywords,
+            deadline=deadline
+        )
+
+        # Публикуем во все настроенные социальные сети
+        social_coordinator = SocialMediaCoordinator()
+        social_results = social_coordinator.publish_to_all(
+            posts_data=social_posts,
+            image_path=image_path,  # Передаем путь к изображению
+            deadline=deadline
+        )
+
+        # Подсчитываем успешные публикации
+        successful_posts = sum(1 for r in social_results.values() if r.get('success'))
+        total_platforms = len(social_results)
+
+        logger.info(f"📱 Социальные сети: {successful_posts}/{total_platforms} публикаций успешны")
+
+        # Логируем детали
+        for platform, result in social_results.items():
+            if result.get('success'):
+                logger.info(f"   ✅ {platform}: {result.get('post_id')}")
+            else:
+                logger.warning(f"   ⚠️  {platform}: {result.get('reason', 'failed')}")
+
+    except Exception as e:
+        logger.error(f"❌ Ошибка публикации в социальные сети: {e}")
+        import traceback
+        logger.error(traceback.format_exc())
+        # Продолжаем работу даже если публикация в соцсети не удалась
+
+def release_plan(plan_id):
+    """Вернуть захваченный план в очередь (после публикации ничего не меняет)"""
+    conn = sqlite3.connect(DB_FILE, timeout=30)
+    plan_scheduler.release_plan(conn, plan_id)
+    conn.close()
+
+@run_ledger.recorded('publish', falsy_is_error=True)
+@metrics.instrument('publish', falsy_is_error=True)
+def publish_next_article(deadline=None):
+    """Опубликовать следующую статью.
+
+    Весь прогон ограничен дедлайном (PUBLISH_DEADLINE_SECONDS по умолчанию):
+    каждый этап получает свой бюджет, и зависший прогон завершается ошибкой
+    не позже дедлайна.
+    """
+    if deadline is None:
+        deadline = Deadline(PUBLISH_DEADLINE_SECONDS, label='publish')
     logger.info("🔍 [DEBUG] publish_next_article() вызвана")
     logger.info(f"🔍 [DEBUG] Текущее время: {datetime.now(timezone.utc).isoformat()}")
 
+    plan = None
     try:
         logger.info("🔍 [DEBUG] Получаем следующий план...")
-        plan = get_next_plan()
+        # План захватывается (статус 'publishing'): задачи API (main.py) его уже не возьмут.
+        # Запланированные (future) посты идут первыми, похожие на опубликованные темы откладываются
+        plan = prefetch_worker.claim_next_plan(screen=screen_plan)
         logger.info(f"🔍 [DEBUG] План получен: {plan is not None}")
 
         if not plan:
-            logger.info("Нет статей, ожидающих публикации")
+            logger.info("Нет статей, доступных для публикации (очередь пуста или окна публикации еще не открыты)")
             return False
 
         plan_id, seed, seo_focus, created_at, last_pub, category = plan
+        run_ledger.annotate(plan_id=plan_id)
         logger.info(f"🔍 [DEBUG] План ID: {plan_id}, Категория: {category}")
         logger.info(f"Публикуем статью: {seed[:50]}... (категория: {category})")
 
-        # Генерируем статью и изображение
-        logger.info("🔍 [DEBUG] Генерируем статью...")
-        article = generate_article_with_image(topic=seed)
-
-        # CRITICAL: Validate article was generated successfully
-        if not article:
-            logger.error(f"❌ FAILED: Article generation failed for topic: {seed}")
-            logger.error("❌ Article will NOT be published. Skipping to prevent bad content.")
-            logger.info("💡 TIP: Will retry this article on next run")
-            return False
-
-        # Extract and validate all required fields
-        title = article.get('title')
-        slug = article.get('slug')
-        meta = article.get('meta_description')
-        keywords = article.get('keywords') or []
-        content_html = article.get('content')
-        image_prompt = article.get('image_prompt', f'Illustration for: {seed}')
-
-        # Double-check critical fields
-        if not title or not slug or not content_html:
-            logger.error(f"❌ FAILED: Missing critical fields in article")
-            logger.error(f"   Title: {bool(title)}, Slug: {bool(slug)}, Content: {bool(content_html)}")
-            logger.error("❌ Article will NOT be published. Skipping to prevent incomplete content.")
-            return False
-        
-        # Загружаем изображение на WordPress
-        featured_media_id = None
-        if article.get("image_url"):
-            try:
-                with open(article["image_url"], "rb") as f:
-                    image_bytes = f.read()
-                
-                filename = os.path.basename(article["image_url"])
-                upload_result = upload_image_to_wp(image_bytes, filename, mime_type='image/png')
-                featured_media_id = upload_result.get('id')
-                logger.info(f"Изображение загружено: {featured_media_id}")
-            except Exception as e:
-                logger.error(f"Ошибка загрузки изображения: {e}")
-        
-        # Создаем теги
-        tag_ids = []
-        if keywords:
-            for keyword in keywords:
-                try:
-                    tag_id = get_or_create_tag(keyword)
-                    if tag_id:
-                        tag_ids.append(tag_id)
-                except Exception as e:
-                    logger.warning(f"Ошибка создания тега {keyword}: {e}")
-        
-        # Получаем ID категории
-        category_ids = []
-        if category:
-            try:
-                category_id = get_or_create_category(category)
-                if category_id:
-                    category_ids.append(category_id)
-                    logger.info(f"Категория установлена: {category} (ID: {category_id})")
-            except Exception as e:
-                logger.warning(f"Ошибка создания категории {category}: {e}")
-        
-        # Публикуем статью
-        wp_post = create_wp_post(
-            title=title,
-            content_html=content_html,
-            slug=slug,
-            status='publish',
-            featured_media_id=featured_media_id,
-            meta_description=meta,
-            tags=tag_ids if tag_ids else None,
-            categories=category_ids if category_ids else None
-        )
+        prefetched = prefetch_worker.get_prefetched(plan_id)
+        if prefetched:
+            # Статья уже сгенерирована и загружена - достаточно сменить статус
+            logger.info(f"⚡ Статья взята из буфера предгенерации (WP ID: {prefetched['wp_id']}, {prefetched['wp_status']})")
+            prefetch_worker.record_hit()
+            wp_post = prefetch_worker.go_live(prefetched, deadline=stage_deadline(deadline, 'wordpress'))
+            title = prefetched['title']
+            slug = prefetched['slug']
+            keywords = prefetched['keywords']
+            # Записи буфера без content_html (до миграции): индекс строится по заголовку и ключевым словам
+            content_html = prefetched['content_html']
+            image_path = prefetched['image_path']
+        else:
+            # Контроль квот: не начинаем генерацию, если прогноз превысит лимиты
+            admitted, reason, retry_after = usage_ledger.check_admission()
+            if not admitted:
+                logger.warning(f"⏸️  Публикация отложена из-за квоты Gemini ({reason}), "
+                               f"повтор возможен через ~{retry_after / 60:.0f} мин")
+                return False
+
+            if prefetch_worker.PREFETCH_ENABLED:
+                prefetch_worker.record_miss()
+
+            prepared = prepare_article(seed, category, plan_id, deadline=deadline)
+            if not prepared:
+                return False
+
+            title = prepared['title']
+            slug = prepared['slug']
+            keywords = prepared['keywords']
+            content_html = prepared['content_html']
+            image_path = prepared['image_path']
+
+            # Публикуем статью
+            wp_post = create_wp_post(
+                title=title,
+                content_html=content_html,
+                slug=slug,
+                status='publish',
+                featured_media_id=prepared['featured_media_id'],
+                meta_description=prepared['meta_description'],
+                tags=prepared['tag_ids'] if prepared['tag_ids'] else None,
+                categories=prepared['category_ids'] if prepared['category_ids'] else None,
+                deadline=stage_deadline(deadline, 'wordpress')
+            )
         
         wp_id = wp_post.get('id')
         wp_url = wp_post.get('link', f"{os.getenv('WP_BASE_URL')}/{slug}")
 
         logger.info(f"✅ Статья опубликована в WordPress: {title} -> WP ID: {wp_id}")
         logger.info(f"📎 URL: {wp_url}")
+        # Пост уже существует: план больше не вернется в очередь, даже если дальше что-то упадет
+        mark_plan_published(plan_id, category)
+        if prefetched:
+            prefetch_worker.mark_consumed(plan_id)
 
         # Публикация в социальные сети
-        enable_social_media = os.getenv('ENABLE_SOCIAL_MEDIA', 'true').lower() == 'true'
-
-        if enable_social_media:
-            logger.info("📱 Начинаем публикацию в социальные сети...")
-            try:
-                # Генерируем контент для социальных сетей
-                social_generator = SocialContentGenerator()
-                social_posts = social_generator.generate_social_posts(
-                    article_title=title,
-                    article_url=wp_url,
-                    article_content=content_html[:1000],  # Первые 1000 символов для контекста
-                    keywords=keywords
-                )
-
-                # Публикуем во все настроенные социальные сети
-                social_coordinator = SocialMediaCoordinator()
-                social_results = social_coordinator.publish_to_all(
-                    posts_data=social_posts,
-                    image_path=article.get("image_url")  # Передаем путь к изображению
-                )
-
-                # Подсчитываем успешные публикации
-                successful_posts = sum(1 for r in social_results.values() if r.get('success'))
-                total_platforms = len(social_results)
-
-                logger.info(f"📱 Социальные сети: {successful_posts}/{total_platforms} публикаций успешны")
-
-                # Логируем детали
-                for platform, result in social_results.items():
-                    if result.get('success'):
-                        logger.info(f"   ✅ {platform}: {result.get('post_id')}")
-                    else:
-                        logger.warning(f"   ⚠️  {platform}: {result.get('reason', 'failed')}")
-
-            except Exception as e:
-                logger.error(f"❌ Ошибка публикации в социальные сети: {e}")
-                import traceback
-                logger.error(traceback.format_exc())
-                # Продолжаем работу даже если публикация в соцсети не удалась
-        else:
-            logger.info("📱 Публикация в социальные сети отключена (ENABLE_SOCIAL_MEDIA=false)")
+        publish_to_social(title, wp_url, content_html or prefetched['content_preview'], keywords, image_path,
+                          deadline=stage_deadline(deadline, 'social'))
 
         # Сохраняем запись о публикации
-        save_post_record(title, slug, wp_id, keywords)
-        mark_plan_published(plan_id)
+        # В тестовом режиме ссылка фиктивная - целью внутренних ссылок она не становится
+        save_post_record(title, slug, wp_id, keywords, plan_id, category, content_html,
+                         link=None if DISABLE_PUBLISH else wp_url)
 
         logger.info(f"✅ Публикация завершена: {title}")
         return True
-        
+
+    except DeadlineExceeded as e:
+        logger.error(f"⏱️  Публикация прервана по дедлайну ({PUBLISH_DEADLINE_SECONDS:g} с): {e}")
+        return False
     except Exception as e:
         logger.error(f"❌ Ошибка публикации статьи: {e}")
         import traceback
         logger.error(traceback.format_exc())
         return False
+    finally:
+        # Неудачный прогон возвращает план в очередь (опубликованный план не меняется)
+        if plan:
+            release_plan(plan[0])
 
 def get_status():
     """Получить статус системы"""
@@ -258,14 +425,11 @@ def get_status():
     conn = sqlite3.connect(DB_FILE)
     cur = conn.cursor()
     
-    cur.execute("SELECT COUNT(*) FROM plans WHERE status='pending'")
-    pending_count = cur.fetchone()[0]
-    
-    cur.execute("SELECT COUNT(*) FROM plans WHERE status='published'")
-    published_count = cur.fetchone()[0]
-    
-    cur.execute("SELECT COUNT(*) FROM posts")
-    total_posts = cur.fetchone()[0]
+    # Счетчики поддерживаются триггерами (plan_scheduler.py), без COUNT(*) по таблицам
+    counts = plan_scheduler.status_counts(conn)
+    pending_count = counts['by_status'].get('pending', 0)
+    published_count = counts['by_status'].get('published', 0)
+    total_posts = counts['posts']
     
     # Получаем время последней публикации из таблицы posts
     cur.execute("SELECT published_at FROM posts ORDER BY published_at DESC LIMIT 1")
@@ -276,8 +440,11 @@ def get_status():
     logger.info(f"🔍 [DEBUG] Статистика БД: pending={pending_count}, published={published_count}, posts={total_posts}")
     logger.info(f"🔍 [DEBUG] Последняя публикация в posts: {last_publish_row}")
     
+    # Адаптивный интервал: при большой очереди публикуем чаще
+    interval = plan_scheduler.publish_interval(pending_count)
+
     last_publish_time = None
-    next_publish = datetime.now(timezone.utc) + timedelta(days=PUBLISH_INTERVAL_DAYS)
+    next_publish = datetime.now(timezone.utc) + interval
     
     if last_publish_row and last_publish_row[0]:
         try:
@@ -285,7 +452,7 @@ def get_status():
             # Если дата без timezone, добавляем UTC
             if last_publish_time.tzinfo is None:
                 last_publish_time = last_publish_time.replace(tzinfo=timezone.utc)
-            next_publish = last_publish_time + timedelta(days=PUBLISH_INTERVAL_DAYS)
+            next_publish = last_publish_time + interval
             logger.info(f"🔍 [DEBUG] Последняя публикация: {last_publish_time}")
             logger.info(f"🔍 [DEBUG] Следующая публикация: {next_publish}")
         except ValueError as e:
@@ -297,7 +464,8 @@ def get_status():
         'published_articles': published_count,
         'total_posts': total_posts,
         'last_publish_time': last_publish_time,
-        'next_publish': next_publish
+        'next_publish': next_publish,
+        'publish_interval': interval
     }
     
     logger.info(f"🔍 [DEBUG] get_status() возвращает: {result}")
@@ -308,12 +476,16 @@ def run_scheduler():
     global last_failed_attempt
 
     logger.info("🚀 Запуск автоматического публикатора статей")
-    logger.info(f"📅 Интервал публикации: каждые {PUBLISH_INTERVAL_DAYS} дней")
+    logger.info(f"📅 Интервал публикации: каждые {plan_scheduler.PUBLISH_INTERVAL_DAYS:g} дней")
+    logger.info(f"⚡ Burst: при очереди > {plan_scheduler.BURST_BACKLOG_THRESHOLD} статей интервал сокращается (не меньше {plan_scheduler.BURST_MIN_INTERVAL_HOURS:g} ч)")
     logger.info(f"⏱️  Задержка при ошибке: {RETRY_DELAY_MINUTES} минут")
 
     # Инициализируем базу данных
     init_db()
 
+    # Метрики Prometheus (METRICS_PORT, 0 = выключено)
+    metrics.start_http_server()
+
     # Показываем начальный статус
     status = get_status()
     logger.info(f"📊 Статус: {status['pending_articles']} статей ожидают публикации, {status['published_articles']} уже опубликованы")
@@ -365,9 +537,9 @@ def run_scheduler():
                     # Проверяем интервал с последней публикации
                     time_since_last = current_time - status['last_publish_time']
                     logger.info(f"🔍 [DEBUG] - Время с последней публикации: {time_since_last}")
-                    logger.info(f"🔍 [DEBUG] - Требуемый интервал: {timedelta(days=PUBLISH_INTERVAL_DAYS)}")
+                    logger.info(f"🔍 [DEBUG] - Требуемый интервал: {status['publish_interval']}")
 
-                    if time_since_last >= timedelta(days=PUBLISH_INTERVAL_DAYS):
+                    if time_since_last >= status['publish_interval']:
                         should_publish = True
                         logger.info(f"⏰ Прошло {time_since_last.days} дней {time_since_last.seconds//3600} часов с последней публикации - время публиковать")
                     else:
@@ -399,6 +571,16 @@ def run_scheduler():
             if current_time.hour % 6 == 0 and current_time.minute < 5:
                 status = get_status()
                 logger.info(f"📊 Статус: {status['pending_articles']} статей ожидают, следующая публикация: {status['next_publish'].strftime('%Y-%m-%d %H:%M')}")
+
+            # Предгенерация следующих статей в окне низкой нагрузки (PREFETCH_HOURS)
+            if prefetch_worker.PREFETCH_ENABLED and prefetch_worker.in_prefetch_window(current_time):
+                status = get_status()
+                prepared = prefetch_worker.refill_buffer(status['next_publish'], status['publish_interval'])
+                if prepared:
+                    logger.info(f"⚡ Предгенерировано статей: {prepared}")
+
+            # Список постов WordPress для внутренних ссылок (раз в INTERNAL_LINKS_SYNC_HOURS, вне публикации)
+            internal_links.sync_wordpress_if_due(Deadline(PUBLISH_DEADLINE_SECONDS, label='links sync'))
             
             # Ждем 5 минут перед следующей проверкой
             time.sleep(300)  # 5 минут
@@ -420,7 +602,12 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Автоматический публикатор статей')
     parser.add_argument('--status', action='store_true', help='Показать статус')
     parser.add_argument('--publish-now', action='store_true', help='Опубликовать статью сейчас')
+    parser.add_argument('--profile', nargs='?', const=profiling.MODE_SAMPLING, choices=profiling.MODES,
+                        help='С --publish-now: профилировать прогон (sampling по умолчанию или cprofile)')
     parser.add_argument('--daemon', action='store_true', help='Запустить в режиме демона')
+    parser.add_argument('--usage', action='store_true', help='Отчет об использовании Gemini API (токены, задержки)')
+    parser.add_argument('--report', action='store_true', help='Отчет p50/p95/p99 по этапам конвейера и регрессии')
+    parser.add_argument('--days', type=int, default=7, help='Период отчета --usage/--report в днях')
     
     args = parser.parse_args()
     
@@ -431,10 +618,24 @@ if __name__ == "__main__":
         print(f"   Статей ожидают публикации: {status['pending_articles']}")
         print(f"   Статей уже опубликованы: {status['published_articles']}")
         print(f"   Всего постов: {status['total_posts']}")
+        print(f"   Интервал публикации: {status['publish_interval']}")
         print(f"   Следующая публикация: {status['next_publish'].strftime('%Y-%m-%d %H:%M')}")
+        prefetch_worker.print_buffer_stats()
+    elif args.usage:
+        init_db()
+        usage_ledger.print_usage_report(args.days)
+        print()
+        key_pool.print_key_stats()
+    elif args.report:
+        init_db()
+        run_ledger.print_report(args.days)
     elif args.publish_now:
         init_db()
-        success = publish_next_article()
+        if args.profile:
+            success, profile = profiling.profile_call(publish_next_article, mode=args.profile)
+            profiling.print_summary(profile)
+        else:
+            success = publish_next_article()
         if success:
             print("✅ Статья опубликована успешно")
         else:
@@ -0,0 +1,162 @@
+"""tracing.py
+
+Per-run timeline in the Chrome Trace Event format (chrome://tracing, Perfetto).
+
+When ENABLE_TRACING is on, every pipeline run (run_ledger.run) collects:
+    - one span for the run itself,
+    - one span per metrics stage (article, image, upload, terms, wordpress,
+      social, publish),
+    - one span per external call: every Gemini attempt and backoff wait
+      (gemini_client.py) and every HTTP request to WordPress and social
+      networks (http_client.py).
+
+Spans carry the real thread id, so concurrent work (sections generated in
+parallel, image next to text) shows up on separate tracks, and the span that
+ends last on the run's track is the one that bounded it. Failed spans keep
+only the exception type and HTTP status: exception texts of `requests` carry
+the full URL with its tokens. The file is written
+to TRACE_DIR/<run_id>.trace.json when the run ends; `otherData.slowest_calls`
+lists the longest external calls.
+
+Settings (.env):
+    ENABLE_TRACING=false
+    TRACE_DIR=traces
+
+Usage:
+    ENABLE_TRACING=true python thenextai_publisher.py --publish-now
+    # open traces/<run_id>.trace.json in https://ui.perfetto.dev
+"""
+import os
+import json
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from dotenv import load_dotenv
+load_dotenv()
+
+import metrics
+
+TRACING_ENABLED = os.getenv('ENABLE_TRACING', 'false').lower() == 'true'
+TRACE_DIR = os.getenv('TRACE_DIR', 'traces')
+
+CAT_RUN = 'run'
+CAT_STAGE = 'stage'
+CAT_GEMINI = 'gemini'
+CAT_HTTP = 'http'
+CAT_WAIT = 'wait'
+# Категории внешних вызовов для otherData.slowest_calls
+EXTERNAL_CATEGORIES = (CAT_GEMINI, CAT_HTTP)
+
+_current_trace = contextvars.ContextVar('trace', default=None)
+
+
+def _now_us():
+    return time.time_ns() // 1000
+
+
+def error_summary(e):
+    """Exception type and HTTP status, without the message (it may contain URLs and tokens)"""
+    response = getattr(e, 'response', None)
+    status = getattr(response, 'status_code', None) or getattr(e, 'code', None)
+    return f"{type(e).__name__} {status}" if isinstance(status, int) else type(e).__name__
+
+
+class Trace:
+    """Events of one run; safe to append from several threads"""
+
+    def __init__(self, run_id, kind):
+        self.run_id = run_id
+        self.kind = kind
+        self.pid = os.getpid()
+        self.events = []
+        self.threads = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, cat, start_us, dur_us, args=None):
+        thread = threading.current_thread()
+        tid = thread.native_id or thread.ident
+        event = {'name': name, 'cat': cat, 'ph': 'X', 'ts': start_us, 'dur': max(0, dur_us),
+                 'pid': self.pid, 'tid': tid}
+        if args:
+            event['args'] = args
+        with self._lock:
+            self.threads.setdefault(tid, thread.name)
+            self.events.append(event)
+
+    def to_dict(self):
+        with self._lock:
+            events = list(self.events)
+            threads = dict(self.threads)
+        metadata = [{'name': 'process_name', 'ph': 'M', 'pid': self.pid, 'tid': 0,
+                     'args': {'name': f"{self.kind} {self.run_id}"}}]
+        metadata += [{'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid, 'args': {'name': name}}
+                     for tid, name in threads.items()]
+        slowest = sorted((e for e in events if e['cat'] in EXTERNAL_CATEGORIES), key=lambda e: -e['dur'])[:5]
+        return {
+            'traceEvents': metadata + sorted(events, key=lambda e: e['ts']),
+            'displayTimeUnit': 'ms',
+            'otherData': {
+                'run_id': self.run_id,
+                'kind': self.kind,
+                'slowest_calls': [{'name': e['name'], 'ms': round(e['dur'] / 1000, 1)} for e in slowest],
+            },
+        }
+
+    def save(self):
+        try:
+            os.makedirs(TRACE_DIR, exist_ok=True)
+            path = os.path.join(TRACE_DIR, f"{self.run_id}.trace.json")
+            with open(path, 'w') as f:
+                json.dump(self.to_dict(), f, default=str)
+            return path
+        except Exception as e:
+            print(f"[tracing] Could not write trace {self.run_id}: {e}")
+            return None
+
+
+@contextmanager
+def trace(run_id, kind):
+    """Collect the spans of one run (no-op unless ENABLE_TRACING)"""
+    if not TRACING_ENABLED:
+        yield None
+        return
+    current = Trace(run_id, kind)
+    token = _current_trace.set(current)
+    started = _now_us()
+    try:
+        yield current
+    finally:
+        current.add(kind, CAT_RUN, started, _now_us() - started, {'run_id': run_id})
+        _current_trace.reset(token)
+        current.save()
+
+
+@contextmanager
+def span(name, cat=CAT_HTTP, **args):
+    """Time a block as a span of the current trace; yields its args dict for extra fields"""
+    current = _current_trace.get()
+    if current is None:
+        yield args
+        return
+    started = _now_us()
+    try:
+        yield args
+    except BaseException as e:
+        args['error'] = error_summary(e)
+        raise
+    finally:
+        current.add(name, cat, started, _now_us() - started, args)
+
+
+def _on_stage(stage_timer):
+    current = _current_trace.get()
+    if current is None:
+        return
+    name = f"{stage_timer.stage}/{stage_timer.backend}" if stage_timer.backend else stage_timer.stage
+    current.add(name, CAT_STAGE, int(stage_timer.started_at * 1_000_000), int(stage_timer.duration * 1_000_000),
+                {'outcome': stage_timer.outcome, 'retries': stage_timer.retries,
+                 'bytes_in': stage_timer.bytes_in, 'bytes_out': stage_timer.bytes_out})
+
+
+metrics.add_stage_listener(_on_stage)
@@ -0,0 +1,452 @@
+"""traffic.py
+
+Record and replay of external HTTP traffic (WordPress, Gemini, social networks).
+
+Recording (HTTP_RECORD_FILE set): every request sent through http_client.py
+(WordPress, Facebook, VK, Telegram) and every Gemini API request (through an
+httpx transport given to the genai SDK, see gemini_client.py) is appended to
+a JSONL file: method, URL, request/response headers and bodies, status,
+time to first byte, total latency and, for streamed Gemini answers, every
+chunk with its offset. The pipeline run id and stage are stored with it.
+Secrets are stripped before anything is written:
+    - auth/key/token/cookie headers,
+    - token/secret/password/key fields in query strings, form and JSON
+      bodies (requests and responses),
+    - the Telegram bot token in the URL path,
+    - multipart bodies (uploads) are never stored, only their size.
+
+Replaying (HTTP_REPLAY_FILE set): no request leaves the process. Each request
+is answered with a recorded response for the same method and URL (query
+included), or, failing that, for the same method and path with ids replaced
+by `{id}`; recorded responses for a key are served in turn. The recorded
+latency is reproduced (streamed chunks at their recorded offsets) divided by
+HTTP_REPLAY_SPEEDUP (0 = no delay). A request with no recording fails as a
+connection error.
+
+Settings (.env):
+    HTTP_RECORD_FILE=                 # e.g. traffic/2026-10-19.jsonl
+    HTTP_RECORD_MAX_REQUEST_KB=64     # larger request bodies: size only
+    HTTP_REPLAY_FILE=                 # .jsonl or .jsonl.gz
+    HTTP_REPLAY_SPEEDUP=1
+
+Usage:
+    HTTP_RECORD_FILE=traffic/day.jsonl python thenextai_publisher.py --daemon
+    python traffic.py traffic/day.jsonl                # endpoints, latency, sizes
+    python benchmark.py --replay traffic/day.jsonl --speedup 10
+"""
+import os
+import re
+import sys
+import gzip
+import json
+import time
+import zlib
+import base64
+import argparse
+import threading
+from collections import defaultdict
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from dotenv import load_dotenv
+load_dotenv()
+
+import requests
+
+import metrics
+import run_ledger
+from usage_ledger import percentile
+
+try:
+    import httpx
+    HAS_HTTPX = True
+except ImportError:
+    HAS_HTTPX = False
+
+RECORD_FILE = os.getenv('HTTP_RECORD_FILE', '')
+RECORD_MAX_REQUEST_BYTES = int(os.getenv('HTTP_RECORD_MAX_REQUEST_KB', '64')) * 1024
+REPLAY_FILE = os.getenv('HTTP_REPLAY_FILE', '')
+REPLAY_SPEEDUP = float(os.getenv('HTTP_REPLAY_SPEEDUP', '1'))
+
+REDACTED = '[redacted]'
+# Поля запросов/ответов с секретами (query, form, JSON)
+SECRET_FIELDS = {'access_token', 'fb_exchange_token', 'client_secret', 'app_secret', 'appsecret_proof',
+                 'api_key', 'key', 'password', 'token', 'refresh_token'}
+_SECRET_HEADER = re.compile(r'auth|key|token|cookie|secret', re.I)
+_TELEGRAM_TOKEN = re.compile(r'/bot[^/]+/')
+# Сегменты пути с идентификаторами: числа и длинные буквенно-цифровые имена (cachedContents/xxx)
+_ID_SEGMENT = re.compile(r'^(\d+|(?=[A-Za-z0-9_]*\d)[A-Za-z0-9_]{10,})$')
+# Заголовки, которые теряют смысл после декодирования тела
+_BODY_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding'}
+
+
+def _secret_field(name):
+    name = str(name).lower()
+    return name in SECRET_FIELDS or name.endswith(('_token', '_secret'))
+
+
+def sanitize_url(url):
+    parts = urlsplit(url)
+    path = _TELEGRAM_TOKEN.sub('/bot{token}/', parts.path)
+    query = urlencode([(k, REDACTED if _secret_field(k) else v) for k, v in parse_qsl(parts.query, keep_blank_values=True)])
+    return urlunsplit((parts.scheme, parts.netloc, path, query, ''))
+
+
+def url_template(url):
+    """Path of a sanitized URL with ids replaced by {id} (no host, no query): the fallback replay key"""
+    path = urlsplit(url).path
+    return '/'.join('{id}' if _ID_SEGMENT.match(segment) else segment for segment in path.split('/'))
+
+
+def sanitize_headers(headers):
+    return {name: (REDACTED if _SECRET_HEADER.search(name) else value)
+            for name, value in headers.items() if name.lower() not in ('set-cookie', 'cookie')}
+
+
+def _sanitize_json(value):
+    if isinstance(value, dict):
+        return {k: (REDACTED if _secret_field(k) else _sanitize_json(v)) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_sanitize_json(v) for v in value]
+    return value
+
+
+def _encode_body(body, content_type, limit=None):
+    """Sanitized body fields of a recorded request/response; the size is always kept"""
+    if body is None:
+        return {'bytes': 0}
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    content_type = (content_type or '').lower()
+    result = {'bytes': len(body)}
+    if 'multipart/' in content_type or (limit is not None and len(body) > limit):
+        return result
+    try:
+        text = body.decode('utf-8')
+    except UnicodeDecodeError:
+        result.update(body=base64.b64encode(body).decode('ascii'), encoding='base64')
+        return result
+    if 'json' in content_type:
+        try:
+            text = json.dumps(_sanitize_json(json.loads(text)), ensure_ascii=False)
+        except ValueError:
+            pass
+    elif 'x-www-form-urlencoded' in content_type:
+        text = urlencode([(k, REDACTED if _secret_field(k) else v) for k, v in parse_qsl(text, keep_blank_values=True)])
+    result['body'] = text
+    return result
+
+
+def _decode_body(recorded):
+    body = recorded.get('body')
+    if body is None:
+        return b''
+    if recorded.get('encoding') == 'base64':
+        return base64.b64decode(body)
+    return body.encode('utf-8')
+
+
+def _context():
+    current = metrics.current_timer()
+    return {'run_id': run_ledger.current_run_id(), 'stage': current.stage if current is not None else None}
+
+
+class Recorder:
+    """Appends sanitized exchanges to a JSONL file; safe to call from several threads"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def write(self, entry):
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        try:
+            with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+        except OSError as e:
+            print(f"[traffic] Could not record {entry.get('method')} {entry.get('url')}: {e}")
+
+    def record_response(self, service, resp, started_at, latency):
+        """Record a finished requests.Response"""
+        request = resp.request
+        headers = {k: v for k, v in resp.headers.items() if k.lower() not in _BODY_HEADERS}
+        self.write({
+            'service': service,
+            'at': started_at,
+            'method': request.method,
+            'url': sanitize_url(request.url),
+            'request': dict(_encode_body(request.body, request.headers.get('Content-Type'), RECORD_MAX_REQUEST_BYTES),
+                            headers=sanitize_headers(request.headers)),
+            'response': dict(_encode_body(resp.content, resp.headers.get('Content-Type')),
+                             status=resp.status_code, headers=sanitize_headers(headers)),
+            'ttfb_ms': round(resp.elapsed.total_seconds() * 1000, 1),
+            'latency_ms': round(latency * 1000, 1),
+            **_context(),
+        })
+
+
+class _Decompressor:
+    """Incremental gzip/deflate decoding of a raw transport stream"""
+
+    def __init__(self, encoding):
+        encoding = (encoding or '').lower()
+        wbits = {'gzip': 16 + zlib.MAX_WBITS, 'deflate': zlib.MAX_WBITS}.get(encoding)
+        self.decoder = zlib.decompressobj(wbits) if wbits else None
+
+    @property
+    def active(self):
+        return self.decoder is not None
+
+    def feed(self, chunk):
+        return self.decoder.decompress(chunk) if self.decoder else chunk
+
+
+if HAS_HTTPX:
+    class _RecordingStream(httpx.SyncByteStream):
+        """Passes a response through unchanged and records it when it is closed"""
+
+        def __init__(self, inner, on_close, encoding):
+            self.inner = inner
+            self.on_close = on_close
+            self.decompressor = _Decompressor(encoding)
+            self.started = time.perf_counter()
+            self.chunks = []
+            self.wire_bytes = 0
+            self.closed = False
+
+        def __iter__(self):
+            for chunk in self.inner:
+                self.wire_bytes += len(chunk)
+                self.chunks.append((time.perf_counter(), self.decompressor.feed(chunk)))
+                yield chunk
+
+        def close(self):
+            if self.closed:
+                return
+            self.closed = True
+            self.inner.close()
+            self.on_close(self.chunks, self.wire_bytes, self.decompressor.active)
+
+    class _ReplayStream(httpx.SyncByteStream):
+        """Yields recorded chunks at their recorded offsets (scaled by the speed-up)"""
+
+        def __init__(self, chunks, started):
+            self.chunks = chunks
+            self.started = started
+
+        def __iter__(self):
+            for offset_ms, data in self.chunks:
+                _sleep_until(self.started, offset_ms)
+                yield data
+
+    class RecordingTransport(httpx.BaseTransport):
+        """httpx transport recording every Gemini exchange (see HttpOptions.client_args)"""
+
+        def __init__(self, recorder, service='gemini'):
+            self.recorder = recorder
+            self.service = service
+            self.inner = httpx.HTTPTransport()
+
+        def handle_request(self, request):
+            started_at = time.time()
+            started = time.perf_counter()
+            response = self.inner.handle_request(request)
+            ttfb = time.perf_counter() - started
+            context = _context()
+            request_body = request.read()
+
+            def on_close(chunks, wire_bytes, decoded):
+                end = chunks[-1][0] if chunks else time.perf_counter()
+                dropped = _BODY_HEADERS if decoded else _BODY_HEADERS - {'content-encoding'}
+                headers = {k: v for k, v in response.headers.items() if k.lower() not in dropped}
+                body = b''.join(data for _, data in chunks)
+                recorded = dict(_encode_body(body, response.headers.get('content-type')),
+                                status=response.status_code, headers=sanitize_headers(headers), wire_bytes=wire_bytes)
+                if 'text/event-stream' in response.headers.get('content-type', ''):
+                    recorded['chunks'] = [[round((at - started) * 1000, 1), data.decode('utf-8', 'replace')]
+                                          for at, data in chunks if data]
+                    recorded.pop('body', None)
+                self.recorder.write({
+                    'service': self.service,
+                    'at': started_at,
+                    'method': request.method,
+                    'url': sanitize_url(str(request.url)),
+                    'request': dict(_encode_body(request_body, request.headers.get('content-type'), RECORD_MAX_REQUEST_BYTES),
+                                    headers=sanitize_headers(request.headers)),
+                    'response': recorded,
+                    'ttfb_ms': round(ttfb * 1000, 1),
+                    'latency_ms': round((end - started) * 1000, 1),
+                    **context,
+                })
+
+            stream = _RecordingStream(response.stream, on_close, response.headers.get('content-encoding'))
+            return httpx.Response(response.status_code, headers=response.headers, stream=stream,
+                                  extensions=response.extensions, request=request)
+
+    class ReplayTransport(httpx.BaseTransport):
+        """httpx transport answering Gemini requests from a recording"""
+
+        def __init__(self, replayer):
+            self.replayer = replayer
+
+        def handle_request(self, request):
+            started = time.perf_counter()
+            entry = self.replayer.find(request.method, str(request.url))
+            if entry is None:
+                raise httpx.ConnectError(f"no recorded response for {request.method} {sanitize_url(str(request.url))}",
+                                         request=request)
+            recorded = entry['response']
+            if 'chunks' in recorded:
+                chunks = [(offset, data.encode('utf-8')) for offset, data in recorded['chunks']]
+            else:
+                chunks = [(entry.get('latency_ms', 0), _decode_body(recorded))]
+            _sleep_until(started, entry.get('ttfb_ms', 0))
+            return httpx.Response(recorded['status'], headers=recorded.get('headers', {}),
+                                  stream=_ReplayStream(chunks, started), request=request)
+
+
+def _sleep_until(started, offset_ms):
+    if REPLAY_SPEEDUP <= 0:
+        return
+    remaining = started + offset_ms / 1000 / REPLAY_SPEEDUP - time.perf_counter()
+    if remaining > 0:
+        time.sleep(remaining)
+
+
+def load_entries(path):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+class Replayer:
+    """Serves recorded responses by exact URL, then by URL template, in turn"""
+
+    def __init__(self, entries):
+        self.exact = defaultdict(list)
+        self.templates = defaultdict(list)
+        self.turns = defaultdict(int)
+        self.served = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        for entry in entries:
+            self.exact[(entry['method'], entry['url'])].append(entry)
+            self.templates[(entry['method'], url_template(entry['url']))].append(entry)
+
+    @classmethod
+    def load(cls, path):
+        return cls(load_entries(path))
+
+    def __len__(self):
+        return sum(len(entries) for entries in self.exact.values())
+
+    def _next(self, key, entries):
+        turn = self.turns[key]
+        self.turns[key] = turn + 1
+        return entries[turn % len(entries)]
+
+    def find(self, method, url):
+        url = sanitize_url(url)
+        candidates = (('exact', self.exact, (method, url)), ('template', self.templates, (method, url_template(url))))
+        with self._lock:
+            for kind, index, key in candidates:
+                entries = index.get(key)
+                if entries:
+                    self.served += 1
+                    return self._next((kind,) + key, entries)
+            self.misses += 1
+            return None
+
+    def respond(self, service, method, url, **kwargs):
+        """requests.request replacement for http_client.py"""
+        started = time.perf_counter()
+        fields = {name: kwargs[name] for name in ('params', 'data', 'json', 'files', 'headers', 'auth') if name in kwargs}
+        prepared = requests.Request(method, url, **fields).prepare()
+        entry = self.find(method, prepared.url)
+        if entry is None:
+            raise requests.ConnectionError(f"no recorded response for {method} {sanitize_url(prepared.url)}")
+        recorded = entry['response']
+        _sleep_until(started, entry.get('latency_ms', 0))
+        resp = requests.Response()
+        resp.status_code = recorded['status']
+        resp.headers = requests.structures.CaseInsensitiveDict(recorded.get('headers', {}))
+        resp._content = _decode_body(recorded)
+        resp.encoding = requests.utils.get_encoding_from_headers(resp.headers) or 'utf-8'
+        resp.url = prepared.url
+        resp.request = prepared
+        resp.reason = 'Replayed'
+        return resp
+
+
+RECORDER = None
+REPLAYER = None
+if REPLAY_FILE:
+    try:
+        REPLAYER = Replayer.load(REPLAY_FILE)
+        print(f"[traffic] Replaying {len(REPLAYER)} recorded requests from {REPLAY_FILE} (x{REPLAY_SPEEDUP:g})")
+    except (OSError, ValueError) as e:
+        print(f"[traffic] Could not load {REPLAY_FILE}: {e}")
+        raise
+elif RECORD_FILE:
+    RECORDER = Recorder(RECORD_FILE)
+    print(f"[traffic] Recording HTTP traffic to {RECORD_FILE}")
+
+
+def httpx_transport():
+    """Transport for the genai SDK's httpx client, or None when neither recording nor replaying"""
+    if not HAS_HTTPX:
+        return None
+    if REPLAYER is not None:
+        return ReplayTransport(REPLAYER)
+    if RECORDER is not None:
+        return RecordingTransport(RECORDER)
+    return None
+
+
+def summary(entries):
+    """Per-endpoint counts, latency percentiles and sizes of a recording"""
+    groups = defaultdict(list)
+    runs = set()
+    first = last = None
+    for entry in entries:
+        groups[(entry['service'], entry['method'], url_template(entry['url']))].append(entry)
+        if entry.get('run_id'):
+            runs.add(entry['run_id'])
+        first = entry['at'] if first is None else min(first, entry['at'])
+        last = entry['at'] if last is None else max(last, entry['at'])
+    rows = []
+    for (service, method, template), group in groups.items():
+        latencies = sorted(e['latency_ms'] for e in group)
+        rows.append({
+            'service': service, 'method': method, 'path': template, 'count': len(group),
+            'errors': sum(1 for e in group if e['response']['status'] >= 400),
+            'p50_ms': percentile(latencies, 50), 'p95_ms': percentile(latencies, 95),
+            'avg_response_bytes': sum(e['response'].get('bytes', 0) for e in group) // len(group),
+        })
+    rows.sort(key=lambda row: (row['service'], -row['count']))
+    return {'requests': sum(row['count'] for row in rows), 'runs': len(runs),
+            'span_seconds': (last - first) if first is not None else 0, 'endpoints': rows}
+
+
+def print_summary(path):
+    result = summary(load_entries(path))
+    print(f"📼 {path}: {result['requests']} запросов, {result['runs']} прогонов, "
+          f"{result['span_seconds'] / 3600:.1f} ч")
+    print(f"   {'Сервис':<10}{'Метод':<7}{'Путь':<52}{'N':>6}{'Ошиб.':>7}{'p50':>9}{'p95':>9}{'Ответ':>10}")
+    for row in result['endpoints']:
+        print(f"   {row['service']:<10}{row['method']:<7}{row['path'][:51]:<52}{row['count']:>6}{row['errors']:>7}"
+              f"{row['p50_ms']:>7.0f}ms{row['p95_ms']:>7.0f}ms{row['avg_response_bytes'] / 1024:>8.1f}KB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Сводка записанного HTTP-трафика')
+    parser.add_argument('file', help='Файл записи (.jsonl или .jsonl.gz)')
+    args = parser.parse_args()
+    if not os.path.exists(args.file):
+        print(f"❌ Файл не найден: {args.file}")
+        sys.exit(1)
+    print_summary(args.file)
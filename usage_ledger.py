@@ -0,0 +1,299 @@
+"""usage_ledger.py
+
+Per-call ledger of Gemini/Imagen usage and quota admission control.
+
+Every API call made through GeminiClient._make_api_request_with_retry is
+recorded in the `api_usage` table of storage.db: model, pipeline stage,
+prompt/cached/response token counts from `usage_metadata`, latency of the
+final attempt, time spent in backoff, number of retries and the outcome.
+
+Before a new job starts, `check_admission` projects its usage (average of
+recent jobs) onto the configured quotas and refuses the job if the projected
+per-minute or per-day totals would exceed them, returning how long to wait.
+
+Settings (.env, 0 = unlimited):
+    GEMINI_DAILY_TOKEN_QUOTA=0
+    GEMINI_DAILY_REQUEST_QUOTA=0
+    GEMINI_MINUTE_TOKEN_QUOTA=0
+    GEMINI_MINUTE_REQUEST_QUOTA=0
+
+Usage:
+    python usage_ledger.py [--days 7]
+"""
+import os
+import sqlite3
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+import metrics
+load_dotenv()
+
+DB_FILE = 'storage.db'
+
+DAILY_TOKEN_QUOTA = int(os.getenv('GEMINI_DAILY_TOKEN_QUOTA', '0'))
+DAILY_REQUEST_QUOTA = int(os.getenv('GEMINI_DAILY_REQUEST_QUOTA', '0'))
+MINUTE_TOKEN_QUOTA = int(os.getenv('GEMINI_MINUTE_TOKEN_QUOTA', '0'))
+MINUTE_REQUEST_QUOTA = int(os.getenv('GEMINI_MINUTE_REQUEST_QUOTA', '0'))
+
+# Оценка одной публикации, пока в журнале нет истории
+DEFAULT_JOB_TOKENS = 12000
+DEFAULT_JOB_REQUESTS = 3
+
+OUTCOME_OK = 'ok'
+OUTCOME_RATE_LIMITED = 'rate_limited'
+OUTCOME_ERROR = 'error'
+OUTCOME_REJECTED = 'rejected'
+OUTCOME_TIMEOUT = 'timeout'     # запрос прерван дедлайном задачи
+
+
+def ensure_schema(conn):
+    conn.execute("""CREATE TABLE IF NOT EXISTS api_usage (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ts TEXT,
+        model TEXT,
+        stage TEXT,
+        prompt_tokens INTEGER DEFAULT 0,
+        cached_tokens INTEGER DEFAULT 0,
+        response_tokens INTEGER DEFAULT 0,
+        total_tokens INTEGER DEFAULT 0,
+        latency_ms REAL,
+        wait_ms REAL DEFAULT 0,
+        retries INTEGER DEFAULT 0,
+        outcome TEXT,
+        error TEXT
+    )""")
+    try:
+        conn.execute("ALTER TABLE api_usage ADD COLUMN key_id TEXT")
+    except sqlite3.OperationalError:
+        # Колонка уже существует
+        pass
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_api_usage_ts ON api_usage(ts)")
+    conn.execute("""CREATE TABLE IF NOT EXISTS article_rejections (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ts TEXT,
+        stage TEXT,
+        model TEXT,
+        reason TEXT,
+        wasted_tokens INTEGER DEFAULT 0,
+        image_calls INTEGER DEFAULT 0,
+        aborted_early INTEGER DEFAULT 0
+    )""")
+    conn.commit()
+
+
+def _connect():
+    conn = sqlite3.connect(DB_FILE, timeout=30)
+    ensure_schema(conn)
+    return conn
+
+
+def extract_usage(response):
+    """(prompt, cached, response, total) token counts from a response or a list of stream chunks"""
+    if isinstance(response, list):
+        # Стрим: usage_metadata приходит в последних чанках
+        for chunk in reversed(response):
+            if getattr(chunk, 'usage_metadata', None):
+                response = chunk
+                break
+        else:
+            return 0, 0, 0, 0
+    usage = getattr(response, 'usage_metadata', None)
+    if not usage:
+        return 0, 0, 0, 0
+    prompt = getattr(usage, 'prompt_token_count', None) or 0
+    cached = getattr(usage, 'cached_content_token_count', None) or 0
+    candidates = getattr(usage, 'candidates_token_count', None) or 0
+    total = getattr(usage, 'total_token_count', None) or (prompt + candidates)
+    return prompt, cached, candidates, total
+
+
+def record_call(model, stage, response=None, latency_ms=None, wait_ms=0.0, retries=0,
+                outcome=OUTCOME_OK, error=None, tokens=None, key_id=None):
+    """Append one API call to the ledger. Never raises: accounting must not break publishing."""
+    try:
+        metrics.observe_gemini_call(stage, model, outcome, latency_ms, retries)
+    except Exception as e:
+        print(f"[usage_ledger] Could not update metrics: {e}")
+    try:
+        prompt, cached, candidates, total = tokens or extract_usage(response)
+        conn = _connect()
+        conn.execute("""INSERT INTO api_usage
+                        (ts, model, stage, prompt_tokens, cached_tokens, response_tokens, total_tokens,
+                         latency_ms, wait_ms, retries, outcome, error, key_id)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                     (datetime.now(timezone.utc).isoformat(), model or 'unknown', stage, prompt, cached,
+                      candidates, total, latency_ms, wait_ms, retries, outcome,
+                      str(error)[:500] if error else None, key_id))
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        print(f"[usage_ledger] Could not record call: {e}")
+
+
+def record_rejection(stage, reason, model=None, wasted_tokens=0, image_calls=0, aborted_early=False):
+    """Record an article rejected by validation.
+
+    `wasted_tokens` are the tokens paid for the rejected text, `image_calls`
+    the image generations spent on it (0 when the rejection came before the
+    image step), `aborted_early` marks generations stopped mid-stream.
+    """
+    try:
+        conn = _connect()
+        conn.execute("""INSERT INTO article_rejections
+                        (ts, stage, model, reason, wasted_tokens, image_calls, aborted_early)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                     (datetime.now(timezone.utc).isoformat(), stage, model, str(reason)[:300],
+                      wasted_tokens, image_calls, int(aborted_early)))
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        print(f"[usage_ledger] Could not record rejection: {e}")
+
+
+def rejection_stats(days=7, now=None):
+    """Rejected articles, tokens and image calls spent on them, and early aborts"""
+    now = now or datetime.now(timezone.utc)
+    conn = _connect()
+    cur = conn.execute("""SELECT COUNT(*), COALESCE(SUM(wasted_tokens), 0), COALESCE(SUM(image_calls), 0),
+                                 COALESCE(SUM(aborted_early), 0)
+                          FROM article_rejections WHERE ts >= ?""",
+                       ((now - timedelta(days=days)).isoformat(),))
+    rejected, wasted_tokens, image_calls, aborted_early = cur.fetchone()
+    conn.close()
+    return {'rejected': rejected, 'wasted_tokens': wasted_tokens,
+            'wasted_image_calls': image_calls, 'aborted_early': aborted_early}
+
+
+def _totals_since(conn, since):
+    cur = conn.execute("SELECT COUNT(*), COALESCE(SUM(total_tokens), 0) FROM api_usage WHERE ts >= ?",
+                       (since.isoformat(),))
+    return cur.fetchone()
+
+
+def estimate_job_usage(conn=None, window_days=7):
+    """Average tokens and requests per publish job over recent history.
+
+    One job = one article generation plus everything it triggers (image,
+    social posts), so totals are divided by the number of article calls
+    (single-request articles or outlines of sectioned ones).
+    """
+    own_conn = conn is None
+    conn = conn or _connect()
+    since = (datetime.now(timezone.utc) - timedelta(days=window_days)).isoformat()
+    cur = conn.execute("""SELECT COUNT(*), COALESCE(SUM(total_tokens), 0),
+                                 SUM(CASE WHEN stage IN ('article', 'outline') THEN 1 ELSE 0 END)
+                          FROM api_usage WHERE ts >= ?""", (since,))
+    calls, tokens, jobs = cur.fetchone()
+    if own_conn:
+        conn.close()
+    if not jobs:
+        return DEFAULT_JOB_TOKENS, DEFAULT_JOB_REQUESTS
+    return max(1, tokens // jobs), max(1, round(calls / jobs))
+
+
+def check_admission(estimated_tokens=None, estimated_requests=None, now=None):
+    """Decide whether a new job fits into the quotas.
+
+    Returns (admitted, reason, retry_after_seconds).
+    """
+    now = now or datetime.now(timezone.utc)
+    conn = _connect()
+    if estimated_tokens is None or estimated_requests is None:
+        est_tokens, est_requests = estimate_job_usage(conn)
+        estimated_tokens = est_tokens if estimated_tokens is None else estimated_tokens
+        estimated_requests = est_requests if estimated_requests is None else estimated_requests
+
+    day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    day_requests, day_tokens = _totals_since(conn, day_start)
+    minute_requests, minute_tokens = _totals_since(conn, now - timedelta(minutes=1))
+    conn.close()
+
+    seconds_to_midnight = (day_start + timedelta(days=1) - now).total_seconds()
+    checks = (
+        (DAILY_TOKEN_QUOTA, day_tokens, estimated_tokens, 'daily tokens', seconds_to_midnight),
+        (DAILY_REQUEST_QUOTA, day_requests, estimated_requests, 'daily requests', seconds_to_midnight),
+        (MINUTE_TOKEN_QUOTA, minute_tokens, estimated_tokens, 'tokens per minute', 60),
+        (MINUTE_REQUEST_QUOTA, minute_requests, estimated_requests, 'requests per minute', 60),
+    )
+    for quota, used, projected, label, retry_after in checks:
+        if quota and used + projected > quota:
+            reason = f"{label}: used {used} + projected {projected} > quota {quota}"
+            return False, reason, retry_after
+    return True, "", 0
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+def usage_report(days=7, now=None):
+    """Per-day and per-stage totals with p50/p95 latency"""
+    now = now or datetime.now(timezone.utc)
+    since = (now - timedelta(days=days)).isoformat()
+    conn = _connect()
+
+    cur = conn.execute("""SELECT substr(ts, 1, 10) AS day, COUNT(*), SUM(prompt_tokens), SUM(cached_tokens),
+                                 SUM(response_tokens), SUM(total_tokens), SUM(retries),
+                                 SUM(CASE WHEN outcome != 'ok' THEN 1 ELSE 0 END)
+                          FROM api_usage WHERE ts >= ? GROUP BY day ORDER BY day""", (since,))
+    per_day = [dict(zip(('day', 'calls', 'prompt_tokens', 'cached_tokens', 'response_tokens',
+                         'total_tokens', 'retries', 'failures'), row)) for row in cur.fetchall()]
+
+    cur = conn.execute("""SELECT stage, model, COUNT(*), SUM(total_tokens), SUM(retries),
+                                 SUM(CASE WHEN outcome != 'ok' THEN 1 ELSE 0 END)
+                          FROM api_usage WHERE ts >= ? GROUP BY stage, model ORDER BY stage, model""", (since,))
+    per_stage = []
+    for stage, model, calls, tokens, retries, failures in cur.fetchall():
+        lat = conn.execute("""SELECT latency_ms FROM api_usage
+                              WHERE ts >= ? AND stage = ? AND model = ? AND latency_ms IS NOT NULL
+                              ORDER BY latency_ms""", (since, stage, model))
+        latencies = [row[0] for row in lat.fetchall()]
+        per_stage.append({
+            'stage': stage, 'model': model, 'calls': calls, 'total_tokens': tokens,
+            'retries': retries, 'failures': failures,
+            'p50_ms': percentile(latencies, 50), 'p95_ms': percentile(latencies, 95)
+        })
+    conn.close()
+    return {'per_day': per_day, 'per_stage': per_stage}
+
+
+def print_usage_report(days=7):
+    report = usage_report(days)
+
+    def fmt_ms(value):
+        return f"{value / 1000:.1f}s" if value is not None else "-"
+
+    print(f"📈 Использование Gemini API за {days} дн.:")
+    if not report['per_day']:
+        print("   Нет данных")
+        return
+    print(f"\n   {'День':<12}{'Вызовы':>8}{'Prompt':>10}{'Cached':>10}{'Response':>10}{'Всего':>10}{'Повторы':>9}{'Ошибки':>8}")
+    for row in report['per_day']:
+        print(f"   {row['day']:<12}{row['calls']:>8}{row['prompt_tokens']:>10}{row['cached_tokens']:>10}"
+              f"{row['response_tokens']:>10}{row['total_tokens']:>10}{row['retries']:>9}{row['failures']:>8}")
+
+    print(f"\n   {'Этап':<10}{'Модель':<32}{'Вызовы':>8}{'Токены':>10}{'p50':>8}{'p95':>8}{'Ошибки':>8}")
+    for row in report['per_stage']:
+        print(f"   {row['stage']:<10}{row['model']:<32}{row['calls']:>8}{row['total_tokens']:>10}"
+              f"{fmt_ms(row['p50_ms']):>8}{fmt_ms(row['p95_ms']):>8}{row['failures']:>8}")
+
+    rejections = rejection_stats(days)
+    if rejections['rejected']:
+        print(f"\n   Отклонено статей: {rejections['rejected']} (прервано в стриме: {rejections['aborted_early']}), "
+              f"потеряно токенов: {rejections['wasted_tokens']}, вызовов изображений: {rejections['wasted_image_calls']}")
+
+    est_tokens, est_requests = estimate_job_usage()
+    print(f"\n   Оценка одной публикации: ~{est_tokens} токенов, ~{est_requests} запросов")
+    admitted, reason, _retry_after = check_admission()
+    print(f"   Новая публикация {'укладывается в квоты' if admitted else 'не укладывается в квоты: ' + reason}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Отчет об использовании Gemini API')
+    parser.add_argument('--days', type=int, default=7, help='Период отчета в днях')
+    args = parser.parse_args()
+    print_usage_report(args.days)
@@ -8,12 +8,17 @@ import requests
 from requests.auth import HTTPBasicAuth
 from urllib.parse import urljoin
 from dotenv import load_dotenv
+from deadline import request_timeout
+from metrics import instrument
+import http_client
 load_dotenv()
 
 WP_BASE = os.getenv('WP_BASE_URL', '').rstrip('/')
 WP_USER = os.getenv('WP_USERNAME')
 WP_PASS = os.getenv('WP_APP_PASSWORD')
 DISABLE_PUBLISH = os.getenv('DISABLE_WP_PUBLISH', 'false').lower() == 'true'
+# Таймаут одного запроса к WordPress (при дедлайне - не больше оставшегося времени)
+WP_TIMEOUT = float(os.getenv('WP_TIMEOUT', '30'))
 
 if not WP_BASE or not WP_USER or not WP_PASS:
     print('[wordpress_client] Warning: WP credentials not configured. Configure .env before using.')
@@ -29,8 +34,13 @@ def _create_wp_slug(name: str) -> str:
     slug = slug.strip('-')  # Remove leading/trailing hyphens
     return slug
 
-def get_or_create_tag(tag_name: str):
+@instrument('terms', 'tag', falsy_is_error=True)
+def get_or_create_tag(tag_name: str, deadline=None):
     """Get existing tag or create new one, returns tag ID"""
+    if DISABLE_PUBLISH:
+        print(f"[WordPress] 🚫 PUBLISHING DISABLED - Would resolve tag: {tag_name}")
+        return None
+
     if not WP_BASE:
         raise RuntimeError('WP_BASE_URL is not set in environment')
 
@@ -43,7 +53,7 @@ def get_or_create_tag(tag_name: str):
     params = {'search': tag_name}
 
     try:
-        resp = requests.get(search_url, auth=auth_clean, params=params)
+        resp = http_client.request('wordpress', 'GET', search_url, auth=auth_clean, params=params, timeout=request_timeout(deadline, WP_TIMEOUT))
         resp.raise_for_status()
         tags = resp.json()
 
@@ -63,7 +73,7 @@ def get_or_create_tag(tag_name: str):
         }
 
         print(f"[WordPress] Creating tag: {tag_name} with slug: {slug}")
-        resp = requests.post(search_url, auth=auth_clean, json=create_data)
+        resp = http_client.request('wordpress', 'POST', search_url, auth=auth_clean, json=create_data, timeout=request_timeout(deadline, WP_TIMEOUT))
 
         # Better error handling
         if resp.status_code != 201:
@@ -85,8 +95,13 @@ def get_or_create_tag(tag_name: str):
         print(f"[WordPress] Error with tag '{tag_name}': {e}")
         return None
 
-def get_or_create_category(category_name: str):
+@instrument('terms', 'category', falsy_is_error=True)
+def get_or_create_category(category_name: str, deadline=None):
     """Get existing category or create new one, returns category ID"""
+    if DISABLE_PUBLISH:
+        print(f"[WordPress] 🚫 PUBLISHING DISABLED - Would resolve category: {category_name}")
+        return None
+
     if not WP_BASE:
         raise RuntimeError('WP_BASE_URL is not set in environment')
 
@@ -99,7 +114,7 @@ def get_or_create_category(category_name: str):
     params = {'search': category_name}
 
     try:
-        resp = requests.get(search_url, auth=auth_clean, params=params)
+        resp = http_client.request('wordpress', 'GET', search_url, auth=auth_clean, params=params, timeout=request_timeout(deadline, WP_TIMEOUT))
         resp.raise_for_status()
         categories = resp.json()
 
@@ -119,7 +134,7 @@ def get_or_create_category(category_name: str):
         }
 
         print(f"[WordPress] Creating category: {category_name} with slug: {slug}")
-        resp = requests.post(search_url, auth=auth_clean, json=create_data)
+        resp = http_client.request('wordpress', 'POST', search_url, auth=auth_clean, json=create_data, timeout=request_timeout(deadline, WP_TIMEOUT))
 
         # Better error handling
         if resp.status_code != 201:
@@ -141,8 +156,13 @@ def get_or_create_category(category_name: str):
         print(f"[WordPress] Error with category '{category_name}': {e}")
         return None
 
-def upload_image_to_wp(image_bytes: bytes, filename: str, mime_type='image/png'):
+@instrument('upload')
+def upload_image_to_wp(image_bytes: bytes, filename: str, mime_type='image/png', deadline=None):
     """Uploads an image and returns the JSON response from WP (contains id and source_url)."""
+    if DISABLE_PUBLISH:
+        print(f"[WordPress] 🚫 PUBLISHING DISABLED - Would upload: {filename} ({len(image_bytes)} bytes)")
+        return {'id': None, 'source_url': None}
+
     if not WP_BASE:
         raise RuntimeError('WP_BASE_URL is not set in environment')
 
@@ -154,13 +174,15 @@ def upload_image_to_wp(image_bytes: bytes, filename: str, mime_type='image/png')
     app_password_clean = WP_PASS.replace(' ', '') if WP_PASS else ''
     auth_clean = HTTPBasicAuth(WP_USER, app_password_clean)
 
-    resp = requests.post(url, auth=auth_clean, files=files, headers=headers)
+    resp = http_client.request('wordpress', 'POST', url, auth=auth_clean, files=files, headers=headers, timeout=request_timeout(deadline, WP_TIMEOUT))
     resp.raise_for_status()
     return resp.json()
 
-def create_wp_post(title, content_html, slug=None, status='publish', featured_media_id=None, meta_description=None, tags=None, categories=None):
+@instrument('wordpress', 'create')
+def create_wp_post(title, content_html, slug=None, status='publish', featured_media_id=None, meta_description=None, tags=None, categories=None, date_gmt=None, deadline=None):
+    """Create a post. `status='future'` with `date_gmt` (ISO, UTC) schedules it on WordPress side."""
     if DISABLE_PUBLISH:
-        print(f"[WordPress] 🚫 PUBLISHING DISABLED - Would publish: {title}")
+        print(f"[WordPress] 🚫 PUBLISHING DISABLED - Would publish: {title} (status={status})")
         # Возвращаем фиктивный ответ для тестирования
         return {
             'id': 99999,
@@ -191,6 +213,8 @@ def create_wp_post(title, content_html, slug=None, status='publish', featured_me
         data['tags'] = tags
     if categories:
         data['categories'] = categories
+    if date_gmt:
+        data['date_gmt'] = date_gmt
 
     # Clean Application Password (remove spaces if any)
     app_password_clean = WP_PASS.replace(' ', '') if WP_PASS else ''
@@ -200,7 +224,7 @@ def create_wp_post(title, content_html, slug=None, status='publish', featured_me
     print(f"[WordPress] URL: {url}")
     print(f"[WordPress] User: {WP_USER}")
 
-    resp = requests.post(url, auth=auth_clean, json=data)
+    resp = http_client.request('wordpress', 'POST', url, auth=auth_clean, json=data, timeout=request_timeout(deadline, WP_TIMEOUT))
 
     if resp.status_code != 201:
         print(f"[WordPress] Error {resp.status_code}: {resp.text}")
@@ -209,3 +233,76 @@ def create_wp_post(title, content_html, slug=None, status='publish', featured_me
     result = resp.json()
     print(f"[WordPress] Post created successfully: ID={result.get('id')}, Link={result.get('link')}")
     return result
+
+
+@instrument('wordpress', 'status')
+def update_wp_post_status(post_id, status='publish', date_gmt=None, deadline=None):
+    """Change status of an existing post (e.g. prefetched draft -> publish). Returns the JSON response."""
+    if DISABLE_PUBLISH:
+        print(f"[WordPress] 🚫 PUBLISHING DISABLED - Would set post {post_id} status to {status}")
+        return {
+            'id': post_id,
+            'link': f'https://example.com/test-post-{post_id}',
+            'status': 'draft'
+        }
+
+    if not WP_BASE:
+        raise RuntimeError('WP_BASE_URL is not set in environment')
+
+    url = urljoin(WP_BASE, f'/wp-json/wp/v2/posts/{post_id}')
+    data = {'status': status}
+    if date_gmt:
+        data['date_gmt'] = date_gmt
+
+    app_password_clean = WP_PASS.replace(' ', '') if WP_PASS else ''
+    auth_clean = HTTPBasicAuth(WP_USER, app_password_clean)
+
+    resp = http_client.request('wordpress', 'POST', url, auth=auth_clean, json=data, timeout=request_timeout(deadline, WP_TIMEOUT))
+
+    if resp.status_code != 200:
+        print(f"[WordPress] Error {resp.status_code}: {resp.text}")
+        resp.raise_for_status()
+
+    result = resp.json()
+    print(f"[WordPress] Post {post_id} status -> {result.get('status')}, Link={result.get('link')}")
+    return result
+
+
+@instrument('wordpress', 'list')
+def list_wp_posts(page=1, per_page=100, deadline=None):
+    """One page of published posts (id, link, title, tags, date_gmt). Returns (posts, total_pages)."""
+    if not WP_BASE:
+        raise RuntimeError('WP_BASE_URL is not set in environment')
+
+    url = urljoin(WP_BASE, '/wp-json/wp/v2/posts')
+    params = {'status': 'publish', 'page': page, 'per_page': per_page, 'orderby': 'id', 'order': 'asc',
+              '_fields': 'id,link,title,tags,date_gmt'}
+
+    app_password_clean = WP_PASS.replace(' ', '') if WP_PASS else ''
+    auth_clean = HTTPBasicAuth(WP_USER, app_password_clean)
+
+    resp = http_client.request('wordpress', 'GET', url, auth=auth_clean, params=params, timeout=request_timeout(deadline, WP_TIMEOUT))
+    resp.raise_for_status()
+    return resp.json(), int(resp.headers.get('X-WP-TotalPages') or 1)
+
+
+@instrument('wordpress', 'tags')
+def get_tag_names(tag_ids, deadline=None):
+    """{tag id: name} for the given tag ids"""
+    if not WP_BASE:
+        raise RuntimeError('WP_BASE_URL is not set in environment')
+
+    url = urljoin(WP_BASE, '/wp-json/wp/v2/tags')
+    app_password_clean = WP_PASS.replace(' ', '') if WP_PASS else ''
+    auth_clean = HTTPBasicAuth(WP_USER, app_password_clean)
+
+    names = {}
+    tag_ids = sorted(set(tag_ids))
+    # include= принимает до 100 id за запрос
+    for start in range(0, len(tag_ids), 100):
+        part = tag_ids[start:start + 100]
+        params = {'include': ','.join(str(tag_id) for tag_id in part), 'per_page': 100, '_fields': 'id,name'}
+        resp = http_client.request('wordpress', 'GET', url, auth=auth_clean, params=params, timeout=request_timeout(deadline, WP_TIMEOUT))
+        resp.raise_for_status()
+        names.update({tag['id']: tag['name'] for tag in resp.json()})
+    return names